@@ -16,6 +16,8 @@
 #ifndef AZURE_PERF
 #define AZURE_PERF
 
+#include <sys/types.h>
+
 /*All the strings are utf-8 encoded*/
 
 /*The max buf size for all string*/
@@ -48,6 +50,8 @@
 #define AP_ERR_INVALID_REFRESH_INTERVAL     (-17)
 #define AP_ERR_INVALID_TIMESTAMP            (-18)
 #define AP_ERR_INVALID_MACHINE_NAME         (-19)
+#define AP_ERR_INVALID_STORE                (-20)
+#define AP_ERR_STORE_BUSY                   (-21)
 
 
 typedef struct 
@@ -70,12 +74,46 @@ typedef struct
     
 } perf_counter;
 
+/*
+ * The binary counter store written by aem.py. A fixed size header followed
+ * by capacity records with the layout of perf_counter. The writer makes the
+ * generation odd before it changes the records and even again when it's
+ * done, readers retry until they see the same even generation before and
+ * after copying the records.
+ */
+#define AP_STORE_MAGIC          "AZPERFST"
+#define AP_STORE_VERSION        (1)
+#define AP_STORE_HEADER_SIZE    (64)
+#define AP_STORE_RECORD_SIZE    (920)
+#define AP_STORE_READ_RETRY     (1000)
+
+typedef struct
+{
+    char                        magic[8];
+    unsigned int                version;
+    unsigned int                header_size;
+    unsigned int                record_size;
+    unsigned int                capacity;
+    volatile unsigned long long generation;
+    volatile unsigned int       count;
+    unsigned int                reserved;
+} ap_store_header;
+
+/*The store records are read by copying them into perf_counter*/
+typedef char ap_store_record_size_check[
+    (sizeof(perf_counter) == AP_STORE_RECORD_SIZE) ? 1 : -1];
+
 typedef struct
 {
     perf_counter    buf[PERF_COUNT_MAX]; 
     int             len; 
     int             err;
     char            *ap_file;
+    char            *ap_store_file;
+    void            *store_map;
+    size_t          store_map_size;
+    dev_t           store_dev;
+    ino_t           store_ino;
 } ap_handler;
 
 ap_handler* ap_open();
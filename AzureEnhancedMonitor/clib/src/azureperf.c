@@ -18,6 +18,11 @@
 #include <stdlib.h> 
 #include <string.h> 
 #include <errno.h>
+#include <fcntl.h>
+#include <sched.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include <azureperf.h> 
 
 #define INTMIN(X, Y) (((X) < (Y)) ? (X) : (Y))
@@ -31,20 +36,174 @@
 
 static char FIELD_SEPRATOR = ';';
 static char DEFAULT_AP_FILE[] = "/var/lib/AzureEnhancedMonitor/PerfCounters";
+static char DEFAULT_AP_STORE_FILE[] = "/var/lib/AzureEnhancedMonitor/PerfCounters.bin";
 
 ap_handler* ap_open()
 {
     ap_handler *handler = malloc(sizeof(ap_handler));
-    handler->ap_file = DEFAULT_AP_FILE;
     memset(handler, 0, sizeof(ap_handler));
+    handler->ap_file = DEFAULT_AP_FILE;
+    handler->ap_store_file = DEFAULT_AP_STORE_FILE;
     return handler;
 }
 
+static void unmap_store(ap_handler *handler)
+{
+    if(handler->store_map)
+    {
+        munmap(handler->store_map, handler->store_map_size);
+        handler->store_map = 0;
+        handler->store_map_size = 0;
+        handler->store_dev = 0;
+        handler->store_ino = 0;
+    }
+}
+
 void ap_close(ap_handler *handler)
 {
+    unmap_store(handler);
     free(handler);
 }
 
+static int is_store_valid(ap_store_header *header, size_t size)
+{
+    return size >= AP_STORE_HEADER_SIZE &&
+           0 == memcmp(header->magic, AP_STORE_MAGIC, sizeof(header->magic)) &&
+           header->version == AP_STORE_VERSION &&
+           header->header_size == AP_STORE_HEADER_SIZE &&
+           header->record_size == sizeof(perf_counter) &&
+           header->header_size + (size_t)header->capacity * header->record_size <= size;
+}
+
+static int map_store(ap_handler *handler)
+{
+    int fd = -1;
+    int ret = 0;
+    struct stat st;
+    void *map = MAP_FAILED;
+
+    //The store is mapped once and kept while the path still names the mapped
+    //file and it's valid. aem recreates the file when it's missing, e.g. after
+    //uninstall, and grows it for a larger capacity.
+    if(stat(handler->ap_store_file, &st) != 0)
+    {
+        unmap_store(handler);
+        return errno;
+    }
+    if(handler->store_map && 
+            st.st_dev == handler->store_dev &&
+            st.st_ino == handler->store_ino &&
+            (size_t)st.st_size == handler->store_map_size &&
+            is_store_valid(handler->store_map, handler->store_map_size))
+    {
+        return 0;
+    }
+    unmap_store(handler);
+
+    fd = open(handler->ap_store_file, O_RDONLY);
+    if(fd < 0)
+    {
+        ret = errno;
+        goto EXIT;
+    }
+    if(fstat(fd, &st) != 0)
+    {
+        ret = errno;
+        goto EXIT;
+    }
+    if(st.st_size < AP_STORE_HEADER_SIZE)
+    {
+        ret = AP_ERR_INVALID_STORE;
+        goto EXIT;
+    }
+    map = mmap(0, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+    if(map == MAP_FAILED)
+    {
+        ret = errno;
+        goto EXIT;
+    }
+    if(!is_store_valid(map, st.st_size))
+    {
+        munmap(map, st.st_size);
+        ret = AP_ERR_INVALID_STORE;
+        goto EXIT;
+    }
+    handler->store_map = map;
+    handler->store_map_size = st.st_size;
+    handler->store_dev = st.st_dev;
+    handler->store_ino = st.st_ino;
+
+EXIT:
+    if(fd >= 0)
+    {
+        close(fd);
+    }
+    return ret;
+}
+
+static int read_pc_from_store(ap_handler *handler)
+{
+    ap_store_header *header = 0;
+    unsigned long long generation = 0;
+    unsigned int count = 0;
+    int retry = 0;
+    int i = 0;
+    int ret = 0;
+
+    ret = map_store(handler);
+    if(ret != 0)
+    {
+        return ret;
+    }
+    header = (ap_store_header*)handler->store_map;
+
+    for(; retry < AP_STORE_READ_RETRY; retry++)
+    {
+        generation = header->generation;
+        __sync_synchronize();
+        if(generation & 1)
+        {
+            //The writer is updating the records
+            sched_yield();
+            continue;
+        }
+        count = header->count;
+        if(count > header->capacity || count > PERF_COUNT_MAX)
+        {
+            sched_yield();
+            continue;
+        }
+        memcpy(handler->buf, (char*)header + header->header_size, 
+               sizeof(perf_counter) * count);
+        __sync_synchronize();
+        if(header->generation == generation)
+        {
+            break;
+        }
+    }
+    if(retry == AP_STORE_READ_RETRY)
+    {
+        memset(handler->buf, 0, sizeof(perf_counter) * PERF_COUNT_MAX);
+        return AP_ERR_STORE_BUSY;
+    }
+
+    for(; i < count; i++)
+    {
+        perf_counter *pc = &handler->buf[i];
+        pc->type_name[TYPE_NAME_MAX - 1] = 0;
+        pc->property_name[PROPERTY_NAME_MAX - 1] = 0;
+        pc->instance_name[INSTANCE_NAME_MAX - 1] = 0;
+        if(pc->counter_typer == PERF_COUNTER_TYPE_STRING)
+        {
+            pc->val_str[STRING_VALUE_MAX - 1] = 0;
+        }
+        pc->unit_name[UNIT_NAME_MAX - 1] = 0;
+        pc->machine_name[MACHINE_NAME_MAX - 1] = 0;
+    }
+    handler->len = count;
+    return 0;
+}
+
 int read_sperator(FILE *fp, int strict)
 {
     int c;
@@ -286,12 +445,25 @@ EXIT:
 
 void ap_refresh(ap_handler *handler)
 {
+    int ret = 0;
     FILE *fp = 0;
     perf_counter *next = 0;
    
     //Reset handler 
     memset(handler->buf, 0, sizeof(perf_counter) * PERF_COUNT_MAX);
     handler->len = 0;
+    handler->err = 0;
+
+    //Read the binary store if aem writes it, the text file otherwise
+    if(handler->ap_store_file)
+    {
+        ret = read_pc_from_store(handler);
+        if(ret == 0 || ret == AP_ERR_STORE_BUSY)
+        {
+            handler->err = ret;
+            goto EXIT;
+        }
+    }
    
     errno = 0;
     fp = fopen(handler->ap_file, "r");
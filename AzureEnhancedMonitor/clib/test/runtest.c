@@ -15,20 +15,38 @@
 //
 
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/time.h>
+#include <sys/wait.h>
 #include <azureperf.h> 
 
 static const char default_input[] = "./test/cases/positive_case";
+static const char test_store[] = "./bin/test_store";
+
+#define LATENCY_TEST_ROUNDS     (10000)
+#define TORN_READ_TEST_SECONDS  (2)
 
 int main(int argc, char ** argv)
 {
+    int ret = 0;
     char* ap_file = (char*) default_input;
     if(argc == 2)
     {
         ap_file = argv[1];
     }
     printf("Parsing perf counters from: %s\n", ap_file);
-    run_test(ap_file);
+    ret = run_test(ap_file);
+    if(ret == 0)
+    {
+        ret = run_store_test(ap_file);
+    }
+    return ret;
 }
 
 void print_counter(perf_counter *pc)
@@ -63,6 +81,7 @@ int run_test(char* ap_file)
 
     handler = ap_open();
     handler->ap_file = ap_file;
+    handler->ap_store_file = 0;
     ap_refresh(handler);
     if(handler->err)
     {
@@ -216,3 +235,234 @@ EXIT:
     return ret;
 }
 
+double now_in_us()
+{
+    struct timeval tv;
+    gettimeofday(&tv, 0);
+    return tv.tv_sec * 1000000.0 + tv.tv_usec;
+}
+
+ap_store_header* create_store(const char *store_file)
+{
+    int fd = -1;
+    size_t size = AP_STORE_HEADER_SIZE + sizeof(perf_counter) * PERF_COUNT_MAX;
+    ap_store_header *header = 0;
+
+    fd = open(store_file, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if(fd < 0 || ftruncate(fd, size) != 0)
+    {
+        goto EXIT;
+    }
+    header = mmap(0, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    if(header == MAP_FAILED)
+    {
+        header = 0;
+        goto EXIT;
+    }
+    memcpy(header->magic, AP_STORE_MAGIC, sizeof(header->magic));
+    header->version = AP_STORE_VERSION;
+    header->header_size = AP_STORE_HEADER_SIZE;
+    header->record_size = sizeof(perf_counter);
+    header->capacity = PERF_COUNT_MAX;
+
+EXIT:
+    if(fd >= 0)
+    {
+        close(fd);
+    }
+    return header;
+}
+
+//Writes the counters the same way aem.py does
+void write_store(ap_store_header *header, perf_counter *pcs, int count)
+{
+    header->generation++;
+    __sync_synchronize();
+    memcpy((char*)header + header->header_size, pcs, 
+           sizeof(perf_counter) * count);
+    header->count = count;
+    __sync_synchronize();
+    header->generation++;
+}
+
+double refresh_latency(ap_handler *handler)
+{
+    int i = 0;
+    double start = now_in_us();
+    for(; i < LATENCY_TEST_ROUNDS; i++)
+    {
+        ap_refresh(handler);
+    }
+    return (now_in_us() - start) / LATENCY_TEST_ROUNDS;
+}
+
+//The writer sets all the counters to the same value in each round. A reader
+//that sees different values in one refresh got a torn read.
+void write_round(ap_store_header *header, perf_counter *pcs, int count, 
+                 long long round)
+{
+    int i = 0;
+    for(; i < count; i++)
+    {
+        pcs[i].counter_typer = PERF_COUNTER_TYPE_LARGE;
+        pcs[i].val_large = round;
+    }
+    write_store(header, pcs, count);
+}
+
+void run_torn_writer(ap_store_header *header, perf_counter *pcs, int count)
+{
+    long long round = 0;
+    while(1)
+    {
+        round++;
+        write_round(header, pcs, count, round);
+    }
+}
+
+//aem recreates the store when it's missing, a reader that keeps its handler
+//open must follow the path to the new file
+int run_store_recreate_test(ap_handler *handler, ap_store_header **header,
+                            perf_counter *pcs, int count)
+{
+    int i = 0;
+    int pass = 0;
+    long long round = 0;
+
+    for(; pass < 2; pass++)
+    {
+        round = pass + 42;
+        munmap(*header, AP_STORE_HEADER_SIZE + sizeof(perf_counter) * PERF_COUNT_MAX);
+        *header = 0;
+        unlink(test_store);
+        if(pass == 0)
+        {
+            //Falls back to the text file while the store is missing
+            ap_refresh(handler);
+            if(handler->err || handler->len != count || handler->store_map)
+            {
+                printf("Counters not read from text without the store, error code:%d\n",
+                       handler->err);
+                return 1;
+            }
+        }
+        *header = create_store(test_store);
+        if(*header == 0)
+        {
+            printf("Failed to recreate store: %s\n", test_store);
+            return 1;
+        }
+        write_round(*header, pcs, count, round);
+        ap_refresh(handler);
+        if(handler->err || handler->len != count)
+        {
+            printf("Failed to read the recreated store, error code:%d\n",
+                   handler->err);
+            return 1;
+        }
+        for(i = 0; i < count; i++)
+        {
+            if(handler->buf[i].val_large != round)
+            {
+                printf("Counters read from the removed store\n");
+                return 1;
+            }
+        }
+    }
+    printf("Recreated store read\n");
+    return 0;
+}
+
+int run_store_test(char *ap_file)
+{
+    int ret = 0;
+    int i = 0;
+    int count = 0;
+    long long refreshes = 0;
+    long long torn = 0;
+    long long busy = 0;
+    double text_latency = 0;
+    double store_latency = 0;
+    time_t end = 0;
+    pid_t writer = 0;
+    perf_counter pcs[PERF_COUNT_MAX];
+    ap_handler *handler = 0;
+    ap_store_header *header = 0;
+
+    printf(">>>>binary counter store\n");
+    handler = ap_open();
+    handler->ap_file = ap_file;
+    handler->ap_store_file = 0;
+    ap_refresh(handler);
+    count = ap_metric_all(handler, pcs, PERF_COUNT_MAX);
+    text_latency = refresh_latency(handler);
+
+    header = create_store(test_store);
+    if(header == 0)
+    {
+        printf("Failed to create store: %s\n", test_store);
+        ret = 1;
+        goto EXIT;
+    }
+    write_store(header, pcs, count);
+
+    handler->ap_store_file = (char*)test_store;
+    ap_refresh(handler);
+    if(handler->err || handler->len != count || 
+            0 != memcmp(handler->buf, pcs, sizeof(perf_counter) * count))
+    {
+        printf("Counters read from store differ from text, error code:%d\n", 
+               handler->err);
+        ret = 1;
+        goto EXIT;
+    }
+    store_latency = refresh_latency(handler);
+    printf("Refresh latency: text %.2lfus, store %.2lfus\n", 
+           text_latency, store_latency);
+
+    write_round(header, pcs, count, 0);
+    writer = fork();
+    if(writer == 0)
+    {
+        run_torn_writer(header, pcs, count);
+        _exit(0);
+    }
+    end = time(0) + TORN_READ_TEST_SECONDS;
+    while(time(0) < end)
+    {
+        ap_refresh(handler);
+        if(handler->err)
+        {
+            busy++;
+            continue;
+        }
+        refreshes++;
+        for(i = 1; i < handler->len; i++)
+        {
+            if(handler->buf[i].val_large != handler->buf[0].val_large)
+            {
+                torn++;
+                break;
+            }
+        }
+    }
+    kill(writer, SIGKILL);
+    waitpid(writer, 0, 0);
+    printf("Torn reads: %lld in %lld refreshes, %lld busy\n", 
+           torn, refreshes, busy);
+    if(torn != 0 || refreshes == 0)
+    {
+        ret = 1;
+        goto EXIT;
+    }
+    ret = run_store_recreate_test(handler, &header, pcs, count);
+
+EXIT:
+    if(header)
+    {
+        munmap(header, AP_STORE_HEADER_SIZE + sizeof(perf_counter) * PERF_COUNT_MAX);
+    }
+    unlink(test_store);
+    ap_close(handler);
+    return ret;
+}
@@ -16,10 +16,13 @@
 import os
 import re
 import socket
+import threading
 import traceback
 import time
 import datetime
-import psutil
+import httplib
+import mmap
+import struct
 import urlparse
 import xml.dom.minidom as minidom
 from azure.storage import TableService, Entity
@@ -125,18 +128,190 @@ def getAzureDiagnosticKeyRange():
     endKey = getMDSPartitionKey(identity, getMDSTimestamp(endTime))
     return startKey, endKey
 
+#Azure table queries of one cycle have to finish within this time
+TableFetchTimeout = MonitoringInterval / 2
+TableRequestTimeout = 20
+#How long a value is reported again when its query fails or times out
+LastGoodValueMaxAge = 5 * MonitoringInterval
+
+class PooledConnection(object):
+    """
+    Wraps a http connection handed to the azure sdk. The sdk closes the
+    connection after each request, this returns it to the pool instead if
+    the response was read completely.
+    """
+    def __init__(self, pool, key, connection):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = None
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def send(self, data):
+        #The sdk sends None for an empty body on non httplib connections
+        if data is not None:
+            self.connection.send(data)
+
+    def getresponse(self):
+        self.response = self.connection.getresponse()
+        return self.response
+
+    def close(self):
+        if (self.response is not None and self.response.isclosed() and
+                self.connection.sock is not None):
+            self.pool.release(self.key, self.connection)
+        else:
+            self.connection.close()
+        self.response = None
+
+class TableConnectionPool(object):
+    """
+    Table services and keep-alive connections to the table endpoints, kept
+    across requests and collection cycles. There is one table service per
+    table, so a service is never used by two queries at the same time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.services = {}
+        self.idle = {}
+
+    def getTableService(self, accountName, accountKey, hostBase, table):
+        key = (accountName, accountKey, hostBase, table)
+        with self.lock:
+            tableService = self.services.get(key)
+        if tableService is None:
+            tableService = TableService(account_name = accountName,
+                                        account_key = accountKey,
+                                        host_base = hostBase)
+            httpClient = tableService._httpclient
+            httpClient.get_connection = lambda request : \
+                    self.getConnection(httpClient, request)
+            with self.lock:
+                self.services[key] = tableService
+        return tableService
+
+    def createConnection(self, protocol, host, port):
+        if protocol == 'http':
+            return httplib.HTTPConnection(host, port,
+                                          timeout=TableRequestTimeout)
+        else:
+            return httplib.HTTPSConnection(host, port,
+                                           timeout=TableRequestTimeout)
+
+    def getConnection(self, httpClient, request):
+        protocol = request.protocol_override \
+                if request.protocol_override else httpClient.protocol
+        host = request.host
+        port = 80 if protocol == 'http' else 443
+        if ':' in host:
+            host, _, port = host.rpartition(':')
+        key = (protocol, host, int(port))
+        with self.lock:
+            connections = self.idle.get(key)
+            connection = connections.pop() if connections else None
+        if connection is None:
+            connection = self.createConnection(*key)
+        return PooledConnection(self, key, connection)
+
+    def release(self, key, connection):
+        with self.lock:
+            self.idle.setdefault(key, []).append(connection)
+
+tableConnectionPool = TableConnectionPool()
+
+def queryEntities(tableService, table, ofilter, oselect, top=None):
+    try:
+        return tableService.query_entities(table, ofilter, oselect, top)
+    except (socket.error, httplib.HTTPException):
+        #The server may have closed the pooled connection, retry once on a
+        #new one
+        return tableService.query_entities(table, ofilter, oselect, top)
+
+class TableQuery(object):
+    def __init__(self, key, func, *args):
+        self.key = key
+        self.func = func
+        self.args = args
+
+class TableFetcher(object):
+    """
+    Runs the azure table queries of a collection cycle concurrently. The
+    queries are started at the beginning of the cycle, the data sources wait
+    for their results until the cycle deadline. A query that fails or misses
+    the deadline falls back to its last good value.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.lastGood = {}
+        self.deadline = None
+
+    def start(self, queries, timeout=TableFetchTimeout):
+        self.deadline = time.time() + timeout
+        for query in queries:
+            self.startQuery(query)
+
+    def startQuery(self, query):
+        with self.lock:
+            if query.key in self.pending:
+                thread, result = self.pending[query.key]
+                if thread.isAlive():
+                    waagent.Warn(("Query {0} from the last cycle is still "
+                                  "running.").format(query.key))
+                    return
+            result = []
+            def run():
+                result.append(query.func(*query.args))
+            thread = threading.Thread(target=run)
+            thread.setDaemon(True)
+            self.pending[query.key] = (thread, result)
+            thread.start()
+
+    def getResult(self, query):
+        if query.key not in self.pending:
+            if self.deadline is None or self.deadline < time.time():
+                self.deadline = time.time() + TableFetchTimeout
+            self.startQuery(query)
+        thread, result = self.pending[query.key]
+        thread.join(max(0, self.deadline - time.time()))
+        if thread.isAlive():
+            waagent.Warn(("Query {0} didn't finish before the cycle deadline."
+                          "").format(query.key))
+            value = None
+        else:
+            with self.lock:
+                del self.pending[query.key]
+            value = result[0] if result else None
+
+        now = time.time()
+        if value is not None:
+            self.lastGood[query.key] = (now, value)
+            return value
+        if query.key in self.lastGood:
+            timestamp, lastValue = self.lastGood[query.key]
+            if now - timestamp <= LastGoodValueMaxAge:
+                waagent.Log(("Use the last good value of {0}."
+                             "").format(query.key))
+                return lastValue
+        return None
+
+tableFetcher = TableFetcher()
+
 def getAzureDiagnosticCPUData(accountName, accountKey, hostBase,
                               startKey, endKey, deploymentId):
     try:
         waagent.Log("Retrieve diagnostic data(CPU).")
         table = "LinuxCpuVer2v0"
-        tableService = TableService(account_name = accountName, 
-                                    account_key = accountKey,
-                                    host_base = hostBase)
+        tableService = tableConnectionPool.getTableService(accountName,
+                                                           accountKey,
+                                                           hostBase,
+                                                           table)
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}' "
                    "and DeploymentId eq '{2}'").format(startKey, endKey, deploymentId)
         oselect = ("PercentProcessorTime,DeploymentId")
-        data = tableService.query_entities(table, ofilter, oselect, 1)
+        data = queryEntities(tableService, table, ofilter, oselect, 1)
         if data is None or len(data) == 0:
             return None
         cpuPercent = float(data[0].PercentProcessorTime)
@@ -154,13 +329,14 @@ def getAzureDiagnosticMemoryData(accountName, accountKey, hostBase,
     try:
         waagent.Log("Retrieve diagnostic data: Memory")
         table = "LinuxMemoryVer2v0"
-        tableService = TableService(account_name = accountName, 
-                                    account_key = accountKey,
-                                    host_base = hostBase)
+        tableService = tableConnectionPool.getTableService(accountName,
+                                                           accountKey,
+                                                           hostBase,
+                                                           table)
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}' "
                    "and DeploymentId eq '{2}'").format(startKey, endKey, deploymentId)
         oselect = ("PercentAvailableMemory,DeploymentId")
-        data = tableService.query_entities(table, ofilter, oselect, 1)
+        data = queryEntities(tableService, table, ofilter, oselect, 1)
         if data is None or len(data) == 0:
             return None
         memoryPercent = 100 - float(data[0].PercentAvailableMemory)
@@ -172,27 +348,25 @@ def getAzureDiagnosticMemoryData(accountName, accountKey, hostBase,
         AddExtensionEvent(message=FAILED_TO_RETRIEVE_MDS_DATA)
         return None
 
+def getAzureDiagnosticQueries(config):
+    accountName = config.getLADName()
+    accountKey = config.getLADKey()
+    hostBase = config.getLADHostBase()
+    deploymentId = config.getVmDeploymentId()
+    startKey, endKey = getAzureDiagnosticKeyRange()
+    args = (accountName, accountKey, hostBase, startKey, endKey, deploymentId)
+    cpuQuery = TableQuery(("LAD", accountName, "CPU"),
+                          getAzureDiagnosticCPUData, *args)
+    memoryQuery = TableQuery(("LAD", accountName, "Memory"),
+                             getAzureDiagnosticMemoryData, *args)
+    return cpuQuery, memoryQuery
+
 class AzureDiagnosticData(object):
     def __init__(self, config):
         self.config = config
-        accountName = config.getLADName()
-        accountKey = config.getLADKey()
-        hostBase = config.getLADHostBase()
-        hostname = socket.gethostname()
-        deploymentId = config.getVmDeploymentId()
-        startKey, endKey = getAzureDiagnosticKeyRange()
-        self.cpuPercent = getAzureDiagnosticCPUData(accountName, 
-                                                    accountKey,
-                                                    hostBase,
-                                                    startKey,
-                                                    endKey,
-                                                    deploymentId)
-        self.memoryPercent = getAzureDiagnosticMemoryData(accountName, 
-                                                          accountKey,
-                                                          hostBase,
-                                                          startKey,
-                                                          endKey,
-                                                          deploymentId)
+        cpuQuery, memoryQuery = getAzureDiagnosticQueries(config)
+        self.cpuPercent = tableFetcher.getResult(cpuQuery)
+        self.memoryPercent = tableFetcher.getResult(memoryQuery)
 
     def getCPUPercent(self):
         return self.cpuPercent
@@ -345,17 +519,77 @@ class CPUInfo(object):
         return self.isHTon
 
     def getCPUPercent(self):
-        return psutil.cpu_percent()
-    
+        return cpuTimesSampler.sample()
+
+class CPUTimesSampler(object):
+    """
+    CPU usage since the previous sample, from the aggregated line of /proc/stat.
+    """
+    def __init__(self, statFile="/proc/stat"):
+        self.statFile = statFile
+        self.lastTimes = None
+
+    def readTimes(self):
+        content = waagent.GetFileContents(self.statFile)
+        if content is None:
+            return None
+        fields = content.split("\n")[0].split()
+        if len(fields) < 5 or fields[0] != "cpu":
+            return None
+        times = map(lambda x : long(x), fields[1:])
+        #guest and guest_nice are already counted in user and nice
+        total = sum(times[0:8])
+        #idle and iowait
+        idle = sum(times[3:5])
+        return total, idle
+
+    def sample(self):
+        times = self.readTimes()
+        if times is None:
+            return None
+        lastTimes = self.lastTimes
+        self.lastTimes = times
+        if lastTimes is None or times[0] <= lastTimes[0]:
+            return 0.0
+        totalDelta = times[0] - lastTimes[0]
+        idleDelta = times[1] - lastTimes[1]
+        return round(100.0 * (totalDelta - idleDelta) / totalDelta, 1)
+
+cpuTimesSampler = CPUTimesSampler()
+
+def readMemInfo(memInfoFile="/proc/meminfo"):
+    """
+    Returns a dict of /proc/meminfo fields in bytes.
+    """
+    memInfo = {}
+    content = waagent.GetFileContents(memInfoFile)
+    if content is None:
+        return memInfo
+    for line in content.split("\n"):
+        fields = line.split()
+        if len(fields) >= 2 and fields[0].endswith(":"):
+            memInfo[fields[0][:-1]] = long(fields[1]) * 1024
+    return memInfo
+
 class MemoryInfo(object):
-    def __init__(self):
-        self.memInfo = psutil.virtual_memory()
+    def __init__(self, memInfoFile="/proc/meminfo"):
+        memInfo = readMemInfo(memInfoFile)
+        self.total = memInfo.get("MemTotal", 0L)
+        if "MemAvailable" in memInfo:
+            self.available = memInfo["MemAvailable"]
+        else:
+            #Kernels before 3.14 don't report MemAvailable
+            self.available = (memInfo.get("MemFree", 0L) + 
+                              memInfo.get("Buffers", 0L) + 
+                              memInfo.get("Cached", 0L))
 
     def getMemSize(self):
-        return self.memInfo[0]  / 1024 / 1024 #MB
+        return self.total  / 1024 / 1024 #MB
 
     def getMemPercent(self):
-        return self.memInfo[2] #%
+        if self.total == 0:
+            return None
+        return round(100.0 * (self.total - self.available) / self.total, 1) #%
 
 def getMacAddress(adapterId):
     nicAddrPath = os.path.join("/sys/class/net", adapterId, "address")
@@ -374,11 +608,65 @@ def sameList(l1, l2):
             return False
     return True
 
+NetDevFile = "/proc/net/dev"
+NetSnmpFile = "/proc/net/snmp"
+
+def readNetworkCounters(netDevFile=NetDevFile):
+    """
+    Read received and sent bytes of all adapters from /proc/net/dev in one go.
+    Returns a dict of adapterId -> (bytesRecv, bytesSent).
+    """
+    counters = {}
+    content = waagent.GetFileContents(netDevFile)
+    if content is None:
+        return counters
+    #Skip the two header lines
+    for line in content.split("\n")[2:]:
+        if ":" not in line:
+            continue
+        adapterId, data = line.split(":", 1)
+        fields = data.split()
+        if len(fields) < 9:
+            continue
+        counters[adapterId.strip()] = (int(fields[0]), int(fields[8]))
+    return counters
+
+class NetworkRateSampler(object):
+    """
+    Keep the counters of the previous sample, so that the rates of all the 
+    adapters are the deltas over the time between two collection cycles.
+    """
+    def __init__(self, netDevFile=NetDevFile):
+        self.netDevFile = netDevFile
+        self.lastCounters = None
+        self.lastTime = None
+
+    def sample(self):
+        counters = readNetworkCounters(self.netDevFile)
+        now = time.time()
+        rates = {}
+        if self.lastCounters is not None and now > self.lastTime:
+            interval = now - self.lastTime
+            for adapterId, (bytesRecv, bytesSent) in counters.iteritems():
+                last = self.lastCounters.get(adapterId)
+                #New adapter or counters reset, report it from the next sample
+                if last is None or bytesRecv < last[0] or bytesSent < last[1]:
+                    continue
+                rates[adapterId] = ((bytesRecv - last[0]) / interval,
+                                    (bytesSent - last[1]) / interval)
+        self.lastCounters = counters
+        self.lastTime = now
+        return counters, rates
+
+networkRateSampler = NetworkRateSampler()
+
 class NetworkInfo(object):
-    def __init__(self):
-        self.nics = psutil.net_io_counters(pernic=True)
+    def __init__(self, sampler=None):
+        if sampler is None:
+            sampler = networkRateSampler
+        self.nics, self.rates = sampler.sample()
         self.nicNames = []
-        for nicName, stat in self.nics.iteritems():
+        for nicName in self.nics:
             if nicName != 'lo':
                 self.nicNames.append(nicName)
 
@@ -386,52 +674,35 @@ class NetworkInfo(object):
         return self.nicNames
 
     def getNetworkReadBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_recv1 = net[adapterId][1]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_recv2 = net[adapterId][1]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_recv2 - bytes_recv1) / interval
+        rate = self.rates.get(adapterId)
+        if rate is not None:
+            return rate[0]
         else:
             return 0
 
     def getNetworkWriteBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_sent1 = net[adapterId][0]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_sent2 = net[adapterId][0]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_sent2 - bytes_sent1) / interval
+        rate = self.rates.get(adapterId)
+        if rate is not None:
+            return rate[1]
         else:
             return 0
 
-    def getNetstat(self):
-        retCode, output = waagent.RunGetOutput("netstat -s", chk_err=False)
-        return output
+    def getNetSnmp(self):
+        return waagent.GetFileContents(NetSnmpFile)
 
     def getNetworkPacketRetransmitted(self):
-        netstat = self.getNetstat()
-        match = re.search("(\d+)\s*segments retransmited", netstat)
-        if match != None:
-            return int(match.group(1))
+        snmp = self.getNetSnmp()
+        retransSegs = None
+        if snmp is not None:
+            #The Tcp: header line is followed by the Tcp: values line
+            tcpLines = filter(lambda x : x.startswith("Tcp:"), snmp.split("\n"))
+            if len(tcpLines) >= 2:
+                fields = dict(zip(tcpLines[0].split()[1:], tcpLines[1].split()[1:]))
+                retransSegs = fields.get("RetransSegs")
+        if retransSegs is not None:
+            return int(retransSegs)
         else:
-            waagent.Error("Failed to parse netstat output: {0}".format(netstat))
+            waagent.Error("Failed to parse {0}: {1}".format(NetSnmpFile, snmp))
             updateLatestErrorRecord(FAILED_TO_RETRIEVE_LOCAL_DATA)
             AddExtensionEvent(message=FAILED_TO_RETRIEVE_LOCAL_DATA)
             return None
@@ -470,15 +741,57 @@ class HardwareChangeInfo(object):
         else:
             return oldTime
 
+CPUOnlineFile = "/sys/devices/system/cpu/online"
+class FactCache(object):
+    """
+    Facts that don't change every cycle, in two tiers. Boot static facts are
+    loaded once per process. Hotplug facts are loaded again when the hardware
+    signature, the online CPUs and the MAC list, changes. Per cycle data is
+    not cached, it's read from /proc every cycle.
+    """
+    def __init__(self):
+        self.bootStatic = {}
+        self.hotplug = {}
+        self.hwSignature = None
+
+    def getBootStatic(self, key, loader):
+        if key not in self.bootStatic:
+            self.bootStatic[key] = loader()
+        return self.bootStatic[key]
+
+    def updateHardwareSignature(self, hwSignature):
+        if hwSignature != self.hwSignature:
+            if self.hwSignature is not None:
+                waagent.Log("Hardware change detected, reload hotplug facts.")
+            self.hotplug.clear()
+            self.hwSignature = hwSignature
+
+    def getHotplug(self, key, loader):
+        if key not in self.hotplug:
+            self.hotplug[key] = loader()
+        return self.hotplug[key]
+
+factCache = FactCache()
+
+def getHardwareSignature(adapterIds):
+    cpuOnline = waagent.GetFileContents(CPUOnlineFile)
+    if cpuOnline is not None:
+        cpuOnline = cpuOnline.strip()
+    macs = map(lambda x : getMacAddress(x), adapterIds)
+    macs.sort()
+    return cpuOnline, tuple(macs)
+
 class LinuxMetric(object):
     def __init__(self, config):
         self.config = config
+        #Network
+        self.networkInfo = NetworkInfo()
+        factCache.updateHardwareSignature(getHardwareSignature(
+            self.networkInfo.getAdapterIds()))
         #CPU
-        self.cpuInfo = CPUInfo.getCPUInfo()
+        self.cpuInfo = factCache.getHotplug("cpuInfo", CPUInfo.getCPUInfo)
         #Memory
         self.memInfo = MemoryInfo()
-        #Network
-        self.networkInfo = NetworkInfo()
         #Detect hardware change
         self.hwChangeInfo = HardwareChangeInfo(self.networkInfo)
         self.timestamp = int(time.time())
@@ -568,6 +881,12 @@ class VMDataSource(object):
     def __init__(self, config):
         self.config = config
 
+    def getTableQueries(self):
+        if self.config.isLADEnabled():
+            return list(getAzureDiagnosticQueries(self.config))
+        else:
+            return []
+
     def collect(self):
         counters = []
         if self.config.isLADEnabled():
@@ -812,14 +1131,15 @@ def getStorageTableKeyRange():
 def getStorageMetrics(account, key, hostBase, table, startKey, endKey):
     try:
         waagent.Log("Retrieve storage metrics data.")
-        tableService = TableService(account_name = account, 
-                                    account_key = key,
-                                    host_base = hostBase)
+        tableService = tableConnectionPool.getTableService(account,
+                                                           key,
+                                                           hostBase,
+                                                           table)
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}'"
                    "").format(startKey, endKey)
         oselect = ("TotalRequests,TotalIngress,TotalEgress,AverageE2ELatency,"
                    "AverageServerLatency,RowKey")
-        metrics = tableService.query_entities(table, ofilter, oselect)
+        metrics = queryEntities(tableService, table, ofilter, oselect)
         waagent.Log("{0} records returned.".format(len(metrics)))
         return metrics
     except Exception as e:
@@ -988,24 +1308,36 @@ class StorageDataSource(object):
                 counters.append(self.createCounterDiskIOPS(dev, disk.get("iops")))
                 counters.append(self.createCounterDiskThroughput(dev, disk.get("throughput")))
 
-        accounts = self.config.getStorageAccountNames()
-        for account in accounts:
-            if self.config.getStorageAccountType(account) == "Standard":
-                counters.extend(self.collectMetrixForStandardStorage(account))
+        for account in self.getStandardStorageAccounts():
+            counters.extend(self.collectMetrixForStandardStorage(account))
         return counters
 
-    def collectMetrixForStandardStorage(self, account):
-        counters = []
+    def getStandardStorageAccounts(self):
+        accounts = self.config.getStorageAccountNames()
+        return filter(lambda x : self.config.getStorageAccountType(x) == "Standard",
+                      accounts)
+
+    def getTableQueries(self):
+        return map(lambda x : self.getStorageMetricsQuery(x),
+                   self.getStandardStorageAccounts())
+
+    def getStorageMetricsQuery(self, account):
         startKey, endKey = getStorageTableKeyRange()
         tableName = self.config.getStorageAccountMinuteTable(account)
         accountKey = self.config.getStorageAccountKey(account)
         hostBase = self.config.getStorageHostBase(account)
-        metrics = getStorageMetrics(account, 
-                                    accountKey,
-                                    hostBase,
-                                    tableName,
-                                    startKey,
-                                    endKey)
+        return TableQuery(("Storage", account, tableName),
+                          getStorageMetrics,
+                          account,
+                          accountKey,
+                          hostBase,
+                          tableName,
+                          startKey,
+                          endKey)
+
+    def collectMetrixForStandardStorage(self, account):
+        counters = []
+        metrics = tableFetcher.getResult(self.getStorageMetricsQuery(account))
         stat = AzureStorageStat(metrics)
         counters.append(self.createCounterStorageId(account))
         counters.append(self.createCounterReadBytes(account, stat))
@@ -1177,9 +1509,12 @@ class StaticDataSource(object):
     def __init__(self, config):
         self.config = config
 
+    def getTableQueries(self):
+        return []
+
     def collect(self):
         counters = []
-        hvInfo = HvInfo()
+        hvInfo = factCache.getBootStatic("hvInfo", HvInfo)
         counters.append(self.createCounterCloudProvider())
         counters.append(self.createCounterCpuOverCommitted())
         counters.append(self.createCounterMemoryOverCommitted())
@@ -1314,16 +1649,204 @@ class EnhancedMonitor(object):
         self.dataSources.append(StorageDataSource(config))
         self.dataSources.append(StaticDataSource(config))
         self.writer = PerfCounterWriter()
+        #Take the first network sample, the rates of the first cycle are
+        #computed against it
+        networkRateSampler.sample()
 
     def run(self):
         counters = []
+        #Start all the azure table queries before collecting the local data
+        queries = []
+        for dataSource in self.dataSources:
+            queries.extend(dataSource.getTableQueries())
+        tableFetcher.start(queries)
         for dataSource in self.dataSources:
             counters.extend(dataSource.collect())
         clearLastErrorRecord()
         self.writer.write(counters)
 
+#Layout of ap_store_header and perf_counter in clib/include/azureperf.h
+PerfCounterStoreMagic = "AZPERFST"
+PerfCounterStoreVersion = 1
+PerfCounterStoreHeaderSize = 64
+PerfCounterStoreCapacity = 128 #PERF_COUNT_MAX
+StoreHeaderFormat = "<8sIIIIQII"
+StoreGenerationOffset = 24
+StoreCountOffset = 32
+#Type, category, name, instance and the is empty flag
+StoreRecordHeadFormat = "<i64s128s256si"
+StoreRecordValueSize = 256
+#Unit, refresh interval, timestamp and machine name
+StoreRecordTailFormat = "<64sI4xq128s"
+StoreRecordSize = (struct.calcsize(StoreRecordHeadFormat) + 
+                   StoreRecordValueSize + 
+                   struct.calcsize(StoreRecordTailFormat))
+
+def encodeStoreString(value, size):
+    if isinstance(value, unicode):
+        value = value.encode("utf8")
+    else:
+        value = str(value)
+    #Leave room for the terminating null
+    return value[0:size - 1]
+
+def packPerfCounterValue(counter):
+    if counter.counterType == PerfCounterType.COUNTER_TYPE_INT:
+        return struct.pack("<i", int(counter.value))
+    elif counter.counterType == PerfCounterType.COUNTER_TYPE_LARGE:
+        return struct.pack("<q", long(counter.value))
+    elif counter.counterType == PerfCounterType.COUNTER_TYPE_DOUBLE:
+        return struct.pack("<d", float(counter.value))
+    else:
+        return encodeStoreString(counter.value, StoreRecordValueSize)
+
+def packPerfCounter(counter):
+    value = None
+    if counter.value is not None:
+        try:
+            value = packPerfCounterValue(counter)
+        except (struct.error, ValueError, TypeError) as e:
+            waagent.Warn(("Perf counter {0} doesn't fit in the store: {1}"
+                          "").format(counter.name, e))
+    return (struct.pack(StoreRecordHeadFormat,
+                        counter.counterType,
+                        encodeStoreString(counter.category, 64),
+                        encodeStoreString(counter.name, 128),
+                        encodeStoreString(counter.instance, 256),
+                        0 if value is not None else 1) +
+            (value or "").ljust(StoreRecordValueSize, "\0") +
+            struct.pack(StoreRecordTailFormat,
+                        encodeStoreString(counter.unit, 64),
+                        counter.refreshInterval,
+                        counter.timestamp,
+                        encodeStoreString(counter.machine, 128)))
+
+def unpackPerfCounter(record):
+    headSize = struct.calcsize(StoreRecordHeadFormat)
+    counterType, category, name, instance, isEmpty = struct.unpack(
+            StoreRecordHeadFormat, record[0:headSize])
+    value = record[headSize:headSize + StoreRecordValueSize]
+    unit, refreshInterval, timestamp, machine = struct.unpack(
+            StoreRecordTailFormat, record[headSize + StoreRecordValueSize:])
+    if isEmpty:
+        value = None
+    elif counterType == PerfCounterType.COUNTER_TYPE_INT:
+        value = struct.unpack("<i", value[0:4])[0]
+    elif counterType == PerfCounterType.COUNTER_TYPE_LARGE:
+        value = struct.unpack("<q", value[0:8])[0]
+    elif counterType == PerfCounterType.COUNTER_TYPE_DOUBLE:
+        value = struct.unpack("<d", value[0:8])[0]
+    else:
+        value = value.rstrip("\0").decode("utf8", "replace")
+    counter = PerfCounter(counterType = counterType,
+                          category = category.rstrip("\0"),
+                          name = name.rstrip("\0"),
+                          instance = instance.rstrip("\0"),
+                          value = value,
+                          unit = unit.rstrip("\0"),
+                          timestamp = timestamp,
+                          refreshInterval = refreshInterval)
+    counter.machine = machine.rstrip("\0")
+    return counter
+
+class PerfCounterStore(object):
+    """
+    Fixed layout binary copy of the perf counters in a memory mapped file,
+    read by the azureperf library. The file is created once and updated in
+    place. The generation in the header is odd while the records are being
+    written, readers retry until they see the same even generation before
+    and after reading the records.
+    """
+    def __init__(self, storeFile, capacity=PerfCounterStoreCapacity):
+        self.storeFile = storeFile
+        self.capacity = capacity
+        self.size = PerfCounterStoreHeaderSize + capacity * StoreRecordSize
+        self.map = None
+
+    def open(self):
+        self.close()
+        fd = os.open(self.storeFile, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            #Only grow the file, shrinking it under a reader's mapping would
+            #crash the reader
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            self.map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        header = struct.unpack_from(StoreHeaderFormat, self.map, 0)
+        if header[0:5] != (PerfCounterStoreMagic, 
+                           PerfCounterStoreVersion,
+                           PerfCounterStoreHeaderSize,
+                           StoreRecordSize,
+                           self.capacity):
+            generation = self.beginWrite()
+            struct.pack_into("<8sIIII", self.map, 0,
+                             PerfCounterStoreMagic, 
+                             PerfCounterStoreVersion,
+                             PerfCounterStoreHeaderSize,
+                             StoreRecordSize,
+                             self.capacity)
+            struct.pack_into("<I", self.map, StoreCountOffset, 0)
+            self.endWrite(generation)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def getGeneration(self):
+        return struct.unpack_from("<Q", self.map, StoreGenerationOffset)[0]
+
+    def beginWrite(self):
+        #An odd generation is left by a writer that didn't finish
+        generation = self.getGeneration() & ~1L
+        struct.pack_into("<Q", self.map, StoreGenerationOffset, generation + 1)
+        return generation
+
+    def endWrite(self, generation):
+        struct.pack_into("<Q", self.map, StoreGenerationOffset, generation + 2)
+
+    def write(self, counters):
+        if self.map is None or not os.path.isfile(self.storeFile):
+            self.open()
+        if len(counters) > self.capacity:
+            waagent.Warn(("{0} perf counters don't fit in the store, the last "
+                          "{1} are dropped.").format(len(counters), 
+                                                     len(counters) - self.capacity))
+            counters = counters[0:self.capacity]
+        records = "".join(map(lambda c : packPerfCounter(c), counters))
+        generation = self.beginWrite()
+        start = PerfCounterStoreHeaderSize
+        self.map[start:start + len(records)] = records
+        struct.pack_into("<I", self.map, StoreCountOffset, len(counters))
+        self.endWrite(generation)
+
+    def read(self, maxRetry = 1000):
+        if self.map is None:
+            self.open()
+        for i in range(0, maxRetry):
+            generation = self.getGeneration()
+            if generation & 1:
+                time.sleep(0.001)
+                continue
+            count = struct.unpack_from("<I", self.map, StoreCountOffset)[0]
+            start = PerfCounterStoreHeaderSize
+            records = self.map[start:start + min(count, self.capacity) * StoreRecordSize]
+            if self.getGeneration() == generation:
+                return map(lambda i : unpackPerfCounter(records[i:i + StoreRecordSize]),
+                           range(0, len(records), StoreRecordSize))
+        raise IOError("Perf counter store is being written: {0}".format(self.storeFile))
+
 EventFile=os.path.join(LibDir, "PerfCounters")
 class PerfCounterWriter(object):
+    """
+    Writes the perf counters to the binary store read by the azureperf
+    library, and exports them in the text format to the event file.
+    """
+    def __init__(self):
+        self.stores = {}
+
     def write(self, counters, maxRetry = 3, eventFile=EventFile):
         for i in range(0, maxRetry):
             try:
@@ -1331,7 +1854,7 @@ class PerfCounterWriter(object):
                 waagent.Log(("Write {0} counters to event file."
                              "").format(len(counters)))
                 return
-            except IOError as e:
+            except EnvironmentError as e:
                 waagent.Warn((u"Write to perf counters file failed: {0}"
                               "").format(e))
                 waagent.Log("Retry: {0}".format(i))
@@ -1344,8 +1867,26 @@ class PerfCounterWriter(object):
         raise
 
     def _write(self, counters, eventFile):
-        with open(eventFile, "w+") as F:
-            F.write("".join(map(lambda c : str(c), counters)).encode("utf8"))
+        self.export(counters, eventFile)
+        if not os.path.isfile(eventFile):
+            return
+        storeFile = eventFile + ".bin"
+        if storeFile not in self.stores:
+            self.stores[storeFile] = PerfCounterStore(storeFile)
+        self.stores[storeFile].write(counters)
+
+    def export(self, counters, eventFile):
+        content = "".join(map(lambda c : str(c), counters)).encode("utf8")
+        if os.path.exists(eventFile) and not os.path.isfile(eventFile):
+            with open(eventFile, "w+") as F:
+                F.write(content)
+            return
+        #Replace the file, so that readers of the text format never see it
+        #half written
+        tmpFile = eventFile + ".tmp"
+        with open(tmpFile, "w+") as F:
+            F.write(content)
+        os.rename(tmpFile, eventFile)
 
 class EnhancedMonitorConfig(object):
     def __init__(self, publicConfig, privateConfig):
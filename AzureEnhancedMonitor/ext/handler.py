@@ -102,6 +102,9 @@ def daemon(hutil):
             hutil.do_status_report("Enable", "error", 0, "{0}".format(e))
         waagent.Log("Finished collection.")
         timeElapsed = time.time() - startTime
+        if timeElapsed > aem.MonitoringInterval:
+            waagent.Warn(("Collection took {0:.1f}s, longer than the "
+                          "monitoring interval.").format(timeElapsed))
         timeToWait = (aem.MonitoringInterval - timeElapsed)
         #Make sure timeToWait is in the range [0, aem.MonitoringInterval)
         timeToWait = timeToWait % aem.MonitoringInterval
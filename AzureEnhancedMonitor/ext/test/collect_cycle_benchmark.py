@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#Runs the local part of a collection cycle, the VM and the static data
+#sources without LAD, a number of times and reports the latency of the first
+#and of the steady state cycles, with the commands forked in each.
+#Usage: python collect_cycle_benchmark.py [cycles]
+
+import json
+import sys
+import time
+
+import env
+import aem
+from Utils.WAAgentUtil import waagent
+from test_aem import TestPublicConfig, TestPrivateConfig
+
+forks = []
+runGetOutput = waagent.RunGetOutput
+def countingRunGetOutput(cmd, *args, **kwargs):
+    forks.append(cmd)
+    return runGetOutput(cmd, *args, **kwargs)
+
+def collect(config):
+    del forks[:]
+    start = time.time()
+    aem.VMDataSource(config).collect()
+    aem.StaticDataSource(config).collect()
+    return time.time() - start, len(forks)
+
+def main():
+    cycles = 100
+    if len(sys.argv) > 1:
+        cycles = int(sys.argv[1])
+    waagent.LoggerInit("/dev/null", "/dev/null")
+    waagent.RunGetOutput = countingRunGetOutput
+    config = aem.EnhancedMonitorConfig(json.loads(TestPublicConfig),
+                                       json.loads(TestPrivateConfig))
+    config.configData["wad.isenabled"] = "0"
+
+    elapsed, forkCount = collect(config)
+    print("First cycle: {0:.2f}ms, {1} forks".format(elapsed * 1000,
+                                                     forkCount))
+    total = 0
+    totalForks = 0
+    for i in range(0, cycles):
+        elapsed, forkCount = collect(config)
+        total = total + elapsed
+        totalForks = totalForks + forkCount
+    print("Steady state: {0:.2f}ms per cycle, {1:.2f} forks per cycle".format(
+          total * 1000 / cycles, float(totalForks) / cycles))
+
+if __name__ == '__main__':
+    main()
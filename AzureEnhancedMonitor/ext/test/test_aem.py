@@ -16,9 +16,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import BaseHTTPServer
+import SocketServer
 import datetime
+import httplib
 import os
 import json
+import threading
+import time
 import unittest
 
 import env
@@ -95,6 +100,59 @@ TestPrivateConfig = """\
     }]
 }
 """
+#The table service returns the feed without whitespace between the elements
+FakeTableFeed = ("<?xml version=\"1.0\" encoding=\"utf-8\" standalone=\"yes\"?>"
+                 "<feed xmlns:d=\"http://schemas.microsoft.com/ado/2007/08/dataservices\" "
+                 "xmlns:m=\"http://schemas.microsoft.com/ado/2007/08/dataservices/metadata\" "
+                 "xmlns=\"http://www.w3.org/2005/Atom\">"
+                 "<entry><content type=\"application/xml\"><m:properties>"
+                 "<d:PartitionKey>0000000000000000001___0635578412400000000</d:PartitionKey>"
+                 "<d:RowKey>1</d:RowKey>"
+                 "<d:PercentProcessorTime m:type=\"Edm.Double\">{0}</d:PercentProcessorTime>"
+                 "<d:DeploymentId>cd98461b43364478a908d03d0c3135a7</d:DeploymentId>"
+                 "</m:properties></content></entry></feed>")
+
+class FakeTableHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = FakeTableFeed.format(self.server.value)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class FakeTableServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           FakeTableHandler)
+        self.delay = 0
+        self.value = 25.0
+        self.connections = 0
+
+class FakeTableConnectionPool(aem.TableConnectionPool):
+    """
+    Sends the requests for all the accounts to the fake table server.
+    """
+    def __init__(self, server):
+        aem.TableConnectionPool.__init__(self)
+        self.server = server
+
+    def createConnection(self, protocol, host, port):
+        return httplib.HTTPConnection("127.0.0.1", self.server.server_port,
+                                      timeout=5)
+
 class TestAEM(unittest.TestCase):
     def setUp(self):
         waagent.LoggerInit("/dev/null", "/dev/stdout")
@@ -184,10 +242,114 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(0, len(adapterIds))
         adapterId = adapterIds[0]
         self.assertNotEquals(None, aem.getMacAddress(adapterId))
-        self.assertNotEquals(None, netinfo.getNetworkReadBytes())
-        self.assertNotEquals(None, netinfo.getNetworkWriteBytes())
+        self.assertNotEquals(None, netinfo.getNetworkReadBytes(adapterId))
+        self.assertNotEquals(None, netinfo.getNetworkWriteBytes(adapterId))
         self.assertNotEquals(None, netinfo.getNetworkPacketRetransmitted())
 
+    def test_network_rate_sampler(self):
+        testNetDevFile = "/tmp/NetDev"
+        netDevHeader = ("Inter-|   Receive                                                |  Transmit\n"
+                        " face |bytes    packets errs drop fifo frame compressed multicast|"
+                        "bytes    packets errs drop fifo colls carrier compressed\n")
+        netDevLine = "  {0}: {1} 10 0 0 0 0 0 0 {2} 10 0 0 0 0 0 0\n"
+        waagent.SetFileContents(testNetDevFile, netDevHeader + 
+                                netDevLine.format("lo", 100, 100) +
+                                netDevLine.format("eth0", 1000, 2000) +
+                                netDevLine.format("eth1", 5000, 5000))
+        sampler = aem.NetworkRateSampler(testNetDevFile)
+        netinfo = aem.NetworkInfo(sampler)
+        self.assertEquals(["eth0", "eth1"], sorted(netinfo.getAdapterIds()))
+        #No previous sample yet
+        self.assertEquals(0, netinfo.getNetworkReadBytes("eth0"))
+
+        sampler.lastTime = sampler.lastTime - 10
+        waagent.SetFileContents(testNetDevFile, netDevHeader + 
+                                netDevLine.format("lo", 100, 100) +
+                                netDevLine.format("eth0", 3000, 2500) +
+                                netDevLine.format("eth1", 10, 10) +
+                                netDevLine.format("eth2", 10, 10))
+        netinfo = aem.NetworkInfo(sampler)
+        self.assertAlmostEqual(200, netinfo.getNetworkReadBytes("eth0"), delta=1)
+        self.assertAlmostEqual(50, netinfo.getNetworkWriteBytes("eth0"), delta=1)
+        #Counters reset and new adapters have no rate until the next cycle
+        self.assertEquals(0, netinfo.getNetworkReadBytes("eth1"))
+        self.assertEquals(0, netinfo.getNetworkWriteBytes("eth2"))
+        os.remove(testNetDevFile)
+
+    def test_cpu_times_sampler(self):
+        testStatFile = "/tmp/Stat"
+        statLine = "cpu  {0} 0 {1} {2} {3} 0 0 0 {4} 0\ncpu0 1 2 3 4 5 0 0 0 0 0\n"
+        waagent.SetFileContents(testStatFile, statLine.format(100, 100, 700, 100, 50))
+        sampler = aem.CPUTimesSampler(testStatFile)
+        #No previous sample yet
+        self.assertEquals(0.0, sampler.sample())
+        #200 busy and 200 idle(iowait included), guest time is not counted
+        waagent.SetFileContents(testStatFile, statLine.format(250, 150, 850, 150, 80))
+        self.assertEquals(50.0, sampler.sample())
+        os.remove(testStatFile)
+
+    def test_meminfo_parser(self):
+        testMemInfoFile = "/tmp/MemInfo"
+        waagent.SetFileContents(testMemInfoFile, ("MemTotal:        4000 kB\n"
+                                                  "MemFree:          500 kB\n"
+                                                  "MemAvailable:    1000 kB\n"
+                                                  "Buffers:          100 kB\n"
+                                                  "Cached:           400 kB\n"
+                                                  "HugePages_Total:    0\n"))
+        meminfo = aem.MemoryInfo(testMemInfoFile)
+        self.assertEquals(3, meminfo.getMemSize()) #MB
+        self.assertEquals(75.0, meminfo.getMemPercent())
+
+        #Older kernels without MemAvailable
+        waagent.SetFileContents(testMemInfoFile, ("MemTotal:        4000 kB\n"
+                                                  "MemFree:          500 kB\n"
+                                                  "Buffers:          100 kB\n"
+                                                  "Cached:           400 kB\n"))
+        meminfo = aem.MemoryInfo(testMemInfoFile)
+        self.assertEquals(75.0, meminfo.getMemPercent())
+        os.remove(testMemInfoFile)
+
+    def test_net_snmp_parser(self):
+        testNetSnmpFile = "/tmp/NetSnmp"
+        waagent.SetFileContents(testNetSnmpFile,
+                ("Ip: Forwarding DefaultTTL InReceives\n"
+                 "Ip: 1 64 100\n"
+                 "Tcp: RtoAlgorithm RtoMin RtoMax MaxConn ActiveOpens "
+                 "PassiveOpens AttemptFails EstabResets CurrEstab InSegs "
+                 "OutSegs RetransSegs InErrs OutRsts InCsumErrors\n"
+                 "Tcp: 1 200 120000 -1 10 20 0 0 2 300 400 42 0 1 0\n"))
+        netSnmpFile = aem.NetSnmpFile
+        aem.NetSnmpFile = testNetSnmpFile
+        try:
+            netinfo = aem.NetworkInfo()
+            self.assertEquals(42, netinfo.getNetworkPacketRetransmitted())
+        finally:
+            aem.NetSnmpFile = netSnmpFile
+            os.remove(testNetSnmpFile)
+
+    def test_fact_cache(self):
+        factCache = aem.FactCache()
+        loads = []
+        def loader():
+            loads.append(1)
+            return len(loads)
+        self.assertEquals(1, factCache.getBootStatic("hvInfo", loader))
+        self.assertEquals(1, factCache.getBootStatic("hvInfo", loader))
+
+        factCache.updateHardwareSignature(("0-1", ("00-0d-3a-00-00-01",)))
+        self.assertEquals(2, factCache.getHotplug("cpuInfo", loader))
+        factCache.updateHardwareSignature(("0-1", ("00-0d-3a-00-00-01",)))
+        self.assertEquals(2, factCache.getHotplug("cpuInfo", loader))
+
+        #CPU hotplug invalidates the hotplug tier only
+        factCache.updateHardwareSignature(("0-3", ("00-0d-3a-00-00-01",)))
+        self.assertEquals(3, factCache.getHotplug("cpuInfo", loader))
+        self.assertEquals(1, factCache.getBootStatic("hvInfo", loader))
+
+        #So does a NIC change
+        factCache.updateHardwareSignature(("0-3", ()))
+        self.assertEquals(4, factCache.getHotplug("cpuInfo", loader))
+
     def test_hwchangeinfo(self):
         netinfo = aem.NetworkInfo()
         testHwInfoFile = "/tmp/HwInfo"
@@ -342,6 +504,54 @@ class TestAEM(unittest.TestCase):
             self.assertNotEquals(None, counter)
             self.assertNotEquals(None, counter.value)
 
+    def runFetchCycle(self, fetcher, queries, timeout=5):
+        startTime = time.time()
+        fetcher.start(queries, timeout)
+        results = map(lambda q : fetcher.getResult(q), queries)
+        return time.time() - startTime, results
+
+    def test_table_fetcher(self):
+        server = FakeTableServer()
+        serverThread = threading.Thread(target=server.serve_forever)
+        serverThread.setDaemon(True)
+        serverThread.start()
+        tableConnectionPool = aem.tableConnectionPool
+        aem.tableConnectionPool = FakeTableConnectionPool(server)
+        try:
+            def getQueries(accountCount):
+                return map(lambda i : aem.TableQuery(
+                    ("LAD", "account{0}".format(i), "CPU"),
+                    aem.getAzureDiagnosticCPUData,
+                    "account{0}".format(i),
+                    "cXdlcg==",
+                    ".table.core.windows.net",
+                    "startKey",
+                    "endKey",
+                    "cd98461b43364478a908d03d0c3135a7"), range(0, accountCount))
+            fetcher = aem.TableFetcher()
+            server.delay = 0.5
+            oneAccountTime, results = self.runFetchCycle(fetcher, getQueries(1))
+            self.assertEquals([25.0], results)
+            #The queries of all the accounts run at the same time
+            manyAccountsTime, results = self.runFetchCycle(fetcher, getQueries(8))
+            self.assertEquals([25.0] * 8, results)
+            self.assertTrue(manyAccountsTime < oneAccountTime + 0.4)
+
+            #Connections are kept across cycles
+            self.runFetchCycle(fetcher, getQueries(8))
+            self.assertEquals(8, server.connections)
+
+            #Queries missing the deadline report the last good value
+            server.delay = 2
+            server.value = 50.0
+            elapsed, results = self.runFetchCycle(fetcher, getQueries(8), 0.2)
+            self.assertEquals([25.0] * 8, results)
+            self.assertTrue(elapsed < 1)
+        finally:
+            aem.tableConnectionPool = tableConnectionPool
+            server.shutdown()
+            server.server_close()
+
     def test_writer(self):
         testEventFile = "/tmp/Event"
         if os.path.isfile(testEventFile):
@@ -364,6 +574,59 @@ class TestAEM(unittest.TestCase):
         self.assertRaises(IOError, writer.write, counters, 2, testEventFile)
         print("==============================")
 
+    def test_perf_counter_store(self):
+        testStoreFile = "/tmp/PerfCounters.bin"
+        if os.path.isfile(testStoreFile):
+            os.remove(testStoreFile)
+        counters = [aem.PerfCounter(counterType = 1,
+                                    category = "cpu",
+                                    name = "Current VM Processing Power",
+                                    value = 4,
+                                    unit = "compute unit"),
+                    aem.PerfCounter(counterType = 2,
+                                    category = "cpu",
+                                    name = "Current Hw Frequency",
+                                    value = 2194.507,
+                                    unit = "MHz",
+                                    refreshInterval = 60),
+                    aem.PerfCounter(counterType = 3,
+                                    category = "network",
+                                    name = "Network Read Bytes",
+                                    instance = "eth0",
+                                    value = 1L << 40,
+                                    unit = "byte/s"),
+                    aem.PerfCounter(counterType = 4,
+                                    category = "config",
+                                    name = "Cloud Provider",
+                                    value = "Microsoft Azure"),
+                    aem.PerfCounter(counterType = 1,
+                                    category = "memory",
+                                    name = "Current Memory assigned",
+                                    value = None,
+                                    unit = "MB")]
+        store = aem.PerfCounterStore(testStoreFile)
+        store.write(counters)
+        self.assertEquals(aem.PerfCounterStoreHeaderSize +
+                          aem.PerfCounterStoreCapacity * 920,
+                          os.path.getsize(testStoreFile))
+        self.assertEquals(4, store.getGeneration())
+        readCounters = aem.PerfCounterStore(testStoreFile).read()
+        self.assertEquals(map(lambda c : str(c), counters),
+                          map(lambda c : str(c), readCounters))
+
+        #Updated in place
+        store.write(counters[0:2])
+        self.assertEquals(6, store.getGeneration())
+        self.assertEquals(2, len(aem.PerfCounterStore(testStoreFile).read()))
+
+        #A writer stopped in the middle of an update
+        store.beginWrite()
+        self.assertRaises(IOError, aem.PerfCounterStore(testStoreFile).read, 3)
+        store.write(counters)
+        self.assertEquals(8, store.getGeneration())
+        store.close()
+        os.remove(testStoreFile)
+
     def test_easyHash(self):
         hashVal = aem.easyHash('a')
         self.assertEquals(97, hashVal)
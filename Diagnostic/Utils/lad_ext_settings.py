@@ -170,3 +170,16 @@ class LadExtSettings(ExtSettings):
             return " -T {0}".format(flags)
         else:
             return ""
+
+    def get_mdsd_memory_limit_in_MB(self):
+        """
+        Return mdsdMemoryLimitInMB, if any, from public config
+        :rtype: int
+        :return: mdsd memory limit in MB, or None if not given or invalid
+        """
+        limit = self.read_public_config('mdsdMemoryLimitInMB')
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return None
+        return limit if limit > 0 else None
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#
+# Azure Linux extension
+#
+# Linux Azure Diagnostic Extension (Current version is specified in manifest.xml)
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+# MIT License
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the ""Software""), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+# THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# mdsd memory accounting: RSS samples from /proc/<pid>/statm are kept in a ring buffer, and a leak is suspected
+# when the RSS exceeds a budget derived from the VM/cgroup memory, or when it grows steadily towards that budget.
+
+import collections
+import os
+import time
+
+_page_size_in_KB = os.sysconf('SC_PAGE_SIZE') / 1024
+_unlimited_in_KB = 1 << 52  # cgroup v1 reports "no limit" as a huge number close to 2^63 bytes
+
+default_budget_ratio = 0.3  # Default budget is this ratio of the VM (or cgroup) memory...
+min_default_budget_in_KB = 256 * 1024  # ...but no less than 256MB
+max_default_budget_in_KB = 2000000  # ...and no more than roughly 2GB, which used to be the fixed threshold
+
+
+def read_rss_in_KB(pid):
+    """
+    Read the resident set size of a process from /proc/<pid>/statm, which is cheaper to read than status or smaps.
+    :param pid: ID of the process
+    :rtype: int
+    :return: RSS in KB, or None if the process doesn't exist.
+    """
+    try:
+        with open('/proc/{0}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * _page_size_in_KB
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def read_anonymous_in_KB(pid):
+    """
+    Read the anonymous (heap and other private) memory of a process from /proc/<pid>/smaps_rollup (Linux 4.14+).
+    This walks all the mappings of the process, so it's only read when a leak is suspected.
+    :param pid: ID of the process
+    :rtype: int
+    :return: Anonymous memory in KB, or None if smaps_rollup isn't available.
+    """
+    try:
+        with open('/proc/{0}/smaps_rollup'.format(pid)) as f:
+            for line in f:
+                if line.startswith('Anonymous:'):  # Example line: "Anonymous:         33904 kB"
+                    return int(line.split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def _read_cgroup_memory_limit_in_KB(proc_cgroup_path, cgroup_root):
+    """
+    Read the memory limit of the cgroup of a process, for either cgroup v2 or v1.
+    :return: The limit in KB, or None if there's no limit
+    """
+    try:
+        with open(proc_cgroup_path) as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return None
+
+    for line in lines:
+        hierarchy_id, controllers, path = line.split(':', 2)
+        if hierarchy_id == '0' and controllers == '':
+            limit_path = os.path.join(cgroup_root, path.lstrip('/'), 'memory.max')
+        elif 'memory' in controllers.split(','):
+            limit_path = os.path.join(cgroup_root, 'memory', path.lstrip('/'), 'memory.limit_in_bytes')
+        else:
+            continue
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+        except (IOError, OSError):
+            continue
+        if limit.isdigit() and int(limit) / 1024 < _unlimited_in_KB:
+            return int(limit) / 1024
+    return None
+
+
+def get_available_memory_in_KB(meminfo_path='/proc/meminfo', proc_cgroup_path='/proc/self/cgroup',
+                               cgroup_root='/sys/fs/cgroup'):
+    """
+    Get the memory available to LAD (and mdsd, which is in the same cgroup): the VM's total memory, or the memory
+    limit of LAD's cgroup if it's lower.
+    :rtype: int
+    :return: Memory in KB, or None if it can't be determined.
+    """
+    total_in_KB = None
+    try:
+        with open(meminfo_path) as f:
+            for line in f:
+                if line.startswith('MemTotal:'):  # Example line: "MemTotal:        8167892 kB"
+                    total_in_KB = int(line.split()[1])
+                    break
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+
+    cgroup_limit_in_KB = _read_cgroup_memory_limit_in_KB(proc_cgroup_path, cgroup_root)
+    if total_in_KB is None or (cgroup_limit_in_KB is not None and cgroup_limit_in_KB < total_in_KB):
+        return cgroup_limit_in_KB
+    return total_in_KB
+
+
+def get_memory_budget_in_KB(configured_limit_in_MB, available_memory_in_KB):
+    """
+    Get the memory budget of mdsd.
+    :param int configured_limit_in_MB: mdsdMemoryLimitInMB from LAD settings, or None if not given
+    :param int available_memory_in_KB: Result of get_available_memory_in_KB()
+    :rtype: int
+    :return: The configured limit if any (but never more than the available memory), or otherwise a ratio of the
+             available memory.
+    """
+    if configured_limit_in_MB:
+        budget_in_KB = configured_limit_in_MB * 1024
+        if available_memory_in_KB:
+            budget_in_KB = min(budget_in_KB, available_memory_in_KB)
+        return budget_in_KB
+    if not available_memory_in_KB:
+        return max_default_budget_in_KB
+    budget_in_KB = int(available_memory_in_KB * default_budget_ratio)
+    return min(max(budget_in_KB, min_default_budget_in_KB), max_default_budget_in_KB)
+
+
+class MdsdMemoryMonitor(object):
+    """
+    Keeps the recent RSS samples of an mdsd process, and tells whether a memory leak is suspected from them.
+    """
+
+    def __init__(self, pid, budget_in_KB, window_size=20, growth_horizon_in_seconds=1800):
+        """
+        Constructor
+        :param pid: ID of the mdsd process
+        :param int budget_in_KB: Memory budget of mdsd (get_memory_budget_in_KB())
+        :param int window_size: Number of samples in the ring buffer the growth slope is fitted over
+        :param int growth_horizon_in_seconds: A sustained growth is a leak if it would exceed the budget within this
+                                              many seconds
+        """
+        self.pid = pid
+        self.budget_in_KB = budget_in_KB
+        self.growth_horizon_in_seconds = growth_horizon_in_seconds
+        self.samples = collections.deque(maxlen=window_size)  # (time, RSS in KB) tuples
+
+    def sample(self):
+        """
+        Sample the process's RSS into the ring buffer.
+        :rtype: int
+        :return: RSS in KB, or None if the process is gone.
+        """
+        rss_in_KB = read_rss_in_KB(self.pid)
+        if rss_in_KB is not None:
+            self.add_sample(time.time(), rss_in_KB)
+        return rss_in_KB
+
+    def add_sample(self, sample_time, rss_in_KB):
+        self.samples.append((sample_time, rss_in_KB))
+
+    def get_growth_fit(self):
+        """
+        Fit a line through the samples in the ring buffer by least squares.
+        :rtype: (float, float)
+        :return: Slope in KB per second and coefficient of determination (r^2), or (0.0, 0.0) with < 3 samples.
+        """
+        n = len(self.samples)
+        if n < 3:
+            return 0.0, 0.0
+        t0 = self.samples[0][0]
+        mean_t = sum(t - t0 for t, _ in self.samples) / float(n)
+        mean_m = sum(m for _, m in self.samples) / float(n)
+        s_tt = sum((t - t0 - mean_t) ** 2 for t, _ in self.samples)
+        s_mm = sum((m - mean_m) ** 2 for _, m in self.samples)
+        s_tm = sum((t - t0 - mean_t) * (m - mean_m) for t, m in self.samples)
+        if s_tt == 0 or s_mm == 0:
+            return 0.0, 0.0
+        return s_tm / s_tt, (s_tm * s_tm) / (s_tt * s_mm)
+
+    def check_suspected_leak(self):
+        """
+        Check whether a memory leak is suspected from the samples taken so far. A leak is suspected either when the
+        latest sample exceeds the budget, or when the ring buffer is full of a steady growth (r^2 >= 0.9) that's past
+        half the budget and would exceed it within the growth horizon.
+        :rtype: (bool, str)
+        :return: Whether a leak is suspected, and the reason if so.
+        """
+        if not self.samples:
+            return False, ''
+        rss_in_KB = self.samples[-1][1]
+        if rss_in_KB > self.budget_in_KB:
+            return True, "RSS {0}MB exceeds budget {1}MB".format(rss_in_KB / 1024, self.budget_in_KB / 1024)
+
+        if len(self.samples) < self.samples.maxlen or rss_in_KB * 2 < self.budget_in_KB:
+            return False, ''
+        slope, r_squared = self.get_growth_fit()
+        if slope <= 0 or r_squared < 0.9:
+            return False, ''
+        seconds_to_budget = (self.budget_in_KB - rss_in_KB) / slope
+        if seconds_to_budget > self.growth_horizon_in_seconds:
+            return False, ''
+        return True, "RSS {0}MB growing {1:.1f}KB/s steadily (r^2={2:.2f}), would exceed budget {3}MB in {4}s".format(
+            rss_in_KB / 1024, slope, r_squared, self.budget_in_KB / 1024, int(seconds_to_budget))
+
+    def export_history(self):
+        """
+        Export the samples in the ring buffer for telemetry, in a compact form.
+        :rtype: str
+        :return: e.g. "rss_KB@30s=[102400,102528,...] budget_KB=2000000 slope_KB/s=4.27"
+        """
+        interval = 0
+        if len(self.samples) >= 2:
+            interval = int(round((self.samples[-1][0] - self.samples[0][0]) / (len(self.samples) - 1)))
+        return "rss_KB@{0}s=[{1}] budget_KB={2} slope_KB/s={3:.2f}".format(
+            interval, ','.join(str(m) for _, m in self.samples), self.budget_in_KB, self.get_growth_fit()[0])
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+# Azure Linux extension
+#
+# Linux Azure Diagnostic Extension (Current version is specified in manifest.xml)
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+# MIT License
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the ""Software""), to deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+# Software.
+# THE SOFTWARE IS PROVIDED *AS IS*, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
+# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Helpers used by diagnostic.py's mdsd monitoring loop. Everything here works off /proc, pipes and inotify,
+# so that the steady-state monitoring doesn't need to fork any command.
+
+import ctypes
+import errno
+import os
+import select
+import struct
+import threading
+
+
+def read_proc_cmdline(pid):
+    """
+    Read the command line of a process from /proc/<pid>/cmdline.
+    :param pid: ID of the process (int or str)
+    :return: The command line with its arguments separated by spaces, or '' if the process doesn't exist.
+    """
+    try:
+        with open('/proc/{0}/cmdline'.format(str(pid).strip())) as f:
+            return f.read().replace('\0', ' ').strip()
+    except (IOError, OSError):
+        return ''
+
+
+def is_process_running(name, pid_file_path=None):
+    """
+    Check if a process with the given name is running, without forking any command.
+    If pid_file_path is given, only the PID in it is checked, so that a missing or stale PID file costs no scan of
+    /proc (the caller is expected to confirm with a more expensive check). Otherwise /proc/*/comm is scanned.
+    :param str name: Name of the process executable (e.g., 'omiserver')
+    :param str pid_file_path: Path of the PID file written by the process, or None
+    :rtype: bool
+    """
+    if pid_file_path:
+        try:
+            with open(pid_file_path) as f:
+                pid = f.read().strip()
+            return pid.isdigit() and name in read_proc_cmdline(pid)
+        except (IOError, OSError):
+            return False
+
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/comm'.format(entry)) as f:
+                # comm is truncated to 15 characters
+                if f.read().strip() == name[:15]:
+                    return True
+        except (IOError, OSError):
+            pass  # The process exited while we were scanning
+    return False
+
+
+class ProcessExitWatcher(object):
+    """
+    Reaps a subprocess.Popen object on a background thread, and makes its exit visible through a pipe,
+    so that it can be waited on with select() together with other file descriptors.
+    """
+    def __init__(self, process):
+        self._process = process
+        self._exited = threading.Event()
+        self._read_fd, self._write_fd = os.pipe()
+        self._thread = threading.Thread(target=self._wait)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _wait(self):
+        try:
+            self._process.wait()
+        finally:
+            self._exited.set()
+            os.write(self._write_fd, 'x')
+
+    def fileno(self):
+        return self._read_fd
+
+    def has_exited(self):
+        return self._exited.is_set()
+
+    def close(self):
+        """
+        Close the pipe. Must be called only after the process has exited.
+        """
+        self._thread.join()
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+class DirectoryWatch(object):
+    """
+    inotify watch on a directory, reporting the names of the files created, modified or moved into it.
+    Use create_directory_watch() to get one.
+    """
+    _IN_MODIFY = 0x00000002
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+    _event_header = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self, dir_path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = self._IN_MODIFY | self._IN_MOVED_TO | self._IN_CREATE
+        if libc.inotify_add_watch(self._fd, dir_path, mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, 'inotify_add_watch failed', dir_path)
+
+    def fileno(self):
+        return self._fd
+
+    def read_changed_names(self):
+        """
+        Consume all pending events.
+        :rtype: set
+        :return: Names of the files changed since the last call
+        """
+        names = set()
+        while True:
+            try:
+                buf = os.read(self._fd, 4096)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.EAGAIN:
+                    return names
+                raise
+            pos = 0
+            while pos + self._event_header.size <= len(buf):
+                name_len = self._event_header.unpack_from(buf, pos)[3]
+                pos += self._event_header.size
+                names.add(buf[pos:pos + name_len].rstrip('\0'))
+                pos += name_len
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_directory_watch(dir_path):
+    """
+    Create a DirectoryWatch on dir_path.
+    :return: A DirectoryWatch object, or None if inotify isn't available (the caller should then poll).
+    """
+    try:
+        return DirectoryWatch(dir_path)
+    except (AttributeError, OSError):
+        return None
+
+
+def wait_for_readable(objects, timeout):
+    """
+    select() on objects for reading, returning early (with no object) if interrupted by a signal.
+    :param list objects: Objects with a fileno() method, or file descriptors
+    :param float timeout: Seconds to wait at most
+    :rtype: list
+    :return: The objects readable
+    """
+    try:
+        return select.select(objects, [], [], max(0, timeout))[0]
+    except select.error as e:
+        if e.args[0] == errno.EINTR:
+            return []
+        raise
@@ -57,33 +57,6 @@ def get_storage_endpoints_with_account(account, endpoint_without_account):
     return (tableEndpoint, blobEndpoint)
 
 
-def check_suspected_memory_leak(pid, logger_err):
-    """
-    Check suspected memory leak of a process, by inspecting /proc/<pid>/status's VmRSS value.
-    :param pid: ID of the process we are checking.
-    :param logger_err: Error logging function (e.g., hutil.error)
-    :return (bool, int): Bool indicating whether memory leak is suspected. Int for memory usage in KB in true case.
-    """
-    memory_leak_threshold_in_KB = 2000000  # Roughly 2GB. TODO: Make it configurable or automatically calculated
-    memory_usage_in_KB = 0
-    memory_leak_suspected = False
-
-    try:
-        # Check /proc/[pid]/status file for "VmRSS" to find out the process's virtual memory usage
-        # Note: "VmSize" for some reason starts out very high (>2000000) at this moment, so can't use that.
-        with open("/proc/{0}/status".format(pid)) as proc_file:
-            for line in proc_file:
-                if line.startswith("VmRSS:"):  # Example line: "VmRSS:   33904 kB"
-                    memory_usage_in_KB = int(line.split()[1])
-                    memory_leak_suspected = memory_usage_in_KB > memory_leak_threshold_in_KB
-                    break
-    except Exception as e:
-        # Not to throw in case any statement above fails (e.g., invalid pid). Just log.
-        logger_err("Failed to check memory usage of pid={0}.\nError: {1}\nTrace:\n{2}".format(pid, e, traceback.format_exc()))
-
-    return memory_leak_suspected, memory_usage_in_KB
-
-
 class LadLogHelper(object):
     """
     Various LAD log helper functions encapsulated here, so that we don't have to tag along all the parameters.
@@ -106,24 +79,24 @@ class LadLogHelper(object):
         self._ext_name = ext_name
         self._ext_ver = ext_ver
 
-    def log_suspected_memory_leak_and_kill_mdsd(self, memory_usage_in_KB, mdsd_process, ext_op):
+    def log_suspected_memory_leak_and_stop_mdsd(self, leak_reason, memory_history, mdsd_process, ext_op):
         """
-        Log suspected-memory-leak message both in ext logs and as a waagent event.
-        :param memory_usage_in_KB: Memory usage in KB (to be included in the log)
-        :param mdsd_process: Python Process object for the mdsd process to kill
+        Log suspected-memory-leak message both in ext logs and as a waagent event, and ask mdsd to terminate.
+        :param leak_reason: Why a leak is suspected (from MdsdMemoryMonitor.check_suspected_leak())
+        :param memory_history: Recent memory usage of mdsd (from MdsdMemoryMonitor.export_history())
+        :param mdsd_process: Python Process object for the mdsd process to terminate
         :param ext_op: Extension operation type to use for waagent event (waagent.WALAEventOperation.HeartBeat)
         :return: None
         """
-        memory_leak_msg = "Suspected mdsd memory leak (Virtual memory usage: {0}MB). " \
-                          "Recycling mdsd to self-mitigate.".format(int((memory_usage_in_KB + 1023) / 1024))
+        memory_leak_msg = "Suspected mdsd memory leak ({0}). Recycling mdsd to self-mitigate.".format(leak_reason)
         self._logger_log(memory_leak_msg)
         # Add a telemetry for a possible statistical analysis
         self._waagent_event_adder(name=self._ext_name,
                                   op=ext_op,
                                   isSuccess=True,
                                   version=self._ext_ver,
-                                  message=memory_leak_msg)
-        mdsd_process.kill()
+                                  message=memory_leak_msg + " Memory history: " + memory_history)
+        mdsd_process.terminate()
 
     def report_mdsd_dependency_setup_failure(self, ext_event_type, failure_msg):
         """
@@ -37,6 +37,7 @@ try:
     # waagent, ext handler
     from Utils.WAAgentUtil import waagent
     import Utils.HandlerUtil as Util
+    import Utils.LogUtil as LogUtil
 
     # Old LAD utils
     import Utils.LadDiagnosticUtil as LadUtil
@@ -50,6 +51,8 @@ try:
     import lad_config_all as lad_cfg
     from Utils.imds_util import ImdsLogger
     import Utils.omsagent_util as oms
+    import Utils.mdsd_supervisor as supervisor
+    import Utils.mdsd_memory as mdsd_memory
 except Exception as e:
     print 'A local import (e.g., waagent) failed. Exception: {0}\n' \
           'Stacktrace: {1}'.format(e, traceback.format_exc())
@@ -68,6 +71,12 @@ g_mdsd_file_resources_prefix = ''  # Eventually '/var/run/mdsd/lad_mdsd'
 g_lad_pids_filepath = ''  # LAD process IDs (diagnostic.py, mdsd) file path. g_ext_dir + '/lad.pids'
 g_ext_op_type = None  # Extension operation type (e.g., Install, Enable, HeartBeat, ...)
 g_mdsd_bin_path = '/usr/local/lad/bin/mdsd'  # mdsd binary path. Fixed w/ lad-mdsd-*.{deb,rpm} pkgs
+g_mdsd_monitor_interval_in_seconds = 30  # Interval of the periodic checks on mdsd (LAD PIDs, memory, OMI)
+g_mdsd_log_report_min_interval_in_seconds = 5  # Least interval between two reports of new mdsd.err/warn content
+g_omiserver_pid_filepath = '/var/opt/omi/run/omiserver.pid'
+g_omi_noop_probe_interval_in_seconds = 300  # Interval of the omicli noop probe while omiserver is running
+g_omi_last_noop_probe_time = 0  # Time of the last omicli noop probe
+g_mdsd_stop_timeout_in_seconds = 30  # How long mdsd is given to exit after SIGTERM before it's SIGKILL'ed
 g_diagnostic_py_filepath = ''  # Full path of this script. g_ext_dir + '/diagnostic.py'
 # Only 2 globals not following 'g_...' naming convention, for legacy readability...
 RunGetOutput = None  # External command executor callable
@@ -439,6 +448,10 @@ def start_mdsd(configurator):
         info_file_path,
         g_ext_settings.get_mdsd_trace_option()).split(" ")
 
+    mdsd_memory_budget_in_KB = mdsd_memory.get_memory_budget_in_KB(g_ext_settings.get_mdsd_memory_limit_in_MB(),
+                                                                   mdsd_memory.get_available_memory_in_KB())
+    hutil.log("mdsd memory budget: {0}MB".format(mdsd_memory_budget_in_KB / 1024))
+
     try:
         start_watcher_thread()
 
@@ -447,7 +460,12 @@ def start_mdsd(configurator):
 
         while num_quick_consecutive_crashes < 3:  # We consider only quick & consecutive crashes for retries
 
-            RunGetOutput('rm -f ' + g_mdsd_file_resources_prefix + '.pidport')  # Must delete any existing port num file
+            pidport_filepath = g_mdsd_file_resources_prefix + '.pidport'
+            if os.path.exists(pidport_filepath):
+                os.remove(pidport_filepath)  # Must delete any existing port num file
+            # Only what's logged by this mdsd instance is reported
+            err_scanner = LogUtil.LogFileScanner(err_file_path, start_at_end=True)
+            warn_scanner = LogUtil.LogFileScanner(warn_file_path, start_at_end=True)
             mdsd_stdout_stream = open(mdsd_stdout_redirect_path, "w")
             hutil.log("Start mdsd " + str(command))
             mdsd = subprocess.Popen(command,
@@ -459,31 +477,79 @@ def start_mdsd(configurator):
             write_lad_pids_to_file(g_lad_pids_filepath, os.getpid(), mdsd.pid)
 
             last_mdsd_start_time = datetime.datetime.now()
-            last_error_time = last_mdsd_start_time
             omi_installed = True  # Remembers if OMI is installed at each iteration
-            # Continuously monitors mdsd process
+            # Continuously monitors mdsd process. mdsd is reaped by mdsd_exit_watcher as soon as it terminates, and
+            # the log dir is watched through inotify (if available), so nothing needs to be polled in between the
+            # periodic checks.
+            mdsd_exit_watcher = supervisor.ProcessExitWatcher(mdsd)
+            mdsd_memory_monitor = mdsd_memory.MdsdMemoryMonitor(mdsd.pid, mdsd_memory_budget_in_KB)
+            log_dir_watch = supervisor.create_directory_watch(log_dir)
+            wait_objects = [mdsd_exit_watcher]
+            if log_dir_watch:
+                wait_objects.append(log_dir_watch)
+            changed_scanners = set()
+            last_log_report_time = 0
+            next_check_time = time.time() + g_mdsd_monitor_interval_in_seconds
             while True:
-                time.sleep(30)
-                if " ".join(get_lad_pids()).find(str(mdsd.pid)) < 0 and len(get_lad_pids()) >= 2:
-                    mdsd.kill()
-                    hutil.log("Another process is started, now exit")
-                    return
-                if mdsd.poll() is not None:  # if mdsd has terminated
+                timeout = next_check_time - time.time()
+                if changed_scanners:
+                    timeout = min(timeout,
+                                  last_log_report_time + g_mdsd_log_report_min_interval_in_seconds - time.time())
+                ready = supervisor.wait_for_readable(wait_objects, timeout)
+                if mdsd_exit_watcher.has_exited():  # if mdsd has terminated
+                    hutil.log("mdsd (pid={0}) terminated with exit code {1}".format(mdsd.pid, mdsd.returncode))
                     time.sleep(60)
                     mdsd_stdout_stream.flush()
                     break
 
+                if log_dir_watch in ready:
+                    changed_names = log_dir_watch.read_changed_names()
+                    for scanner in (err_scanner, warn_scanner):
+                        if os.path.basename(scanner.log_file) in changed_names:
+                            changed_scanners.add(scanner)
+                if changed_scanners and \
+                        time.time() >= last_log_report_time + g_mdsd_log_report_min_interval_in_seconds:
+                    report_new_mdsd_logs(*changed_scanners)
+                    changed_scanners.clear()
+                    last_log_report_time = time.time()
+
+                if time.time() < next_check_time:
+                    continue
+                next_check_time = time.time() + g_mdsd_monitor_interval_in_seconds
+
+                lad_pids = get_lad_pids()
+                if str(mdsd.pid) not in lad_pids and len(lad_pids) >= 2:
+                    mdsd.kill()
+                    hutil.log("Another process is started, now exit")
+                    return
+
                 # mdsd is now up for at least 30 seconds. Do some monitoring activities.
-                # 1. Mitigate if memory leak is suspected.
-                mdsd_memory_leak_suspected, mdsd_memory_usage_in_KB = check_suspected_memory_leak(mdsd.pid, hutil.error)
+                # 1. Mitigate if memory leak is suspected (by RSS over budget or by steady growth towards it).
+                mdsd_memory_monitor.sample()
+                mdsd_memory_leak_suspected, mdsd_memory_leak_reason = mdsd_memory_monitor.check_suspected_leak()
                 if mdsd_memory_leak_suspected:
-                    g_lad_log_helper.log_suspected_memory_leak_and_kill_mdsd(mdsd_memory_usage_in_KB, mdsd,
-                                                                             waagent_ext_event_type)
+                    mdsd_anonymous_in_KB = mdsd_memory.read_anonymous_in_KB(mdsd.pid)
+                    if mdsd_anonymous_in_KB is not None:
+                        mdsd_memory_leak_reason += ", anonymous {0}MB".format(mdsd_anonymous_in_KB / 1024)
+                    g_lad_log_helper.log_suspected_memory_leak_and_stop_mdsd(mdsd_memory_leak_reason,
+                                                                             mdsd_memory_monitor.export_history(),
+                                                                             mdsd, waagent_ext_event_type)
+                    if not supervisor.wait_for_readable([mdsd_exit_watcher], g_mdsd_stop_timeout_in_seconds):
+                        hutil.log("mdsd didn't exit in {0} seconds after SIGTERM. Sending SIGKILL.".format(
+                            g_mdsd_stop_timeout_in_seconds))
+                        mdsd.kill()
                     break
                 # 2. Restart OMI if it crashed (Issue #128)
                 omi_installed = restart_omi_if_crashed(omi_installed, mdsd)
-                # 3. Check if there's any new logs in mdsd.err and report
-                last_error_time = report_new_mdsd_errors(err_file_path, last_error_time)
+                # 3. Check if there's any new logs in mdsd.err and report (inotify unavailable, so poll here)
+                if not log_dir_watch:
+                    report_new_mdsd_logs(err_scanner, warn_scanner)
+
+            mdsd_exit_watcher.close()
+            err_scanner.close()
+            warn_scanner.close()
+            if log_dir_watch:
+                log_dir_watch.close()
 
             # Out of the inner while loop: mdsd terminated.
             if mdsd_stdout_stream:
@@ -536,28 +602,29 @@ def start_mdsd(configurator):
             mdsd_stdout_stream.close()
 
 
-def report_new_mdsd_errors(err_file_path, last_error_time):
+def report_new_mdsd_logs(*scanners):
     """
-    Monitors if there's any new stuff in mdsd.err and report it if any through the agent/ext status report mechanism.
-    :param err_file_path: Path of the mdsd.err file
-    :param last_error_time: Time when last error was reported.
-    :return: Time when the last error was reported. Same as the argument if there's no error reported in this call.
-             A new time (error file ctime) if a new error is reported.
+    Report any new stuff in mdsd.err through the agent/ext status report mechanism, and log any new stuff in mdsd.warn.
+    :param scanners: LogUtil.LogFileScanner objects of mdsd.err and/or mdsd.warn
+    :return: None
     """
-    if not os.path.exists(err_file_path):
-        return last_error_time
-    err_file_ctime = datetime.datetime.strptime(time.ctime(int(os.path.getctime(err_file_path))), "%a %b %d %H:%M:%S %Y")
-    if last_error_time >= err_file_ctime:
-        return last_error_time
-    # No new error above. A new error below.
-    last_error_time = err_file_ctime
-    last_error = tail(err_file_path)
-    if len(last_error) > 0 and (datetime.datetime.now() - last_error_time) < datetime.timedelta(minutes=30):
-        # Only recent error logs (within 30 minutes) are reported.
-        hutil.log("Error in MDSD:" + last_error)
-        hutil.do_status_report(g_ext_op_type, "success", '1',
-                               "message in mdsd.err:" + str(last_error_time) + ":" + last_error)
-    return last_error_time
+    for scanner in scanners:
+        new_log = scanner.read_new(1024)
+        if not new_log:
+            continue
+        if os.path.basename(scanner.log_file) == "mdsd.err":
+            try:
+                err_file_ctime = datetime.datetime.strptime(time.ctime(int(os.path.getctime(scanner.log_file))),
+                                                            "%a %b %d %H:%M:%S %Y")
+            except OSError:
+                continue  # mdsd.err was removed since it was read
+            if (datetime.datetime.now() - err_file_ctime) < datetime.timedelta(minutes=30):
+                # Only recent error logs (within 30 minutes) are reported.
+                hutil.log("Error in MDSD:" + new_log)
+                hutil.do_status_report(g_ext_op_type, "success", '1',
+                                       "message in mdsd.err:" + str(err_file_ctime) + ":" + new_log)
+        else:
+            hutil.log("Warning in MDSD:" + new_log)
 
 
 def stop_mdsd():
@@ -607,11 +674,11 @@ def get_lad_pids():
 
     with open(g_lad_pids_filepath, "r") as f:
         for pid in f.readlines():
-            is_still_alive = RunGetOutput("cat /proc/" + pid.strip() + "/cmdline", should_log=False)[1]
+            is_still_alive = supervisor.read_proc_cmdline(pid)
             if is_still_alive.find('/waagent/') > 0:
                 lad_pids.append(pid.strip())
             else:
-                hutil.log("return not alive " + is_still_alive.strip())
+                hutil.log("return not alive " + is_still_alive)
     return lad_pids
 
 
@@ -623,6 +690,7 @@ def restart_omi_if_crashed(omi_installed, mdsd):
     :param mdsd: Python Process object for the mdsd process, because it might need to be signaled.
     :return: bool indicating whether OMI was installed at this iteration (from this call)
     """
+    global g_omi_last_noop_probe_time
     omicli_path = "/opt/omi/bin/omicli"
     omicli_noop_query_cmd = omicli_path + " noop"
     omi_was_installed = omi_installed  # Remember the OMI install status from the last iteration
@@ -637,7 +705,11 @@ def restart_omi_if_crashed(omi_installed, mdsd):
         hutil.log("OMI is reinstalled. Will resume checking if OMI is up and running.")
 
     should_restart_omi = False
-    if omi_installed:
+    # omicli is run at each iteration only if omiserver looks gone. While it's running, omicli is run at a longer
+    # interval, which still catches a hung omiserver without forking omicli at each iteration.
+    if omi_installed and (not supervisor.is_process_running('omiserver', g_omiserver_pid_filepath) or
+                          time.time() - g_omi_last_noop_probe_time >= g_omi_noop_probe_interval_in_seconds):
+        g_omi_last_noop_probe_time = time.time()
         cmd_exit_status, cmd_output = RunGetOutput(cmd=omicli_noop_query_cmd, should_log=False)
         should_restart_omi = cmd_exit_status is not 0
         if should_restart_omi:
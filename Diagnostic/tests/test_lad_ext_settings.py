@@ -99,5 +99,11 @@ class LadExtSettingsTest(unittest.TestCase):
         self.assertNotEqual(json.dumps(self._lad_settings.get_handler_settings(), sort_keys=True),
                             json.dumps(actual_json, sort_keys=True))
 
+    def test_mdsd_memory_limit(self):
+        self.assertIsNone(self._lad_settings.get_mdsd_memory_limit_in_MB())
+        for limit, expected in ((512, 512), ("1024", 1024), (0, None), ("abc", None)):
+            settings = LadExtSettings({"publicSettings": {"mdsdMemoryLimitInMB": limit}})
+            self.assertEqual(settings.get_mdsd_memory_limit_in_MB(), expected)
+
 if __name__ == '__main__':
     unittest.main()
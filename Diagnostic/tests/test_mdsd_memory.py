@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import Utils.mdsd_memory as mdsd_memory
+
+
+class MemoryBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._meminfo_path = self._write('meminfo', 'MemTotal:        8000000 kB\nMemFree:         4000000 kB\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, rel_path, content):
+        path = os.path.join(self._dir, rel_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _get_available_memory_in_KB(self, proc_cgroup):
+        proc_cgroup_path = self._write('proc_cgroup', proc_cgroup)
+        return mdsd_memory.get_available_memory_in_KB(self._meminfo_path, proc_cgroup_path,
+                                                      os.path.join(self._dir, 'cgroup'))
+
+    def test_available_memory_cgroup_v2(self):
+        self._write('cgroup/system.slice/walinuxagent.service/memory.max', '1073741824\n')
+        self.assertEqual(self._get_available_memory_in_KB('0::/system.slice/walinuxagent.service\n'), 1048576)
+        self._write('cgroup/system.slice/walinuxagent.service/memory.max', 'max\n')
+        self.assertEqual(self._get_available_memory_in_KB('0::/system.slice/walinuxagent.service\n'), 8000000)
+
+    def test_available_memory_cgroup_v1(self):
+        proc_cgroup = '5:cpu,cpuacct:/azure.slice\n4:memory:/azure.slice\n1:name=systemd:/azure.slice\n'
+        self._write('cgroup/memory/azure.slice/memory.limit_in_bytes', '9223372036854771712\n')
+        self.assertEqual(self._get_available_memory_in_KB(proc_cgroup), 8000000)
+        self._write('cgroup/memory/azure.slice/memory.limit_in_bytes', '2147483648\n')
+        self.assertEqual(self._get_available_memory_in_KB(proc_cgroup), 2097152)
+        # Limit above the VM memory
+        self._write('cgroup/memory/azure.slice/memory.limit_in_bytes', '17179869184\n')
+        self.assertEqual(self._get_available_memory_in_KB(proc_cgroup), 8000000)
+
+    def test_budget(self):
+        self.assertEqual(mdsd_memory.get_memory_budget_in_KB(None, 1000000), 300000)
+        self.assertEqual(mdsd_memory.get_memory_budget_in_KB(None, 500000), 256 * 1024)
+        self.assertEqual(mdsd_memory.get_memory_budget_in_KB(None, 64000000), 2000000)
+        self.assertEqual(mdsd_memory.get_memory_budget_in_KB(None, None), 2000000)
+        self.assertEqual(mdsd_memory.get_memory_budget_in_KB(512, 1000000), 512 * 1024)
+        self.assertEqual(mdsd_memory.get_memory_budget_in_KB(4096, 1000000), 1000000)
+
+
+class MdsdMemoryMonitorTest(unittest.TestCase):
+    def test_sample_own_process(self):
+        monitor = mdsd_memory.MdsdMemoryMonitor(os.getpid(), 2000000)
+        rss_in_KB = monitor.sample()
+        self.assertGreater(rss_in_KB, 0)
+        self.assertEqual(len(monitor.samples), 1)
+        self.assertIsNone(mdsd_memory.MdsdMemoryMonitor(-1, 2000000).sample())
+
+    def test_over_budget(self):
+        monitor = mdsd_memory.MdsdMemoryMonitor(0, 100000)
+        monitor.add_sample(0, 90000)
+        self.assertEqual(monitor.check_suspected_leak(), (False, ''))
+        monitor.add_sample(30, 100001)
+        self.assertTrue(monitor.check_suspected_leak()[0])
+
+    def test_steady_growth(self):
+        monitor = mdsd_memory.MdsdMemoryMonitor(0, 100000, window_size=10, growth_horizon_in_seconds=1800)
+        # Steady 20KB/s growth, suspected once it would exceed the budget within 30 minutes
+        for i in range(9):
+            monitor.add_sample(i * 30, 50000 + i * 600)
+            self.assertFalse(monitor.check_suspected_leak()[0])
+        monitor.add_sample(270, 55400)
+        slope, r_squared = monitor.get_growth_fit()
+        self.assertAlmostEqual(slope, 20.0)
+        self.assertAlmostEqual(r_squared, 1.0)
+        self.assertFalse(monitor.check_suspected_leak()[0])  # 2230s to the budget
+        i = 10
+        while not monitor.check_suspected_leak()[0]:
+            monitor.add_sample(i * 30, 50000 + i * 600)
+            i += 1
+        self.assertEqual(monitor.samples[-1][1], 64400)  # 1780s to the budget
+        self.assertTrue(monitor.export_history().startswith('rss_KB@30s=[59000,59600,'))
+
+    def test_noisy_or_small_usage(self):
+        monitor = mdsd_memory.MdsdMemoryMonitor(0, 100000, window_size=10)
+        for i in range(10):
+            monitor.add_sample(i * 30, 80000 + (5000 if i % 2 else -5000) + i * 100)
+        self.assertFalse(monitor.check_suspected_leak()[0])
+        monitor = mdsd_memory.MdsdMemoryMonitor(0, 100000, window_size=10)
+        for i in range(10):
+            monitor.add_sample(i * 30, 10000 + i * 1000)  # Steep, but still below half the budget
+        self.assertFalse(monitor.check_suspected_leak()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
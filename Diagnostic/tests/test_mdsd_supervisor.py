@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import Utils.mdsd_supervisor as supervisor
+
+
+class DirectoryWatchTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_directory_watch(self):
+        watch = supervisor.create_directory_watch(self._dir)
+        if watch is None:
+            self.skipTest('inotify is not available')
+        try:
+            self.assertEqual(supervisor.wait_for_readable([watch], 0), [])
+            with open(os.path.join(self._dir, 'mdsd.err'), 'a') as f:
+                f.write('error\n')
+            self.assertEqual(supervisor.wait_for_readable([watch], 5), [watch])
+            self.assertEqual(watch.read_changed_names(), set(['mdsd.err']))
+            self.assertEqual(supervisor.wait_for_readable([watch], 0), [])
+        finally:
+            watch.close()
+
+
+class ProcessTest(unittest.TestCase):
+    def test_read_proc_cmdline(self):
+        self.assertIn('python', supervisor.read_proc_cmdline(os.getpid()))
+        self.assertIn('python', supervisor.read_proc_cmdline(str(os.getpid()) + '\n'))
+        self.assertEqual(supervisor.read_proc_cmdline(sys.maxint), '')
+
+    def test_is_process_running(self):
+        pid_file = tempfile.NamedTemporaryFile()
+        pid_file.write(str(os.getpid()))
+        pid_file.flush()
+        self.assertTrue(supervisor.is_process_running('python', pid_file.name))
+        self.assertFalse(supervisor.is_process_running('no-such-process', pid_file.name))
+        self.assertFalse(supervisor.is_process_running('no-such-process', '/no/such/file'))
+
+    def test_is_process_running_without_pid_file(self):
+        with open('/proc/self/comm') as f:
+            name = f.read().strip()
+        self.assertTrue(supervisor.is_process_running(name))
+        self.assertFalse(supervisor.is_process_running('no-such-process'))
+        # A missing PID file isn't made up for by scanning /proc
+        self.assertFalse(supervisor.is_process_running(name, '/no/such/file'))
+
+    def test_process_exit_watcher(self):
+        process = subprocess.Popen(['sleep', '30'])
+        watcher = supervisor.ProcessExitWatcher(process)
+        self.assertEqual(supervisor.wait_for_readable([watcher], 0.1), [])
+        self.assertFalse(watcher.has_exited())
+
+        start = time.time()
+        process.kill()
+        self.assertEqual(supervisor.wait_for_readable([watcher], 5), [watcher])
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(watcher.has_exited())
+        self.assertEqual(process.returncode, -9)
+        watcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
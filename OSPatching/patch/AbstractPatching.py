@@ -22,13 +22,19 @@ import re
 import json
 import random
 import shutil
+import threading
 import time
 import datetime
 import logging
 import logging.handlers
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 from Utils.WAAgentUtil import waagent
 from ConfigOptions import ConfigOptions
+from RestartAnalyzer import RestartAnalyzer
 
 mfile = os.path.join(os.getcwd(), 'HandlerManifest.json')
 with open(mfile,'r') as f:
@@ -82,7 +88,8 @@ class AbstractPatching(object):
         self.patched = []
         self.to_patch = []
         self.downloaded = []
-        self.download_retry_queue = []
+        self.download_timings = dict()
+        self.patch_timings = dict()
 
         # Patching Configuration
         self.disabled = None
@@ -96,6 +103,15 @@ class AbstractPatching(object):
         self.start_time = None
         self.download_time = None
         self.download_duration = 3600
+        # Distros whose package manager can download several packages in one transaction (see download_packages)
+        # raise the batch size, and the parallelism if separate transactions can run at the same time.
+        self.download_batch_size = 1
+        self.download_parallelism = 1
+        self.download_max_retry = 12
+        # Likewise for the installation: up to patch_batch_size packages are installed in one transaction.
+        # patch_seconds_per_package estimates the time a package takes to install until some are measured.
+        self.patch_batch_size = 1
+        self.patch_seconds_per_package = 30
         self.gap_between_stage = 60
         self.current_configs = dict()
 
@@ -121,9 +137,11 @@ class AbstractPatching(object):
 
         # Reboot Requirements
         self.reboot_required = False
-        self.open_deleted_files_before = list()
-        self.open_deleted_files_after = list()
+        self.restart_analyzer = RestartAnalyzer()
+        self.open_deleted_files_before = dict()
+        self.open_deleted_files_after = dict()
         self.needs_restart = list()
+        self.pids_to_restart = set()
 
     def is_string_none_or_empty(self, str):
         if str is None or len(str) < 1:
@@ -228,6 +246,14 @@ class AbstractPatching(object):
             hr_min = download_duration.split(':')
             self.download_duration = int(hr_min[0]) * 3600 + int(hr_min[1]) * 60
 
+        # The parameter "downloadBatchSize" is not exposed to users either.
+        download_batch_size = settings.get('downloadBatchSize')
+        if download_batch_size is not None and str(download_batch_size).isdigit() and int(download_batch_size) > 0:
+            self.download_batch_size = int(download_batch_size)
+        patch_batch_size = settings.get('patchBatchSize')
+        if patch_batch_size is not None and str(patch_batch_size).isdigit() and int(patch_batch_size) > 0:
+            self.patch_batch_size = int(patch_batch_size)
+
         oneoff = settings.get('oneoff')
         if oneoff is None or str(oneoff).lower() not in ConfigOptions.oneoff:
             msg = "The value of parameter \"oneoff\" is empty or invalid. Set it False by default."
@@ -411,20 +437,29 @@ class AbstractPatching(object):
         waagent.SetFileContents(self.package_patched_path, '')
 
         start_download_time = time.time()
-        # Installing security patches is mandatory
-        self._download(self.category_required)
+        # Resolve the full set to download first: installing security patches is mandatory
+        to_download = []
+        resolved = set(self.downloaded)
+        categories = [self.category_required]
         if self.category == self.category_all:
-            self._download(self.category_all)
-        self.retry_download()
+            categories.append(self.category_all)
+        for category in categories:
+            for pkg_name in self._check_download(category):
+                if pkg_name not in resolved:
+                    resolved.add(pkg_name)
+                    to_download.append((pkg_name, category))
+        if to_download:
+            self._download(to_download, start_download_time + self.download_duration)
         end_download_time = time.time()
         waagent.AddExtensionEvent(name=self.hutil.get_name(),
                                   op=waagent.WALAEventOperation.Download,
                                   isSuccess=True,
                                   version=Version,
-                                  message=" ".join(["Real downloading time is", str(round(end_download_time-start_download_time,3)), "s"]))
+                                  message=" ".join(["Real downloading time is", str(round(end_download_time-start_download_time,3)), "s,",
+                                                    str(len(self.downloaded)), "of", str(len(to_download)), "packages downloaded"]))
 
-    def _download(self, category):
-        self.log_and_syslog(logging.INFO, "Start to check&download patches (Category:" + category + ")")
+    def _check_download(self, category):
+        self.log_and_syslog(logging.INFO, "Start to check patches to download (Category:" + category + ")")
         retcode, downloadlist = self.check(category)
         if retcode > 0:
             msg = "Failed to check valid upgrades"
@@ -433,57 +468,110 @@ class AbstractPatching(object):
         if 'walinuxagent' in downloadlist:
             downloadlist.remove('walinuxagent')
         if not downloadlist:
-            self.log_and_syslog(logging.INFO, "No packages are available for update.")
-            return
-        self.log_and_syslog(logging.INFO, "There are " + str(len(downloadlist)) + " packages to upgrade.")
-        self.log_and_syslog(logging.INFO, "Download list: " + ' '.join(downloadlist))
-        for pkg_name in downloadlist:
-            if pkg_name in self.downloaded:
+            self.log_and_syslog(logging.INFO, "No packages are available for update. (Category:" + category + ")")
+        return downloadlist
+
+    def _download(self, to_download, deadline):
+        """
+        Download the packages in transactions of download_batch_size packages, running up to
+        download_parallelism transactions at once. The packages of a failed transaction are retried
+        one by one with an exponential backoff, without holding back the other transactions.
+        to_download is a list of (package, category) tuples, and deadline the end of the download window.
+        """
+        self.log_and_syslog(logging.INFO, "There are " + str(len(to_download)) + " packages to upgrade.")
+        self.log_and_syslog(logging.INFO, "Download list: " + ' '.join([pkg_name for pkg_name,category in to_download]))
+        categories = dict(to_download)
+        pkg_names = [pkg_name for pkg_name,category in to_download]
+        # (not before, retry count, packages) of the transactions to run
+        pending = [(0, 0, pkg_names[i:i + self.download_batch_size])
+                   for i in range(0, len(pkg_names), self.download_batch_size)]
+        results = queue.Queue()
+        running = 0
+        overrun_reported = False
+        while pending or running:
+            if pending and self.exists_stop_flag():
+                self.log_and_syslog(logging.INFO, "Downloading patches is stopped/canceled")
+                pending = []
                 continue
-            retcode = self.download_package(pkg_name)
-            if retcode != 0:
-                self.log_and_syslog(logging.ERROR, "Failed to download the package: " + pkg_name)
-                self.log_and_syslog(logging.INFO, "Put {0} into a retry queue".format(pkg_name))
-                self.download_retry_queue.append((pkg_name, category))
+            now = time.time()
+            pending.sort(key=lambda item: item[0])
+            while pending and running < self.download_parallelism and pending[0][0] <= now:
+                not_before, retry_count, packages = pending.pop(0)
+                worker = threading.Thread(target=self._download_transaction, args=(packages, retry_count, results))
+                worker.daemon = True
+                worker.start()
+                running += 1
+            timeout = None
+            if pending and running < self.download_parallelism:
+                # Wake up for the next backed off retry
+                timeout = max(0, pending[0][0] - now)
+            try:
+                packages, retry_count, failed, elapsed = results.get(timeout=timeout)
+            except queue.Empty:
                 continue
-            self.downloaded.append(pkg_name)
-            self.log_and_syslog(logging.INFO, "Package " + pkg_name + " is downloaded.")
-            waagent.AppendFileContents(self.package_downloaded_path, pkg_name + ' ' + category + '\n')
-
-    def retry_download(self):
-        retry_count = 0
-        max_retry_count = 12
-        self.log_and_syslog(logging.INFO, "Retry queue: {0}".format(
-            " ".join([pkg_name for pkg_name,category in self.download_retry_queue])))
-        while self.download_retry_queue:
-            pkg_name, category = self.download_retry_queue[0]
-            self.download_retry_queue = self.download_retry_queue[1:]
-            retcode = self.download_package(pkg_name)
-            if retcode == 0:
+            running -= 1
+
+            for pkg_name in packages:
+                self.download_timings[pkg_name] = self.download_timings.get(pkg_name, 0) + elapsed / len(packages)
+                if pkg_name in failed:
+                    continue
                 self.downloaded.append(pkg_name)
-                self.log_and_syslog(logging.INFO, "Package " + pkg_name + " is downloaded.")
-                waagent.AppendFileContents(self.package_downloaded_path, pkg_name + ' ' + category + '\n')
-            else:
+                self.log_and_syslog(logging.INFO, "Package {0} is downloaded in {1}s.".format(
+                    pkg_name, round(self.download_timings[pkg_name], 3)))
+                waagent.AppendFileContents(self.package_downloaded_path, pkg_name + ' ' + categories[pkg_name] + '\n')
+
+            now = time.time()
+            for pkg_name in failed:
                 self.log_and_syslog(logging.ERROR, "Failed to download the package: " + pkg_name)
-                self.log_and_syslog(logging.INFO, "Put {0} back into a retry queue".format(pkg_name))
-                self.download_retry_queue.append((pkg_name,category))
-                retry_count = retry_count + 1
-                if retry_count > max_retry_count:
-                    err_msg = ("Failed to download after {0} retries, "
-                        "retry queue: {1}").format(max_retry_count,
-                        " ".join([pkg_name for pkg_name,category in self.download_retry_queue]))
-                    self.log_and_syslog(logging.ERROR, err_msg)
+                if len(packages) > 1:
+                    # The transaction may have failed because of another package, so retry it on its own right away
+                    pending.append((now, retry_count, [pkg_name]))
+                    continue
+                if retry_count >= self.download_max_retry:
+                    msg = "Failed to download {0} after {1} retries".format(pkg_name, retry_count)
+                    self.log_and_syslog(logging.ERROR, msg)
                     waagent.AddExtensionEvent(name=self.hutil.get_name(),
                                               op=waagent.WALAEventOperation.Download,
                                               isSuccess=False,
                                               version=Version,
-                                              message=err_msg)
-                    break
-                k = retry_count if (retry_count < 10) else 10
+                                              message=msg)
+                    continue
+                k = retry_count + 1 if (retry_count < 10) else 10
                 interval = int(random.uniform(0, 2 ** k))
-                self.log_and_syslog(logging.INFO, ("Sleep {0}s before "
-                    "the next retry, current retry_count = {1}").format(interval, retry_count))
-                time.sleep(interval)
+                if now + interval > deadline:
+                    self.log_and_syslog(logging.WARNING, "Download time exceeded. {0} will not be retried".format(pkg_name))
+                    continue
+                self.log_and_syslog(logging.INFO, ("Retry {0} in {1}s, "
+                    "current retry_count = {2}").format(pkg_name, interval, retry_count + 1))
+                pending.append((now + interval, retry_count + 1, [pkg_name]))
+
+            # Check the time spent so far per package against the download window
+            left = len(pkg_names) - len(self.downloaded)
+            if not overrun_reported and left > 0 and self.downloaded:
+                per_package = sum(self.download_timings.values()) / len(self.download_timings)
+                expected_end = now + per_package * left / self.download_parallelism
+                if expected_end > deadline:
+                    overrun_reported = True
+                    self.log_and_syslog(logging.WARNING, ("Downloading takes {0}s per package, the {1} packages left "
+                        "are expected to exceed downloadDuration by {2}s").format(
+                        round(per_package, 3), left, int(expected_end - deadline)))
+
+    def _download_transaction(self, packages, retry_count, results):
+        start_time = time.time()
+        try:
+            failed = self.download_packages(packages)
+        except Exception as e:
+            self.hutil.error("Failed to download {0}: {1}".format(' '.join(packages), e))
+            failed = packages
+        results.put((packages, retry_count, failed, time.time() - start_time))
+
+    def download_packages(self, packages):
+        """
+        Download packages in one transaction of the package manager.
+        Return the list of the packages which failed to download.
+        The default implementation downloads them one at a time with download_package.
+        """
+        return [pkg_name for pkg_name in packages if self.download_package(pkg_name) != 0]
 
     def patch(self):
         # Read the latest configuration for scheduled task
@@ -567,24 +655,98 @@ class AbstractPatching(object):
         self.log_and_syslog(logging.INFO, "Start to install " + str(len(patchlist)) +" patches (Category:" + category + ")")
         self.log_and_syslog(logging.INFO, "Patch list: " + ' '.join(patchlist))
         pkg_failed = []
-        for pkg_name in patchlist:
-            if pkg_name == 'walinuxagent':
-                continue
-            current_patch_time = time.time()
-            if current_patch_time - start_patch_time > self.install_duration:
+        units = self.get_install_units([pkg_name for pkg_name in patchlist if pkg_name != 'walinuxagent'])
+        # Each transaction is a list of units, which are the lists of packages to be installed together
+        transactions = []
+        for unit in units:
+            if transactions and len(sum(transactions[-1], [])) + len(unit) <= self.patch_batch_size:
+                transactions[-1].append(unit)
+            else:
+                transactions.append([unit])
+        while transactions:
+            transaction = transactions.pop(0)
+            seconds_per_package = self.patch_seconds_per_package
+            if self.patch_timings:
+                seconds_per_package = sum(self.patch_timings.values()) / len(self.patch_timings)
+            time_left = self.install_duration - (time.time() - start_patch_time)
+            fitting = 0
+            estimated = 0
+            while fitting < len(transaction) and estimated + len(transaction[fitting]) * seconds_per_package <= time_left:
+                estimated += len(transaction[fitting]) * seconds_per_package
+                fitting += 1
+            if fitting == 0:
                 msg = "Patching time exceeded. The pending package will be patched in the next cycle"
                 self.log_and_syslog(logging.WARNING, msg)
                 return True,pkg_failed
-            retcode = self.patch_package(pkg_name)
-            if retcode != 0:
-                self.log_and_syslog(logging.ERROR, "Failed to patch the package:" + pkg_name)
-                pkg_failed.append(' '.join([pkg_name, category]))
-                continue
-            self.patched.append(pkg_name)
-            self.log_and_syslog(logging.INFO, "Package " + pkg_name + " is patched.")
-            waagent.AppendFileContents(self.package_patched_path, pkg_name + ' ' + category + '\n')
+            if fitting < len(transaction):
+                transactions.insert(0, transaction[fitting:])
+                transaction = transaction[:fitting]
+
+            packages = sum(transaction, [])
+            current_patch_time = time.time()
+            retcode = self.patch_packages(packages)
+            elapsed = time.time() - current_patch_time
+            for pkg_name in packages:
+                self.patch_timings[pkg_name] = self.patch_timings.get(pkg_name, 0) + elapsed / len(packages)
+            if retcode == 0:
+                self.log_and_syslog(logging.INFO, "Installed {0} packages in {1}s (estimated {2}s)".format(
+                    len(packages), round(elapsed, 3), round(estimated, 3)))
+                for pkg_name in packages:
+                    self.patched.append(pkg_name)
+                    self.log_and_syslog(logging.INFO, "Package " + pkg_name + " is patched.")
+                    waagent.AppendFileContents(self.package_patched_path, pkg_name + ' ' + category + '\n')
+            elif len(transaction) > 1:
+                # Bisect to find the failing packages, and install the others
+                self.log_and_syslog(logging.WARNING, "Failed to patch the packages: {0}. Retry them in two halves".format(' '.join(packages)))
+                half = len(transaction) // 2
+                transactions[0:0] = [transaction[:half], transaction[half:]]
+            else:
+                for pkg_name in packages:
+                    self.log_and_syslog(logging.ERROR, "Failed to patch the package:" + pkg_name)
+                    pkg_failed.append(' '.join([pkg_name, category]))
         return False,pkg_failed
 
+    def get_install_units(self, packages):
+        """
+        Split packages into the units that must be installed in the same transaction, such as
+        the binary packages built from one source package, which depend on each other's version.
+        """
+        return [[pkg_name] for pkg_name in packages]
+
+    def group_by_source(self, packages, output):
+        """
+        Group packages by source package, from output lines made of a package name and its source package name.
+        Packages missing from output are units of their own.
+        """
+        sources = dict()
+        for line in output.split('\n'):
+            fields = line.split()
+            if len(fields) == 2 and fields[0] in packages:
+                sources[fields[0]] = fields[1]
+        units = []
+        unit_of_source = dict()
+        for pkg_name in packages:
+            source = sources.get(pkg_name)
+            if source is None:
+                units.append([pkg_name])
+            elif source in unit_of_source:
+                unit_of_source[source].append(pkg_name)
+            else:
+                unit_of_source[source] = [pkg_name]
+                units.append(unit_of_source[source])
+        return units
+
+    def patch_packages(self, packages):
+        """
+        Install packages in one transaction of the package manager. Return 0 if all are installed.
+        The default implementation installs them one at a time with patch_package.
+        """
+        retcode = 0
+        for pkg_name in packages:
+            if self.patch_package(pkg_name) != 0:
+                retcode = 1
+        return retcode
+
     def patch_one_off(self):
         """
         Called when startTime is empty string, which means a on-demand patch.
@@ -710,26 +872,14 @@ class AbstractPatching(object):
 
     def check_needs_restart(self):
         self.needs_restart.extend(self.get_pkg_needs_restart())
-        patched_files = dict()
-        for pkg in self.get_pkg_patched():
-            cmd = ' '.join([self.pkg_query_cmd, pkg])
-            try:
-                retcode, output = waagent.RunGetOutput(cmd)
-                patched_files[os.path.basename(pkg)] = [filename for filename in output.split("\n") if os.path.isfile(filename)]
-            except Exception:
-                self.log_and_syslog(logging.ERROR, "Failed to " + cmd)
-        # for k,v in patched_files.items():
-        #     self.log_and_syslog(logging.INFO, k + ": " + " ".join(v))
-        open_deleted_files = list()
-        for filename in self.open_deleted_files_after:
-            if filename not in self.open_deleted_files_before:
-                open_deleted_files.append(filename)
-        # self.log_and_syslog(logging.INFO, "Open deleted files: " + " ".join(open_deleted_files))
-        for pkg,files in patched_files.items():
-            for filename in files:
-                realpath = os.path.realpath(filename)
-                if realpath in open_deleted_files and pkg not in self.needs_restart:
-                     self.needs_restart.append(pkg)
+        patched_files = self.get_pkg_files(self.get_pkg_patched())
+        restart_needed, self.pids_to_restart = self.restart_analyzer.find_restart_needed(
+            patched_files, self.open_deleted_files_before, self.open_deleted_files_after)
+        for pkg in sorted(restart_needed):
+            if pkg not in self.needs_restart:
+                self.needs_restart.append(pkg)
+            self.log_and_syslog(logging.INFO, "Processes using the old files of {0}: {1}".format(
+                pkg, " ".join([str(pid) for pid in sorted(restart_needed[pkg])])))
         msg = "Packages needs to restart: "
         pkgs = " ".join(self.needs_restart)
         if pkgs:
@@ -741,16 +891,37 @@ class AbstractPatching(object):
     def get_pkg_needs_restart(self):
         return []
 
+    def get_pkg_files(self, packages):
+        """
+        Return a dict of the packages to the lists of their files.
+        The default implementation queries pkg_query_cmd once per package.
+        """
+        pkg_files = dict()
+        for pkg in packages:
+            cmd = ' '.join([self.pkg_query_cmd, pkg])
+            try:
+                retcode, output = waagent.RunGetOutput(cmd)
+                pkg_files[os.path.basename(pkg)] = [filename for filename in output.split("\n") if filename]
+            except Exception:
+                self.log_and_syslog(logging.ERROR, "Failed to " + cmd)
+        return pkg_files
+
+    def get_pkg_files_from_rpm(self, packages):
+        """
+        Query the files of rpm packages (or of rpm files with pkg_files_query_cmd 'rpm -qp') in one rpm call.
+        """
+        pkg_files = dict()
+        if not packages:
+            return pkg_files
+        retcode, output = waagent.RunGetOutput(self.pkg_files_query_cmd + " --qf '[%{NAME} %{FILENAMES}\\n]' " + " ".join(packages), chk_err=False)
+        for line in output.split('\n'):
+            fields = line.split(' ', 1)
+            if len(fields) == 2 and fields[1].startswith('/'):
+                pkg_files.setdefault(fields[0], []).append(fields[1])
+        return pkg_files
+
     def check_open_deleted_files(self):
-        ret = list()
-        retcode,output = waagent.RunGetOutput('lsof | grep "DEL"')
-        if retcode == 0:
-            for line in output.split('\n'):
-                if line:
-                    filename = line.split()[-1]
-                    if filename not in ret:
-                        ret.append(filename)
-        return ret
+        return self.restart_analyzer.scan_open_deleted_files()
 
     def create_stop_flag(self):
         waagent.SetFileContents(self.stop_flag_path, '')
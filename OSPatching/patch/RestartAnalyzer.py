@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# RestartAnalyzer finds the processes which still use the old files of the
+# patched packages, and so need to be restarted.
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+
+class RestartAnalyzer(object):
+    deleted_suffix = ' (deleted)'
+
+    def __init__(self, proc_root='/proc'):
+        self.proc_root = proc_root
+        self.realdir_cache = dict()
+
+    def scan_open_deleted_files(self):
+        """
+        Scan /proc/<pid>/maps and /proc/<pid>/fd for the files which are mapped
+        or open while they have been deleted, e.g. replaced by a package upgrade.
+        Return a dict of the file paths to the set of the PIDs using them.
+        """
+        open_deleted_files = dict()
+        for pid in os.listdir(self.proc_root):
+            if not pid.isdigit():
+                continue
+            for filename in self._read_deleted_maps(pid) | self._read_deleted_fds(pid):
+                open_deleted_files.setdefault(filename, set()).add(int(pid))
+        return open_deleted_files
+
+    def _read_deleted_maps(self, pid):
+        deleted = set()
+        try:
+            with open(os.path.join(self.proc_root, pid, 'maps')) as maps:
+                for line in maps:
+                    # e.g. "7f2c4e5d1000-7f2c4e6a3000 r-xp 00000000 08:01 1835 /usr/lib/libssl.so.1.0.0 (deleted)"
+                    line = line.rstrip('\n')
+                    if line.endswith(self.deleted_suffix):
+                        fields = line.split(None, 5)
+                        if len(fields) == 6 and fields[5].startswith('/'):
+                            deleted.add(fields[5][:-len(self.deleted_suffix)])
+        except (IOError, OSError):
+            pass  # The process has exited, or is not ours to read
+        return deleted
+
+    def _read_deleted_fds(self, pid):
+        deleted = set()
+        fd_dir = os.path.join(self.proc_root, pid, 'fd')
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            return deleted
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith('/') and target.endswith(self.deleted_suffix):
+                deleted.add(target[:-len(self.deleted_suffix)])
+        return deleted
+
+    def _realpath(self, filename):
+        """
+        Resolve the directory of a packaged file, e.g. /lib to /usr/lib, caching it since
+        the files of all the packages live in a few hundred directories.
+        """
+        dirname, basename = os.path.split(filename)
+        realdir = self.realdir_cache.get(dirname)
+        if realdir is None:
+            realdir = os.path.realpath(dirname)
+            self.realdir_cache[dirname] = realdir
+        return os.path.join(realdir, basename)
+
+    def find_restart_needed(self, pkg_files, open_deleted_before, open_deleted_after):
+        """
+        Join the files of the patched packages with the files which became open deleted during the patching.
+        pkg_files is a dict of the package names to their files, and open_deleted_before/after are results of
+        scan_open_deleted_files().
+        Return a dict of the packages needing a restart to the PIDs using their old files, and the set of all these PIDs.
+        """
+        open_deleted = dict()
+        for filename, pids in open_deleted_after.items():
+            pids = pids - open_deleted_before.get(filename, set())
+            if pids:
+                open_deleted[filename] = pids
+        restart_needed = dict()
+        pids_to_restart = set()
+        if not open_deleted:
+            return restart_needed, pids_to_restart
+        deleted_paths = set(open_deleted)
+        for pkg, files in pkg_files.items():
+            pids = set()
+            for filename in deleted_paths.intersection(self._realpath(f) for f in files):
+                pids |= open_deleted[filename]
+            if pids:
+                restart_needed[pkg] = pids
+                pids_to_restart |= pids
+        return restart_needed, pids_to_restart
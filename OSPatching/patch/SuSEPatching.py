@@ -35,6 +35,10 @@ class SuSEPatching(AbstractPatching):
         self.download_cmd = 'zypper --non-interactive --pkg-cache-dir ' + self.cache_dir + ' install -d --auto-agree-with-licenses -t patch '
         self.patch_cmd = 'zypper --non-interactive --pkg-cache-dir ' + self.cache_dir + ' install --auto-agree-with-licenses -t patch '
         self.pkg_query_cmd = 'rpm -qlp'
+        self.pkg_files_query_cmd = 'rpm -qp'
+        # Zypper holds a global lock, so the transactions can't run in parallel
+        self.download_batch_size = 20
+        self.patch_batch_size = 50
         waagent.Run('zypper -q --gpg-auto-import-keys --non-interactive refresh', False)
     
     def check(self, category):
@@ -66,7 +70,16 @@ class SuSEPatching(AbstractPatching):
         else:
             return 0
 
+    def download_packages(self, packages):
+        retcode = waagent.Run(self.download_cmd + ' '.join(packages), False)
+        if 0 < retcode and retcode < 100:
+            return packages
+        return []
+
     def patch_package(self, package):
+        return self.patch_packages([package])
+
+    def patch_packages(self, packages):
         if self.patched_pkgs == None:
             self.patched_pkgs = list()
             for root,dirs,files in os.walk(self.cache_dir):
@@ -74,7 +87,7 @@ class SuSEPatching(AbstractPatching):
                     if filename.endswith('rpm'):
                         shutil.copy(os.path.join(root, filename), "/tmp/")
                         self.patched_pkgs.append("/tmp/"+filename)
-        retcode = waagent.Run(self.patch_cmd + package, False)
+        retcode = waagent.Run(self.patch_cmd + ' '.join(packages), False)
         if 0 < retcode and retcode < 100:
             return 1
         else:
@@ -85,5 +98,8 @@ class SuSEPatching(AbstractPatching):
     def check_reboot(self):
         pass
 
+    def get_pkg_files(self, packages):
+        return self.get_pkg_files_from_rpm(packages)
+
     def get_pkg_patched(self):
         return self.patched_pkgs
@@ -29,10 +29,14 @@ class UbuntuPatching(AbstractPatching):
         self.check_security_suffix = ' -o Dir::Etc::SourceList=/etc/apt/security.sources.list'
         waagent.Run('grep "-security" /etc/apt/sources.list | sudo grep -v "#" > /etc/apt/security.sources.list')
         self.download_cmd = 'apt-get -d -y install'
+        self.download_batch_size = 20
         self.patch_cmd = 'apt-get -y -q --force-yes -o Dpkg::Options::="--force-confdef" install'
         self.fix_cmd = 'dpkg --configure -a --force-confdef'
         self.status_cmd = 'apt-cache show'
         self.pkg_query_cmd = 'dpkg-query -L'
+        self.dpkg_info_dir = '/var/lib/dpkg/info'
+        self.source_query_cmd = "dpkg-query -W -f='${Package} ${source:Package}\\n'"
+        self.patch_batch_size = 50
         # Avoid a config prompt
         os.environ['DEBIAN_FRONTEND']='noninteractive'
 
@@ -102,13 +106,46 @@ class UbuntuPatching(AbstractPatching):
     def download_package(self, package):
         return waagent.Run(self.download_cmd + ' ' + package)
 
+    def download_packages(self, packages):
+        # apt-get install -d takes the dpkg lock like any install, so the transactions run one at a time
+        # (download_parallelism is 1) and each downloads its packages in one go.
+        retcode = waagent.Run(' '.join([self.download_cmd] + packages))
+        if retcode != 0:
+            return packages
+        return []
+
     def patch_package(self, package):
         retcode, output = self.try_package_with_autofix(self.patch_cmd + ' ' + package)
         return retcode
 
+    def patch_packages(self, packages):
+        retcode, output = self.try_package_with_autofix(self.patch_cmd + ' ' + ' '.join(packages))
+        return retcode
+
+    def get_install_units(self, packages):
+        retcode, output = waagent.RunGetOutput(self.source_query_cmd + ' ' + ' '.join(packages), chk_err=False)
+        return self.group_by_source(packages, output)
+
     def check_reboot(self):
         self.reboot_required = os.path.isfile('/var/run/reboot-required')
 
+    def get_pkg_files(self, packages):
+        # Read the file lists kept by dpkg, <package>.list or <package>:<arch>.list,
+        # instead of running dpkg-query -L once per package
+        packages = set(packages)
+        pkg_files = dict()
+        for list_file in os.listdir(self.dpkg_info_dir):
+            if not list_file.endswith('.list'):
+                continue
+            pkg = list_file[:-len('.list')]
+            if pkg not in packages:
+                pkg = pkg.split(':')[0]
+                if pkg not in packages:
+                    continue
+            with open(os.path.join(self.dpkg_info_dir, list_file)) as f:
+                pkg_files.setdefault(pkg, []).extend([line.rstrip('\n') for line in f if line.startswith('/')])
+        return pkg_files
+
     def get_pkg_needs_restart(self):
         fd = '/var/run/reboot-required.pkgs'
         if not os.path.isfile(fd):
@@ -28,9 +28,14 @@ class redhatPatching(AbstractPatching):
         self.check_security_cmd = 'yum -q --security check-update'
         self.clean_cmd = 'yum clean packages'
         self.download_cmd = 'yum -q -y --downloadonly update'
+        # Yum holds a global lock, so the transactions can't run in parallel
+        self.download_batch_size = 20
         self.patch_cmd = 'yum -y update'
         self.status_cmd = 'yum -q info'
         self.pkg_query_cmd = 'repoquery -l'
+        self.pkg_files_query_cmd = 'rpm -q'
+        self.source_query_cmd = "rpm -q --qf '%{NAME} %{SOURCERPM}\\n'"
+        self.patch_batch_size = 50
         self.cache_dir = '/var/cache/yum/'
 
     def install(self):
@@ -91,9 +96,26 @@ class redhatPatching(AbstractPatching):
         # Yum exit code is not 0 even if succeed, so check if the package rpm exsits to verify that downloading succeeds.
         return self.check_download(package)
 
+    def download_packages(self, packages):
+        waagent.Run(self.download_cmd + ' ' + ' '.join(packages), chk_err=False)
+        return [pkg_name for pkg_name in packages if self.check_download(pkg_name) != 0]
+
     def patch_package(self, package):
         return waagent.Run(self.patch_cmd + ' ' + package)
 
+    def patch_packages(self, packages):
+        return waagent.Run(self.patch_cmd + ' ' + ' '.join(packages))
+
+    def get_install_units(self, packages):
+        retcode, output = waagent.RunGetOutput(self.source_query_cmd + ' ' + ' '.join(packages), chk_err=False)
+        # Strip the version from the source rpm name, e.g. openssl-1.0.2k-19.el7.src.rpm
+        output = '\n'.join([' '.join([line.split()[0], line.split()[1].rsplit('-', 2)[0]])
+                            for line in output.split('\n') if len(line.split()) == 2])
+        return self.group_by_source(packages, output)
+
+    def get_pkg_files(self, packages):
+        return self.get_pkg_files_from_rpm(packages)
+
     def check_reboot(self):
         retcode,last_kernel = waagent.RunGetOutput("rpm -q --last kernel")
         last_kernel = last_kernel.split()[0][7:]
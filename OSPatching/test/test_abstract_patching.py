@@ -0,0 +1,232 @@
+#!/usr/bin/python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import mock
+sys.path.append(os.path.abspath('../patch'))
+# AbstractPatching reads the extension version from the manifest in the working directory
+test_dir = os.getcwd()
+os.chdir('..')
+try:
+    import AbstractPatching as abstract_patching
+finally:
+    os.chdir(test_dir)
+
+
+class StubPatching(abstract_patching.AbstractPatching):
+    """
+    Records the transactions of the package manager instead of running it. A transaction
+    containing a package of failing fails as a whole, like apt-get and yum do.
+    """
+    def __init__(self, work_dir):
+        super(StubPatching, self).__init__(mock.MagicMock())
+        self.package_downloaded_path = os.path.join(work_dir, 'package.downloaded')
+        self.package_patched_path = os.path.join(work_dir, 'package.patched')
+        self.stop_flag_path = os.path.join(work_dir, 'StopOSPatching')
+        self.lock = threading.Lock()
+        self.transactions = []
+        self.failing = set()
+        self.messages = []
+        # Output of the source package query, lines of a package name and its source package name
+        self.sources = ''
+        # Seconds each package takes to install, on the clock of the test
+        self.clock = None
+        self.seconds_per_package = 0
+
+    def log_and_syslog(self, level, message):
+        self.messages.append(message)
+
+    def download_packages(self, packages):
+        with self.lock:
+            self.transactions.append(list(packages))
+        if self.failing.intersection(packages):
+            return list(packages)
+        return []
+
+    def get_install_units(self, packages):
+        return self.group_by_source(packages, self.sources)
+
+    def patch_packages(self, packages):
+        self.transactions.append(list(packages))
+        if self.clock is not None:
+            self.clock.now += self.seconds_per_package * len(packages)
+        if self.failing.intersection(packages):
+            return 1
+        return 0
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.patching = StubPatching(self.work_dir)
+        # Retry right away unless a test sets the backoff
+        self.uniform = mock.patch.object(abstract_patching.random, 'uniform', return_value=0)
+        self.uniform.start()
+        event_patcher = mock.patch.object(abstract_patching.waagent, 'AddExtensionEvent')
+        self.add_extension_event = event_patcher.start()
+        self.addCleanup(event_patcher.stop)
+
+    def tearDown(self):
+        self.uniform.stop()
+        shutil.rmtree(self.work_dir)
+
+    def download(self, packages, deadline=None):
+        if deadline is None:
+            deadline = time.time() + 3600
+        self.patching._download([(pkg_name, 'important') for pkg_name in packages], deadline)
+
+    def test_download_in_transactions(self):
+        self.patching.download_batch_size = 2
+        self.download(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(self.patching.transactions, [['a', 'b'], ['c', 'd'], ['e']])
+        self.assertEqual(self.patching.downloaded, ['a', 'b', 'c', 'd', 'e'])
+        with open(self.patching.package_downloaded_path) as f:
+            self.assertEqual(f.read(), ''.join(pkg_name + ' important\n' for pkg_name in 'abcde'))
+
+    def test_parallel_transactions(self):
+        self.patching.download_batch_size = 1
+        self.patching.download_parallelism = 3
+        running = []
+        concurrency = []
+        def download_packages(packages):
+            with self.patching.lock:
+                running.append(packages)
+                concurrency.append(len(running))
+            time.sleep(0.05)
+            with self.patching.lock:
+                running.remove(packages)
+            return []
+        self.patching.download_packages = download_packages
+        self.download(['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual(sorted(self.patching.downloaded), ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual(max(concurrency), 3)
+
+    def test_failed_transaction_is_split(self):
+        self.patching.download_batch_size = 3
+        self.patching.download_max_retry = 2
+        self.patching.failing.add('b')
+        self.download(['a', 'b', 'c', 'd'])
+        # The packages of the failed transaction are retried on their own, b up to download_max_retry times more
+        self.assertEqual(self.patching.transactions, [['a', 'b', 'c'], ['d'], ['a'], ['b'], ['c'], ['b'], ['b']])
+        self.assertEqual(sorted(self.patching.downloaded), ['a', 'c', 'd'])
+        self.assertTrue('Failed to download b after 2 retries' in self.patching.messages)
+        self.assertEqual(self.add_extension_event.call_count, 1)
+
+    def test_retry_stops_at_deadline(self):
+        self.patching.failing.add('a')
+        self.uniform.stop()
+        self.uniform = mock.patch.object(abstract_patching.random, 'uniform', return_value=60)
+        self.uniform.start()
+        self.download(['a', 'b'], deadline=time.time() + 30)
+        # The backoff of a ends after the deadline
+        self.assertEqual(self.patching.transactions, [['a'], ['b']])
+        self.assertEqual(self.patching.downloaded, ['b'])
+        self.assertTrue('Download time exceeded. a will not be retried' in self.patching.messages)
+
+    def test_stop_flag(self):
+        self.patching.failing.add('a')
+        open(self.patching.stop_flag_path, 'w').close()
+        self.download(['a', 'b'])
+        self.assertEqual(self.patching.transactions, [])
+        self.assertEqual(self.patching.downloaded, [])
+
+
+class TestPatch(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.patching = StubPatching(self.work_dir)
+        self.patching.install_duration = 3600
+        self.patching.clock = FakeClock()
+        time_patcher = mock.patch.object(abstract_patching, 'time', self.patching.clock)
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        abstract_patching.start_patch_time = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_group_by_source(self):
+        output = 'libc6 glibc\nlibc-bin glibc\nbash bash\nunrelated glibc\nmalformed\n'
+        self.assertEqual(self.patching.group_by_source(['libc6', 'bash', 'libc-bin', 'vim'], output),
+                         [['libc6', 'libc-bin'], ['bash'], ['vim']])
+
+    def test_patch_in_batches(self):
+        self.patching.patch_batch_size = 3
+        self.patching.sources = 'a src1\nb src2\nc src1\nd src3\ne src3'
+        self.assertEqual(self.patching._patch('important', ['a', 'b', 'c', 'walinuxagent', 'd', 'e']), (False, []))
+        # a and c are built from one source package and installed together, the agent is never patched
+        self.assertEqual(self.patching.transactions, [['a', 'c', 'b'], ['d', 'e']])
+        self.assertEqual(self.patching.patched, ['a', 'c', 'b', 'd', 'e'])
+        with open(self.patching.package_patched_path) as f:
+            self.assertEqual(f.read(), ''.join(pkg_name + ' important\n' for pkg_name in 'acbde'))
+
+    def test_unit_larger_than_the_batch(self):
+        self.patching.patch_batch_size = 1
+        self.patching.sources = 'a src1\nb src1'
+        self.assertEqual(self.patching._patch('important', ['a', 'b', 'c']), (False, []))
+        self.assertEqual(self.patching.transactions, [['a', 'b'], ['c']])
+
+    def test_failed_transaction_is_bisected(self):
+        self.patching.patch_batch_size = 4
+        self.patching.failing.add('c')
+        self.assertEqual(self.patching._patch('important', ['a', 'b', 'c', 'd']), (False, ['c important']))
+        self.assertEqual(self.patching.transactions, [['a', 'b', 'c', 'd'], ['a', 'b'], ['c', 'd'], ['c'], ['d']])
+        self.assertEqual(self.patching.patched, ['a', 'b', 'd'])
+
+    def test_failed_unit_is_not_split(self):
+        self.patching.patch_batch_size = 3
+        self.patching.sources = 'a src1\nb src1'
+        self.patching.failing.add('b')
+        self.assertEqual(self.patching._patch('important', ['a', 'b', 'c']), (False, ['a important', 'b important']))
+        self.assertEqual(self.patching.transactions, [['a', 'b', 'c'], ['a', 'b'], ['c']])
+        self.assertEqual(self.patching.patched, ['c'])
+
+    def test_transactions_fit_the_window(self):
+        self.patching.patch_batch_size = 5
+        self.patching.patch_seconds_per_package = 30
+        self.patching.seconds_per_package = 30
+        self.patching.install_duration = 100
+        # Only 3 packages fit, the others are left for the next cycle
+        self.assertEqual(self.patching._patch('important', ['a', 'b', 'c', 'd', 'e']), (True, []))
+        self.assertEqual(self.patching.transactions, [['a', 'b', 'c']])
+        self.assertEqual(self.patching.patched, ['a', 'b', 'c'])
+
+    def test_window_estimate_uses_past_timings(self):
+        self.patching.patch_batch_size = 2
+        self.patching.patch_seconds_per_package = 30
+        self.patching.seconds_per_package = 10
+        self.patching.install_duration = 70
+        # After the first transaction a package takes 10s instead of 30s, so the 50s left fit 5 more,
+        # and the last transaction is cut to what fits
+        self.assertEqual(self.patching._patch('important', ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']), (True, []))
+        self.assertEqual(self.patching.transactions, [['a', 'b'], ['c', 'd'], ['e', 'f'], ['g']])
+
+if __name__ == '__main__':
+    unittest.main()
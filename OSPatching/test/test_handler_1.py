@@ -745,7 +745,8 @@ class Test(unittest.TestCase):
         self.assertEqual(cm.exception.code, 0)
 
         patch_list = get_patch_list(MyPatching.package_patched_path)
-        self.assertEqual(patch_list, ['a', 'b', 'c', 'd', 'e', '1'])
+        # '1' would start 56s into the 60s window and take 11s, so it's left for the next cycle
+        self.assertEqual(patch_list, ['a', 'b', 'c', 'd', 'e'])
         log_contents = waagent.GetFileContents(log_file)[old_log_len:]
         self.assertTrue('Patching time exceeded' in log_contents)
 
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.append('../patch')
+from RestartAnalyzer import RestartAnalyzer
+
+
+class TestRestartAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.proc_root = tempfile.mkdtemp()
+        self.analyzer = RestartAnalyzer(self.proc_root)
+
+    def tearDown(self):
+        shutil.rmtree(self.proc_root)
+
+    def add_process(self, pid, maps, fds):
+        pid_dir = os.path.join(self.proc_root, str(pid))
+        os.makedirs(os.path.join(pid_dir, 'fd'))
+        with open(os.path.join(pid_dir, 'maps'), 'w') as f:
+            for filename in maps:
+                f.write('7f2c4e5d1000-7f2c4e6a3000 r-xp 00000000 08:01 1835                       ' + filename + '\n')
+        for fd, target in enumerate(fds):
+            os.symlink(target, os.path.join(pid_dir, 'fd', str(fd)))
+
+    def test_scan_open_deleted_files(self):
+        self.add_process(100, ['/usr/lib/libssl.so.1.0.0 (deleted)', '/usr/lib/libc.so.6', '[heap]',
+                               '/dev/zero (deleted)', '/usr/lib/my lib.so (deleted)'],
+                         ['/var/log/old.log (deleted)', 'socket:[1234]', '/tmp/open.txt'])
+        self.add_process(200, ['/usr/lib/libssl.so.1.0.0 (deleted)'], [])
+        os.makedirs(os.path.join(self.proc_root, 'sys'))
+        self.assertEqual(self.analyzer.scan_open_deleted_files(), {
+            '/usr/lib/libssl.so.1.0.0': set([100, 200]),
+            '/dev/zero': set([100]),
+            '/usr/lib/my lib.so': set([100]),
+            '/var/log/old.log': set([100]),
+        })
+
+    def test_find_restart_needed(self):
+        before = {'/usr/lib/libcrypto.so.1.0.0': set([100])}
+        after = {'/usr/lib/libcrypto.so.1.0.0': set([100]),
+                 '/usr/lib/libssl.so.1.0.0': set([100, 200]),
+                 '/usr/sbin/sshd': set([300])}
+        pkg_files = {'libssl1.0.0': ['/usr/lib/libssl.so.1.0.0', '/usr/lib/libcrypto.so.1.0.0'],
+                     'openssh-server': ['/usr/sbin/sshd', '/usr/share/doc/sshd'],
+                     'bash': ['/bin/bash']}
+        restart_needed, pids = self.analyzer.find_restart_needed(pkg_files, before, after)
+        self.assertEqual(restart_needed, {'libssl1.0.0': set([100, 200]), 'openssh-server': set([300])})
+        self.assertEqual(pids, set([100, 200, 300]))
+
+    def test_find_restart_needed_through_symlinked_directory(self):
+        lib_dir = os.path.join(self.proc_root, 'usr', 'lib')
+        os.makedirs(lib_dir)
+        os.symlink(lib_dir, os.path.join(self.proc_root, 'lib'))
+        after = {os.path.join(lib_dir, 'libc.so.6'): set([1])}
+        pkg_files = {'libc6': [os.path.join(self.proc_root, 'lib', 'libc.so.6')]}
+        restart_needed, pids = self.analyzer.find_restart_needed(pkg_files, dict(), after)
+        self.assertEqual(restart_needed, {'libc6': set([1])})
+
+
+if __name__ == '__main__':
+    unittest.main()
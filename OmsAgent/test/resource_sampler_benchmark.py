@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# OmsAgent extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the cost of one omsagent resource usage sample taken by
+# ProcessTreeSampler with the top | grep | awk pipeline it replaced.
+# Forks are counted from the system-wide "processes" counter of /proc/stat.
+# Usage: python resource_sampler_benchmark.py [samples] [omsagent pid file]
+
+from __future__ import print_function
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import env
+import watcherutil
+
+TopCommand = 'top -bn1 | grep -i omsagent | awk \'{print $1 " " $2 " " $9 " " $10  " " $12}\''
+
+
+def forks_so_far():
+    with open('/proc/stat') as f:
+        for line in f:
+            if line.startswith('processes '):
+                return int(line.split()[1])
+
+
+def measure(func, samples):
+    forks = forks_so_far()
+    start = time.time()
+    for i in range(samples):
+        func()
+    elapsed = time.time() - start
+    return elapsed * 1000 / samples, float(forks_so_far() - forks) / samples
+
+
+def main():
+    samples = 100
+    if len(sys.argv) > 1:
+        samples = int(sys.argv[1])
+    child = None
+    if len(sys.argv) > 2:
+        pid_file = sys.argv[2]
+    else:
+        # Sample this process, with a child, when omsagent isn't installed.
+        pid_file = os.path.join(tempfile.mkdtemp(), 'omsagent.pid')
+        with open(pid_file, 'w') as f:
+            f.write(str(os.getpid()))
+        devnull = open(os.devnull, 'w')
+        child = subprocess.Popen(['sleep', '600'], stdout=devnull, stderr=devnull)
+
+    try:
+        sampler = watcherutil.ProcessTreeSampler(pid_file, 'omsagent')
+        cost, forks = measure(sampler.sample, samples)
+        print("ProcessTreeSampler: {0:.3f}ms per sample, {1:.2f} forks per sample".format(cost, forks))
+
+        def run_top():
+            subprocess.Popen(TopCommand, shell=True, stdout=subprocess.PIPE).communicate()
+        cost, forks = measure(run_top, max(samples // 10, 1))
+        print("top | grep | awk:   {0:.3f}ms per sample, {1:.2f} forks per sample".format(cost, forks))
+    finally:
+        if child:
+            child.kill()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# OmsAgent extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import env
+import os
+import shutil
+import tempfile
+import time
+import watcherutil
+
+ClockTicks = os.sysconf('SC_CLK_TCK')
+PageSize = os.sysconf('SC_PAGE_SIZE')
+
+
+class TestProcessTreeSampler(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.proc_root = os.path.join(self.root, 'proc')
+        self.cgroup_root = os.path.join(self.root, 'cgroup')
+        self.pid_file = os.path.join(self.root, 'omsagent.pid')
+        self.write(self.pid_file, '100\n')
+        # 100 pages of total memory
+        self.write(os.path.join(self.proc_root, 'meminfo'), 'MemTotal: {0} kB\n'.format(PageSize * 100 // 1024))
+        self.set_uptime(1000)
+        self.sampler = watcherutil.ProcessTreeSampler(self.pid_file, 'omsagent', proc_root=self.proc_root,
+                                                      cgroup_root=self.cgroup_root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, content):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def set_uptime(self, seconds):
+        self.write(os.path.join(self.proc_root, 'uptime'), '{0} 0.00\n'.format(seconds))
+
+    def add_process(self, pid, ppid, cpu_seconds, start_seconds, resident_pages, cgroup='0::/user.slice'):
+        fields = ['S', str(ppid)] + ['0'] * 9 + [str(cpu_seconds * ClockTicks), '0'] + ['0'] * 6 + \
+                 [str(start_seconds * ClockTicks)]
+        self.write(os.path.join(self.proc_root, str(pid), 'stat'),
+                   '{0} (ruby worker) {1}\n'.format(pid, ' '.join(fields)))
+        self.write(os.path.join(self.proc_root, str(pid), 'statm'), '1000 {0} 10 1 0 100 0\n'.format(resident_pages))
+        self.write(os.path.join(self.proc_root, str(pid), 'cgroup'), cgroup + '\n')
+
+    def test_child_processes(self):
+        self.add_process(100, 1, 40, 900, 10)
+        self.add_process(101, 100, 10, 950, 5)
+        self.add_process(102, 101, 0, 990, 1)
+        self.add_process(200, 1, 500, 0, 50)
+
+        # First sample averages the CPU usage since omsagent started
+        self.assertEqual(self.sampler.sample(), (16.0, 50.0))
+
+        self.add_process(100, 1, 65, 900, 10)
+        self.add_process(101, 100, 10, 950, 5)
+        self.add_process(102, 101, 10, 990, 3)
+        self.set_uptime(1050)
+        # 35s used in 50s, smoothed with the previous 50%
+        self.assertEqual(self.sampler.sample(), (17.0, 60.0))
+
+        # omsagent restarted
+        shutil.rmtree(os.path.join(self.proc_root, '101'))
+        shutil.rmtree(os.path.join(self.proc_root, '102'))
+        self.add_process(100, 1, 1, 1040, 10)
+        self.assertEqual(self.sampler.sample(), (10.0, 10.0))
+
+    def test_cgroup_processes(self):
+        cgroup = '1:name=systemd:/system.slice/omsagent-ws.service'
+        self.add_process(100, 1, 10, 900, 10, cgroup)
+        self.add_process(103, 1, 10, 900, 20, cgroup)
+        self.add_process(101, 100, 10, 900, 40, cgroup)
+        self.write(os.path.join(self.cgroup_root, 'systemd/system.slice/omsagent-ws.service/cgroup.procs'),
+                   '100\n103\n')
+        self.assertEqual(self.sampler.sample(), (30.0, 20.0))
+
+    def test_not_running(self):
+        self.add_process(101, 1, 10, 900, 10)
+        self.assertRaises(IOError, self.sampler.sample)
+
+class TestFatalLogs(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.original_log_file = watcherutil.OmsAgentLogFile
+        self.log_file = watcherutil.OmsAgentLogFile = os.path.join(self.root, 'omsagent.log')
+        self.errors = []
+        self.watcher = watcherutil.Watcher(self.errors.append, lambda msg: None)
+
+    def tearDown(self):
+        watcherutil.OmsAgentLogFile = self.original_log_file
+        shutil.rmtree(self.root)
+
+    def append(self, level, message, log_time=None):
+        log_time = time.gmtime(log_time or time.time())
+        with open(self.log_file, 'a') as f:
+            f.write('{0} +0000 [{1}]: {2}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S', log_time), level, message))
+
+    def test_fatal_logs(self):
+        self.append('info', 'starting fluentd')
+        marker = watcherutil.LogFileMarker()
+        self.assertFalse(self.watcher.check_for_fatal_oms_logs(marker))
+
+        self.append('info', 'No space left on the device')
+        self.append('error', 'No space left on the device', time.time() - 3600)
+        self.assertFalse(self.watcher.check_for_fatal_oms_logs(marker))
+
+        self.append('error', 'unexpected error error_class=Errno::ENOSPC '
+                             'error="Fatal error, can not clear buffer file"')
+        self.assertTrue(self.watcher.check_for_fatal_oms_logs(marker))
+        self.assertFalse(self.watcher.check_for_fatal_oms_logs(marker))
+
+        # Rotated
+        os.rename(self.log_file, self.log_file + '.1')
+        self.append('warn', 'Errono::ENOSPC error=')
+        self.assertTrue(self.watcher.check_for_fatal_oms_logs(marker))
+        self.assertEqual(self.errors, ['Found non recoverable error log in agent log file'] * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,7 +18,6 @@ from builtins import object
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
 import os
 import io
 import datetime
@@ -32,7 +31,6 @@ import json
 import uuid
 from threading import Thread
 import re
-import hashlib
 from omsagent import run_command_and_log
 from omsagent import RestartOMSAgentServiceCommand
 
@@ -63,12 +61,14 @@ class SelfMonitorInfo(object):
         self._last_reset_success = True
         self._error_count = 0
         self._memory_used_in_percent = 0
+        self._cpu_used_in_percent = 0
         self._consecutive_high_memory_usage = 0
 
     def reset(self):
         self._consecutive_error_count = 0
         self._consecutive_high_memory_usage = 0
         self._memory_used_in_percent = 0
+        self._cpu_used_in_percent = 0
 
     def reset_error_info(self):
         self._consecutive_error_count = 0
@@ -108,14 +108,145 @@ class SelfMonitorInfo(object):
 class LogFileMarker(object):
     """
         Class to hold omsagent log file marker information.
+        The scanner remembers the inode and offset read up to, and starts over if the log is rotated.
     """
     def __init__(self):
-        self._last_pos = 0
-        self._last_crc = ""
+        self._scanner = None
+        self._signatures = None
+        self.reset_marker()
 
     def reset_marker(self):
-        self._last_pos = 0
-        self._last_crc = ""
+        # Imported on use: omsagent imports this module before its guarded Utils imports,
+        # and failing to import Utils is not an exit case for it.
+        from Utils import LogUtil
+        if self._scanner is not None:
+            self._scanner.close()
+        self._signatures = LogUtil.Signatures(ErrorStatements)
+        self._scanner = LogUtil.LogFileScanner(OmsAgentLogFile)
+
+class ProcessTreeSampler(object):
+    """
+        Samples the CPU and memory usage of a process and of its child processes (e.g. omsagent and its
+        fluentd workers) from /proc, without running any command.
+        The processes are listed from the cgroup of the process if it is a dedicated one (the omsagent
+        systemd service), otherwise from the parent PIDs in /proc/<pid>/stat.
+        CPU usage is computed from the clock ticks used between two samples, and both values are
+        smoothed across samples with an exponentially weighted moving average.
+    """
+    def __init__(self, pid_file, cgroup_name, smoothing_factor=0.5, proc_root='/proc', cgroup_root='/sys/fs/cgroup'):
+        self._pid_file = pid_file
+        self._cgroup_name = cgroup_name
+        self._smoothing_factor = smoothing_factor
+        self._proc_root = proc_root
+        self._cgroup_root = cgroup_root
+        self._clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+        self._memory_total = None
+        self._root_key = None
+        self._last_ticks = {}
+        self._last_uptime = None
+        self.memory_used_in_percent = None
+        self.cpu_used_in_percent = None
+
+    def _read(self, *path):
+        with open(os.path.join(self._proc_root, *path)) as f:
+            return f.read()
+
+    def _read_stat(self, pid):
+        """
+            return tuple : parent pid, clock ticks used (user + system), start time in clock ticks.
+        """
+        # The process name is in parentheses and may contain spaces, so split after it.
+        fields = self._read(pid, 'stat').rsplit(')', 1)[1].split()
+        return fields[1], int(fields[11]) + int(fields[12]), int(fields[19])
+
+    def _list_cgroup_processes(self, pid):
+        for line in self._read(pid, 'cgroup').splitlines():
+            hierarchy_id, controllers, path = line.split(':', 2)
+            if self._cgroup_name not in path:
+                continue
+            if hierarchy_id == '0':
+                procs_file = os.path.join(self._cgroup_root, path.lstrip('/'), 'cgroup.procs')
+            elif controllers == 'name=systemd':
+                procs_file = os.path.join(self._cgroup_root, 'systemd', path.lstrip('/'), 'cgroup.procs')
+            else:
+                continue
+            try:
+                with open(procs_file) as f:
+                    return f.read().split()
+            except IOError:
+                pass
+        return None
+
+    def _list_descendant_processes(self, pid):
+        children = {}
+        for entry in os.listdir(self._proc_root):
+            if entry.isdigit():
+                try:
+                    children.setdefault(self._read_stat(entry)[0], []).append(entry)
+                except (IOError, OSError, IndexError):
+                    pass  # The process exited while we were listing.
+        pids = [pid]
+        for parent in pids:
+            pids.extend(children.get(parent, []))
+        return pids
+
+    def _smooth(self, smoothed_value, value):
+        if smoothed_value is None:
+            return value
+        return self._smoothing_factor * value + (1 - self._smoothing_factor) * smoothed_value
+
+    def sample(self):
+        """
+            Take a sample and update the smoothed values.
+            return tuple : memory, cpu (smoothed, in percent). memory is the sum of the resident memory of
+            the processes over the total memory, cpu is of one CPU like in top.
+        """
+        with open(self._pid_file) as f:
+            pid = f.readline().strip()
+        if self._memory_total is None:
+            for line in self._read('meminfo').splitlines():
+                if line.startswith('MemTotal:'):
+                    self._memory_total = int(line.split()[1]) * 1024
+                    break
+        uptime = float(self._read('uptime').split()[0])
+
+        pids = self._list_cgroup_processes(pid) or self._list_descendant_processes(pid)
+        ticks = {}
+        resident_pages = 0
+        root_key = None
+        for member in pids:
+            try:
+                _, used_ticks, start_time = self._read_stat(member)
+                resident_pages += int(self._read(member, 'statm').split()[1])
+            except (IOError, OSError, IndexError):
+                continue  # The process exited while we were sampling.
+            ticks[(member, start_time)] = used_ticks
+            if member == pid:
+                root_key = (member, start_time)
+        if root_key is None:
+            raise IOError('omsagent process {0} is not running'.format(pid))
+
+        if root_key != self._root_key:
+            # First sample of this process: CPU usage is averaged since it started.
+            self._root_key = root_key
+            self.memory_used_in_percent = self.cpu_used_in_percent = None
+            used_ticks = sum(ticks.values())
+            elapsed = uptime - root_key[1] / self._clock_ticks
+        else:
+            # Processes started since the last sample count all the ticks they used.
+            used_ticks = sum(t - self._last_ticks.get(key, 0) for key, t in ticks.items())
+            elapsed = uptime - self._last_uptime
+        self._last_ticks = ticks
+        self._last_uptime = uptime
+
+        cpu_used_in_percent = 0.0
+        if elapsed > 0:
+            cpu_used_in_percent = max(used_ticks, 0) / self._clock_ticks / elapsed * 100
+        memory_used_in_percent = resident_pages * self._page_size * 100.0 / self._memory_total
+        self.cpu_used_in_percent = self._smooth(self.cpu_used_in_percent, cpu_used_in_percent)
+        self.memory_used_in_percent = self._smooth(self.memory_used_in_percent, memory_used_in_percent)
+        return round(self.memory_used_in_percent, 1), round(self.cpu_used_in_percent, 1)
 
 class Watcher(object):
     """
@@ -132,6 +263,7 @@ class Watcher(object):
         self._hutil_log = hutil_log
         self._consecutive_error_count = 0
         self._consecutive_restarts_due_to_error = 0
+        self._resource_sampler = ProcessTreeSampler(OmsAgentPidFile, 'omsagent')
 
     def write_waagent_event(self, event):
         offset = str(int(time.time() * 1000000))
@@ -342,6 +474,7 @@ class Watcher(object):
         self.write_waagent_event(event)
 
         self_mon_info._memory_used_in_percent = resource_usage[0]
+        self_mon_info._cpu_used_in_percent = resource_usage[1]
 
         if (self_mon_info._memory_used_in_percent > 0):
             if (self_mon_info._memory_used_in_percent > MemoryThresholdToWatchFor):
@@ -435,65 +568,27 @@ class Watcher(object):
         read_start_time = int(time.time())
 
         if os.path.isfile(OmsAgentLogFile):
-            last_crc = log_file_marker._last_crc
-            last_pos = log_file_marker._last_pos
-
             # We do not want to propogate any exception to the caller.
 
             try:
-                f = open(OmsAgentLogFile, "r")
-
-                text = f.readline()
-
-                #  Handle log rotate. Check for CRC of first line of the log file.
-                #  Some of the agents like Splunk uses this technique.
-                #  If it matches with previous CRC, then file has not changed.
-                #  If it is not matching then file has changed and do not seek from
-                #  the last_pos rather continue from the begining.
-
-                if (text != ''):
-                    crc = hashlib.sha256(text).hexdigest()
-                    self._hutil_log("Last crc = {0}, current crc= {1} position = {2}".format(last_crc, crc, last_pos))
-                    if (last_crc == crc):
-
-                        if (last_pos > 0):
-                            f.seek(last_pos)
-                    else:
-                        self._hutil_log("File has changed do not seek from the offset. current crc = {0}".format(crc))
-
-                    log_file_marker._last_crc = crc
-                    total_lines_read = 1
-
-                while True:
-                    text = f.readline()
-
-                    if (text == ''):
-                        log_file_marker._last_pos = f.tell()
-                        break
-
-                    total_lines_read += 1
+                # Only the lines containing one of the error statements are returned by the scanner,
+                # so the level and the timestamp are parsed for these lines only.
+                for text in log_file_marker._scanner.scan(log_file_marker._signatures):
                     res = reg_ex.match(text)
 
-                    if res:
+                    if res and (res.group(2) == "warn" or res.group(2) == "error"):
                         log_entry_time = self.get_total_seconds_from_epoch_for_fluent_logs(res.group(1))
                         if (log_entry_time + (10 * 60) < read_start_time):
                             # ignore log line if we are reading logs older than 10 minutes.
                             pass
-                        elif (res.group(2) == "warn" or res.group(2) == "error"):
-                            for error_statement in ErrorStatements:
-                                if (res.group(3) in error_statement):
-                                    self._hutil_error("Found non recoverable error log in agent log file")
-
-                                    # File should be closed in the finally block.
-                                    return True
+                        else:
+                            self._hutil_error("Found non recoverable error log in agent log file")
+                            return True
 
                 self._hutil_log("Did not find any non recoverable logs in omsagent log file")
 
             except Exception as e:
                 self._hutil_error ("Caught an exception {0}".format(traceback.format_exc()))
-
-            finally:
-                f.close()
         else:
             self._hutil_error ("Omsagent log file not found : {0}".format(OmsAgentLogFile))
 
@@ -503,33 +598,15 @@ class Watcher(object):
         """
             If we hit any exception in getting resoource usage of the omsagent return 0,0
             We need not crash/fail in this case.
-            return tuple : memory, cpu.
-            Long run for north star we should use cgroups. cgroups tools are not available
-            by default on all the distros and we would need to package with the agent those and use.
-            Also at this point it is not very clear if customers would want us to create cgroups on their vms.
+            return tuple : memory, cpu, smoothed across the samples taken at each health check.
+            Both include the child processes of omsagent.
         """
 
         try:
-            mem_usage = 0.0
-            cpu_usage = 0.0
-            with open(OmsAgentPidFile, 'r') as infile:
-                pid = infile.readline()	 # Get pid of omsagent process.
-
-                # top output:
-                # $1 - PID,
-                # $2 - account,
-                # $9 - CPU,
-                # $10 - Memory,
-                # $12 - Process name
-                out = subprocess.Popen('top -bn1 | grep -i omsagent | awk \'{print $1 " " $2 " " $9 " " $10  " " $12}\'', shell=True, stdout=subprocess.PIPE)
-                for line in out.stdout:
-                    s = line.split()
-
-                    if (len(s) >= 4 and s[0] == pid and s[1] == 'omsagent' and s[4] == 'omsagent'):
-                        return float(s[3]) , float(s[2])
+            return self._resource_sampler.sample()
 
         except Exception as e:
             self._hutil_error('Error getting memory usage for omsagent process. Exception={0}'.format(e))
 
         # Control will reach here only in case of error condition. In that case it is ok to return 0 as it is harmless to be cautious.
-        return mem_usage, cpu_usage
+        return 0.0, 0.0
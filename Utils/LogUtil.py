@@ -21,24 +21,146 @@ import string
 import sys
 
 OutputSize = 4 * 1024
+ReadChunkSize = 1024 * 1024
+
+
+def to_printable(buf):
+    """
+    Keep only the printable ASCII characters of the bytes read from a log.
+    """
+    # encoding works different for between interpreter version, we are keeping separate implementation to ensure
+    # backward compatibility
+    if sys.version_info[0] == 3:
+        buf = buf.decode("ascii", "ignore")
+        return ''.join(c for c in buf if c in string.printable)
+    buf = filter(lambda x: x in string.printable, buf)
+    return buf.decode("ascii", "ignore")
+
+
+class Signatures(object):
+    """
+    Strings searched for in a log by LogFileScanner.scan().
+    Each one is searched for through a whole chunk with bytes.find(), which is about ten times faster than
+    matching an alternation regular expression over the same chunk.
+    """
+    def __init__(self, signatures):
+        self._signatures = [s.encode("utf-8") for s in signatures]
+
+    def find_all(self, buf, start, end):
+        """
+        :return: Sorted list of the (start, end) positions of all the signatures found in buf[start:end].
+        """
+        spans = []
+        for signature in self._signatures:
+            pos = buf.find(signature, start, end)
+            while pos >= 0:
+                spans.append((pos, pos + len(signature)))
+                pos = buf.find(signature, pos + 1, end)
+        spans.sort()
+        return spans
+
+
+class LogFileScanner(object):
+    """
+    Incrementally reads a log file that is only appended to, from where the previous read stopped.
+    The position is tracked by (inode, offset), so a log that is rotated, recreated or truncated is read
+    again from its beginning. The file is kept open between reads, so that its inode can't be reused by a
+    recreated file meanwhile; call close() when done.
+    The file is read through its descriptor, without the buffering of file objects, which doesn't notice
+    truncation in Python 2.
+    """
+    def __init__(self, log_file, start_at_end=False, chunk_size=ReadChunkSize):
+        self.log_file = log_file
+        self._chunk_size = chunk_size
+        self._fd = None
+        self._offset = 0
+        if start_at_end and self._reopen():
+            self._offset = os.fstat(self._fd).st_size
+
+    def _reopen(self):
+        self.close()
+        self._offset = 0
+        try:
+            self._fd = os.open(self.log_file, os.O_RDONLY)
+            return True
+        except OSError:
+            return False
+
+    def _open_current(self):
+        """
+        Make sure the file that is now at log_file is the one open, and return its size, or None if there's none.
+        """
+        try:
+            st = os.stat(self.log_file)
+        except OSError:
+            self.close()
+            return None
+        if self._fd is None or st.st_ino != os.fstat(self._fd).st_ino:
+            if not self._reopen():
+                return None
+        if st.st_size < self._offset:
+            self._offset = 0
+        return st.st_size
+
+    def read_new(self, max_size=None):
+        """
+        Read what was appended since the last read.
+        :param max_size: If given, only the last max_size bytes of the new content are read.
+        :return: The printable part of the new content, or '' if there's none.
+        """
+        size = self._open_current()
+        if size is None or size <= self._offset:
+            return ''
+        start = self._offset
+        if max_size is not None:
+            start = max(start, size - max_size)
+        os.lseek(self._fd, start, os.SEEK_SET)
+        buf = os.read(self._fd, size - start)
+        self._offset = start + len(buf)
+        return to_printable(buf)
+
+    def scan(self, signatures):
+        """
+        Search the complete lines appended since the last read for signatures, in large chunks, so that the
+        lines that don't contain any are never split or decoded. A last line not terminated yet is left for the
+        next scan.
+        :param signatures: Signatures object
+        :return: List of the lines containing a signature, decoded and without their line break.
+        """
+        matching_lines = []
+        if self._open_current() is None:
+            return matching_lines
+        os.lseek(self._fd, self._offset, os.SEEK_SET)
+        pending = b''
+        while True:
+            chunk = os.read(self._fd, self._chunk_size)
+            if not chunk:
+                break
+            buf = pending + chunk
+            end = buf.rfind(b'\n') + 1
+            line_end = 0
+            for match_start, match_end in signatures.find_all(buf, 0, end):
+                if match_start < line_end:
+                    continue  # Another signature in a line already found
+                line_start = buf.rfind(b'\n', 0, match_start) + 1
+                line_end = buf.find(b'\n', match_end) + 1
+                matching_lines.append(buf[line_start:line_end - 1].decode("utf-8", "replace"))
+            self._offset += end
+            pending = buf[end:]
+        return matching_lines
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
 
 
 def tail(log_file, output_size = OutputSize):
-    pos = min(output_size, os.path.getsize(log_file))
-    with open(log_file, "r") as log:
-        log.seek(0, os.SEEK_END)
-        log.seek(log.tell() - pos, os.SEEK_SET)
-        buf = log.read(output_size)
-        buf = filter(lambda x: x in string.printable, buf)
-
-        # encoding works different for between interpreter version, we are keeping separate implementation to ensure
-        # backward compatibility
-        if sys.version_info[0] == 3:
-            buf = ''.join(list(buf)).encode('ascii', 'ignore').decode("ascii", "ignore")
-        elif sys.version_info[0] == 2:
-            buf = buf.decode("ascii", "ignore")
-
-        return buf
+    scanner = LogFileScanner(log_file)
+    try:
+        return scanner.read_new(output_size)
+    finally:
+        scanner.close()
 
 
 def get_formatted_log(summary, stdout, stderr):
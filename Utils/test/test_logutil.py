@@ -14,6 +14,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
+import tempfile
 import unittest
 import LogUtil as lu
 
@@ -28,5 +31,62 @@ class TestLogUtil(unittest.TestCase):
         tail = lu.tail("/tmp/testtail")
         self.assertEquals("abcdefghijklmnopqrstuvwxyz", tail)
 
+        self.assertEquals("", lu.tail("/tmp/testtail_not_found"))
+
+
+class TestLogFileScanner(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.dir, "test.log")
+        self.pattern = lu.Signatures(["No space left", "Fatal error (buffer)"])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def append(self, content):
+        with open(self.log_file, "ab") as F:
+            F.write(content.encode("utf-8"))
+
+    def test_read_new(self):
+        self.append("old\n")
+        scanner = lu.LogFileScanner(self.log_file, start_at_end=True)
+        self.assertEquals("", scanner.read_new())
+        self.append("new\n")
+        self.assertEquals("new\n", scanner.read_new())
+        self.append("0123456789")
+        self.assertEquals("789", scanner.read_new(3))
+        self.assertEquals("", scanner.read_new())
+
+        # Recreated, then truncated
+        os.remove(self.log_file)
+        self.append("recreated\n")
+        self.assertEquals("recreated\n", scanner.read_new())
+        with open(self.log_file, "w") as F:
+            F.write("x\n")
+        self.assertEquals("x\n", scanner.read_new())
+        os.remove(self.log_file)
+        self.assertEquals("", scanner.read_new())
+        scanner.close()
+
+    def test_scan(self):
+        scanner = lu.LogFileScanner(self.log_file, chunk_size=16)
+        self.assertEquals([], scanner.scan(self.pattern))
+        self.append("2018-08-02 19:27:34 +0000 [info]: started\n"
+                    "2018-08-02 19:27:35 +0000 [error]: No space left, No space left\n"
+                    "2018-08-02 19:27:36 +0000 [warn]: Fatal error (buffer)")
+        self.assertEquals(["2018-08-02 19:27:35 +0000 [error]: No space left, No space left"],
+                          scanner.scan(self.pattern))
+        # The last line is scanned once it's complete
+        self.append(u" again\n\u6211 No space left\n")
+        self.assertEquals(["2018-08-02 19:27:36 +0000 [warn]: Fatal error (buffer) again",
+                           u"\u6211 No space left"],
+                          scanner.scan(self.pattern))
+        self.assertEquals([], scanner.scan(self.pattern))
+
+        with open(self.log_file, "w") as F:
+            F.write("No space left\n")
+        self.assertEquals(["No space left"], scanner.scan(self.pattern))
+        scanner.close()
+
 if __name__ == '__main__':
     unittest.main()
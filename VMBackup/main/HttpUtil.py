@@ -18,6 +18,9 @@
 
 import time
 import datetime
+import errno
+import socket
+import ssl
 import traceback
 try:
     import httplib as httplibs
@@ -26,31 +29,110 @@ except ImportError:
 import shlex
 import subprocess
 import sys
+import threading
 from common import CommonVariables
 from subprocess import *
 from Utils.WAAgentUtil import waagent
 import sys
 
+class HttpResponse(object):
+    """
+    response whose body has already been read, so that the connection it came
+    from can go back to the pool before the caller looks at the body.
+    """
+    def __init__(self, resp, body):
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.getheaders()
+        self.body = body
+
+    def getheaders(self):
+        return self.headers
+
+    def getheader(self, name, default = None):
+        for key, value in self.headers:
+            if key.lower() == name.lower():
+                return value
+        return default
+
+    def read(self):
+        body = self.body
+        self.body = b''
+        return body
+
+class HttpConnectionPool(object):
+    """
+    keep-alive connections per (scheme, host, port, proxy), shared by every
+    HttpUtil in the process so the TLS handshake to a storage host is done once.
+    """
+    max_idle_per_host = 16
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, key, factory):
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                self.reused = self.reused + 1
+                return connections.pop(), True
+            self.created = self.created + 1
+        return factory(), False
+
+    def release(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
 class HttpUtil(object):
     """description of class"""
+    connection_pool = HttpConnectionPool()
+    config_lock = threading.Lock()
+    config_resolved = False
+    proxy_config = (None, None)
+
     def __init__(self, hutil):
-        Config = None
-        self.proxyHost = None
-        self.proxyPort = None
-        try:
-            waagent.MyDistro = waagent.GetMyDistro()
-            Config = waagent.ConfigurationProvider(None)
-        except Exception as e:
-            errorMsg = "Failed to construct ConfigurationProvider, which may due to the old wala code with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
-            hutil.log(errorMsg)
-            Config = None
         self.logger = hutil
-        if Config != None:
-            self.proxyHost = Config.get("HttpProxy.Host")
-            self.proxyPort = Config.get("HttpProxy.Port")
+        self.proxyHost, self.proxyPort = HttpUtil.get_proxy_config(hutil)
 
         self.tmpFile = './tmp_file_FD76C85E-406F-4CFA-8EB0-CF18B123365C'
 
+    @staticmethod
+    def get_proxy_config(hutil):
+        # waagent configuration is only read once per process
+        with HttpUtil.config_lock:
+            if not HttpUtil.config_resolved:
+                Config = None
+                proxyHost = None
+                proxyPort = None
+                try:
+                    waagent.MyDistro = waagent.GetMyDistro()
+                    Config = waagent.ConfigurationProvider(None)
+                except Exception as e:
+                    errorMsg = "Failed to construct ConfigurationProvider, which may due to the old wala code with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
+                    hutil.log(errorMsg)
+                    Config = None
+                if Config != None:
+                    proxyHost = Config.get("HttpProxy.Host")
+                    proxyPort = Config.get("HttpProxy.Port")
+                HttpUtil.proxy_config = (proxyHost, proxyPort)
+                HttpUtil.config_resolved = True
+        return HttpUtil.proxy_config
+
     """
     snapshot also called this. so we should not write the file/read the file in this method.
     """
@@ -115,23 +197,24 @@ class HttpUtil(object):
 
             if(isHostCall or self.proxyHost == None or self.proxyPort != None):
                 if(isHostCall):
-                    connection = httplibs.HTTPConnection(sasuri_obj.hostname, timeout = 10) # making call with port 80 to make it http call
+                    key = ('http', sasuri_obj.hostname, sasuri_obj.port, None)
+                    factory = lambda: httplibs.HTTPConnection(sasuri_obj.hostname, sasuri_obj.port, timeout = 10) # making call with port 80 to make it http call
                 else:
-                    connection = httplibs.HTTPSConnection(sasuri_obj.hostname, timeout = 10)
+                    key = ('https', sasuri_obj.hostname, sasuri_obj.port, None)
+                    factory = lambda: httplibs.HTTPSConnection(sasuri_obj.hostname, sasuri_obj.port, timeout = 10)
                 self.logger.log("Details of sas uri object  hostname: " + str(sasuri_obj.hostname) + " path: " + str(sasuri_obj.path))
-                connection.request(method=method, url=(sasuri_obj.path + '?' + sasuri_obj.query), body=data, headers = headers)
-                resp = connection.getresponse()
-                if(responseBodyRequired):
-                    responeBody = resp.read().decode('utf-8-sig')
-                connection.close()
+                url = sasuri_obj.path + '?' + sasuri_obj.query
             else:
-                connection = httplibs.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
-                connection.set_tunnel(sasuri_obj.hostname, 443)
+                key = ('https', sasuri_obj.hostname, 443, (self.proxyHost, self.proxyPort))
+                def factory():
+                    connection = httplibs.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
+                    connection.set_tunnel(sasuri_obj.hostname, 443)
+                    return connection
                 # If proxy is used, full url is needed.
-                path = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
-                connection.request(method=method, url=(path), body=data, headers=headers)
-                resp = connection.getresponse()
-                connection.close()
+                url = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
+            resp = self.pooled_request(key, factory, method, url, data, headers)
+            if(responseBodyRequired):
+                responeBody = resp.read().decode('utf-8-sig')
             result = CommonVariables.success
         except Exception as e:
             errorMsg = str(datetime.datetime.now()) +  " Failed to call http with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
@@ -142,3 +225,58 @@ class HttpUtil(object):
             return result, resp, errorMsg, responeBody
         else:
             return result, resp, errorMsg
+
+    @staticmethod
+    def is_stale_connection_error(e, sent):
+        """
+        whether e is how a reused keep-alive connection fails when the server closed it while it
+        was idle: the request can not be written, or the connection is closed before any byte of
+        the response. the server has not processed the request then, so it is safe to send it again.
+        a timeout is never one of these, the server may still be working on the request.
+        """
+        if isinstance(e, socket.timeout):
+            return False
+        if not sent:
+            return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+        if isinstance(e, ssl.SSLError):
+            # the tls connection was closed instead of the status line, openssl 3 reports it with this message
+            return e.errno == ssl.SSL_ERROR_EOF or 'unexpected eof while reading' in str(e).lower().replace('_', ' ')
+        if not isinstance(e, httplibs.BadStatusLine):
+            return False
+        # python 3 raises RemoteDisconnected for an empty status line, python 2 a BadStatusLine with
+        # the repr of the empty line or this message
+        return isinstance(e, getattr(httplibs, 'RemoteDisconnected', ())) or e.line in ('', "''") or str(e.line).startswith('No status line received')
+
+    def pooled_request(self, key, factory, method, url, data, headers):
+        connection, reused = HttpUtil.connection_pool.acquire(key, factory)
+        sent = False
+        try:
+            connection.request(method=method, url=url, body=data, headers=headers)
+            sent = True
+            resp = connection.getresponse()
+        except (httplibs.HTTPException, socket.error) as e:
+            connection.close()
+            if not reused or not HttpUtil.is_stale_connection_error(e, sent):
+                raise
+            # the server closed the idle keep-alive connection, retry once on a new one
+            self.logger.log("pooled connection was closed by the server with error: " + str(e) + ", retrying on a new connection")
+            connection = factory()
+            try:
+                connection.request(method=method, url=url, body=data, headers=headers)
+                resp = connection.getresponse()
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+        try:
+            body = resp.read()
+        except Exception:
+            connection.close()
+            raise
+        if resp.will_close:
+            connection.close()
+        else:
+            HttpUtil.connection_pool.release(key, connection)
+        return HttpResponse(resp, body)
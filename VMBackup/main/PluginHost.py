@@ -7,7 +7,12 @@ try:
     import ConfigParser as ConfigParsers
 except ImportError:
     import configparser as ConfigParsers
-from common import CommonVariables
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from common import CommonVariables, monotonic_time
+from Utils import HandlerUtil
 from pwd import getpwuid
 from stat import *
 import traceback
@@ -31,12 +36,13 @@ import traceback
 
 
 class PluginHostError(object):
-    def __init__(self, errorCode, pluginName):
+    def __init__(self, errorCode, pluginName, timeInSeconds = None):
         self.errorCode = errorCode
         self.pluginName = pluginName
+        self.timeInSeconds = timeInSeconds
 
     def __str__(self):
-        return 'Plugin :- ', self.pluginName , ' ErrorCode :- ' + str(self.errorCode)
+        return 'Plugin :- ' + str(self.pluginName) + ' ErrorCode :- ' + str(self.errorCode) + ' Time :- ' + str(self.timeInSeconds)
 
 
 class PluginHostResult(object):
@@ -73,6 +79,8 @@ class PluginHost(object):
         self.postScriptCompleted = []
         self.postScriptResult = []
         self.pollTime = 3
+        # time left to a plugin past its timeout, for it to report its own timeout result
+        self.resultGraceInSeconds = 5
 
     def pre_check(self):
         self.logger.log('Loading script modules now...',True,'Info')
@@ -193,94 +201,84 @@ class PluginHost(object):
         return permissions
 
 
-    def pre_script(self):
-
-            # Runs pre_script() for all plugins and maintains a timer
+    def run_scripts(self, scriptName, scriptLabel, scriptCompleted, scriptResult, timeoutErrorCode):
 
+            # Runs pre_script() or post_script() of all plugins on a thread each, and waits for their
+            # completion. Each plugin has its own deadline (its timeout) within the global one.
 
         result = PluginHostResult()
-        curr = 0
-        for plugin in self.plugins:
-            t1 = threading.Thread(target=plugin.pre_script, args=(curr, self.preScriptCompleted, self.preScriptResult))
+        completions = queue.Queue()
+        startTime = monotonic_time()
+        globalDeadline = startTime + self.timeoutInSeconds + self.resultGraceInSeconds
+        deadlines = []
+        for curr in range(0, self.noOfPlugins):
+            plugin = self.plugins[curr]
+            pluginTimeout = min(getattr(plugin, 'timeoutInSeconds', self.timeoutInSeconds), self.timeoutInSeconds)
+            deadlines.append(startTime + pluginTimeout + self.resultGraceInSeconds)
+            t1 = threading.Thread(target=self.run_plugin_script, args=(getattr(plugin, scriptName), curr, scriptCompleted, scriptResult, completions))
+            t1.daemon = True
             t1.start()
-            curr = curr + 1
-
-        flag = True
-        for i in range(0, int(self.timeoutInSeconds/self.pollTime) + 2): #waiting 10 more seconds to escape race condition between Host and script timing out
-            time.sleep(self.pollTime)
-            flag = True
-            for j in range(0,self.noOfPlugins):
-                flag = flag & self.preScriptCompleted[j]
-            if flag:
-                break
 
+        timeInSeconds = [None] * self.noOfPlugins
+        pending = set(range(0, self.noOfPlugins))
+        while pending:
+            now = monotonic_time()
+            for j in list(pending):
+                if deadlines[j] <= now:
+                    self.logger.log(scriptLabel + ' of ' + self.pluginName[j] + ' did not complete in time.', True, 'Error')
+                    pending.remove(j)
+            if not pending or globalDeadline <= now:
+                break
+            try:
+                j = completions.get(timeout = min([deadlines[k] for k in pending] + [globalDeadline]) - now)
+            except queue.Empty:
+                continue
+            timeInSeconds[j] = monotonic_time() - startTime
+            pending.discard(j)
 
         continueBackup = True
-        #Plugin timed out
-        if not flag:
-            ecode = CommonVariables.FailedPrepostPluginhostPreTimeout
-            result.anyScriptFailed = True
-            presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
+        telemetry = []
+        for j in range(0,self.noOfPlugins):
+            ecode = timeoutErrorCode
+            if timeInSeconds[j] is not None and scriptCompleted[j]:
+                continueBackup = continueBackup & scriptResult[j].continueBackup
+                ecode = scriptResult[j].errorCode
+                self.logger.log(scriptLabel + ' of ' + self.pluginName[j] + ' took ' + str(round(timeInSeconds[j], 3)) + 's', True, 'Info')
+                telemetry.append(self.pluginName[j] + ':' + str(int(timeInSeconds[j] * 1000)))
+            if ecode != CommonVariables.PrePost_PluginStatus_Success:
+                result.anyScriptFailed = True
+            presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j], timeInSeconds = timeInSeconds[j])
             result.errors.append(presult)
-        else:
-            for j in range(0,self.noOfPlugins):
-                ecode = CommonVariables.FailedPrepostPluginhostPreTimeout
-                continueBackup = continueBackup & self.preScriptResult[j].continueBackup
-                if self.preScriptCompleted[j]:
-                    ecode = self.preScriptResult[j].errorCode
-                if ecode != CommonVariables.PrePost_PluginStatus_Success:
-                    result.anyScriptFailed = True
-                presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
-                result.errors.append(presult)
+        HandlerUtil.HandlerUtility.add_to_telemetery_data(scriptLabel + 'TimeInMs', ','.join(telemetry))
         result.continueBackup = continueBackup
-        self.logger.log('Finished prescript execution from PluginHost side. Continue Backup: '+str(continueBackup),True,'Info')
+        return result
+
+    def run_plugin_script(self, script, pluginIndex, scriptCompleted, scriptResult, completions):
+        try:
+            script(pluginIndex, scriptCompleted, scriptResult)
+        except Exception as err:
+            errMsg = 'Error in running the script of plugin ' + self.pluginName[pluginIndex] + ': %s, stack trace: %s' % (str(err), traceback.format_exc())
+            self.logger.log(errMsg, True, 'Error')
+        finally:
+            completions.put(pluginIndex)
+
+    def pre_script(self):
+
+            # Runs pre_script() for all plugins and maintains a timer
+
+        result = self.run_scripts('pre_script', 'Prescript', self.preScriptCompleted, self.preScriptResult, CommonVariables.FailedPrepostPluginhostPreTimeout)
+        self.logger.log('Finished prescript execution from PluginHost side. Continue Backup: '+str(result.continueBackup),True,'Info')
         return result
 
     def post_script(self):
 
             # Runs post_script() for all plugins and maintains a timer
 
-
         result = PluginHostResult()
         if not self.modulesLoaded:
             return result
 
         self.logger.log('Starting postscript for all modules.',True,'Info')
-        curr = 0
-        for plugin in self.plugins:
-            t1 = threading.Thread(target=plugin.post_script, args=(curr, self.postScriptCompleted, self.postScriptResult))
-            t1.start()
-            curr = curr + 1
-
-        flag = True
-        for i in range(0, int(self.timeoutInSeconds/self.pollTime) + 2): #waiting 10 more seconds to escape race condition between Host and script timing out
-            time.sleep(self.pollTime)
-            flag = True
-            for j in range(0,self.noOfPlugins):
-                flag = flag & self.postScriptCompleted[j]
-            if flag:
-                break
-
-        continueBackup = True
-
-        #Plugin timed out
-        if not flag:
-            ecode = CommonVariables.FailedPrepostPluginhostPostTimeout
-            result.anyScriptFailed = True
-            presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
-            result.errors.append(presult)
-        else:
-            for j in range(0,self.noOfPlugins):
-                ecode = CommonVariables.FailedPrepostPluginhostPostTimeout
-                continueBackup = continueBackup & self.postScriptResult[j].continueBackup
-                if self.postScriptCompleted[j]:
-                    ecode = self.postScriptResult[j].errorCode
-                if ecode != CommonVariables.PrePost_PluginStatus_Success:
-                    result.anyScriptFailed = True
-                presult = PluginHostError(errorCode = ecode, pluginName = self.pluginName[j])
-                result.errors.append(presult)
-        result.continueBackup = continueBackup
-        self.logger.log('Finished postscript execution from PluginHost side. Continue Backup: '+str(continueBackup),True,'Info')
+        result = self.run_scripts('post_script', 'Postscript', self.postScriptCompleted, self.postScriptResult, CommonVariables.FailedPrepostPluginhostPostTimeout)
+        self.logger.log('Finished postscript execution from PluginHost side. Continue Backup: '+str(result.continueBackup),True,'Info')
         return result
-
-
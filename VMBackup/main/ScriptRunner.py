@@ -2,9 +2,12 @@ import json
 import subprocess
 import time
 import os
+import select
+import errno
+import threading
 from pwd import getpwuid
 from stat import *
-from common import CommonVariables
+from common import CommonVariables, monotonic_time
 import traceback
 from Utils import HandlerUtil
 
@@ -36,6 +39,46 @@ from Utils import HandlerUtil
     # errorcode = process return code, means bash script encountered some other error, like 127 for script not found
 
 
+def wait_for_exit(process, timeout):
+    """
+        Waits for process to exit, for at most timeout seconds. A reaper thread waits for the
+        process and writes to a pipe, which is selected on, so the exit is noticed right away.
+        Returns the return code of the process, or None if it is still running.
+    """
+    read_fd, write_fd = os.pipe()
+
+    def reap():
+        try:
+            process.wait()
+            os.write(write_fd, b'x')
+        except OSError:
+            pass  # the waiter timed out and closed its end
+        finally:
+            os.close(write_fd)
+
+    reaper = threading.Thread(target=reap)
+    reaper.daemon = True
+    reaper.start()
+    end_time = monotonic_time() + timeout
+    try:
+        while True:
+            remaining = end_time - monotonic_time()
+            if remaining <= 0:
+                return None
+            try:
+                readable = select.select([read_fd], [], [], remaining)[0]
+            except (select.error, OSError) as err:
+                # interrupted by a signal, e.g. SIGCHLD of the freeze binary, on python 2
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+            if readable:
+                reaper.join()
+                return process.returncode
+    finally:
+        os.close(read_fd)
+
+
 class ScriptRunnerResult(object):
     def __init__(self):
         self.errorCode = None
@@ -44,6 +87,7 @@ class ScriptRunnerResult(object):
         self.requiredNoOfRetries = 0
         self.fileCode = []
         self.filePath = []
+        self.timeInSeconds = 0
 
     def __str__(self):
         errorStr =  'ErrorCode :- ' + str(self.errorCode) + '\n'
@@ -190,6 +234,40 @@ class ScriptRunner(object):
 
         return errorCode,dobackup,self.fsFreeze_on, self.pollSleepTime
 
+    def run_script(self, scriptName, scriptLocation, scriptParams, noOfRetries):
+
+            # Runs the script with sh, and runs it again up to noOfRetries times while it fails,
+            # all within timeoutInSeconds.
+            # Returns the return code of the last run (None if it timed out), the number of retries done
+            # and the time taken in seconds.
+
+        paramsStr = ['sh',str(scriptLocation)]
+        for param in scriptParams:
+            paramsStr.append(str(param))
+
+        startTime = monotonic_time()
+        endTime = startTime + self.timeoutInSeconds
+        cnt = 0
+        devnull = open(os.devnull, 'w')
+        try:
+            while True:
+                self.logger.log('Running '+scriptName+' for '+self.pluginName+' module...',True,'Info')
+                # the output is not read, so it must not go to a pipe that the script could fill up and block on
+                process = subprocess.Popen(paramsStr, stdout=devnull, stderr=devnull, close_fds=True)
+                returnCode = wait_for_exit(process, endTime - monotonic_time())
+                if returnCode is None:
+                    self.logger.log(scriptName.capitalize()+' for '+self.pluginName+' timed out.',True,'Error')
+                    break
+                if returnCode == CommonVariables.PrePost_ScriptStatus_Success:
+                    break
+                if cnt >= noOfRetries:
+                    break
+                self.logger.log(scriptName.capitalize()+' for '+self.pluginName+' failed. Retrying...',True,'Info')
+                cnt = cnt + 1
+        finally:
+            devnull.close()
+        return returnCode, cnt, monotonic_time() - startTime
+
     def pre_script(self, pluginIndex, preScriptCompleted, preScriptResult):
 
             # Generates a system call to run the prescript
@@ -201,37 +279,10 @@ class ScriptRunner(object):
         result = ScriptRunnerResult()
         result.requiredNoOfRetries = self.preScriptNoOfRetries
 
-        paramsStr = ['sh',str(self.preScriptLocation)]
-        for param in self.preScriptParams:
-            paramsStr.append(str(param))
-
-        self.logger.log('Running prescript for '+self.pluginName+' module...',True,'Info')
-        process = subprocess.Popen(paramsStr, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        returnCode, result.noOfRetries, result.timeInSeconds = self.run_script('prescript', self.preScriptLocation, self.preScriptParams, self.preScriptNoOfRetries)
 
-        flag_timeout = False
-        curr = 0
-        cnt = 0
-        while True:
-            while process.poll() is None:
-                if curr >= self.pollTotalCount:
-                    self.logger.log('Prescript for '+self.pluginName+' timed out.',True,'Error')
-                    flag_timeout = True
-                    break
-                curr = curr + 1
-                time.sleep(self.pollSleepTime)
-            if process.returncode is CommonVariables.PrePost_ScriptStatus_Success:
-                break
-            if flag_timeout:
-                break
-            if cnt >= self.preScriptNoOfRetries:
-                break
-            self.logger.log('Prescript for '+self.pluginName+' failed. Retrying...',True,'Info')
-            cnt = cnt + 1
-
-
-        result.noOfRetries = cnt
-        if not flag_timeout:
-            result.errorCode = process.returncode
+        if returnCode is not None:
+            result.errorCode = returnCode
             if result.errorCode != CommonVariables.PrePost_ScriptStatus_Success:
                 self.logger.log('Prescript for '+self.pluginName+' failed with error code: '+str(result.errorCode)+' .',True,'Error')
                 result.continueBackup = self.continueBackupOnFailure
@@ -256,36 +307,10 @@ class ScriptRunner(object):
 
         result.requiredNoOfRetries = self.postScriptNoOfRetries
 
-        paramsStr = ['sh',str(self.postScriptLocation)]
-        for param in self.postScriptParams:
-            paramsStr.append(str(param))
-
-        self.logger.log('Running postscript for '+self.pluginName+' module...',True,'Info')
-        process = subprocess.Popen(paramsStr, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        returnCode, result.noOfRetries, result.timeInSeconds = self.run_script('postscript', self.postScriptLocation, self.postScriptParams, self.postScriptNoOfRetries)
 
-        flag_timeout = False
-        curr = 0
-        cnt = 0
-        while True:
-            while process.poll() is None:
-                if curr >= self.pollTotalCount:
-                    self.logger.log('Postscript for '+self.pluginName+' timed out.',True,'Error')
-                    flag_timeout = True
-                    break
-                curr = curr + 1
-                time.sleep(self.pollSleepTime)
-            if process.returncode is CommonVariables.PrePost_ScriptStatus_Success:
-                break
-            if flag_timeout:
-                break
-            if cnt >= self.postScriptNoOfRetries:
-                break
-            self.logger.log('Postscript for '+self.pluginName+' failed. Retrying...',True,'Info')
-            cnt = cnt + 1
-
-        result.noOfRetries = cnt
-        if not flag_timeout:
-            result.errorCode = process.returncode
+        if returnCode is not None:
+            result.errorCode = returnCode
             if result.errorCode != CommonVariables.PrePost_ScriptStatus_Success:
                 self.logger.log('Postscript for '+self.pluginName+' failed with error code: '+str(result.errorCode)+' .',True,'Error')
                 result.errorCode = CommonVariables.FailedPrepostPostScriptFailed
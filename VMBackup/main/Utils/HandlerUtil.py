@@ -74,6 +74,7 @@ import platform
 import subprocess
 import datetime
 import Utils.Status
+from Utils.LogBuffer import LogRingBuffer
 from MachineIdentity import MachineIdentity
 import ExtensionErrorCodeHelper
 import traceback
@@ -86,7 +87,73 @@ class HandlerContext:
         self._version = '0.0'
         return
 
+class ConfigFileCache(object):
+    """
+    parsed view of /etc/azure/vmbackup.conf. the file is only parsed again
+    when its mtime, inode or size changes, so looking up a value costs one
+    stat instead of an open and a parse.
+    """
+    def __init__(self, configfile):
+        self.configfile = configfile
+        self.signature = None
+        self.config = None
+
+    def get_config(self):
+        try:
+            stat = os.stat(self.configfile)
+        except OSError:
+            self.signature = None
+            self.config = None
+            return None
+        signature = (stat.st_mtime, stat.st_ino, stat.st_size)
+        if signature != self.signature:
+            config = ConfigParsers.ConfigParser()
+            config.read(self.configfile)
+            self.config = config
+            self.signature = signature
+        return self.config
+
+    def get_value(self, section, key):
+        config = self.get_config()
+        if config is not None and config.has_option(section, key):
+            return config.get(section, key)
+        return None
+
+    def set_value(self, section, key, value):
+        if not os.path.exists(os.path.dirname(self.configfile)):
+            os.makedirs(os.path.dirname(self.configfile))
+        config = ConfigParsers.RawConfigParser()
+        if os.path.exists(self.configfile):
+            config.read(self.configfile)
+        if config.has_section(section):
+            if config.has_option(section, key):
+                config.remove_option(section, key)
+        else:
+            config.add_section(section)
+        config.set(section, key, value)
+        # write to a temporary file and rename it over the config so that readers never see a partial file
+        mode = 0o644
+        if os.path.exists(self.configfile):
+            mode = os.stat(self.configfile).st_mode & 0o777
+        fd, temp_file = tempfile.mkstemp(dir = os.path.dirname(self.configfile), prefix = '.vmbackup.conf.')
+        try:
+            with os.fdopen(fd, 'w') as config_file:
+                config.write(config_file)
+            os.chmod(temp_file, mode)
+            os.rename(temp_file, self.configfile)
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        finally:
+            self.invalidate()
+
+    def invalidate(self):
+        self.signature = None
+        self.config = None
+
 class HandlerUtility:
+    config_cache = ConfigFileCache('/etc/azure/vmbackup.conf')
     telemetry_data = {} 
     serializable_telemetry_data = []
     ExtErrorCode = ExtensionErrorCodeHelper.ExtensionErrorCodeEnum.success
@@ -95,7 +162,7 @@ class HandlerUtility:
     def __init__(self, log, error, short_name):
         self._log = log
         self._error = error
-        self.log_message = ""
+        self.log_message = LogRingBuffer()
         self._short_name = short_name
         self.patching = None
         self.storageDetailsObj = None
@@ -164,7 +231,7 @@ class HandlerUtility:
             else:
                 self._log(self._get_log_prefix() + message)
             message = "{0}  {1}  {2} \n".format(str(datetime.datetime.now()) , level , message)
-        self.log_message = self.log_message + message
+        self.log_message.append(message)
 
     def log_py3(self, msg):
         if type(msg) is not str:
@@ -180,7 +247,7 @@ class HandlerUtility:
         self._error(self._get_log_prefix() + message)
 
     def fetch_log_message(self):
-        return self.log_message
+        return self.log_message.getvalue()
 
     def _parse_config(self, ctxt):
         config = None
@@ -319,39 +386,18 @@ class HandlerUtility:
     seqsnapshot valid values(0-> parallel snapshot, 1-> programatically set sequential snapshot , 2-> customer set it for sequential snapshot)
     '''
     def get_value_from_configfile(self, key):
-        global backup_logger
         value = None
-        configfile = '/etc/azure/vmbackup.conf'
         try :
-            if os.path.exists(configfile):
-                config = ConfigParsers.ConfigParser()
-                config.read(configfile)
-                if config.has_option('SnapshotThread',key):
-                    value = config.get('SnapshotThread',key)
+            value = HandlerUtility.config_cache.get_value('SnapshotThread', key)
         except Exception as e:
             pass
 
         return value
  
     def set_value_to_configfile(self, key, value):
-        configfile = '/etc/azure/vmbackup.conf'
         try :
             self.log('setting ' + str(key)  + 'in config file to ' + str(value) , 'Info')
-            if not os.path.exists(os.path.dirname(configfile)):
-                os.makedirs(os.path.dirname(configfile))
-            config = ConfigParsers.RawConfigParser()
-            if os.path.exists(configfile):
-                config.read(configfile)
-                if config.has_section('SnapshotThread'):
-                    if config.has_option('SnapshotThread', key):
-                        config.remove_option('SnapshotThread', key)
-                else:
-                    config.add_section('SnapshotThread')
-            else:
-                config.add_section('SnapshotThread')
-            config.set('SnapshotThread', key, value)
-            with open(configfile, 'w') as config_file:
-                config.write(config_file)
+            HandlerUtility.config_cache.set_value('SnapshotThread', key, value)
         except Exception as e:
             errorMsg = " Unable to set config file.key is "+ key +"with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.log(errorMsg, 'Warning')
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+
+PAGE_SIZE_BYTES = 512
+STATUS_BLOB_LIMIT_BYTES = 10485760 # 10 MB
+
+class LogRingBuffer(object):
+    """
+    append only log buffer with a fixed byte budget. once the budget is
+    exceeded the oldest messages are dropped, so logging during the freeze
+    can not grow without bound.
+    """
+    def __init__(self, budget_bytes = STATUS_BLOB_LIMIT_BYTES):
+        self.budget_bytes = budget_bytes
+        self.chunks = deque()
+        self.size = 0
+        self.dropped_bytes = 0
+
+    def append(self, msg):
+        if msg is None or len(msg) == 0:
+            return
+        if len(msg) > self.budget_bytes:
+            self.dropped_bytes = self.dropped_bytes + len(msg) - self.budget_bytes
+            msg = msg[len(msg) - self.budget_bytes:]
+        self.chunks.append(msg)
+        self.size = self.size + len(msg)
+        while self.size > self.budget_bytes:
+            oldest = self.chunks.popleft()
+            self.size = self.size - len(oldest)
+            self.dropped_bytes = self.dropped_bytes + len(oldest)
+
+    def __len__(self):
+        return self.size
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+    def clear(self):
+        self.chunks.clear()
+        self.size = 0
+
+    def __str__(self):
+        return self.getvalue()
+
+def pad_to_page_size(msg):
+    if (len(msg) % PAGE_SIZE_BYTES) != 0:
+        msg = msg.ljust(len(msg) + (PAGE_SIZE_BYTES - (len(msg) % PAGE_SIZE_BYTES)))
+    return msg
@@ -10,6 +10,8 @@ from Utils.DiskUtil import DiskUtil
 import Utils.HandlerUtil
 import traceback
 import subprocess
+import re
+import threading
 
 class SizeCalculation(object):
 
@@ -18,6 +20,9 @@ class SizeCalculation(object):
         self.logger=logger
         self.file_systems_info = []
         self.non_physical_file_systems = ['fuse', 'nfs', 'cifs', 'overlay', 'aufs', 'lustre', 'secfs2', 'zfs', 'btrfs', 'iso']
+        self.pseudo_file_systems = ['proc', 'sysfs', 'cgroup', 'cgroup2', 'devpts', 'securityfs', 'pstore', 'debugfs', 'tracefs', 'mqueue', 'hugetlbfs', 'configfs', 'bpf', 'autofs', 'binfmt_misc', 'fusectl', 'efivarfs', 'rpc_pipefs', 'nsfs', 'selinuxfs']
+        self.mountinfo_path = '/proc/self/mountinfo'
+        self.statvfs_timeout = 5
         self.known_fs = ['ext3', 'ext4', 'jfs', 'xfs', 'reiserfs', 'devtmpfs', 'tmpfs', 'rootfs', 'fuse', 'nfs', 'cifs', 'overlay', 'aufs', 'lustre', 'secfs2', 'zfs', 'btrfs', 'iso']
 
     def get_loop_devices(self):
@@ -36,148 +41,264 @@ class SizeCalculation(object):
     def get_total_used_size(self):
         try:
             size_calc_failed = False
-            df = subprocess.Popen(["df" , "-k"], stdout=subprocess.PIPE)
-            '''
-            Sample output of the df command
-
-            Filesystem                                              Type     1K-blocks    Used    Avail Use% Mounted on
-            /dev/sda2                                               xfs       52155392 3487652 48667740   7% /
-            devtmpfs                                                devtmpfs   7170976       0  7170976   0% /dev
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /dev/shm
-            tmpfs                                                   tmpfs      7180624  760496  6420128  11% /run
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /sys/fs/cgroup
-            /dev/sda1                                               ext4        245679  151545    76931  67% /boot
-            /dev/sdb1                                               ext4      28767204 2142240 25140628   8% /mnt/resource
-            /dev/mapper/mygroup-thinv1                              xfs        1041644   33520  1008124   4% /bricks/brick1
-            /dev/mapper/mygroup-85197c258a54493da7880206251f5e37_0  xfs        1041644   33520  1008124   4% /run/gluster/snaps/85197c258a54493da7880206251f5e37/brick2
-            /dev/mapper/mygroup2-thinv2                             xfs       15717376 5276944 10440432  34% /tmp/test
-            /dev/mapper/mygroup2-63a858543baf4e40a3480a38a2f232a0_0 xfs       15717376 5276944 10440432  34% /run/gluster/snaps/63a858543baf4e40a3480a38a2f232a0/brick2
-            tmpfs                                                   tmpfs      1436128       0  1436128   0% /run/user/1000
-            //Centos72test/cifs_test                                cifs      52155392 4884620 47270772  10% /mnt/cifs_test2
-
-            '''
-            output = ""
-            process_wait_time = 300
-            while(df is not None and process_wait_time >0 and df.poll() is None):
-                time.sleep(1)
-                process_wait_time -= 1
-            self.logger.log("df command executed for process wait time value" + str(process_wait_time), True)
-            if(df is not None and df.poll() is not None):
-                self.logger.log("df return code"+str(df.returncode), True)
-                output = df.stdout.read()
-            if sys.version_info > (3,):
-                output = str(output, encoding='utf-8', errors="backslashreplace")
+            rows = self.get_used_size_rows_from_mountinfo()
+            if rows is None:
+                self.logger.log("falling back to df for the used size calculation", True)
+                rows, size_calc_failed = self.get_used_size_rows_from_df()
+                disk_loop_devices_file_systems = self.get_loop_devices()
+                self.logger.log("outside loop device", True)
             else:
-                output = str(output)
-            output = output.strip().split("\n")
-            disk_loop_devices_file_systems = self.get_loop_devices()
-            self.logger.log("outside loop device", True)
-            total_used = 0
-            total_used_network_shares = 0
-            total_used_gluster = 0
-            total_used_loop_device=0
-            total_used_temporary_disks = 0 
-            total_used_ram_disks = 0
-            total_used_unknown_fs = 0
-            network_fs_types = []
-            unknown_fs_types = []
-      
-            if len(self.file_systems_info) == 0 :
-                self.file_systems_info = disk_util.get_mount_file_systems()
-
-            output_length = len(output)
-            index = 1
-            while index < output_length:
-                if(len(output[index].split()) < 6 ): #when a row is divided in 2 lines
-                    index = index+1
-                    if(index < output_length and len(output[index-1].split()) + len(output[index].split()) == 6):
-                        output[index] = output[index-1] + output[index]
-                    else:
-                        self.logger.log("Output of df command is not in desired format",True)
-                        total_used = 0
-                        size_calc_failed = True
-                        break
-                device, size, used, available, percent, mountpoint = output[index].split()
-                fstype = ''
-                isNetworkFs = False
-                isKnownFs = False
-
-
-                for file_system_info in self.file_systems_info:
-                    if device == file_system_info[0] and mountpoint == file_system_info[2]:
-                        fstype = file_system_info[1]
-                self.logger.log("Device name : {0} fstype : {1} size : {2} used space in KB : {3} available space : {4} mountpoint : {5}".format(device,fstype,size,used,available,mountpoint),True)
-
-                for nonPhysicaFsType in self.non_physical_file_systems:
-                    if nonPhysicaFsType in fstype.lower():
-                        isNetworkFs = True
-                        break
-
-                for knownFs in self.known_fs:
-                    if knownFs in fstype.lower():
-                        isKnownFs = True
-                        break
+                disk_loop_devices_file_systems = [row[0] for row in rows if 'loop' in row[0]]
+            if size_calc_failed:
+                return 0, size_calc_failed
+            total_used = self.sum_used_size(rows, disk_loop_devices_file_systems)
+            return total_used * 1024, size_calc_failed #Converting into Bytes
+        except Exception as e:
+            errMsg = 'Unable to fetch total used space with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
+            self.logger.log(errMsg,True)
+            size_calc_failed = True
+            return 0,size_calc_failed
 
-                if not (isKnownFs or fstype == '' or fstype == None):
-                    unknown_fs_types.append(fstype)
+    def unescape_mountinfo_field(self, field):
+        # mountinfo escapes space, tab, newline and backslash as octal
+        if '\\' not in field:
+            return field
+        return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), field)
 
-                if isNetworkFs :
-                    if fstype not in network_fs_types :
-                        network_fs_types.append(fstype)
-                    self.logger.log("Not Adding network-drive, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
-                    total_used_network_shares = total_used_network_shares + int(used)
+    def get_mountinfo_entries(self):
+        """
+        parses /proc/self/mountinfo once, returns a list of
+        (major:minor, root, mount point, fstype, source) in mount order
+        """
+        entries = []
+        with open(self.mountinfo_path, 'r') as mountinfo:
+            for line in mountinfo:
+                fields = line.split()
+                if '-' not in fields:
+                    continue
+                separator = fields.index('-')
+                if separator < 6 or len(fields) < separator + 3:
+                    continue
+                entries.append((fields[2], self.unescape_mountinfo_field(fields[3]), self.unescape_mountinfo_field(fields[4]), fields[separator + 1], self.unescape_mountinfo_field(fields[separator + 2])))
+        return entries
 
-                elif device == '/dev/sdb1' :
-                    self.logger.log("Not Adding temporary disk, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
-                    total_used_temporary_disks = total_used_temporary_disks + int(used)
+    def statvfs_with_timeout(self, mount_point, timeout):
+        result = {}
+        def statvfs():
+            try:
+                result['stat'] = os.statvfs(mount_point)
+            except Exception as e:
+                result['error'] = e
+        statvfs_thread = threading.Thread(target = statvfs)
+        statvfs_thread.daemon = True
+        statvfs_thread.start()
+        statvfs_thread.join(timeout)
+        if statvfs_thread.is_alive():
+            raise Exception("statvfs timed out after " + str(timeout) + " seconds")
+        if 'error' in result:
+            raise result['error']
+        return result['stat']
 
-                elif "tmpfs" in fstype.lower() or "devtmpfs" in fstype.lower() or "ramdiskfs" in fstype.lower() or "rootfs" in fstype.lower():
-                    self.logger.log("Not Adding RAM disks, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
-                    total_used_ram_disks = total_used_ram_disks + int(used)
+    def get_used_size_rows_from_mountinfo(self):
+        """
+        returns the df like rows (device, fstype, size, used, available, mountpoint) in KB
+        using /proc/self/mountinfo and statvfs, or None when mountinfo can not be read
+        """
+        try:
+            entries = self.get_mountinfo_entries()
+        except Exception as e:
+            errMsg = 'Unable to read {0} with error: {1}, stack trace: {2}'.format(self.mountinfo_path, str(e), traceback.format_exc())
+            self.logger.log(errMsg, True, 'Warning')
+            return None
+        self.logger.log("mountinfo entries : " + str(len(entries)), True)
+        # only the last mount on a mount point is visible
+        visible_entries = {}
+        for entry in entries:
+            visible_entries[entry[2]] = entry
+        # like df, a file system mounted more than once is only counted at its shortest mount point
+        entries_by_device = {}
+        for entry in entries:
+            devno, root, mount_point, fstype, source = entry
+            if fstype in self.pseudo_file_systems or visible_entries[mount_point] is not entry:
+                continue
+            existing = entries_by_device.get(devno)
+            if existing is None or len(mount_point) < len(existing[2]):
+                entries_by_device[devno] = entry
+        self.file_systems_info = [(entry[4], entry[3], entry[2]) for entry in entries if entries_by_device.get(entry[0]) is entry]
+        rows = []
+        timed_out_mounts = []
+        for entry in entries:
+            devno, root, mount_point, fstype, source = entry
+            if entries_by_device.get(devno) is not entry:
+                continue
+            try:
+                if self.is_local_file_system(fstype):
+                    stat = os.statvfs(mount_point)
+                else:
+                    # a hung network mount must not block the size calculation
+                    stat = self.statvfs_with_timeout(mount_point, self.statvfs_timeout)
+            except Exception as e:
+                self.logger.log("Unable to statvfs mount point {0} : {1}".format(mount_point, str(e)), True, 'Warning')
+                if 'timed out' in str(e):
+                    timed_out_mounts.append(mount_point)
+                continue
+            if stat.f_blocks == 0:
+                continue
+            size = stat.f_blocks * stat.f_frsize // 1024
+            used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize // 1024
+            available = stat.f_bavail * stat.f_frsize // 1024
+            rows.append((source, fstype, size, used, available, mount_point))
+        if len(timed_out_mounts) != 0:
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("statvfsTimedOutMounts", str(timed_out_mounts))
+        return rows
+
+    def is_local_file_system(self, fstype):
+        fstype = fstype.lower()
+        for nonPhysicaFsType in self.non_physical_file_systems:
+            if nonPhysicaFsType in fstype:
+                return False
+        for knownFs in self.known_fs:
+            if knownFs in fstype:
+                return True
+        return False
 
-                elif 'loop' in device and device not in disk_loop_devices_file_systems:
-                    self.logger.log("Not Adding Loop Device , Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
-                    total_used_loop_device = total_used_loop_device + int(used)
+    def get_used_size_rows_from_df(self):
+        size_calc_failed = False
+        rows = []
+        df = subprocess.Popen(["df" , "-k"], stdout=subprocess.PIPE)
+        '''
+        Sample output of the df command
 
-                elif (mountpoint.startswith('/run/gluster/snaps/')):
-                    self.logger.log("Not Adding Gluster Device , Device name : {0} used space in KB : {1} mount point : {2}".format(device,used,mountpoint),True)
-                    total_used_gluster = total_used_gluster + int(used)
+        Filesystem                                              Type     1K-blocks    Used    Avail Use% Mounted on
+        /dev/sda2                                               xfs       52155392 3487652 48667740   7% /
+        devtmpfs                                                devtmpfs   7170976       0  7170976   0% /dev
+        tmpfs                                                   tmpfs      7180624       0  7180624   0% /dev/shm
+        tmpfs                                                   tmpfs      7180624  760496  6420128  11% /run
+        tmpfs                                                   tmpfs      7180624       0  7180624   0% /sys/fs/cgroup
+        /dev/sda1                                               ext4        245679  151545    76931  67% /boot
+        /dev/sdb1                                               ext4      28767204 2142240 25140628   8% /mnt/resource
+        /dev/mapper/mygroup-thinv1                              xfs        1041644   33520  1008124   4% /bricks/brick1
+        /dev/mapper/mygroup-85197c258a54493da7880206251f5e37_0  xfs        1041644   33520  1008124   4% /run/gluster/snaps/85197c258a54493da7880206251f5e37/brick2
+        /dev/mapper/mygroup2-thinv2                             xfs       15717376 5276944 10440432  34% /tmp/test
+        /dev/mapper/mygroup2-63a858543baf4e40a3480a38a2f232a0_0 xfs       15717376 5276944 10440432  34% /run/gluster/snaps/63a858543baf4e40a3480a38a2f232a0/brick2
+        tmpfs                                                   tmpfs      1436128       0  1436128   0% /run/user/1000
+        //Centos72test/cifs_test                                cifs      52155392 4884620 47270772  10% /mnt/cifs_test2
 
-                elif device.startswith( '\\\\' ) or device.startswith( '//' ):
-                    self.logger.log("Not Adding network-drive as it starts with slahes, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
-                    total_used_network_shares = total_used_network_shares + int(used)
+        '''
+        output = ""
+        process_wait_time = 300
+        while(df is not None and process_wait_time >0 and df.poll() is None):
+            time.sleep(1)
+            process_wait_time -= 1
+        self.logger.log("df command executed for process wait time value" + str(process_wait_time), True)
+        if(df is not None and df.poll() is not None):
+            self.logger.log("df return code"+str(df.returncode), True)
+            output = df.stdout.read()
+        if sys.version_info > (3,):
+            output = str(output, encoding='utf-8', errors="backslashreplace")
+        else:
+            output = str(output)
+        output = output.strip().split("\n")
+
+        if len(self.file_systems_info) == 0 :
+            self.file_systems_info = DiskUtil(patching = self.patching,logger = self.logger).get_mount_file_systems()
+        fstypes = {}
+        for file_system_info in self.file_systems_info:
+            fstypes[(file_system_info[0], file_system_info[2])] = file_system_info[1]
 
+        output_length = len(output)
+        index = 1
+        while index < output_length:
+            if(len(output[index].split()) < 6 ): #when a row is divided in 2 lines
+                index = index+1
+                if(index < output_length and len(output[index-1].split()) + len(output[index].split()) == 6):
+                    output[index] = output[index-1] + output[index]
                 else:
-                    self.logger.log("Adding Device name : {0} used space in KB : {1} mount point : {2} fstype : {3}".format(device,used,mountpoint,fstype),True)
-                    total_used = total_used + int(used) #return in KB
-                    if not (isKnownFs or fstype == '' or fstype == None):
-                        total_used_unknown_fs = total_used_unknown_fs + int(used)
-
-                index = index + 1
-
-            if not len(unknown_fs_types) == 0:
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("unknownFSTypeInDf",str(unknown_fs_types))
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("totalUsedunknownFS",str(total_used_unknown_fs))
-                self.logger.log("Total used space in Bytes of unknown FSTypes : {0}".format(total_used_unknown_fs * 1024),True)
-
-            if not len(network_fs_types) == 0:
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("networkFSTypeInDf",str(network_fs_types))
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("totalUsedNetworkShare",str(total_used_network_shares))
-                self.logger.log("Total used space in Bytes of network shares : {0}".format(total_used_network_shares * 1024),True)
-            if total_used_gluster !=0 :
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("glusterFSSize",str(total_used_gluster))
-            if total_used_temporary_disks !=0:
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("tempDisksSize",str(total_used_temporary_disks))
-            if total_used_ram_disks != 0:
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("ramDisksSize",str(total_used_ram_disks))
-            if total_used_loop_device != 0 :
-                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("loopDevicesSize",str(total_used_loop_device))
-            self.logger.log("Total used space in Bytes : {0}".format(total_used * 1024),True)
-            return total_used * 1024, size_calc_failed #Converting into Bytes
-        except Exception as e:
-            errMsg = 'Unable to fetch total used space with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
-            self.logger.log(errMsg,True)
-            size_calc_failed = True
-            return 0,size_calc_failed
+                    self.logger.log("Output of df command is not in desired format",True)
+                    size_calc_failed = True
+                    break
+            device, size, used, available, percent, mountpoint = output[index].split()
+            rows.append((device, fstypes.get((device, mountpoint), ''), size, used, available, mountpoint))
+            index = index + 1
+        return rows, size_calc_failed
+
+    def sum_used_size(self, rows, disk_loop_devices_file_systems):
+        total_used = 0
+        total_used_network_shares = 0
+        total_used_gluster = 0
+        total_used_loop_device=0
+        total_used_temporary_disks = 0 
+        total_used_ram_disks = 0
+        total_used_unknown_fs = 0
+        network_fs_types = []
+        unknown_fs_types = []
+
+        for device, fstype, size, used, available, mountpoint in rows:
+            isNetworkFs = False
+            isKnownFs = False
+            self.logger.log("Device name : {0} fstype : {1} size : {2} used space in KB : {3} available space : {4} mountpoint : {5}".format(device,fstype,size,used,available,mountpoint),True)
+
+            for nonPhysicaFsType in self.non_physical_file_systems:
+                if nonPhysicaFsType in fstype.lower():
+                    isNetworkFs = True
+                    break
+
+            for knownFs in self.known_fs:
+                if knownFs in fstype.lower():
+                    isKnownFs = True
+                    break
+
+            if not (isKnownFs or fstype == '' or fstype == None):
+                unknown_fs_types.append(fstype)
+
+            if isNetworkFs :
+                if fstype not in network_fs_types :
+                    network_fs_types.append(fstype)
+                self.logger.log("Not Adding network-drive, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
+                total_used_network_shares = total_used_network_shares + int(used)
+
+            elif device == '/dev/sdb1' :
+                self.logger.log("Not Adding temporary disk, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
+                total_used_temporary_disks = total_used_temporary_disks + int(used)
+
+            elif "tmpfs" in fstype.lower() or "devtmpfs" in fstype.lower() or "ramdiskfs" in fstype.lower() or "rootfs" in fstype.lower():
+                self.logger.log("Not Adding RAM disks, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
+                total_used_ram_disks = total_used_ram_disks + int(used)
+
+            elif 'loop' in device and device not in disk_loop_devices_file_systems:
+                self.logger.log("Not Adding Loop Device , Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
+                total_used_loop_device = total_used_loop_device + int(used)
+
+            elif (mountpoint.startswith('/run/gluster/snaps/')):
+                self.logger.log("Not Adding Gluster Device , Device name : {0} used space in KB : {1} mount point : {2}".format(device,used,mountpoint),True)
+                total_used_gluster = total_used_gluster + int(used)
+
+            elif device.startswith( '\\\\' ) or device.startswith( '//' ):
+                self.logger.log("Not Adding network-drive as it starts with slahes, Device name : {0} used space in KB : {1} fstype : {2}".format(device,used,fstype),True)
+                total_used_network_shares = total_used_network_shares + int(used)
+
+            else:
+                self.logger.log("Adding Device name : {0} used space in KB : {1} mount point : {2} fstype : {3}".format(device,used,mountpoint,fstype),True)
+                total_used = total_used + int(used) #return in KB
+                if not (isKnownFs or fstype == '' or fstype == None):
+                    total_used_unknown_fs = total_used_unknown_fs + int(used)
 
+        if not len(unknown_fs_types) == 0:
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("unknownFSTypeInDf",str(unknown_fs_types))
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("totalUsedunknownFS",str(total_used_unknown_fs))
+            self.logger.log("Total used space in Bytes of unknown FSTypes : {0}".format(total_used_unknown_fs * 1024),True)
 
+        if not len(network_fs_types) == 0:
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("networkFSTypeInDf",str(network_fs_types))
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("totalUsedNetworkShare",str(total_used_network_shares))
+            self.logger.log("Total used space in Bytes of network shares : {0}".format(total_used_network_shares * 1024),True)
+        if total_used_gluster !=0 :
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("glusterFSSize",str(total_used_gluster))
+        if total_used_temporary_disks !=0:
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("tempDisksSize",str(total_used_temporary_disks))
+        if total_used_ram_disks != 0:
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("ramDisksSize",str(total_used_ram_disks))
+        if total_used_loop_device != 0 :
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("loopDevicesSize",str(total_used_loop_device))
+        self.logger.log("Total used space in Bytes : {0}".format(total_used * 1024),True)
+        return total_used
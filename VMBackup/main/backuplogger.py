@@ -23,11 +23,14 @@ import time
 import traceback
 from blobwriter import BlobWriter
 from Utils.WAAgentUtil import waagent
+from Utils.LogBuffer import LogRingBuffer
 import sys
 
 class Backuplogger(object):
     def __init__(self, hutil):
-        self.msg = ''
+        # logs written during the freeze, kept in memory until the file systems are thawed
+        self.msg = LogRingBuffer()
+        self.blob_writer = None
         self.con_path = '/dev/console'
         self.enforced_local_flag_value = True
         self.hutil = hutil
@@ -35,9 +38,9 @@ class Backuplogger(object):
 
     def enforce_local_flag(self, enforced_local):
         if (self.enforced_local_flag_value != False and enforced_local == False):
-            self.msg = self.msg + "================== Logs during Freeze Start ==============" + "\n"
+            self.msg.append("================== Logs during Freeze Start ==============" + "\n")
         elif (self.enforced_local_flag_value == False and enforced_local == True):
-            self.msg = self.msg + "================== Logs during Freeze End ==============" + "\n"
+            self.msg.append("================== Logs during Freeze End ==============" + "\n")
             self.commit_to_local()
         self.enforced_local_flag_value = enforced_local
 
@@ -52,7 +55,7 @@ class Backuplogger(object):
                 log_msg = "{0}  {1}  {2} \n".format(str(datetime.datetime.now()) , level , msg)
                 self.log_to_con(log_msg)
             if(self.enforced_local_flag_value == False):
-                self.msg += log_msg
+                self.msg.append(log_msg)
             else:
                 self.hutil.log(str(msg),level)
 
@@ -86,8 +89,7 @@ class Backuplogger(object):
     def commit(self, logbloburi):
         #commit to local file system first, then commit to the network.
         try:
-            self.hutil.log(self.msg)
-            self.msg = ''
+            self.commit_to_local()
         except Exception as e:
             pass 
         try:
@@ -96,16 +98,23 @@ class Backuplogger(object):
             self.hutil.log('commit to blob failed')
 
     def commit_to_local(self):
-        self.hutil.log(self.msg)
-        self.msg = ''
+        if self.msg.dropped_bytes > 0:
+            self.hutil.log("dropped " + str(self.msg.dropped_bytes) + " bytes of logs written during the freeze")
+            self.msg.dropped_bytes = 0
+        self.hutil.log(self.msg.getvalue())
+        self.msg.clear()
 
     def commit_to_blob(self, logbloburi):
         UploadStatusAndLog = self.hutil.get_value_from_configfile('UploadStatusAndLog')
         if (UploadStatusAndLog == None or UploadStatusAndLog == 'True'):
             log_to_blob = ""
-            blobWriter = BlobWriter(self.hutil)
+            # the same writer is kept so that later commits only upload the pages that changed
+            if self.blob_writer is None:
+                self.blob_writer = BlobWriter(self.hutil)
+            blobWriter = self.blob_writer
             # append the wala log at the end.
             try:
+                header = ""
                 # distro information
                 if(self.hutil is not None and self.hutil.patching is not None and self.hutil.patching.distro_info is not None):
                     distro_str = ""
@@ -113,8 +122,8 @@ class Backuplogger(object):
                         distro_str = self.hutil.patching.distro_info[0] + " " + self.hutil.patching.distro_info[1]
                     else:
                         distro_str = self.hutil.patching.distro_info[0]
-                    self.msg = "Distro Info:" + distro_str + "\n" + self.msg
-                self.msg = "Guest Agent Version is :" + waagent.GuestAgentVersion + "\n" + self.msg
+                    header = "Distro Info:" + distro_str + "\n"
+                header = "Guest Agent Version is :" + waagent.GuestAgentVersion + "\n" + header
                 with open("/var/log/waagent.log", 'rb') as file:
                     file.seek(0, os.SEEK_END)
                     length = file.tell()
@@ -123,7 +132,7 @@ class Backuplogger(object):
                         seek_len_abs = length
                     file.seek(0 - seek_len_abs, os.SEEK_END)
                     tail_wala_log = file.read()
-                    log_to_blob = str(self.hutil.fetch_log_message()) + "Tail of previous logs:" + str(self.prev_log) + "Tail of WALA Log:" + str(tail_wala_log) + "Tail of shell script log:" + str(self.hutil.get_shell_script_log())
+                    log_to_blob = header + str(self.hutil.fetch_log_message()) + "Tail of previous logs:" + str(self.prev_log) + "Tail of WALA Log:" + str(tail_wala_log) + "Tail of shell script log:" + str(self.hutil.get_shell_script_log())
             except Exception as e:
                 errMsg = 'Failed to get the waagent log with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
                 self.hutil.log(errMsg)
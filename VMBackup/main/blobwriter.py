@@ -26,6 +26,7 @@ except ImportError:
 from common import CommonVariables
 from HttpUtil import HttpUtil
 from Utils import HandlerUtil
+from Utils import LogBuffer
 
 class BlobProperties():
     def __init__(self, blobType, contentLength):
@@ -38,6 +39,9 @@ class BlobWriter(object):
     """description of class"""
     def __init__(self, hutil):
         self.hutil = hutil
+        self.http_util = HttpUtil(hutil)
+        # page-blob content written by this writer, used to upload only the pages that changed
+        self.page_blob_content = {}
     """
     network call should have retry.
     """
@@ -47,9 +51,7 @@ class BlobWriter(object):
             if(blobUri is not None):
                 blobType = self.GetBlobType(blobUri)
                 if (str(blobType).lower() == "pageblob"):
-                    # Clear Page-Blob Contents
-                    self.ClearPageBlob(blobUri)
-                    # Write to Page-Blob
+                    # Write the changed pages and clear the rest of the Page-Blob
                     self.WritePageBlob(msg, blobUri)
                 else:
                     self.WriteBlockBlob(msg, blobUri)
@@ -64,7 +66,7 @@ class BlobWriter(object):
             try:
                 # get the blob type
                 if(blobUri is not None):
-                    http_util = HttpUtil(self.hutil)
+                    http_util = self.http_util
                     sasuri_obj = urlparse.urlparse(blobUri)
                     headers = {}
                     headers["x-ms-blob-type"] = 'BlockBlob'
@@ -91,12 +93,10 @@ class BlobWriter(object):
             retry_times = 3
             while(retry_times > 0):
                 msg = message
+                previous_msg = self.page_blob_content.pop(blobUri, None)
                 try:
-                    PAGE_SIZE_BYTES = 512
                     PAGE_UPLOAD_LIMIT_BYTES = 4194304 # 4 MB
-                    STATUS_BLOB_LIMIT_BYTES = 10485760 # 10 MB
-                    http_util = HttpUtil(self.hutil)
-                    sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
+                    STATUS_BLOB_LIMIT_BYTES = LogBuffer.STATUS_BLOB_LIMIT_BYTES
                     # Get Blob-properties to know content-length
                     blobProperties = self.GetBlobProperties(blobUri)
                     blobContentLength = int(blobProperties.contentLength)
@@ -110,10 +110,9 @@ class BlobWriter(object):
                         msg = msg[msgLen-maxMsgLen:msgLen]
                         msgLen = len(msg)
                         self.hutil.log("WritePageBlob: msg length after aligning to maxMsgLen:"+str(msgLen))
-                    if((msgLen % PAGE_SIZE_BYTES) != 0):
+                    if((msgLen % LogBuffer.PAGE_SIZE_BYTES) != 0):
                         # Add padding to message to make its legth multiple of 512
-                        paddedLen = msgLen + (512 - (msgLen % PAGE_SIZE_BYTES))
-                        msg = msg.ljust(paddedLen)
+                        msg = LogBuffer.pad_to_page_size(msg)
                         msgLen = len(msg)
                         self.hutil.log("WritePageBlob: msg length after aligning to page-size(512):"+str(msgLen))
                     if(blobContentLength < msgLen):
@@ -128,26 +127,28 @@ class BlobWriter(object):
                         msg = msg[msgLen-blobContentLength:msgLen]
                         msgLen = len(msg)
                         self.hutil.log("WritePageBlob: msg length after aligning to blobContentLength:"+str(msgLen))
-                    # Write Pages
-                    result = CommonVariables.error
-                    bytes_sent = 0
-                    while (bytes_sent < msgLen):
-                        bytes_remaining = msgLen - bytes_sent
-                        pageContent = None
-                        if(bytes_remaining > PAGE_UPLOAD_LIMIT_BYTES): # more than 4 MB
-                            pageContent = msg[bytes_sent:bytes_sent+PAGE_UPLOAD_LIMIT_BYTES]
-                        else:
-                            pageContent = msg[bytes_sent:msgLen]
-                        self.hutil.log("WritePageBlob: pageContentLen:"+str(len(pageContent)))
-                        result = self.put_page_update(pageContent, blobUri, bytes_sent)
+                    # Write only the pages that differ from the last successful write
+                    result = CommonVariables.success
+                    for range_start, range_end in self.get_dirty_page_ranges(previous_msg, msg, PAGE_UPLOAD_LIMIT_BYTES):
+                        pageContent = msg[range_start:range_end]
+                        self.hutil.log("WritePageBlob: pageContentLen:"+str(len(pageContent)) + " offset:" + str(range_start))
+                        result = self.put_page_update(pageContent, blobUri, range_start)
                         if(result == CommonVariables.success):
                             self.hutil.log("WritePageBlob: page written succesfully")
                         else:
                             self.hutil.log("WritePageBlob: page failed to write")
                             break
-                        bytes_sent = bytes_sent + len(pageContent)                      
+                    # Clear whatever is left after the message, the whole tail if nothing is known about the blob
+                    clearEnd = blobContentLength
+                    if(previous_msg is not None):
+                        clearEnd = min(len(previous_msg), blobContentLength)
+                    if(result == CommonVariables.success and clearEnd > msgLen):
+                        result = self.put_page_clear(blobUri, msgLen, clearEnd - msgLen)
+                        if(result != CommonVariables.success):
+                            self.hutil.log("WritePageBlob: page-blob failed to clear the tail")
                     if(result == CommonVariables.success):
                         self.hutil.log("WritePageBlob: page-blob written succesfully")
+                        self.page_blob_content[blobUri] = msg
                         retry_times = 0
                     else:
                         self.hutil.log("WritePageBlob: page-blob failed to write")
@@ -160,33 +161,28 @@ class BlobWriter(object):
         else:
             self.hutil.log("WritePageBlob: bloburi is None")
 
-    def ClearPageBlob(self, blobUri):
-        if(blobUri is not None):
-            retry_times = 3
-            while(retry_times > 0):
-                try:
-                    http_util = HttpUtil(self.hutil)
-                    sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
-                    # Get Blob-properties to know content-length
-                    blobProperties = self.GetBlobProperties(blobUri)
-                    contentLength = int(blobProperties.contentLength)
-                    # Clear Pages
-                    if(contentLength > 0):
-                        result = self.put_page_clear(blobUri, 0, contentLength)
-                        if(result == CommonVariables.success):
-                            self.hutil.log("ClearPageBlob: page-blob cleared succesfully")
-                            retry_times = 0
-                        else:
-                            self.hutil.log("ClearPageBlob: page-blob failed to clear")
-                    else:
-                        self.hutil.log("ClearPageBlob: page-blob contentLength is 0")
-                        retry_times = 0
-                except Exception as e:
-                    self.hutil.log("ClearPageBlob: Failed to clear to page-blob with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
-                self.hutil.log("ClearPageBlob: retry times is " + str(retry_times))
-                retry_times = retry_times - 1
-        else:
-            self.hutil.log("ClearPageBlob: bloburi is None")
+    def get_dirty_page_ranges(self, previous_msg, msg, upload_limit):
+        """
+        returns (start, end) ranges of msg that differ from previous_msg, aligned to
+        the page size, merged when adjacent and split at the upload limit.
+        """
+        ranges = []
+        page_size = LogBuffer.PAGE_SIZE_BYTES
+        range_start = None
+        for page_start in range(0, len(msg), page_size):
+            page_end = page_start + page_size
+            is_dirty = previous_msg is None or msg[page_start:page_end] != previous_msg[page_start:page_end]
+            if is_dirty and range_start is None:
+                range_start = page_start
+            elif not is_dirty and range_start is not None:
+                ranges.append((range_start, page_start))
+                range_start = None
+            if range_start is not None and page_end - range_start >= upload_limit:
+                ranges.append((range_start, page_end))
+                range_start = None
+        if range_start is not None:
+            ranges.append((range_start, len(msg)))
+        return ranges
 
     def GetBlobType(self, blobUri):
         blobType = "BlockBlob"
@@ -204,10 +200,11 @@ class BlobWriter(object):
             retry_times = 3
             while(retry_times > 0):
                 try:
-                    http_util = HttpUtil(self.hutil)
+                    http_util = self.http_util
                     sasuri_obj = urlparse.urlparse(blobUri)
                     headers = {}
-                    result, httpResp, errMsg = http_util.HttpCallGetResponse('GET', sasuri_obj, None, headers = headers)
+                    # HEAD returns the same properties without downloading the blob content
+                    result, httpResp, errMsg = http_util.HttpCallGetResponse('HEAD', sasuri_obj, None, headers = headers)
                     self.hutil.log("GetBlobProperties: HttpCallGetResponse : result :" + str(result) + ", errMsg :" + str(errMsg))
                     blobProperties = self.httpresponse_get_blob_properties(httpResp)
                     self.hutil.log("GetBlobProperties: blobProperties :" + str(blobProperties))
@@ -219,7 +216,7 @@ class BlobWriter(object):
         return blobProperties
 
     def put_page_clear(self, blobUri, pageBlobIndex, clearLength):
-        http_util = HttpUtil(self.hutil)
+        http_util = self.http_util
         sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
         headers = {}
         headers["x-ms-page-write"] = 'clear'
@@ -229,7 +226,7 @@ class BlobWriter(object):
         return result
 
     def put_page_update(self, pageContent, blobUri, pageBlobIndex):
-        http_util = HttpUtil(self.hutil)
+        http_util = self.http_util
         sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
         headers = {}
         headers["x-ms-page-write"] = 'update'
@@ -242,7 +239,7 @@ class BlobWriter(object):
         isSuccessful = False
         if (size % 512 == 0):
             try:
-                http_util = HttpUtil(self.hutil)
+                http_util = self.http_util
                 sasuri_obj = urlparse.urlparse(blobUri + '&comp=properties')
                 headers = {}
                 headers["x-ms-blob-content-length"] = size
@@ -16,6 +16,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import ctypes
+import os
+import time
+
 class CommonVariables:
     azure_path = 'main/azure'
     utils_path_name = 'Utils'
@@ -68,6 +72,8 @@ class CommonVariables:
 
     unable_to_open_err_string= 'file open failed for some mount'
 
+    snapshot_workers_default = 16
+
     """
     error code definitions
     """
@@ -132,6 +138,37 @@ class CommonVariables:
     def isTerminalStatus(status):
         return (status==CommonVariables.status_success or status==CommonVariables.status_error)
 
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+CLOCK_MONOTONIC = 1
+
+def get_monotonic_clock():
+    """
+    returns a function reading a clock that is not changed by wall clock adjustments.
+    python 2 has no time.monotonic(), so clock_gettime(CLOCK_MONOTONIC) is called
+    through ctypes there (it is in librt before glibc 2.17). the wall clock is the
+    last resort if neither is available.
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    for library in ('librt.so.1', None):
+        try:
+            clock_gettime = ctypes.CDLL(library, use_errno = True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        def monotonic():
+            ts = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        return monotonic
+    return time.time
+
+monotonic_time = get_monotonic_clock()
+
 class DeviceItem(object):
     def __init__(self):
         #NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL
@@ -34,6 +34,7 @@ from common import CommonVariables
 from HttpUtil import HttpUtil
 from Utils import Status
 from Utils import HandlerUtil
+import fsfreezer
 from fsfreezer import FsFreezer
 from guestsnapshotter import GuestSnapshotter
 from hostsnapshotter import HostSnapshotter
@@ -219,7 +220,11 @@ class FreezeSnapshotter(object):
             time_after_freeze = datetime.datetime.now()
             freezeTimeTaken = time_after_freeze-time_before_freeze
             self.logger.log('T:S ***** freeze, time_before_freeze=' + str(time_before_freeze) + ", time_after_freeze=" + str(time_after_freeze) + ", freezeTimeTaken=" + str(freezeTimeTaken))
+            # FreezeTime keeps its historical 5 second offset so that it stays comparable across versions,
+            # FreezeTimeInMs subtracts the actual delay before the freeze binary is started
             HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeTime", str(time_after_freeze-time_before_freeze-datetime.timedelta(seconds=5)))
+            freezeTime = time_after_freeze-time_before_freeze-datetime.timedelta(seconds=fsfreezer.BinaryStartDelayInSeconds)
+            HandlerUtil.HandlerUtility.add_to_telemetery_data("FreezeTimeInMs", str(int(self.hutil.timedelta_total_seconds(freezeTime) * 1000)))
             run_result = CommonVariables.success
             run_status = 'success'
             all_failed= False
@@ -273,12 +278,15 @@ class FreezeSnapshotter(object):
                 all_snapshots_failed = True
                 return run_result, run_status, blob_snapshot_info_array, all_failed, all_snapshots_failed, unable_to_sleep, is_inconsistent
 
+            snap_shotter = GuestSnapshotter(self.logger, self.hutil)
+            # workers are started before the freeze so that nothing is forked while the file systems are frozen
+            snap_shotter.start_workers(self.para_parser)
+
             if self.g_fsfreeze_on :
                 run_result, run_status = self.freeze()
 
             if(run_result == CommonVariables.success or self.takeCrashConsistentSnapshot == True):
                 HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.snapshotCreator, CommonVariables.guestExtension)
-                snap_shotter = GuestSnapshotter(self.logger, self.hutil)
                 self.logger.log('T:S doing snapshot now...')
                 time_before_snapshot = datetime.datetime.now()
                 snapshot_result, blob_snapshot_info_array, all_failed, is_inconsistent, unable_to_sleep, all_snapshots_failed = snap_shotter.snapshotall(self.para_parser, self.freezer, self.g_fsfreeze_on)
@@ -287,6 +295,7 @@ class FreezeSnapshotter(object):
                 self.logger.log('T:S ***** takeSnapshotFromGuest, time_before_snapshot=' + str(time_before_snapshot) + ", time_after_snapshot=" + str(time_after_snapshot) + ", snapshotTimeTaken=" + str(snapshotTimeTaken))
                 HandlerUtil.HandlerUtility.add_to_telemetery_data("snapshotTimeTaken", str(snapshotTimeTaken))
                 self.logger.log('T:S snapshotall ends...', True)
+            snap_shotter.stop_workers()
 
         except Exception as e:
             errMsg = 'Failed to do the snapshot with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
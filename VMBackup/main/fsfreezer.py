@@ -26,12 +26,18 @@ import sys
 import signal
 import traceback
 import threading
+import select
+import fcntl
 from common import CommonVariables
+from Utils import HandlerUtil
+
+# delay before the freeze binary is started, excluded from the FreezeTime telemetry
+BinaryStartDelayInSeconds = 3
 
 def thread_for_binary(self,args):
     self.logger.log("Thread for binary is called",True)
-    time.sleep(3)
-    self.logger.log("Waited in thread for 3 seconds",True)
+    time.sleep(BinaryStartDelayInSeconds)
+    self.logger.log("Waited in thread for " + str(BinaryStartDelayInSeconds) + " seconds",True)
     self.logger.log("****** 1. Starting Freeze Binary ",True)
     self.child = subprocess.Popen(args,stdout=subprocess.PIPE)
     self.logger.log("Binary subprocess Created",True)
@@ -60,11 +66,50 @@ class FreezeHandler(object):
         self.child= None
         self.logger=logger
         self.hutil = hutil
+        self.freeze_completed_time = None
+        # the signal handlers write to this pipe so waiting is a select on it instead of sleep polling
+        self.wakeup_read_fd, self.wakeup_write_fd = os.pipe()
+        for fd in (self.wakeup_read_fd, self.wakeup_write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_write_fd, b'1')
+        except OSError:
+            # pipe is full, a wakeup is already pending
+            pass
+
+    def wait_for(self, condition, timeout):
+        """
+        waits until condition() is true or timeout seconds have passed, waking up
+        as soon as a signal is received. returns the last value of condition().
+        """
+        end_time = time.time() + timeout
+        while not condition():
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                # the 0.1 second cap re-checks the condition in case a signal was coalesced
+                readable, writable, exceptional = select.select([self.wakeup_read_fd], [], [], min(remaining, 0.1))
+            except (select.error, OSError, IOError):
+                # interrupted by a signal on python 2
+                continue
+            if readable:
+                try:
+                    while os.read(self.wakeup_read_fd, 512):
+                        pass
+                except OSError:
+                    pass
+        return True
 
     def sigusr1_handler(self,signal,frame):
+        self.freeze_completed_time = time.time()
         self.logger.log('freezed',False)
         self.logger.log("****** 4. Freeze Completed (Signal=1 received)",False)
         self.sig_handle=1
+        self.wakeup()
 
     def sigchld_handler(self,signal,frame):
         self.logger.log('some child process terminated')
@@ -72,10 +117,12 @@ class FreezeHandler(object):
             self.logger.log("binary child terminated",True)
             self.logger.log("****** 9. Binary Process completed (Signal=2 received)",True)
             self.sig_handle=2
+        self.wakeup()
 
     def reset_signals(self):
         self.sig_handle = 0
         self.child= None
+        self.freeze_completed_time = None
 
 
     def startproc(self,args):
@@ -96,15 +143,13 @@ class FreezeHandler(object):
 
         self.logger.log("safe freeze wait time in seconds : " + str(proc_sleep_time_int))
 
-        for i in range(0,(int(proc_sleep_time_int/2))):
-            if(self.sig_handle==0):
-                self.logger.log("inside while with sig_handle "+str(self.sig_handle))
-                time.sleep(2)
-            else:
-                break
+        self.wait_for(lambda: self.sig_handle != 0, proc_sleep_time_int)
         self.logger.log("Binary output for signal handled: "+str(self.sig_handle))
         return self.sig_handle
 
+    def wait_for_child_exit(self, timeout):
+        return self.wait_for(lambda: self.child.poll() is not None, timeout)
+
     def signal_receiver(self):
         signal.signal(signal.SIGUSR1,self.sigusr1_handler)
         signal.signal(signal.SIGCHLD,self.sigchld_handler)
@@ -213,13 +258,12 @@ class FsFreezer:
         elif(self.freeze_handler.child.poll() is None):
             self.logger.log("child process still running")
             self.logger.log("****** 7. Sending Thaw Signal to Binary")
+            thaw_signal_time = time.time()
             self.freeze_handler.child.send_signal(signal.SIGUSR1)
-            for i in range(0,30):
-                if(self.freeze_handler.child.poll() is None):
-                    self.logger.log("child still running sigusr1 sent")
-                    time.sleep(1)
-                else:
-                    break
+            if(self.freeze_handler.wait_for_child_exit(30)):
+                self.record_freeze_window(thaw_signal_time, time.time())
+            else:
+                self.logger.log("child still running 30 seconds after sigusr1 sent")
             self.logger.enforce_local_flag(True)
             self.log_binary_output()
             if(self.freeze_handler.child.returncode!=0):
@@ -241,6 +285,17 @@ class FsFreezer:
         self.logger.enforce_local_flag(True)
         return thaw_result, unable_to_sleep
 
+    def record_freeze_window(self, thaw_signal_time, thaw_completed_time):
+        thaw_time_ms = int((thaw_completed_time - thaw_signal_time) * 1000)
+        self.logger.log("thaw completed in " + str(thaw_time_ms) + " ms")
+        HandlerUtil.HandlerUtility.add_to_telemetery_data("ThawTimeInMs", str(thaw_time_ms))
+        if(self.freeze_handler.freeze_completed_time is not None):
+            snapshot_time_ms = int((thaw_signal_time - self.freeze_handler.freeze_completed_time) * 1000)
+            HandlerUtil.HandlerUtility.add_to_telemetery_data("FrozenSnapshotTimeInMs", str(snapshot_time_ms))
+            frozen_time_ms = int((thaw_completed_time - self.freeze_handler.freeze_completed_time) * 1000)
+            self.logger.log("file systems were frozen for " + str(frozen_time_ms) + " ms")
+            HandlerUtil.HandlerUtility.add_to_telemetery_data("FrozenTimeInMs", str(frozen_time_ms))
+
     def log_binary_output(self):
         self.logger.log("============== Binary output traces start ================= ", True)
         while True:
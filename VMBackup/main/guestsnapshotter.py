@@ -27,8 +27,13 @@ try:
     import ConfigParser as ConfigParsers
 except ImportError:
     import configparser as ConfigParsers
-import multiprocessing as mp
 import datetime
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 from common import CommonVariables
 from HttpUtil import HttpUtil
 from Utils import Status
@@ -63,14 +68,138 @@ class SnapshotResult(object):
             error_str+=(str(error)) + "\n"
         return error_str
 
+class SnapshotTaskLogger(object):
+    """
+    collects the log lines of one snapshot task so that concurrent workers
+    do not interleave their messages in the backup logger.
+    """
+    def __init__(self):
+        self.msg = ''
+
+    def log(self, msg, local=False, level='Info'):
+        self.msg = self.msg + str(datetime.datetime.now()) + " " + str(msg) + " "
+
+class SnapshotWorkerPool(object):
+    """
+    fixed size pool of snapshot worker threads. the workers are started
+    before the freeze so no process or thread is created while the file
+    systems are frozen, and results are streamed back as soon as each blob
+    is snapshotted.
+    """
+    def __init__(self, logger, worker_count):
+        self.logger = logger
+        self.worker_count = worker_count
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.workers = []
+
+    def start(self):
+        for i in range(0, self.worker_count):
+            worker = threading.Thread(target=self.worker_loop)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.logger.log("snapshot worker pool started with " + str(self.worker_count) + " workers")
+
+    def is_started(self):
+        return len(self.workers) > 0
+
+    def submit(self, index, target, args, deadline):
+        self.tasks.put((index, target, args, deadline))
+
+    def worker_loop(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            index, target, args, deadline = task
+            if time.time() > deadline:
+                self.results.put((index, None, "deadline exceeded before the snapshot was started"))
+                continue
+            try:
+                self.results.put((index, target(*args), None))
+            except Exception as e:
+                self.results.put((index, None, "snapshot worker failed with error: %s, stack trace: %s" % (str(e), traceback.format_exc())))
+
+    def completed(self, count, deadline):
+        """
+        yields (index, result, error) tuples as the workers finish, until count
+        results were received or the deadline passes.
+        """
+        received = 0
+        while received < count:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.results.get(True, remaining)
+            except queue.Empty:
+                break
+            received = received + 1
+            yield item
+
+    def stop(self):
+        for worker in self.workers:
+            self.tasks.put(None)
+        self.workers = []
+
 class GuestSnapshotter(object):
     """description of class"""
+    # how long the results of the snapshots cut off by the freeze deadline are waited for after the thaw,
+    # the snapshot http call times out after 10 seconds per socket operation
+    late_result_timeout = 30
+    # status code of the blobs whose snapshot did not complete at all
+    timed_out_status_code = 408
+
     def __init__(self, logger, hutil):
         self.logger = logger
         self.configfile='/etc/azure/vmbackup.conf'
         self.hutil = hutil
+        self.worker_pool = None
+
+    def is_parallel_snapshot(self, paras):
+        return not (self.get_value_from_configfile('seqsnapshot') == '1' or self.get_value_from_configfile('seqsnapshot') == '2' or (len(paras.blobs) <= 4))
+
+    def get_worker_count(self, blob_count):
+        worker_count = self.get_value_from_configfile('snapshotWorkers')
+        worker_count_int = CommonVariables.snapshot_workers_default
+        if worker_count != None and worker_count != '':
+            try:
+                worker_count_int = int(worker_count)
+            except ValueError:
+                self.logger.log('snapshotWorkers config value was not a number, defaulting to ' + str(CommonVariables.snapshot_workers_default), True, 'Warning')
+        return max(1, min(worker_count_int, blob_count))
+
+    def get_snapshot_timeout(self):
+        # the safefreeze binary thaws on its own after this timeout, so a snapshot finishing later is not consistent anyway
+        timeout = self.get_value_from_configfile('timeout')
+        timeout_int = 60
+        if timeout != None and timeout != '':
+            try:
+                timeout_int = int(timeout)
+            except ValueError:
+                self.logger.log('timeout config value was not a number, defaulting to 60 seconds', True, 'Warning')
+        return timeout_int
+
+    def start_workers(self, paras):
+        """
+        starts the snapshot workers ahead of the freeze when the snapshots are going to be taken in parallel.
+        """
+        try:
+            if self.worker_pool is None and paras.blobs is not None and self.is_parallel_snapshot(paras):
+                self.worker_pool = SnapshotWorkerPool(self.logger, self.get_worker_count(len(paras.blobs)))
+                self.worker_pool.start()
+        except Exception as e:
+            errorMsg = "Failed to start the snapshot workers with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
+            self.logger.log(errorMsg, True, 'Warning')
+            self.worker_pool = None
 
-    def snapshot(self, sasuri, sasuri_index, meta_data, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger):
+    def stop_workers(self):
+        if self.worker_pool is not None:
+            self.worker_pool.stop()
+            self.worker_pool = None
+
+    def snapshot(self, sasuri, sasuri_index, meta_data):
         temp_logger=''
         error_logger=''
         snapshot_error = SnapshotError()
@@ -96,11 +225,13 @@ class GuestSnapshotter(object):
                         value = meta['Value']
                         headers["x-ms-meta-" + key] = value
                 temp_logger = temp_logger + str(headers)
-                http_util = HttpUtil(self.logger)
+                task_logger = SnapshotTaskLogger()
+                http_util = HttpUtil(task_logger)
                 sasuri_obj = urlparser.urlparse(sasuri + '&comp=snapshot')
                 temp_logger = temp_logger + str(datetime.datetime.now()) + ' start calling the snapshot rest api. '
                 # initiate http call for blob-snapshot and get http response
                 result, httpResp, errMsg, responseBody  = http_util.HttpCallGetResponse('PUT', sasuri_obj, body_content, headers = headers, responseBodyRequired = True)
+                temp_logger = temp_logger + task_logger.msg
                 temp_logger = temp_logger + str("responseBody: " + responseBody)
                 if(result == CommonVariables.success and httpResp != None):
                     # retrieve snapshot information from http response
@@ -121,10 +252,7 @@ class GuestSnapshotter(object):
             snapshot_error.errorcode = CommonVariables.error
             snapshot_error.sasuri = sasuri
         temp_logger=temp_logger + str(datetime.datetime.now()) + ' snapshot ends..'
-        global_logger.put(temp_logger)
-        global_error_logger.put(error_logger)
-        snapshot_result_error.put(snapshot_error)
-        snapshot_info_indexer_queue.put(snapshot_info_indexer)
+        return snapshot_error, snapshot_info_indexer, temp_logger, error_logger
 
     def snapshot_seq(self, sasuri, sasuri_index, meta_data):
         result = None
@@ -185,52 +313,39 @@ class GuestSnapshotter(object):
         all_snapshots_failed = False
         set_next_backup_to_seq = False
         try:
-            self.logger.log("before start of multiprocessing queues..")
-            mp_jobs = []
-            queue_creation_starttime = datetime.datetime.now()
-            global_logger = mp.Queue()
-            global_error_logger = mp.Queue()
-            snapshot_result_error = mp.Queue()
-            snapshot_info_indexer_queue = mp.Queue()
-            time_before_snapshot_start = datetime.datetime.now()
             blobs = paras.blobs
 
             if blobs is not None:
-                # initialize blob_snapshot_info_array
-                mp_jobs = []
-                blob_index = 0
+                if self.worker_pool is None:
+                    self.logger.log("snapshot workers were not started before the freeze, starting them now..")
+                    pool_creation_starttime = datetime.datetime.now()
+                    self.start_workers(paras)
+                    if self.worker_pool is None:
+                        all_snapshots_failed = True
+                        raise Exception("Exception while creating snapshot worker pool")
+                    timediff = datetime.datetime.now() - pool_creation_starttime
+                    if(timediff.seconds >= 10):
+                        self.logger.log("snapshot worker pool creation took more than 10 secs. Setting next backup to sequential")
+                        set_next_backup_to_seq = True
+
+                timeout = self.get_snapshot_timeout()
+                deadline = time.time() + timeout
                 self.logger.log('****** 5. Snaphotting (Guest-parallel) Started')
+                blob_index = 0
                 for blob in blobs:
                     blobUri = blob.split("?")[0]
                     self.logger.log("index: " + str(blob_index) + " blobUri: " + str(blobUri))
                     blob_snapshot_info_array.append(HostSnapshotObjects.BlobSnapshotInfo(False, blobUri, None, 500))
-                    try:
-                        mp_jobs.append(mp.Process(target=self.snapshot,args=(blob, blob_index, paras.backup_metadata, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger)))
-                    except Exception as e:
-                        self.logger.log("multiprocess queue creation failed")
-                        all_snapshots_failed = True
-                        raise Exception("Exception while creating multiprocess queue")
-
+                    self.worker_pool.submit(blob_index, self.snapshot, (blob, blob_index, paras.backup_metadata), deadline)
                     blob_index = blob_index + 1
 
-                counter = 0
-                for job in mp_jobs:
-                    job.start()
-                    if(counter == 0):
-                        queue_creation_endtime = datetime.datetime.now()
-                        timediff = queue_creation_endtime - queue_creation_starttime
-                        if(timediff.seconds >= 10):
-                            self.logger.log("mp queue creation took more than 10 secs. Setting next backup to sequential")
-                            set_next_backup_to_seq = True
-                    counter = counter + 1
-
-                time_after_snapshot_start = datetime.datetime.now()
-                timeout = self.get_value_from_configfile('timeout')
-                if timeout == None:
-                    timeout = 60
-
-                for job in mp_jobs:
-                    job.join()
+                logging = []
+                error_logging = []
+                completed_indexes = set()
+                for index, task_result, task_error in self.worker_pool.completed(len(blobs), deadline):
+                    completed_indexes.add(index)
+                    if self.record_parallel_snapshot_result(blobs, index, task_result, task_error, snapshot_result, blob_snapshot_info_array, logging, error_logging):
+                        all_failed = False
                 self.logger.log('****** 6. Snaphotting (Guest-parallel) Completed')
                 thaw_result = None
                 if g_fsfreeze_on and thaw_done_local == False:
@@ -243,31 +358,42 @@ class GuestSnapshotter(object):
                         self.logger.log("Setting to sequential snapshot")
                         self.hutil.set_value_to_configfile('seqsnapshot', '1')
                     self.logger.log('T:S thaw result ' + str(thaw_result))
-                    if(thaw_result is not None and len(thaw_result.errors) > 0  and (snapshot_result is None or len(snapshot_result.errors) == 0)):
-                        is_inconsistent = True
-                        snapshot_result.errors.append(thaw_result.errors)
-                        return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
+
+                # the snapshots cut off by the deadline may still complete, their real result goes in the status
+                pending_count = len(blobs) - len(completed_indexes)
+                if pending_count > 0:
+                    self.logger.log(str(pending_count) + " snapshots did not complete within " + str(timeout) + " seconds, waiting for their results")
+                    for index, task_result, task_error in self.worker_pool.completed(pending_count, time.time() + self.late_result_timeout):
+                        completed_indexes.add(index)
+                        error_logging.append(str(datetime.datetime.now()) + " index: " + str(index) + " snapshot completed after the freeze deadline")
+                        if self.record_parallel_snapshot_result(blobs, index, task_result, task_error, snapshot_result, blob_snapshot_info_array, logging, error_logging):
+                            all_failed = False
+                            # taken after the deadline, possibly after the file systems were thawed
+                            is_inconsistent = True
+                for index in range(0, len(blobs)):
+                    if index not in completed_indexes:
+                        # the outcome is unknown, the snapshot may still be taken
+                        snapshot_error = SnapshotError()
+                        snapshot_error.errorcode = CommonVariables.error
+                        snapshot_error.sasuri = blobs[index]
+                        snapshot_result.errors.append(snapshot_error)
+                        error_logging.append(str(datetime.datetime.now()) + " index: " + str(index) + " snapshot timed out, its outcome is unknown")
+                        snapshot_info_indexer = SnapshotInfoIndexerObj(index, False, None, "snapshot timed out")
+                        snapshot_info_indexer.statusCode = self.timed_out_status_code
+                        self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[index])
+
+                if(thaw_result is not None and len(thaw_result.errors) > 0  and (snapshot_result is None or len(snapshot_result.errors) == 0)):
+                    is_inconsistent = True
+                    snapshot_result.errors.append(thaw_result.errors)
+                    return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
                 self.logger.log('end of snapshot process')
-                logging = [global_logger.get() for job in mp_jobs]
                 self.logger.log(str(logging))
-                error_logging = [global_error_logger.get() for job in mp_jobs]
                 self.logger.log(str(error_logging),False,'Error')
-                if not snapshot_result_error.empty():
-                    results = [snapshot_result_error.get() for job in mp_jobs]
-                    for result in results:
-                        if(result.errorcode != CommonVariables.success):
-                            snapshot_result.errors.append(result)
-                if not snapshot_info_indexer_queue.empty():
-                    snapshot_info_indexers = [snapshot_info_indexer_queue.get() for job in mp_jobs]
-                    for snapshot_info_indexer in snapshot_info_indexers:
-                        # update blob_snapshot_info_array element properties from snapshot_info_indexer object
-                        self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[snapshot_info_indexer.index])
-                        if (blob_snapshot_info_array[snapshot_info_indexer.index].isSuccessful == True):
-                            all_failed = False
-                        self.logger.log("index: " + str(snapshot_info_indexer.index) + " blobSnapshotUri: " + str(blob_snapshot_info_array[snapshot_info_indexer.index].snapshotUri))
+                for index in range(0, len(blob_snapshot_info_array)):
+                    self.logger.log("index: " + str(index) + " blobSnapshotUri: " + str(blob_snapshot_info_array[index].snapshotUri))
 
-                    all_snapshots_failed = all_failed
-                    self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
+                all_snapshots_failed = all_failed
+                self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
 
                 return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
             else:
@@ -278,8 +404,30 @@ class GuestSnapshotter(object):
             self.logger.log(errorMsg)
             exceptOccurred = True
             return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
+        finally:
+            self.stop_workers()
 
 
+    def record_parallel_snapshot_result(self, blobs, index, task_result, task_error, snapshot_result, blob_snapshot_info_array, logging, error_logging):
+        """
+        records the result of the snapshot worker task of blobs[index], and returns whether the snapshot succeeded.
+        """
+        if task_result is None:
+            snapshot_error = SnapshotError()
+            snapshot_error.errorcode = CommonVariables.error
+            snapshot_error.sasuri = blobs[index]
+            snapshot_info_indexer = SnapshotInfoIndexerObj(index, False, None, task_error)
+            error_logging.append(str(datetime.datetime.now()) + " index: " + str(index) + " " + str(task_error))
+        else:
+            snapshot_error, snapshot_info_indexer, temp_logger, error_logger = task_result
+            logging.append(temp_logger)
+            error_logging.append(error_logger)
+        if(snapshot_error.errorcode != CommonVariables.success):
+            snapshot_result.errors.append(snapshot_error)
+        # update blob_snapshot_info_array element properties from snapshot_info_indexer object
+        self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[snapshot_info_indexer.index])
+        return blob_snapshot_info_array[snapshot_info_indexer.index].isSuccessful == True
+
     def snapshotall_seq(self, paras, freezer, thaw_done, g_fsfreeze_on):
         exceptOccurred = False
         self.logger.log("doing snapshotall now in sequence...")
@@ -335,15 +483,10 @@ class GuestSnapshotter(object):
 
     def get_value_from_configfile(self, key):
         value = None
-        configfile = '/etc/azure/vmbackup.conf'
         try :
-            if os.path.exists(configfile):
-                config = ConfigParsers.ConfigParser()
-                config.read(configfile)
-                if config.has_option('SnapshotThread',key):
-                    value = config.get('SnapshotThread',key)
-                else:
-                    self.logger.log("Config File doesn't have the key :" + key)
+            value = HandlerUtil.HandlerUtility.config_cache.get_value('SnapshotThread', key)
+            if value is None:
+                self.logger.log("Config File doesn't have the key :" + key)
         except Exception as e:
             errorMsg = " Unable to ed config file.key is "+ key +"with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.logger.log(errorMsg)
@@ -351,7 +494,7 @@ class GuestSnapshotter(object):
 
     def snapshotall(self, paras, freezer, g_fsfreeze_on):
         thaw_done = False
-        if (self.get_value_from_configfile('seqsnapshot') == '1' or self.get_value_from_configfile('seqsnapshot') == '2' or (len(paras.blobs) <= 4)):
+        if not self.is_parallel_snapshot(paras):
             snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done, unable_to_sleep, all_snapshots_failed =  self.snapshotall_seq(paras, freezer, thaw_done, g_fsfreeze_on)
         else:
             snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done, unable_to_sleep, all_snapshots_failed =  self.snapshotall_parallel(paras, freezer, thaw_done, g_fsfreeze_on)
@@ -300,10 +300,9 @@ def daemon():
         if(freezer.mounts is not None):
             hutil.partitioncount = len(freezer.mounts.mounts)
         backup_logger.log(" configfile " + str(configfile), True)
-        config = ConfigParsers.ConfigParser()
-        config.read(configfile)
-        if config.has_option('SnapshotThread','timeout'):
-            thread_timeout= config.get('SnapshotThread','timeout')
+        timeout = hutil.get_value_from_configfile('timeout')
+        if timeout is not None:
+            thread_timeout = timeout
     except Exception as e:
         errMsg='cannot read config file or file not present'
         backup_logger.log(errMsg, True, 'Warning')
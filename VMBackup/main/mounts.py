@@ -18,11 +18,13 @@
 
 from os.path import *
 
+import os
 import re
 import sys
 import subprocess
 import types
 from Utils.DiskUtil import DiskUtil
+import Utils.HandlerUtil
 
 class Error(Exception):
     pass
@@ -35,9 +37,148 @@ class Mount:
         self.mount_point = mount_point
         self.unique_name = str(self.mount_point) + "_" + str(self.name)
 
+class MountInfoEntry:
+    def __init__(self, position, device, root, mount_point, fstype, source):
+        self.position = position
+        self.device = device
+        self.root = root
+        self.mount_point = mount_point
+        self.fstype = fstype
+        self.source = source
+
+class MountTable:
+    """
+    The mount table parsed from /proc/self/mountinfo, indexed by mount point, device number ("major:minor") and fs type.
+    """
+    def __init__(self, mountinfo_path = '/proc/self/mountinfo'):
+        # all the entries, in mount order
+        self.entries = []
+        # when a mount point is mounted over, the last entry is the one visible
+        self.by_mount_point = {}
+        self.by_device = {}
+        self.by_fstype = {}
+        with open(mountinfo_path, 'r') as mountinfo:
+            for line in mountinfo:
+                entry = self.parse_line(len(self.entries), line)
+                if entry is not None:
+                    self.entries.append(entry)
+                    self.by_mount_point[entry.mount_point] = entry
+                    self.by_device.setdefault(entry.device, []).append(entry)
+                    self.by_fstype.setdefault(entry.fstype, []).append(entry)
+
+    @staticmethod
+    def unescape(path):
+        # spaces, tabs, newlines and backslashes are escaped as octal, e.g. "\040"
+        if '\\' not in path:
+            return path
+        return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), path)
+
+    @staticmethod
+    def parse_line(position, line):
+        # e.g. "36 35 98:0 /mnt1 /mnt2 rw,noatime master:1 - ext3 /dev/root rw,errors=continue"
+        fields = line.split()
+        try:
+            separator = fields.index('-', 6)
+        except ValueError:
+            return None
+        if len(fields) < separator + 3:
+            return None
+        return MountInfoEntry(position = position, device = fields[2], root = MountTable.unescape(fields[3]),
+                              mount_point = MountTable.unescape(fields[4]), fstype = fields[separator + 1],
+                              source = MountTable.unescape(fields[separator + 2]))
+
 class Mounts:
-    def __init__(self,patching,logger):
+    supported_fstypes = set(['ext3', 'ext4', 'xfs', 'btrfs'])
+
+    def __init__(self,patching,logger,mountinfo_path = '/proc/self/mountinfo',sys_block_path = '/sys/dev/block'):
         self.mounts = []
+        self.logger = logger
+        self.sys_block_path = sys_block_path
+        if exists(mountinfo_path):
+            self.load_from_mountinfo(mountinfo_path)
+        else:
+            logger.log(mountinfo_path + " not found, getting the mounts from lsblk and mount commands", True)
+            self.load_from_commands(patching)
+
+    def get_block_device(self, device):
+        """
+        Returns the name and type (as lsblk names them, e.g. ("sda1", "part") or ("rootvg-rootlv", "lvm"))
+        of the block device with the given "major:minor" number, or None if it isn't a block device.
+        """
+        device_path = join(self.sys_block_path, device)
+        if not exists(device_path):
+            return None
+        name = basename(realpath(device_path))
+        device_type = 'disk'
+        if exists(join(device_path, 'loop')):
+            device_type = 'loop'
+        elif exists(join(device_path, 'dm')):
+            device_type = 'dm'
+            try:
+                with open(join(device_path, 'dm', 'name')) as f:
+                    name = f.read().strip()
+                with open(join(device_path, 'dm', 'uuid')) as f:
+                    dm_uuid = f.read().strip()
+                if dm_uuid.startswith('LVM-'):
+                    device_type = 'lvm'
+                elif dm_uuid.startswith('CRYPT-'):
+                    device_type = 'crypt'
+            except IOError:
+                pass
+        elif exists(join(device_path, 'partition')):
+            device_type = 'part'
+        return name, device_type
+
+    def load_from_mountinfo(self, mountinfo_path):
+        table = MountTable(mountinfo_path)
+        self.logger.log("mountinfo has " + str(len(table.entries)) + " mounts on " + str(len(table.by_device)) + " devices, fs types " + str(sorted(table.by_fstype.keys())), True)
+        for fstype in table.by_fstype:
+            if ("fuse" in fstype.lower() or "nfs" in fstype.lower() or "cifs" in fstype.lower()):
+                Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("networkFSTypePresentInMount","True")
+                break
+
+        block_devices = {}
+        for fstype in self.supported_fstypes:
+            for entry in table.by_fstype.get(fstype, []):
+                # only the visible mount of a mount point can be frozen through it
+                if table.by_mount_point[entry.mount_point] is not entry:
+                    continue
+                device = entry.device
+                if device.startswith('0:') and entry.source.startswith('/dev/'):
+                    # btrfs reports an anonymous device number, the block device is the mount source
+                    try:
+                        rdev = os.stat(entry.source).st_rdev
+                        device = str(os.major(rdev)) + ':' + str(os.minor(rdev))
+                    except OSError:
+                        pass
+                if device not in block_devices:
+                    block_devices[device] = (self.get_block_device(device), [])
+                block_devices[device][1].append(entry)
+
+        positions = {}
+        for device, (block_device, entries) in block_devices.items():
+            if block_device is None:
+                continue
+            # a file system is frozen once, through one of its mount points: bind mounts of it are skipped,
+            # preferring the mount of the file system root over a bind mount of a sub directory
+            entry = entries[0]
+            for candidate in entries:
+                if candidate.root == '/':
+                    entry = candidate
+                    break
+            name, device_type = block_device
+            mount = Mount(name, device_type, entry.fstype, entry.mount_point)
+            positions[mount.mount_point] = entry.position
+            self.mounts.append(mount)
+            if len(entries) > 1:
+                self.logger.log("mount point " + str(entry.mount_point) + " chosen for device " + str(name) + " over " + str([e.mount_point for e in entries if e is not entry]), True)
+            self.logger.log("mounts list item added, mount point "+str(mount.mount_point)+", device-name "+str(mount.name)+", fs-type "+str(mount.fstype)+", unique-name "+str(mount.unique_name), True)
+        # latest mounts first, like the mount command output in reverse
+        self.mounts.sort(key = lambda mount: positions[mount.mount_point], reverse = True)
+        self.logger.log("added_mount_point_names :" + str([mount.mount_point for mount in self.mounts]), True)
+
+    def load_from_commands(self, patching):
+        logger = self.logger
         added_mount_point_names = [] 
         disk_util = DiskUtil(patching,logger)
         # Get mount points 
@@ -97,7 +238,4 @@ class Mounts:
         self.mounts.reverse()
 
     def should_skip_fstype(self, fstype):
-        if (fstype == 'ext3' or fstype == 'ext4' or fstype == 'xfs' or fstype == 'btrfs'):
-            return False
-        else:
-            return True
+        return fstype not in self.supported_fstypes
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the per log line cost of the WriteLog lookup, parsing the config
+# file on every call versus the cached config. Run from the VMBackup folder:
+#   python test/config_cache_benchmark.py [lines]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+try:
+    import ConfigParser as ConfigParsers
+except ImportError:
+    import configparser as ConfigParsers
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'main'))
+from Utils.HandlerUtil import ConfigFileCache
+
+def read_uncached(configfile, key):
+    value = None
+    if os.path.exists(configfile):
+        config = ConfigParsers.ConfigParser()
+        config.read(configfile)
+        if config.has_option('SnapshotThread', key):
+            value = config.get('SnapshotThread', key)
+    return value
+
+def main():
+    lines = 10000
+    if len(sys.argv) > 1:
+        lines = int(sys.argv[1])
+    config_dir = tempfile.mkdtemp()
+    configfile = os.path.join(config_dir, 'vmbackup.conf')
+    cache = ConfigFileCache(configfile)
+    cache.set_value('SnapshotThread', 'WriteLog', 'True')
+    cache.set_value('SnapshotThread', 'timeout', '60')
+
+    start = time.time()
+    for i in range(0, lines):
+        read_uncached(configfile, 'WriteLog')
+    uncached_time = time.time() - start
+
+    start = time.time()
+    for i in range(0, lines):
+        cache.get_value('SnapshotThread', 'WriteLog')
+    cached_time = time.time() - start
+
+    cache.set_value('SnapshotThread', 'WriteLog', 'False')
+    if cache.get_value('SnapshotThread', 'WriteLog') != 'False':
+        raise Exception('cache was not invalidated by the write')
+
+    print('log lines: {0}'.format(lines))
+    print('parse per lookup: {0:.2f}us/line'.format(uncached_time * 1000000 / lines))
+    print('cached lookup: {0:.2f}us/line'.format(cached_time * 1000000 / lines))
+    shutil.rmtree(config_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Drives FsFreezer against a fake safefreeze binary that speaks the same
+# signal protocol (SIGUSR1 to the parent once frozen, SIGUSR1 back to thaw)
+# without freezing anything, and reports how long the freeze window and the
+# thaw took. Run from the VMBackup folder:
+#   python test/freeze_window_benchmark.py [iterations]
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'main'))
+from fsfreezer import FsFreezer
+from Utils import HandlerUtil
+
+FAKE_SAFEFREEZE = '''#!/usr/bin/env python
+import os
+import signal
+import sys
+import time
+
+thawed = []
+signal.signal(signal.SIGUSR1, lambda signum, frame: thawed.append(1))
+print("****** 2. Binary Freeze Started")
+print("****** 3. Binary Freeze Completed")
+sys.stdout.flush()
+os.kill(os.getppid(), signal.SIGUSR1)
+deadline = time.time() + int(sys.argv[1])
+while not thawed and time.time() < deadline:
+    time.sleep(0.001)
+print("****** 8. Binary Thaw Signal Received")
+sys.exit(0 if thawed else 1)
+'''
+
+class ConsoleLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        pass
+
+    def enforce_local_flag(self, enforced_local):
+        pass
+
+class ConfigStub(object):
+    def get_value_from_configfile(self, key):
+        return None
+
+def main():
+    iterations = 5
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    binary_dir = tempfile.mkdtemp()
+    fake_binary = os.path.join(binary_dir, 'safefreeze')
+    with open(fake_binary, 'w') as binary_file:
+        binary_file.write(FAKE_SAFEFREEZE)
+    os.chmod(fake_binary, stat.S_IRWXU)
+
+    freezer = FsFreezer(patching = None, logger = ConsoleLogger(), hutil = ConfigStub())
+    freezer.skip_freeze = False
+    for i in range(0, iterations):
+        freezer.freeze_handler.reset_signals()
+        freezer.freeze_handler.signal_receiver()
+        sig_handle = freezer.freeze_handler.startproc([fake_binary, '60'])
+        if sig_handle != 1:
+            raise Exception('fake binary did not report the freeze, sig_handle: ' + str(sig_handle))
+        start = time.time()
+        thaw_result, unable_to_sleep = freezer.thaw_safe()
+        if len(thaw_result.errors) != 0:
+            raise Exception('thaw failed: ' + str(thaw_result))
+        print('iteration {0}: thaw_safe took {1:.1f}ms, frozen for {2}ms, thaw {3}ms'.format(i,
+            (time.time() - start) * 1000,
+            HandlerUtil.HandlerUtility.telemetry_data.get('FrozenTimeInMs'),
+            HandlerUtil.HandlerUtility.telemetry_data.get('ThawTimeInMs')))
+    shutil.rmtree(binary_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures HttpUtil against a local stub https server, with and without the
+# keep-alive connection pool. Run from the VMBackup folder:
+#   python test/http_pool_benchmark.py [requests]
+
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+try:
+    import BaseHTTPServer as httpserver
+except ImportError:
+    import http.server as httpserver
+try:
+    import urlparse as urlparser
+except ImportError:
+    import urllib.parse as urlparser
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'main'))
+from HttpUtil import HttpUtil
+
+class StubBlobHandler(httpserver.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length > 0:
+            self.rfile.read(length)
+        self.send_response(201)
+        self.send_header('x-ms-snapshot', '2014-01-01T00:00:00.0000000Z')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class ConsoleLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        pass
+
+def start_stub_server():
+    cert_dir = tempfile.mkdtemp()
+    cert_file = os.path.join(cert_dir, 'stub.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                           '-subj', '/CN=localhost', '-keyout', cert_file, '-out', cert_file],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    server = httpserver.HTTPServer(('localhost', 0), StubBlobHandler)
+    context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+    context.load_cert_chain(cert_file)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def run(http_util, sasuri_obj, count, pooled):
+    start = time.time()
+    for i in range(0, count):
+        if not pooled:
+            HttpUtil.connection_pool.clear()
+        result, resp, errMsg = http_util.HttpCallGetResponse('PUT', sasuri_obj, '', {'Content-Length': '0'})
+        if resp is None or resp.status != 201:
+            raise Exception('stub request failed: ' + str(errMsg))
+    return time.time() - start
+
+def main():
+    count = 200
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    # the stub uses a self-signed certificate
+    ssl._create_default_https_context = ssl._create_unverified_context
+    server = start_stub_server()
+    sasuri_obj = urlparser.urlparse('https://localhost:{0}/vhds/disk.vhd?sv=stub&comp=snapshot'.format(server.server_port))
+    # no waagent proxy configuration for the stub
+    HttpUtil.config_resolved = True
+    http_util = HttpUtil(ConsoleLogger())
+
+    new_connection_time = run(http_util, sasuri_obj, count, False)
+    pooled_time = run(http_util, sasuri_obj, count, True)
+    print('requests: {0}'.format(count))
+    print('new connection per request: {0:.3f}s ({1:.2f}ms/request)'.format(new_connection_time, new_connection_time * 1000 / count))
+    print('pooled keep-alive connection: {0:.3f}s ({1:.2f}ms/request)'.format(pooled_time, pooled_time * 1000 / count))
+    print('connections created: {0}, reused: {1}'.format(HttpUtil.connection_pool.created, HttpUtil.connection_pool.reused))
+    HttpUtil.connection_pool.clear()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds the Mounts list from a synthetic mountinfo with block devices, bind
+# mounts of them (as containers do), and pseudo/network file systems, and
+# compares it with the lsblk and mount commands path fed with the same mounts.
+# Run from the VMBackup folder:
+#   python test/mounts_benchmark.py [entries] [iterations]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'main'))
+from common import DeviceItem
+from mounts import Mounts
+from Utils.DiskUtil import DiskUtil
+
+class NullLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        pass
+
+def build_mounts(entries):
+    """
+    Returns the mountinfo lines, the mount command output lines, the lsblk device items
+    and the /sys/dev/block entries (device number, name, type) of a synthetic system.
+    """
+    mountinfo = []
+    mount_output = []
+    device_items = []
+    block_devices = []
+    # a tenth of the mounts are file systems on block devices, a third are bind mounts of them
+    device_count = max(1, entries // 10)
+    for i in range(0, device_count):
+        if i % 4 == 3:
+            name, device_type, device = 'datavg-lv' + str(i), 'lvm', '253:' + str(i)
+        else:
+            name, device_type, device = 'sd' + str(i) + '1', 'part', '8:' + str(i)
+        fstype = ['ext4', 'xfs', 'ext3', 'btrfs'][i % 4] if device_type == 'part' else 'xfs'
+        mount_point = '/' if i == 0 else '/data/disk' + str(i)
+        block_devices.append((device, name, device_type))
+        mountinfo.append('{0} 1 {1} / {2} rw,relatime shared:{0} - {3} /dev/{4} rw'.format(len(mountinfo) + 20, device, mount_point, fstype, name))
+        mount_output.append('/dev/{0} on {1} type {2} (rw,relatime)'.format(name, mount_point, fstype))
+        device_item = DeviceItem()
+        device_item.name, device_item.type, device_item.file_system, device_item.mount_point = name, device_type, fstype, mount_point
+        device_items.append(device_item)
+    pseudo_fstypes = ['tmpfs', 'proc', 'overlay', 'cgroup2', 'nfs4', 'fuse.sshfs']
+    while len(mountinfo) < entries:
+        i = len(mountinfo)
+        if i % 3 == 0:
+            device, name, device_type = block_devices[i % device_count]
+            fstype = mountinfo[i % device_count].split(' - ')[1].split()[0]
+            mount_point = '/var/lib/containers/c' + str(i) + '/volume'
+            mountinfo.append('{0} 1 {1} /c{0} {2} rw,relatime shared:{0} - {3} /dev/{4} rw'.format(i + 20, device, mount_point, fstype, name))
+            mount_output.append('/dev/{0} on {1} type {2} (rw,relatime)'.format(name, mount_point, fstype))
+        else:
+            fstype = pseudo_fstypes[i % len(pseudo_fstypes)]
+            mount_point = '/run/containers/c' + str(i) + '/' + fstype
+            mountinfo.append('{0} 1 0:{0} / {1} rw,nosuid shared:{0} - {2} {2} rw'.format(i + 20, mount_point, fstype))
+            mount_output.append('{0} on {1} type {0} (rw,nosuid)'.format(fstype, mount_point))
+    return mountinfo, mount_output, device_items, block_devices
+
+def write_sys_block(sys_root, block_devices):
+    sys_block_path = os.path.join(sys_root, 'dev', 'block')
+    os.makedirs(sys_block_path)
+    for device, name, device_type in block_devices:
+        device_path = os.path.join(sys_root, 'devices', 'dm-' + device.split(':')[1] if device_type == 'lvm' else name)
+        os.makedirs(device_path)
+        if device_type == 'lvm':
+            os.makedirs(os.path.join(device_path, 'dm'))
+            with open(os.path.join(device_path, 'dm', 'name'), 'w') as f:
+                f.write(name + '\n')
+            with open(os.path.join(device_path, 'dm', 'uuid'), 'w') as f:
+                f.write('LVM-' + device + '\n')
+        else:
+            with open(os.path.join(device_path, 'partition'), 'w') as f:
+                f.write('1\n')
+        os.symlink(device_path, os.path.join(sys_block_path, device))
+    return sys_block_path
+
+def main():
+    entries = 5000
+    iterations = 3
+    if len(sys.argv) > 1:
+        entries = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+    mountinfo, mount_output, device_items, block_devices = build_mounts(entries)
+    work_dir = tempfile.mkdtemp()
+    mountinfo_path = os.path.join(work_dir, 'mountinfo')
+    with open(mountinfo_path, 'w') as f:
+        f.write('\n'.join(mountinfo) + '\n')
+    sys_block_path = write_sys_block(os.path.join(work_dir, 'sys'), block_devices)
+    # the commands path, without the cost of forking lsblk and mount
+    DiskUtil.get_mount_output = lambda self: '\n'.join(mount_output) + '\n'
+    DiskUtil.get_device_items = lambda self, dev_path: device_items
+
+    logger = NullLogger()
+    for i in range(0, iterations):
+        start = time.time()
+        mountinfo_mounts = Mounts(None, logger, mountinfo_path, sys_block_path)
+        mountinfo_time = time.time() - start
+        start = time.time()
+        command_mounts = Mounts(None, logger, os.path.join(work_dir, 'no-mountinfo'), sys_block_path)
+        command_time = time.time() - start
+        mountinfo_result = [(m.name, m.type, m.fstype, m.mount_point) for m in mountinfo_mounts.mounts]
+        command_result = [(m.name, m.type, m.fstype, m.mount_point) for m in command_mounts.mounts]
+        if mountinfo_result != command_result:
+            raise Exception('mounts differ: ' + str(mountinfo_result) + ' != ' + str(command_result))
+        print('iteration {0}: {1} mounts, {2} to freeze, mountinfo {3:.1f}ms, lsblk and mount commands {4:.1f}ms'.format(i,
+            len(mountinfo), len(mountinfo_result), mountinfo_time * 1000, command_time * 1000))
+    shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
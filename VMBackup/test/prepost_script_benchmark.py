@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs PluginHost.pre_script and post_script with the ScriptRunner plugin on
+# scripts which sleep for a given time, and reports how much longer than the
+# scripts themselves the pre/post script stage took. Must run as root, since
+# the plugin config and scripts have to be owned by root. Run from the VMBackup
+# folder:
+#   python test/prepost_script_benchmark.py [iterations] [script seconds]
+
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'main'))
+from PluginHost import PluginHost
+from Utils import HandlerUtil
+
+class ConsoleLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        if level == 'Error':
+            print(msg)
+
+def write_file(path, contents, mode):
+    with open(path, 'w') as f:
+        f.write(contents)
+    os.chmod(path, mode)
+
+def main():
+    iterations = 5
+    script_seconds = 0.5
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        script_seconds = float(sys.argv[2])
+    plugin_dir = tempfile.mkdtemp()
+    pre_script = os.path.join(plugin_dir, 'preScript.sh')
+    post_script = os.path.join(plugin_dir, 'postScript.sh')
+    write_file(pre_script, 'sleep ' + str(script_seconds) + '\n', stat.S_IRWXU)
+    write_file(post_script, 'sleep ' + str(script_seconds) + '\n', stat.S_IRWXU)
+    plugin_config = os.path.join(plugin_dir, 'VMSnapshotScriptPluginConfig.json')
+    write_file(plugin_config, json.dumps({
+        'pluginName': 'ScriptRunner',
+        'preScriptLocation': pre_script,
+        'postScriptLocation': post_script,
+        'timeoutInSeconds': 30,
+    }), stat.S_IRUSR | stat.S_IWUSR)
+    host_config = os.path.join(plugin_dir, 'VMSnapshotPluginHost.conf')
+    write_file(host_config, '\n'.join([
+        '[pre_post]',
+        'timeoutInSeconds: 60',
+        'numberOfPlugins: 1',
+        'pluginName0: ScriptRunner',
+        'pluginPath0: ' + os.path.join(os.getcwd(), 'main'),
+        'pluginConfigPath0: ' + plugin_config,
+    ]) + '\n', stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    host = PluginHost(logger = ConsoleLogger())
+    host.configLocation = host_config
+    error_code, dobackup, fsfreeze_on = host.pre_check()
+    if error_code != 0:
+        raise Exception('plugin host pre check failed with ' + str(error_code))
+    for i in range(0, iterations):
+        start = time.time()
+        pre_result = host.pre_script()
+        pre_time = time.time() - start
+        start = time.time()
+        post_result = host.post_script()
+        post_time = time.time() - start
+        if pre_result.anyScriptFailed or post_result.anyScriptFailed:
+            raise Exception('scripts failed: ' + str(pre_result) + str(post_result))
+        print('iteration {0}: prescript stage {1:.0f}ms, postscript stage {2:.0f}ms, for {3:.0f}ms scripts ({4}, {5})'.format(i,
+            pre_time * 1000, post_time * 1000, script_seconds * 1000,
+            HandlerUtil.HandlerUtility.telemetry_data.get('PrescriptTimeInMs'),
+            HandlerUtil.HandlerUtility.telemetry_data.get('PostscriptTimeInMs')))
+    shutil.rmtree(plugin_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests of the freeze log buffer and of the page blob writes of the backup log.
+# Run from the VMBackup folder:
+#   python test/test_log_buffer.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'main'))
+from common import CommonVariables
+from HttpUtil import HttpUtil
+from blobwriter import BlobProperties, BlobWriter
+from Utils import LogBuffer
+from Utils.LogBuffer import LogRingBuffer
+
+class ConsoleLogger(object):
+    def log(self, msg, local=False, level='Info'):
+        pass
+
+class TestLogRingBuffer(unittest.TestCase):
+    def test_append(self):
+        buf = LogRingBuffer(budget_bytes = 100)
+        buf.append('first\n')
+        buf.append('')
+        buf.append(None)
+        buf.append('second\n')
+        self.assertEqual(buf.getvalue(), 'first\nsecond\n')
+        self.assertEqual(len(buf), 13)
+        self.assertEqual(buf.dropped_bytes, 0)
+
+    def test_oldest_messages_are_dropped_over_budget(self):
+        buf = LogRingBuffer(budget_bytes = 10)
+        for msg in ['aaaa', 'bbbb', 'cccc', 'dddd']:
+            buf.append(msg)
+        self.assertEqual(buf.getvalue(), 'ccccdddd')
+        self.assertEqual(len(buf), 8)
+        self.assertEqual(buf.dropped_bytes, 8)
+
+    def test_message_larger_than_budget_keeps_its_end(self):
+        buf = LogRingBuffer(budget_bytes = 4)
+        buf.append('ab')
+        buf.append('123456')
+        self.assertEqual(buf.getvalue(), '3456')
+        self.assertEqual(buf.dropped_bytes, 4)
+
+    def test_clear(self):
+        buf = LogRingBuffer(budget_bytes = 10)
+        buf.append('aaaa')
+        buf.clear()
+        buf.append('bbbb')
+        self.assertEqual(str(buf), 'bbbb')
+        self.assertEqual(len(buf), 4)
+
+    def test_pad_to_page_size(self):
+        self.assertEqual(LogBuffer.pad_to_page_size(''), '')
+        self.assertEqual(len(LogBuffer.pad_to_page_size('a')), 512)
+        self.assertEqual(len(LogBuffer.pad_to_page_size('a' * 512)), 512)
+        self.assertEqual(LogBuffer.pad_to_page_size('a' * 513), 'a' * 513 + ' ' * 511)
+
+class StubPageBlobWriter(BlobWriter):
+    """
+    page blob writer recording the page writes instead of calling the storage
+    """
+    def __init__(self, content_length):
+        BlobWriter.__init__(self, ConsoleLogger())
+        self.content_length = content_length
+        self.writes = []
+
+    def GetBlobProperties(self, blobUri):
+        return BlobProperties('PageBlob', self.content_length)
+
+    def try_resize_page_blob(self, blobUri, size):
+        self.content_length = size
+        return True
+
+    def put_page_update(self, pageContent, blobUri, pageBlobIndex):
+        self.writes.append(('update', pageBlobIndex, len(pageContent)))
+        return CommonVariables.success
+
+    def put_page_clear(self, blobUri, pageBlobIndex, clearLength):
+        self.writes.append(('clear', pageBlobIndex, clearLength))
+        return CommonVariables.success
+
+class TestPageBlobWrites(unittest.TestCase):
+    def setUp(self):
+        # no waagent proxy configuration
+        HttpUtil.config_resolved = True
+        self.blob_uri = 'https://account.blob.test/logs/backup.log?sv=stub'
+
+    def test_dirty_page_ranges(self):
+        writer = StubPageBlobWriter(0)
+        previous_msg = 'a' * 2048
+        msg = 'a' * 512 + 'b' * 512 + 'a' * 512 + 'b' * 600
+        self.assertEqual(writer.get_dirty_page_ranges(previous_msg, msg, 4096), [(512, 1024), (1536, 2136)])
+        self.assertEqual(writer.get_dirty_page_ranges(msg, msg, 4096), [])
+        self.assertEqual(writer.get_dirty_page_ranges(None, msg, 4096), [(0, 2136)])
+
+    def test_dirty_page_ranges_are_split_at_the_upload_limit(self):
+        writer = StubPageBlobWriter(0)
+        msg = 'a' * 512 * 5
+        self.assertEqual(writer.get_dirty_page_ranges(None, msg, 1024), [(0, 1024), (1024, 2048), (2048, 2560)])
+        self.assertEqual(writer.get_dirty_page_ranges(None, msg, 1000), [(0, 1024), (1024, 2048), (2048, 2560)])
+
+    def test_page_blob_writes_are_page_aligned(self):
+        writer = StubPageBlobWriter(4096)
+        writer.WritePageBlob('a' * 700, self.blob_uri)
+        # the message is padded to whole pages, and the rest of the blob is cleared
+        self.assertEqual(writer.writes, [('update', 0, 1024), ('clear', 1024, 3072)])
+
+        writer.writes = []
+        writer.WritePageBlob('a' * 700 + 'b' * 700, self.blob_uri)
+        # only the pages that changed are written, and only what the last write used is cleared
+        self.assertEqual(writer.writes, [('update', 512, 1024)])
+        for operation, offset, length in writer.writes:
+            self.assertEqual(offset % LogBuffer.PAGE_SIZE_BYTES, 0)
+            self.assertEqual(length % LogBuffer.PAGE_SIZE_BYTES, 0)
+
+        writer.writes = []
+        writer.WritePageBlob('c' * 10, self.blob_uri)
+        self.assertEqual(writer.writes, [('update', 0, 512), ('clear', 512, 1024)])
+
+    def test_page_blob_is_resized_to_the_message(self):
+        writer = StubPageBlobWriter(512)
+        writer.WritePageBlob('a' * 1000, self.blob_uri)
+        self.assertEqual(writer.content_length, 1024)
+        self.assertEqual(writer.writes, [('update', 0, 1024)])
+
+if __name__ == '__main__':
+    unittest.main()
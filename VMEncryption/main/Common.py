@@ -33,6 +33,15 @@ class CommonVariables:
     sector_size = 512
     luks_header_size = 4096 * 512
     default_block_size = 52428800
+    # the most data copied between two checkpoints of the ongoing item config,
+    # which is also the most data held in the slice item backup file.
+    max_copy_batch_size = 52428800 * 10
+    copy_batch_target_seconds = 5
+    copy_status_report_interval_in_seconds = 30
+    # the read and write size of the used space copy of the os volume
+    used_space_copy_chunk_size = 4194304
+    # how many data volumes are encrypted at the same time, on different disks
+    default_max_concurrent_encryptions = 4
     min_filesystem_size_support = 52428800 * 3
     #TODO for the sles 11, we should use the ext3
     default_file_system = 'ext4'
@@ -68,6 +77,7 @@ class CommonVariables:
     """
     VolumeTypeKey = 'VolumeType'
     AADClientSecretKey = 'AADClientSecret'
+    MaxConcurrentEncryptionsKey = 'MaxConcurrentEncryptions'
     SecretUriKey = 'SecretUri'
     SecretSeqNum = 'SecretSeqNum'
 
@@ -94,6 +104,7 @@ class CommonVariables:
     EncryptionDecryptionOperationKey = 'DecryptionOperation'
     EncryptionVolumeTypeKey = 'VolumeType'
     EncryptionDiskFormatQueryKey = 'DiskFormatQuery'
+    EncryptionMaxConcurrentEncryptionsKey = 'MaxConcurrentEncryptions'
 
     """
     crypt ongoing item config keys
@@ -114,6 +125,7 @@ class CommonVariables:
     OngoingItemCurrentLuksHeaderFilePathKey = 'CurrentLuksHeaderFilePath'
     OngoingItemCurrentSourcePathKey = 'CurrentSourcePath'
     OngoingItemCurrentBlockSizeKey = 'CurrentBlockSize'
+    OngoingItemCurrentSliceCountKey = 'CurrentSliceCount'
 
     """
     encryption phase devinitions
@@ -209,6 +221,28 @@ class LvmItem(object):
                 " lv_kernel_major:" + str(self.lv_kernel_major) + " lv_kernel_minor:" + str(self.lv_kernel_minor))
 
 
+class DeviceInventory(object):
+    """
+    snapshot of the block devices taken in one pass, with the lvm items and
+    the azure udev symlinks it was built from.
+    device items are indexed by name, majmin and mount point.
+    """
+    def __init__(self, device_items, lvm_items, azure_symlinks):
+        self.device_items = device_items
+        self.lvm_items = lvm_items
+        self.azure_symlinks = azure_symlinks
+        self.by_name = {}
+        self.by_majmin = {}
+        self.by_mount_point = {}
+        for device_item in device_items:
+            if device_item.name not in self.by_name:
+                self.by_name[device_item.name] = device_item
+            if device_item.majmin and device_item.majmin not in self.by_majmin:
+                self.by_majmin[device_item.majmin] = device_item
+            if device_item.mount_point:
+                self.by_mount_point[device_item.mount_point] = device_item
+
+
 class CryptItem(object):
     def __init__(self):
         self.mapper_name = None
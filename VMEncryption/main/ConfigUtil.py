@@ -38,7 +38,6 @@ class ConfigUtil(object):
         return os.path.exists(self.config_file_path)
 
     def save_config(self, prop_name, prop_value):
-        #TODO make the operation an transaction.
         config = ConfigParser()
         if os.path.exists(self.config_file_path):
             config.read(self.config_file_path)
@@ -46,8 +45,7 @@ class ConfigUtil(object):
         if not config.has_section(self.azure_crypt_config_section):
             config.add_section(self.azure_crypt_config_section)
         config.set(self.azure_crypt_config_section, prop_name, prop_value)
-        with open(self.config_file_path, 'wb') as configfile:
-            config.write(configfile)
+        self.write_config(config)
 
     def save_configs(self, key_value_pairs):
         config = ConfigParser()
@@ -59,8 +57,19 @@ class ConfigUtil(object):
         for key_value_pair in key_value_pairs:
             if key_value_pair.prop_value is not None:
                 config.set(self.azure_crypt_config_section, key_value_pair.prop_name, key_value_pair.prop_value)
-        with open(self.config_file_path, 'wb') as configfile:
+        self.write_config(config)
+
+    def write_config(self, config):
+        """
+        writes the config to a temporary file renamed over the config file,
+        so a crash in the middle leaves either the old or the new config.
+        """
+        temp_file_path = self.config_file_path + '.tmp'
+        with open(temp_file_path, 'wb') as configfile:
             config.write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())
+        os.rename(temp_file_path, self.config_file_path)
 
     def get_config(self, prop_name):
         # write the configs, the bek file name and so on.
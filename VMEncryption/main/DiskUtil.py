@@ -23,9 +23,12 @@ import os.path
 import re
 from subprocess import Popen
 import shutil
+import threading
 import traceback
 import uuid
 import glob
+import copy
+from contextlib import contextmanager
 from datetime import datetime
 
 from EncryptionConfig import EncryptionConfig
@@ -33,13 +36,15 @@ from DecryptionMarkConfig import DecryptionMarkConfig
 from EncryptionMarkConfig import EncryptionMarkConfig
 from TransactionalCopyTask import TransactionalCopyTask
 from CommandExecutor import CommandExecutor, ProcessCommunicator
-from Common import CommonVariables, CryptItem, LvmItem, DeviceItem
+from Common import CommonVariables, CryptItem, LvmItem, DeviceItem, DeviceInventory
 
 
 class DiskUtil(object):
     os_disk_lvm = None
     sles_cache = {}
     device_id_cache = {}
+    # serializes the changes of crypttab, azure_crypt_mount and fstab by concurrent encryptions
+    config_files_lock = threading.RLock()
 
     def __init__(self, hutil, patching, logger, encryption_environment):
         self.encryption_environment = encryption_environment
@@ -50,6 +55,9 @@ class DiskUtil(object):
         self.vmbus_sys_path = '/sys/bus/vmbus/devices'
 
         self.command_executor = CommandExecutor(self.logger)
+        self.device_inventory = None
+        # the copies which may run at the same time as this one, sharing the memory for their batches
+        self.concurrent_copies = 1
 
     def copy(self, ongoing_item_config, status_prefix=''):
         copy_task = TransactionalCopyTask(logger=self.logger,
@@ -58,18 +66,14 @@ class DiskUtil(object):
                                           ongoing_item_config=ongoing_item_config,
                                           patching=self.distro_patcher,
                                           encryption_environment=self.encryption_environment,
-                                          status_prefix=status_prefix)
+                                          status_prefix=status_prefix,
+                                          concurrent_copies=self.concurrent_copies)
         try:
-            mem_fs_result = copy_task.prepare_mem_fs()
-            if mem_fs_result != CommonVariables.process_success:
-                return CommonVariables.tmpfs_error
-            else:
-                return copy_task.begin_copy()
+            return copy_task.begin_copy()
         except Exception as e:
-            message = "Failed to perform dd copy: {0}, stack trace: {1}".format(e, traceback.format_exc())
+            message = "Failed to perform copy: {0}, stack trace: {1}".format(e, traceback.format_exc())
             self.logger.log(msg=message, level=CommonVariables.ErrorLevel)
-        finally:
-            copy_task.clear_mem_fs()
+            return CommonVariables.copy_data_error
 
     def format_disk(self, dev_path, file_system):
         mkfs_command = ""
@@ -239,10 +243,11 @@ class DiskUtil(object):
         return non_os_entry_found
 
     def add_crypt_item(self, crypt_item, key_file_path):
-        if self.should_use_azure_crypt_mount():
-            return self.add_crypt_item_to_azure_crypt_mount(crypt_item)
-        else:
-            return self.add_crypt_item_to_crypttab(crypt_item, key_file_path)
+        with self.config_files_lock:
+            if self.should_use_azure_crypt_mount():
+                return self.add_crypt_item_to_azure_crypt_mount(crypt_item)
+            else:
+                return self.add_crypt_item_to_crypttab(crypt_item, key_file_path)
 
     def add_crypt_item_to_crypttab(self, crypt_item, key_file):
         if key_file is None and crypt_item.uses_cleartext_key:
@@ -573,6 +578,10 @@ class DiskUtil(object):
         return fstab_device, fstab_mount_point
 
     def modify_fstab_entry_encrypt(self, mount_point, mapper_path):
+        with self.config_files_lock:
+            self.modify_fstab_entry_encrypt_locked(mount_point, mapper_path)
+
+    def modify_fstab_entry_encrypt_locked(self, mount_point, mapper_path):
         self.logger.log("modify_fstab_entry_encrypt called with mount_point={0}, mapper_path={1}".format(mount_point, mapper_path))
 
         if not mount_point:
@@ -774,14 +783,17 @@ class DiskUtil(object):
         return items
 
     def get_encryption_status(self):
+        with self.shared_device_inventory():
+            return self.get_encryption_status_with_inventory()
+
+    def get_encryption_status_with_inventory(self):
         encryption_status = {
             "data": "NotEncrypted",
             "os": "NotEncrypted"
         }
 
         mount_items = self.get_mount_items()
-        device_items = self.get_device_items(None)
-        device_items_dict = dict([(device_item.mount_point, device_item) for device_item in device_items])
+        device_items_dict = self.get_device_inventory().by_mount_point
 
         os_drive_encrypted = False
         data_drives_found = False
@@ -921,6 +933,40 @@ class DiskUtil(object):
 
         return device_path
 
+    def get_physical_disks(self, dev_path):
+        """
+        returns the majmin of the disks holding the block device at dev_path: the disk of a
+        partition, and the disks under the slaves of a device mapper or md device.
+        """
+        try:
+            rdev = os.stat(dev_path).st_rdev
+        except OSError:
+            return set([dev_path])
+        majmin = '{0}:{1}'.format(os.major(rdev), os.minor(rdev))
+        sysfs_path = os.path.join('/sys/dev/block', majmin)
+        if not os.path.exists(sysfs_path):
+            return set([majmin])
+
+        disks = set()
+        pending_paths = [os.path.realpath(sysfs_path)]
+        visited_paths = set()
+        while pending_paths:
+            current_path = pending_paths.pop()
+            if current_path in visited_paths:
+                continue
+            visited_paths.add(current_path)
+            if os.path.isfile(os.path.join(current_path, 'partition')):
+                pending_paths.append(os.path.dirname(current_path))
+                continue
+            slaves_path = os.path.join(current_path, 'slaves')
+            slaves = os.listdir(slaves_path) if os.path.isdir(slaves_path) else []
+            if slaves:
+                pending_paths.extend(os.path.realpath(os.path.join(slaves_path, slave)) for slave in slaves)
+            else:
+                with open(os.path.join(current_path, 'dev'), 'r') as f:
+                    disks.add(f.read().strip())
+        return disks
+
     def get_device_id(self, dev_path):
         if (dev_path) in DiskUtil.device_id_cache:
             return DiskUtil.device_id_cache[dev_path]
@@ -1012,6 +1058,7 @@ class DiskUtil(object):
 
         proc_comm = ProcessCommunicator()
         self.command_executor.Execute(lsblk_command, communicator=proc_comm, raise_exception_on_failure=True)
+        azure_symlinks = self.get_azure_symlinks()
 
         for line in proc_comm.stdout.splitlines():
             item_value_str = line.strip()
@@ -1029,7 +1076,7 @@ class DiskUtil(object):
             device_item.device_id = self.get_device_items_property(dev_name=device_item.name, property_name='DEVICE_ID')
 
             device_item.azure_name = ''
-            for symlink, target in self.get_azure_symlinks().items():
+            for symlink, target in azure_symlinks.items():
                 if device_item.name in target:
                     device_item.azure_name = symlink
 
@@ -1066,76 +1113,190 @@ class DiskUtil(object):
 
         return device_items_to_return
 
-    def get_device_items(self, dev_path):
-        if self.distro_patcher.distro_info[0].lower() == 'suse' and self.distro_patcher.distro_info[1] == '11':
-            return self.get_device_items_sles(dev_path)
-        else:
-            if dev_path:
-                self.logger.log(msg=("getting blk info for: " + str(dev_path)))
+    @contextmanager
+    def shared_device_inventory(self):
+        """
+        device queries made in this block share one device inventory, so the
+        block devices should not be changed inside it.
+        """
+        if self.device_inventory is not None:
+            yield self.device_inventory
+            return
 
-            if dev_path is None:
-                lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN'
-            else:
-                lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN ' + dev_path
-            
+        self.device_inventory = self.build_device_inventory()
+        try:
+            yield self.device_inventory
+        finally:
+            self.device_inventory = None
+
+    def get_device_inventory(self):
+        if self.device_inventory is not None:
+            return self.device_inventory
+        return self.build_device_inventory()
+
+    def build_device_inventory(self):
+        lvm_items = self.get_lvm_items()
+        azure_symlinks = self.get_azure_symlinks()
+
+        if self.is_sles_11():
+            device_items = self.get_device_items_sles(None)
+        else:
+            lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN'
             proc_comm = ProcessCommunicator()
             self.command_executor.Execute(lsblk_command, communicator=proc_comm, raise_exception_on_failure=True, suppress_logging=True)
-            
-            device_items = []
-            lvm_items = self.get_lvm_items()
-            for line in proc_comm.stdout.splitlines():
-                if line:
-                    device_item = DeviceItem()
+            device_items = self.parse_lsblk_device_items(proc_comm.stdout, lvm_items, azure_symlinks)
 
-                    for disk_info_property in line.split():
-                        property_item_pair = disk_info_property.split('=')
-                        if property_item_pair[0] == 'SIZE':
-                            device_item.size = int(property_item_pair[1].strip('"'))
+        return DeviceInventory(device_items, lvm_items, azure_symlinks)
 
-                        if property_item_pair[0] == 'NAME':
-                            device_item.name = property_item_pair[1].strip('"')
+    def is_sles_11(self):
+        return self.distro_patcher.distro_info[0].lower() == 'suse' and self.distro_patcher.distro_info[1] == '11'
 
-                        if property_item_pair[0] == 'TYPE':
-                            device_item.type = property_item_pair[1].strip('"')
+    def parse_lsblk_device_items(self, lsblk_output, lvm_items, azure_symlinks):
+        device_items = []
+        for line in lsblk_output.splitlines():
+            if line:
+                device_item = DeviceItem()
+
+                for disk_info_property in line.split():
+                    property_item_pair = disk_info_property.split('=')
+                    if property_item_pair[0] == 'SIZE':
+                        device_item.size = int(property_item_pair[1].strip('"'))
+
+                    if property_item_pair[0] == 'NAME':
+                        device_item.name = property_item_pair[1].strip('"')
+
+                    if property_item_pair[0] == 'TYPE':
+                        device_item.type = property_item_pair[1].strip('"')
+
+                    if property_item_pair[0] == 'FSTYPE':
+                        device_item.file_system = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'FSTYPE':
-                            device_item.file_system = property_item_pair[1].strip('"')
-                        
-                        if property_item_pair[0] == 'MOUNTPOINT':
-                            device_item.mount_point = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'MOUNTPOINT':
+                        device_item.mount_point = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'LABEL':
-                            device_item.label = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'LABEL':
+                        device_item.label = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'UUID':
-                            device_item.uuid = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'UUID':
+                        device_item.uuid = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'MODEL':
-                            device_item.model = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'MODEL':
+                        device_item.model = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'MAJ:MIN':
-                            device_item.majmin = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'MAJ:MIN':
+                        device_item.majmin = property_item_pair[1].strip('"')
 
+                device_item.device_id = self.get_device_id_from_sysfs(device_item.majmin)
+                if device_item.device_id is None:
                     device_item.device_id = self.get_device_id(self.get_device_path(device_item.name))
 
-                    if device_item.type is None:
-                        device_item.type = ''
+                if device_item.type is None:
+                    device_item.type = ''
 
-                    if device_item.type.lower() == 'lvm':
-                        for lvm_item in lvm_items:
-                            majmin = lvm_item.lv_kernel_major + ':' + lvm_item.lv_kernel_minor
+                if device_item.type.lower() == 'lvm':
+                    for lvm_item in lvm_items:
+                        majmin = lvm_item.lv_kernel_major + ':' + lvm_item.lv_kernel_minor
 
-                            if majmin == device_item.majmin:
-                                device_item.name = lvm_item.vg_name + '/' + lvm_item.lv_name
+                        if majmin == device_item.majmin:
+                            device_item.name = lvm_item.vg_name + '/' + lvm_item.lv_name
 
-                    device_item.azure_name = ''
-                    for symlink, target in self.get_azure_symlinks().items():
-                        if device_item.name in target:
-                            device_item.azure_name = symlink
+                device_item.azure_name = ''
+                for symlink, target in azure_symlinks.items():
+                    if device_item.name in target:
+                        device_item.azure_name = symlink
 
-                    device_items.append(device_item)
+                device_items.append(device_item)
+
+        return device_items
 
-            return device_items
+    def get_device_id_from_sysfs(self, majmin):
+        """
+        the same device_id udevadm finds in the attributes of the device and
+        its parents, read from sysfs. returns None if the device is not in sysfs.
+        """
+        if not majmin:
+            return None
+        sysfs_path = os.path.join('/sys/dev/block', majmin)
+        if not os.path.exists(sysfs_path):
+            return None
+
+        sysfs_path = os.path.realpath(sysfs_path)
+        while sysfs_path.startswith('/sys/devices/'):
+            device_id_path = os.path.join(sysfs_path, 'device_id')
+            if os.path.isfile(device_id_path):
+                with open(device_id_path, 'r') as f:
+                    match = re.findall(r'{(.*)}', f.read().strip())
+                return match[0] if match else ""
+            sysfs_path = os.path.dirname(sysfs_path)
+        return ""
+
+    def get_sysfs_child_majmins(self, majmin):
+        """
+        returns the majmin of the partitions and holders of a block device, like lsblk lists them.
+        """
+        sysfs_path = os.path.realpath(os.path.join('/sys/dev/block', majmin))
+        child_paths = []
+        for entry in sorted(os.listdir(sysfs_path)):
+            entry_path = os.path.join(sysfs_path, entry)
+            if os.path.isfile(os.path.join(entry_path, 'partition')):
+                child_paths.append(entry_path)
+        holders_path = os.path.join(sysfs_path, 'holders')
+        if os.path.isdir(holders_path):
+            for holder in sorted(os.listdir(holders_path)):
+                child_paths.append(os.path.join(holders_path, holder))
+
+        child_majmins = []
+        for child_path in child_paths:
+            with open(os.path.join(child_path, 'dev'), 'r') as f:
+                child_majmins.append(f.read().strip())
+        return child_majmins
+
+    def get_device_items_from_inventory(self, inventory, dev_path):
+        """
+        returns the device at dev_path followed by its partitions and holders,
+        or None if dev_path is not a block device of the inventory.
+        """
+        try:
+            rdev = os.stat(dev_path).st_rdev
+        except OSError:
+            return None
+        majmin = '{0}:{1}'.format(os.major(rdev), os.minor(rdev))
+        if majmin not in inventory.by_majmin:
+            return None
+
+        device_items = []
+        pending_majmins = [majmin]
+        visited_majmins = set()
+        try:
+            while pending_majmins:
+                current_majmin = pending_majmins.pop(0)
+                if current_majmin in visited_majmins or current_majmin not in inventory.by_majmin:
+                    continue
+                visited_majmins.add(current_majmin)
+                device_items.append(copy.copy(inventory.by_majmin[current_majmin]))
+                pending_majmins = self.get_sysfs_child_majmins(current_majmin) + pending_majmins
+        except (IOError, OSError) as e:
+            self.logger.log("failed to walk the sysfs children of {0}: {1}".format(dev_path, e))
+            return None
+        return device_items
+
+    def get_device_items(self, dev_path):
+        if self.is_sles_11() and (dev_path is not None or self.device_inventory is None):
+            return self.get_device_items_sles(dev_path)
+        else:
+            inventory = self.get_device_inventory()
+            if dev_path is None:
+                return [copy.copy(device_item) for device_item in inventory.device_items]
+
+            self.logger.log(msg=("getting blk info for: " + str(dev_path)))
+            device_items = self.get_device_items_from_inventory(inventory, dev_path)
+            if device_items is not None:
+                return device_items
+
+            lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN ' + dev_path
+            proc_comm = ProcessCommunicator()
+            self.command_executor.Execute(lsblk_command, communicator=proc_comm, raise_exception_on_failure=True, suppress_logging=True)
+            return self.parse_lsblk_device_items(proc_comm.stdout, inventory.lvm_items, inventory.azure_symlinks)
 
     def get_lvm_items(self):
         lvs_command = 'lvs --noheadings --nameprefixes --unquoted -o lv_name,vg_name,lv_kernel_major,lv_kernel_minor'
@@ -1178,13 +1339,13 @@ class DiskUtil(object):
         if DiskUtil.os_disk_lvm is not None:
             return DiskUtil.os_disk_lvm
 
-        device_items = self.get_device_items(None)
+        inventory = self.get_device_inventory()
 
-        if not any([item.type.lower() == 'lvm' for item in device_items]):
+        if not any([item.type.lower() == 'lvm' for item in inventory.device_items]):
             DiskUtil.os_disk_lvm = False
             return False
 
-        lvm_items = filter(lambda item: item.vg_name == "rootvg", self.get_lvm_items())
+        lvm_items = filter(lambda item: item.vg_name == "rootvg", inventory.lvm_items)
 
         current_lv_names = set([item.lv_name for item in lvm_items])
 
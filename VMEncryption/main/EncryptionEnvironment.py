@@ -16,8 +16,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import glob
 import os
 import os.path
+import re
 import subprocess
 from subprocess import *
 
@@ -43,6 +46,30 @@ class EncryptionEnvironment(object):
         self.os_encryption_markers_path = os.path.join(self.encryption_config_path, 'os_encryption_markers')
         self.bek_backup_path = os.path.join(self.encryption_config_path, 'bek_backup')
 
+    def get_slot_environment(self, slot):
+        """
+        returns the environment of the encryption worker in slot, with its own ongoing
+        item config and copy files. slot 0 uses the files of the sequential encryption.
+        """
+        if slot == 0:
+            return self
+        slot_environment = copy.copy(self)
+        slot_environment.azure_crypt_ongoing_item_config_path = os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_item_{0}.ini'.format(slot))
+        slot_environment.copy_header_slice_file_path = os.path.join(self.encryption_config_path, 'copy_header_slice_file_{0}'.format(slot))
+        slot_environment.copy_slice_item_backup_file = os.path.join(self.encryption_config_path, 'copy_slice_item_{0}.bak'.format(slot))
+        return slot_environment
+
+    def get_ongoing_item_config_slots(self):
+        """
+        returns the slots which have an ongoing item config, i.e. an encryption to resume.
+        """
+        slots = []
+        for config_path in glob.glob(os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_item*.ini')):
+            match = re.match(r'azure_crypt_ongoing_item(?:_(\d+))?\.ini$', os.path.basename(config_path))
+            if match:
+                slots.append(int(match.group(1) or 0))
+        return sorted(slots)
+
     def get_se_linux(self):
         proc = Popen([self.patching.getenforce_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         identity, err = proc.communicate()
@@ -29,6 +29,7 @@ class EncryptionMarkConfig(object):
         self.command = None
         self.volume_type = None
         self.diskFormatQuery = None
+        self.max_concurrent_encryptions = None
         self.encryption_mark_config = ConfigUtil(self.encryption_environment.azure_crypt_request_queue_path,
                                                  'encryption_request_queue',
                                                  self.logger)
@@ -42,6 +43,13 @@ class EncryptionMarkConfig(object):
     def get_encryption_disk_format_query(self):
         return self.encryption_mark_config.get_config(CommonVariables.EncryptionDiskFormatQueryKey)
 
+    def get_max_concurrent_encryptions(self):
+        max_concurrent_encryptions = self.encryption_mark_config.get_config(CommonVariables.EncryptionMaxConcurrentEncryptionsKey)
+        try:
+            return max(1, int(max_concurrent_encryptions))
+        except (TypeError, ValueError):
+            return CommonVariables.default_max_concurrent_encryptions
+
     def config_file_exists(self):
         """
         we should compare the timestamp of the file with the current system time
@@ -57,6 +65,8 @@ class EncryptionMarkConfig(object):
         key_value_pairs.append(volume_type)
         disk_format_query = ConfigKeyValuePair(CommonVariables.EncryptionDiskFormatQueryKey, self.diskFormatQuery)
         key_value_pairs.append(disk_format_query)
+        max_concurrent_encryptions = ConfigKeyValuePair(CommonVariables.EncryptionMaxConcurrentEncryptionsKey, self.max_concurrent_encryptions)
+        key_value_pairs.append(max_concurrent_encryptions)
         self.encryption_mark_config.save_configs(key_value_pairs)
 
     def clear_config(self):
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import traceback
+from Common import CommonVariables
+
+
+class SynchronizedStatusReporter(object):
+    """
+    the handler utility given to the encryption workers, their status reports
+    are written to the status file one at a time.
+    """
+    def __init__(self, hutil):
+        self.hutil = hutil
+        self.lock = threading.Lock()
+
+    def do_status_report(self, operation, status, status_code, message):
+        with self.lock:
+            self.hutil.do_status_report(operation=operation,
+                                        status=status,
+                                        status_code=status_code,
+                                        message=message)
+
+    def __getattr__(self, name):
+        return getattr(self.hutil, name)
+
+
+class EncryptionScheduler(object):
+    """
+    encrypts block devices on concurrent worker threads, at most max_concurrency
+    at a time. get_disks returns the set of disks an item is on, items sharing
+    a disk are never encrypted at the same time since each is bound by the
+    throughput of the disk. every worker runs in a slot, a number below
+    max_concurrency not used by another running worker, which keeps its resume
+    state apart from the other workers.
+    """
+    def __init__(self, logger, max_concurrency, get_disks):
+        self.logger = logger
+        self.max_concurrency = max(1, max_concurrency)
+        self.get_disks = get_disks
+
+    def run(self, items, encrypt, get_slot=None):
+        """
+        calls encrypt(item, slot) for the items, which returns whether the item
+        was encrypted. get_slot gives the slot of an item which must run in a
+        given slot, e.g. to resume its encryption. no item is started after one
+        failed. returns the failed items, in the order of items.
+        """
+        condition = threading.Condition()
+        pending = [(item, self.get_disks(item)) for item in items]
+        busy_disks = set()
+        used_slots = set()
+        failed = []
+        threads = []
+
+        def worker(item, disks, slot):
+            succeeded = False
+            try:
+                succeeded = encrypt(item, slot)
+            except Exception as e:
+                self.logger.log(msg="encrypting {0} failed: {1}, stack trace: {2}".format(item, e, traceback.format_exc()),
+                                level=CommonVariables.ErrorLevel)
+            with condition:
+                busy_disks.difference_update(disks)
+                used_slots.discard(slot)
+                if not succeeded:
+                    failed.append(item)
+                condition.notify()
+
+        with condition:
+            while (pending and not failed) or used_slots:
+                if not failed:
+                    for item, disks in list(pending):
+                        if len(used_slots) >= self.max_concurrency:
+                            break
+                        if disks & busy_disks:
+                            continue
+                        if get_slot is not None:
+                            slot = get_slot(item)
+                            if slot in used_slots:
+                                continue
+                        else:
+                            slot = min(set(range(self.max_concurrency)) - used_slots)
+                        pending.remove((item, disks))
+                        busy_disks.update(disks)
+                        used_slots.add(slot)
+                        self.logger.log("encrypting {0} in slot {1} on the disks {2}".format(item, slot, sorted(disks)))
+                        thread = threading.Thread(target=worker, args=(item, disks, slot))
+                        thread.daemon = True
+                        thread.start()
+                        threads.append(thread)
+                if used_slots:
+                    condition.wait()
+
+        for thread in threads:
+            thread.join()
+        if failed and pending:
+            self.logger.log(msg="not encrypting {0} devices after the failure".format(len(pending)),
+                            level=CommonVariables.WarningLevel)
+        return [item for item in items if item in failed]
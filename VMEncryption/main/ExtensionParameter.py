@@ -60,6 +60,7 @@ class ExtensionParameter(object):
 
         self.VolumeType = public_settings.get(CommonVariables.VolumeTypeKey)
         self.DiskFormatQuery = public_settings.get(CommonVariables.DiskFormatQuerykey)
+        self.MaxConcurrentEncryptions = public_settings.get(CommonVariables.MaxConcurrentEncryptionsKey)
 
         """
         private settings
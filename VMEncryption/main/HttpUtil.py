@@ -18,10 +18,14 @@
 
 import time
 import datetime
+import errno
 import traceback
 import urlparse
 import httplib
 import shlex
+import socket
+import ssl
+import threading
 import subprocess
 from Common import CommonVariables
 from subprocess import *
@@ -29,6 +33,11 @@ from Utils.WAAgentUtil import waagent
 
 class HttpUtil(object):
     """description of class"""
+    # the https connections by host kept open by keep_alive calls, shared by all
+    # the HttpUtil objects of the handler process
+    connection_pool = {}
+    connection_pool_lock = threading.Lock()
+
     def __init__(self, logger):
         self.logger = logger
         try:
@@ -41,33 +50,103 @@ class HttpUtil(object):
         self.proxyHost = Config.get("HttpProxy.Host")
         self.proxyPort = Config.get("HttpProxy.Port")
         self.connection = None
+        self.last_call_duration = None
 
     """
     snapshot also called this. so we should not write the file/read the file in this method.
     """
 
-    def Call(self, method, http_uri, data, headers):
+    def Call(self, method, http_uri, data, headers, keep_alive=False):
+        """
+        with keep_alive the connection to the host is taken from and left in the
+        connection pool, the response must be read before the next keep_alive call.
+        """
         try:
             uri_obj = urlparse.urlparse(http_uri)
-            #parse the uri str here
-            if self.proxyHost is None or self.proxyPort is None:
-                self.connection = httplib.HTTPSConnection(uri_obj.hostname, timeout = 10)
-                if uri_obj.query is not None:
-                    self.connection.request(method = method, url=(uri_obj.path +'?'+ uri_obj.query), body = data, headers = headers)
-                else:
-                    self.connection.request(method = method, url=(uri_obj.path), body = data, headers = headers)
-                resp = self.connection.getresponse()
+            start_time = time.time()
+            if not keep_alive:
+                self.connection = self.create_connection(uri_obj)
+                resp = self.request(method, uri_obj, http_uri, data, headers)
             else:
-                self.logger.log("proxyHost is not empty, so use the proxy to call the http.")
-                self.connection = httplib.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
-                if uri_obj.scheme.lower() == "https":
-                    self.connection.set_tunnel(uri_obj.hostname, 443)
-                else:
-                    self.connection.set_tunnel(uri_obj.hostname, 80)
-                self.connection.request(method = method, url = (http_uri), body = data, headers = headers)
-                resp = self.connection.getresponse()
+                pool_key = (uri_obj.scheme.lower(), uri_obj.hostname, uri_obj.port)
+                with HttpUtil.connection_pool_lock:
+                    self.connection = HttpUtil.connection_pool.get(pool_key)
+                    reused = self.connection is not None
+                    if not reused:
+                        self.connection = self.create_connection(uri_obj)
+                        HttpUtil.connection_pool[pool_key] = self.connection
+                sent = False
+                try:
+                    self.send_request(method, uri_obj, http_uri, data, headers)
+                    sent = True
+                    resp = self.connection.getresponse()
+                except (httplib.HTTPException, socket.error) as e:
+                    # a failed connection is not reused as is, its request and response state is unknown
+                    self.connection.close()
+                    if not reused or not HttpUtil.is_stale_connection_error(e, sent):
+                        raise
+                    # the server closed the idle connection before it got the request, retry once on a new one
+                    self.logger.log("reconnecting to {0} after: {1}".format(uri_obj.hostname, e))
+                    self.connection = self.create_connection(uri_obj)
+                    with HttpUtil.connection_pool_lock:
+                        HttpUtil.connection_pool[pool_key] = self.connection
+                    resp = self.request(method, uri_obj, http_uri, data, headers)
+            self.last_call_duration = time.time() - start_time
             return resp
         except Exception as e:
             errorMsg = "Failed to call http with error: {0}, stack trace: {1}".format(e, traceback.format_exc())
             self.logger.log(errorMsg)
-            return None
\ No newline at end of file
+            return None
+
+    def create_connection(self, uri_obj):
+        if self.proxyHost is None or self.proxyPort is None:
+            return httplib.HTTPSConnection(uri_obj.hostname, uri_obj.port, timeout = 10)
+        else:
+            self.logger.log("proxyHost is not empty, so use the proxy to call the http.")
+            connection = httplib.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
+            if uri_obj.port is not None:
+                connection.set_tunnel(uri_obj.hostname, uri_obj.port)
+            elif uri_obj.scheme.lower() == "https":
+                connection.set_tunnel(uri_obj.hostname, 443)
+            else:
+                connection.set_tunnel(uri_obj.hostname, 80)
+            return connection
+
+    @staticmethod
+    def is_stale_connection_error(e, sent):
+        """
+        whether e is how a pooled connection fails when the server closed it while it was idle:
+        the request can not be written, or the connection is closed before any byte of the
+        response. a timeout is not, the server may still be processing the request.
+        """
+        if isinstance(e, socket.timeout):
+            return False
+        if not sent:
+            return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+        if isinstance(e, ssl.SSLError):
+            # the tls connection was closed instead of the status line
+            # openssl 3 reports it as an ssl error with this message rather than SSL_ERROR_EOF
+            return e.errno == ssl.SSL_ERROR_EOF or 'unexpected eof while reading' in str(e).lower().replace('_', ' ')
+        # python 2.7 raises BadStatusLine with the repr of the empty line, or this message in later releases
+        return isinstance(e, httplib.BadStatusLine) and (e.line in ('', "''") or str(e.line).startswith('No status line received'))
+
+    def request(self, method, uri_obj, http_uri, data, headers):
+        self.send_request(method, uri_obj, http_uri, data, headers)
+        return self.connection.getresponse()
+
+    def send_request(self, method, uri_obj, http_uri, data, headers):
+        #parse the uri str here
+        if self.proxyHost is None or self.proxyPort is None:
+            if uri_obj.query is not None:
+                self.connection.request(method = method, url=(uri_obj.path +'?'+ uri_obj.query), body = data, headers = headers)
+            else:
+                self.connection.request(method = method, url=(uri_obj.path), body = data, headers = headers)
+        else:
+            self.connection.request(method = method, url = (http_uri), body = data, headers = headers)
+
+    @staticmethod
+    def close_pooled_connections():
+        with HttpUtil.connection_pool_lock:
+            for connection in HttpUtil.connection_pool.values():
+                connection.close()
+            HttpUtil.connection_pool.clear()
@@ -25,15 +25,40 @@ import traceback
 import re
 import os
 import subprocess
+import time
 
 from tempfile import mkstemp 
 from HttpUtil import HttpUtil
 from urlparse import urlparse
 
 class KeyVaultUtil(object):
+    # the authorize uri of each vault and the access tokens until shortly before
+    # they expire, shared by all the key vault operations of the handler process
+    authorize_uris = {}
+    access_tokens = {}
+    token_expiry_margin_in_seconds = 300
+
     def __init__(self, logger):
         self.api_version = "2015-06-01"
         self.logger = logger
+        self.http_util = None
+        self.request_times = []
+
+    def call(self, operation, method, http_uri, data, headers):
+        """
+        calls the vault or the token endpoint over a pooled connection, and records
+        how long the operation took in request_times.
+        """
+        if self.http_util is None:
+            self.http_util = HttpUtil(self.logger)
+        result = self.http_util.Call(method=method, http_uri=http_uri, data=data, headers=headers, keep_alive=True)
+        if result is not None:
+            self.request_times.append((operation, int(self.http_util.last_call_duration * 1000)))
+        return result
+
+    def log_request_times(self):
+        self.logger.log("key vault request times: {0}".format(', '.join("{0} {1}ms".format(operation, duration)
+                                                                         for operation, duration in self.request_times)))
 
     def urljoin(self,*args):
         """
@@ -50,24 +75,27 @@ class KeyVaultUtil(object):
         try:
             self.logger.log("start creating kek secret")
             passphrase_encoded = base64.standard_b64encode(Passphrase)
-            keys_uri = self.urljoin(KeyVaultURL, "keys")
-
-            http_util = HttpUtil(self.logger)
-            headers = {}
-            result = http_util.Call(method='GET', http_uri=keys_uri, data=None, headers=headers)
-            http_util.connection.close()
-            """
-            get the access token 
-            """
-            self.logger.log("getting the access token.")
-            bearerHeader = result.getheader("www-authenticate")
+            parsed_url = urlparse(KeyVaultURL)
 
-            authorize_uri = self.get_authorize_uri(bearerHeader)
+            authorize_uri = KeyVaultUtil.authorize_uris.get(parsed_url.netloc)
             if authorize_uri is None:
-                self.logger.log("the authorize uri is None")
-                return None
+                keys_uri = self.urljoin(KeyVaultURL, "keys")
+                headers = {}
+                result = self.call('challenge', method='GET', http_uri=keys_uri, data=None, headers=headers)
+                # read the body, the connection is used for the next requests to the vault
+                result.read()
+                """
+                get the access token 
+                """
+                self.logger.log("getting the access token.")
+                bearerHeader = result.getheader("www-authenticate")
+
+                authorize_uri = self.get_authorize_uri(bearerHeader)
+                if authorize_uri is None:
+                    self.logger.log("the authorize uri is None")
+                    return None
+                KeyVaultUtil.authorize_uris[parsed_url.netloc] = authorize_uri
 
-            parsed_url = urlparse(KeyVaultURL)
             vault_domain = re.findall(r".*(vault.*)", parsed_url.netloc)[0]
             kv_resource_name = parsed_url.scheme + '://' + vault_domain
 
@@ -89,6 +117,7 @@ class KeyVaultUtil(object):
 
             secret_id = self.create_secret(access_token, KeyVaultURL, secret_value, KeyEncryptionAlgorithm, DiskEncryptionKeyFileName)
 
+            self.log_request_times()
             return secret_id
         except Exception as e:
             self.logger.log("Failed to create_kek_secret with error: {0}, stack trace: {1}".format(e, traceback.format_exc()))
@@ -121,9 +150,11 @@ class KeyVaultUtil(object):
             import adal
             prv_data = waagent.GetFileContents(prv_path)
             context = adal.AuthenticationContext(AuthorizeUri)
+            start_time = time.time()
             result_json = context.acquire_token_with_client_certificate(KeyVaultResourceName, AADClientID, prv_data, AADClientCertThumbprint)
+            self.request_times.append(('token', int((time.time() - start_time) * 1000)))
             access_token = result_json["accessToken"]
-            return access_token
+            return access_token, start_time + int(result_json["expiresIn"])
         elif self.is_scl_adal_available():
             # On RHEL, support for python-pip and the adal library are made available outside of default python via SCL 
             tmp_data = { "auth": AuthorizeUri, "resource": KeyVaultResourceName, "client": AADClientID, "certificate": prv_path, "thumbprint": AADClientCertThumbprint}
@@ -136,7 +167,8 @@ class KeyVaultUtil(object):
             access_token = subprocess.check_output(['scl', 'enable', 'python27', scl_args]).rstrip()
             if os.path.isfile(tmp_path): 
                 os.remove(tmp_path)
-            return access_token
+            # the expiry is not known, the token is not cached
+            return access_token, None
         else:
             raise Exception('Python ADAL library required for client certificate authentication was not found')
 
@@ -147,26 +179,41 @@ class KeyVaultUtil(object):
         if AADClientSecret and AADClientCertThumbprint:
             raise ValueError("Both AADClientSecret and AADClientCertThumbprint were supplied, when only one of these was expected.")
 
+        token_key = (AuthorizeUri, KeyVaultResourceName, AADClientID)
+        cached_token = KeyVaultUtil.access_tokens.get(token_key)
+        if cached_token is not None:
+            access_token, expires_on = cached_token
+            if time.time() < expires_on - KeyVaultUtil.token_expiry_margin_in_seconds:
+                self.logger.log("using the cached access token")
+                return access_token
+            del KeyVaultUtil.access_tokens[token_key]
+
         if AADClientCertThumbprint:
-            return self.get_access_token_with_certificate(KeyVaultResourceName, AuthorizeUri, AADClientID, AADClientCertThumbprint)
+            access_token, expires_on = self.get_access_token_with_certificate(KeyVaultResourceName, AuthorizeUri, AADClientID, AADClientCertThumbprint)
         else:
             # retrieve access token directly, adal library not required
             token_uri = AuthorizeUri + "/oauth2/token"
             request_content = "resource=" + urllib.quote(KeyVaultResourceName) + "&client_id=" + AADClientID + "&client_secret=" + urllib.quote(AADClientSecret) + "&grant_type=client_credentials"
             headers = {}
-            http_util = HttpUtil(self.logger)
-            result = http_util.Call(method='POST', http_uri=token_uri, data=request_content, headers=headers)
+            start_time = time.time()
+            result = self.call('token', method='POST', http_uri=token_uri, data=request_content, headers=headers)
 
             self.logger.log("{0} {1}".format(result.status, result.getheaders()))
             result_content = result.read()
             if result.status != httplib.OK and result.status != httplib.ACCEPTED:
                 self.logger.log(str(result_content))
                 return None
-            http_util.connection.close()
 
             result_json = json.loads(result_content)
             access_token = result_json["access_token"]
-            return access_token
+            if "expires_on" in result_json:
+                expires_on = int(result_json["expires_on"])
+            else:
+                expires_on = start_time + int(result_json["expires_in"])
+
+        if access_token and expires_on is not None:
+            KeyVaultUtil.access_tokens[token_key] = (access_token, expires_on)
+        return access_token
 
     """
     return the encrypted secret uri if success. else return None
@@ -184,15 +231,13 @@ class KeyVaultUtil(object):
             headers["Content-Type"] = "application/json"
             headers["Authorization"] = "Bearer " + str(AccessToken)
             relative_path = KeyEncryptionKeyURL + "/wrapkey" + '?api-version=' + self.api_version
-            http_util = HttpUtil(self.logger)
-            result = http_util.Call(method='POST', http_uri=relative_path, data=request_content, headers=headers)
+            result = self.call('wrapkey', method='POST', http_uri=relative_path, data=request_content, headers=headers)
 
             result_content = result.read()
             self.logger.log("result_content is: {0}".format(result_content))
             self.logger.log("{0} {1}".format(result.status, result.getheaders()))
             if result.status != httplib.OK and result.status != httplib.ACCEPTED:
                 return None
-            http_util.connection.close()
             result_json = json.loads(result_content)
             secret_value = result_json[u'value']
             return secret_value
@@ -215,18 +260,16 @@ class KeyVaultUtil(object):
             else:
                 request_content = '{{"value":"{0}","attributes":{{"enabled":"true"}},"tags":{{"DiskEncryptionKeyEncryptionAlgorithm":"{1}","DiskEncryptionKeyFileName":"{2}"}}}}'\
                     .format(str(secret_value), KeyEncryptionAlgorithm, DiskEncryptionKeyFileName)
-            http_util = HttpUtil(self.logger)
             headers = {}
             headers["Content-Type"] = "application/json"
             headers["Authorization"] = "Bearer " + AccessToken
-            result = http_util.Call(method='PUT', http_uri=secret_keyvault_uri + '?api-version=' + self.api_version, data=request_content, headers=headers)
+            result = self.call('secret', method='PUT', http_uri=secret_keyvault_uri + '?api-version=' + self.api_version, data=request_content, headers=headers)
 
             self.logger.log("{0} {1}".format(result.status, result.getheaders()))
             result_content = result.read()
             # Do NOT log the result_content. It contains the uploaded secret and we don't want that in the logs.
             result_json = json.loads(result_content)
             secret_id = result_json["id"]
-            http_util.connection.close()
             if result.status != httplib.OK and result.status != httplib.ACCEPTED:
                 self.logger.log("the result status failed.")
                 return None
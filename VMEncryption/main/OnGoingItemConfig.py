@@ -45,6 +45,7 @@ class OnGoingItemConfig(object):
         self.current_source_path = None
         self.current_total_copy_size = None
         self.current_slice_index = None
+        self.current_slice_count = None
         self.current_destination = None
         self.ongoing_item_config = ConfigUtil(encryption_environment.azure_crypt_ongoing_item_config_path, 'azure_crypt_ongoing_item_config', logger)
 
@@ -89,6 +90,13 @@ class OnGoingItemConfig(object):
         else:
             return long(current_slice_index_value)
 
+    def get_current_slice_count(self):
+        current_slice_count_value = self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentSliceCountKey)
+        if current_slice_count_value is None or current_slice_count_value == "":
+            return None
+        else:
+            return long(current_slice_count_value)
+
     def get_from_end(self):
         return self.ongoing_item_config.get_config(CommonVariables.OngoingItemFromEndKey)
 
@@ -130,6 +138,7 @@ class OnGoingItemConfig(object):
         self.current_source_path = self.get_current_source_path()
         self.current_total_copy_size = self.get_current_total_copy_size()
         self.current_slice_index = self.get_current_slice_index()
+        self.current_slice_count = self.get_current_slice_count()
         self.current_destination = self.get_current_destination()
 
     def commit(self):
@@ -179,6 +188,9 @@ class OnGoingItemConfig(object):
         current_block_size_pair = ConfigKeyValuePair(CommonVariables.OngoingItemCurrentBlockSizeKey, self.current_block_size)
         key_value_pairs.append(current_block_size_pair)
 
+        current_slice_count_pair = ConfigKeyValuePair(CommonVariables.OngoingItemCurrentSliceCountKey, self.current_slice_count)
+        key_value_pairs.append(current_slice_count_pair)
+
         self.ongoing_item_config.save_configs(key_value_pairs)
 
     def clear_config(self):
@@ -16,34 +16,185 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
 import os
 import os.path
 import sys
-import shlex
-from subprocess import *
-from CommandExecutor import CommandExecutor
+import threading
+import time
+import traceback
 from Common import CommonVariables
 from ConfigUtil import ConfigUtil
 from OnGoingItemConfig import *
 
 
+def read_range(fd, offset, length):
+    """
+    reads length bytes at offset, returns less only at the end of the device.
+    """
+    os.lseek(fd, offset, os.SEEK_SET)
+    chunks = []
+    remaining = length
+    while remaining > 0:
+        data = os.read(fd, remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    if len(chunks) == 1:
+        return chunks[0]
+    return b''.join(chunks)
+
+def write_range(fd, offset, data):
+    os.lseek(fd, offset, os.SEEK_SET)
+    view = memoryview(data)
+    written = 0
+    while written < len(data):
+        written += os.write(fd, view[written:])
+
+
+class SliceReader(object):
+    """
+    reads one slice of the source on a background thread, so the next slice
+    is read while the current one is written to the backup and the destination.
+    """
+    def __init__(self, fd, offset, length):
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+        self.data = None
+        self.error = None
+        self.thread = threading.Thread(target=self.read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def read(self):
+        try:
+            self.data = read_range(self.fd, self.offset, self.length)
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+class CopyBatchSizer(object):
+    """
+    picks how many slices are copied, journaled and checkpointed together.
+    the batch grows while the measured throughput lets it finish within
+    target_seconds, and is bounded by max_batch_size and by the memory
+    available for the batch being written and the batch being read, shared
+    with the other concurrent_copies running at the same time.
+    """
+    def __init__(self, block_size, max_batch_size, target_seconds, concurrent_copies=1):
+        self.block_size = block_size
+        self.concurrent_copies = max(1, concurrent_copies)
+        self.max_slice_count = max(1, max_batch_size // block_size)
+        self.target_seconds = target_seconds
+        self.throughput = None
+        self.slice_count = 1
+
+    def record(self, copied_bytes, elapsed_seconds):
+        if copied_bytes <= 0 or elapsed_seconds <= 0:
+            return
+        rate = copied_bytes / float(elapsed_seconds)
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput = 0.7 * self.throughput + 0.3 * rate
+
+    def get_memory_available(self):
+        try:
+            with open('/proc/meminfo', 'r') as meminfo:
+                for line in meminfo:
+                    if line.startswith('MemAvailable:'):
+                        return long(line.split()[1]) * 1024
+        except (IOError, OSError, ValueError):
+            pass
+        return None
+
+    def get_slice_count_limit(self):
+        limit = self.max_slice_count
+        memory_available = self.get_memory_available()
+        if memory_available is not None:
+            # two batches are in memory, all the copies use at most a quarter of what is available
+            limit = min(limit, memory_available // (8 * self.block_size * self.concurrent_copies))
+        return max(1, limit)
+
+    def next_slice_count(self):
+        if self.throughput is None:
+            return self.slice_count
+        wanted = int(self.throughput * self.target_seconds) // self.block_size
+        # grow by at most double per batch, shrink right away
+        self.slice_count = max(1, min(wanted, self.slice_count * 2, self.get_slice_count_limit()))
+        return self.slice_count
+
+
+class CopyProgressReporter(object):
+    """
+    reports the copy progress with throughput and eta, at most once per interval.
+    """
+    def __init__(self, hutil, status_prefix, interval_seconds):
+        self.hutil = hutil
+        self.status_prefix = status_prefix
+        self.interval_seconds = interval_seconds
+        self.start_time = time.time()
+        self.last_report_time = None
+        self.copied_bytes = 0
+
+    def add_copied_bytes(self, copied_bytes):
+        self.copied_bytes += copied_bytes
+
+    def report(self, current_slice_index, total_slice_size, remaining_bytes, force=False):
+        if not self.status_prefix:
+            return
+        now = time.time()
+        if not force and self.last_report_time is not None and now - self.last_report_time < self.interval_seconds:
+            return
+        self.last_report_time = now
+
+        msg = self.status_prefix + ': ' \
+            + str(int(current_slice_index / (float)(total_slice_size) * 100.0)) \
+            + '%'
+        elapsed = now - self.start_time
+        if self.copied_bytes > 0 and elapsed > 0:
+            throughput = self.copied_bytes / elapsed
+            msg += ' ({0:.1f} MB/s, ETA {1}s)'.format(throughput / 1048576.0, int(remaining_bytes / throughput))
+
+        self.hutil.do_status_report(operation='DataCopy',
+                                    status=CommonVariables.extension_success_status,
+                                    status_code=str(CommonVariables.success),
+                                    message=msg)
+
+
 class TransactionalCopyTask(object):
     """
     copy_total_size is in byte, skip_target_size is also in byte
     slice_size is in byte 50M
+
+    every slice is read once from the source, written to the backup slice file
+    and then to the destination. the backup slice file is removed only after
+    the destination is synced, so resume_copy can replay an interrupted slice.
+    consecutive slices are copied in batches sized by CopyBatchSizer, the
+    backup slice file holds the whole batch and the ongoing item config is
+    committed once per batch with the slice count of the next batch.
     """
-    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix=''):
+    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix='',
+                 max_batch_size=CommonVariables.max_copy_batch_size,
+                 status_report_interval=CommonVariables.copy_status_report_interval_in_seconds,
+                 concurrent_copies=1):
         """
         copy_total_size is in bytes.
         """
-        self.command_executer = CommandExecutor(logger)
         self.ongoing_item_config = ongoing_item_config
         self.total_size = self.ongoing_item_config.get_current_total_copy_size()
         self.block_size = self.ongoing_item_config.get_current_block_size()
         self.source_dev_full_path = self.ongoing_item_config.get_current_source_path()
         self.destination = self.ongoing_item_config.get_current_destination()
         self.current_slice_index = self.ongoing_item_config.get_current_slice_index()
+        self.current_slice_count = self.ongoing_item_config.get_current_slice_count() or 1
         self.from_end = self.ongoing_item_config.get_from_end()
 
         self.last_slice_size = self.total_size % self.block_size
@@ -56,239 +207,215 @@ class TransactionalCopyTask(object):
         self.patching = patching
         self.disk_util = disk_util
         self.hutil = hutil
-        self.tmpfs_mount_point = "/mnt/azure_encrypt_tmpfs"
-        self.slice_file_path = self.tmpfs_mount_point + "/slice_file"
-        self.copy_command = self.patching.dd_path
-
-    def resume_copy_internal(self, copy_slice_item_backup_file_size, skip_block, original_total_copy_size):
-        block_size_of_slice_item_backup = 512
-        #copy the left slice
-        if copy_slice_item_backup_file_size <= original_total_copy_size:
-            skip_of_slice_item_backup_file = copy_slice_item_backup_file_size / block_size_of_slice_item_backup
-            left_count = ((original_total_copy_size - copy_slice_item_backup_file_size) / block_size_of_slice_item_backup)
-            total_count = original_total_copy_size / block_size_of_slice_item_backup
-            original_device_skip_count = (self.block_size * skip_block) / block_size_of_slice_item_backup 
-            if left_count != 0:
-                dd_cmd = str(self.copy_command) \
-                       + ' if=' + self.source_dev_full_path \
-                       + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                       + ' bs=' + str(block_size_of_slice_item_backup) \
-                       + ' skip=' + str(original_device_skip_count + skip_of_slice_item_backup_file) \
-                       + ' seek=' + str(skip_of_slice_item_backup_file) \
-                       + ' count=' + str(left_count)
-
-                return_code = self.command_executer.Execute(dd_cmd)
-                if return_code != CommonVariables.process_success:
-                    return return_code
-
-            dd_cmd = str(self.copy_command) \
-                   + ' if=' + self.encryption_environment.copy_slice_item_backup_file \
-                   + ' of=' + self.destination \
-                   + ' bs=' + str(block_size_of_slice_item_backup) \
-                   + ' seek=' + str(original_device_skip_count) \
-                   + ' count=' + str(total_count)
-
-            return_code = self.command_executer.Execute(dd_cmd)
-            if return_code != CommonVariables.process_success:
-                return return_code
-            else:
-                self.current_slice_index += 1
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                return return_code
+        self.batch_sizer = CopyBatchSizer(block_size=self.block_size,
+                                          max_batch_size=max_batch_size,
+                                          target_seconds=CommonVariables.copy_batch_target_seconds,
+                                          concurrent_copies=concurrent_copies)
+        self.progress_reporter = CopyProgressReporter(hutil=hutil,
+                                                      status_prefix=status_prefix,
+                                                      interval_seconds=status_report_interval)
+
+    def get_slice_range(self, slice_index):
+        """
+        returns the (offset, length) of the slice copied at slice_index,
+        the length of the partial slice is last_slice_size and may be zero.
+        """
+        if self.from_end.lower() == 'true':
+            skip_block = self.total_slice_size - slice_index - 1
+            is_last_slice = (slice_index == 0)
         else:
+            skip_block = slice_index
+            is_last_slice = (slice_index == self.total_slice_size - 1)
+
+        if is_last_slice:
+            return (skip_block * self.block_size, self.last_slice_size)
+        else:
+            return (skip_block * self.block_size, self.block_size)
+
+    def get_batch_range(self, slice_index, slice_count):
+        """
+        returns the (offset, length) covering slice_count slices from slice_index,
+        the slices of a batch are adjacent in both directions.
+        """
+        first_offset, first_length = self.get_slice_range(slice_index)
+        last_offset, last_length = self.get_slice_range(slice_index + slice_count - 1)
+        start = min(first_offset, last_offset)
+        end = max(first_offset + first_length, last_offset + last_length)
+        return (start, end - start)
+
+    def get_remaining_bytes(self):
+        if self.current_slice_index >= self.total_slice_size:
+            return 0
+        return self.get_batch_range(self.current_slice_index, self.total_slice_size - self.current_slice_index)[1]
+
+    def open_source(self):
+        return os.open(self.source_dev_full_path, os.O_RDONLY)
+
+    def open_destination(self):
+        return os.open(self.destination, os.O_WRONLY | os.O_CREAT, 0o600)
+
+    def write_backup_slice(self, data):
+        backup_fd = os.open(self.encryption_environment.copy_slice_item_backup_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            write_range(backup_fd, 0, data)
+            os.fsync(backup_fd)
+        finally:
+            os.close(backup_fd)
+
+    def remove_backup_slice(self):
+        if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
+            os.remove(self.encryption_environment.copy_slice_item_backup_file)
+
+    def commit_slice_index(self):
+        self.ongoing_item_config.current_slice_index = self.current_slice_index
+        self.ongoing_item_config.current_slice_count = self.current_slice_count
+        self.ongoing_item_config.commit()
+
+    def resume_copy_internal(self, copy_slice_item_backup_file_size, offset, original_total_copy_size, slice_count):
+        if copy_slice_item_backup_file_size > original_total_copy_size:
             self.logger.log(msg="copy_slice_item_backup_file_size is bigger than original_total_copy_size",
                             level=CommonVariables.ErrorLevel)
             return CommonVariables.backup_slice_file_error
 
+        try:
+            backup_fd = os.open(self.encryption_environment.copy_slice_item_backup_file, os.O_RDWR)
+            try:
+                #copy the left slice
+                if copy_slice_item_backup_file_size < original_total_copy_size:
+                    source_fd = self.open_source()
+                    try:
+                        left_data = read_range(source_fd,
+                                               offset + copy_slice_item_backup_file_size,
+                                               original_total_copy_size - copy_slice_item_backup_file_size)
+                    finally:
+                        os.close(source_fd)
+                    write_range(backup_fd, copy_slice_item_backup_file_size, left_data)
+                    os.fsync(backup_fd)
+                data = read_range(backup_fd, 0, original_total_copy_size)
+            finally:
+                os.close(backup_fd)
+
+            destination_fd = self.open_destination()
+            try:
+                write_range(destination_fd, offset, data)
+                os.fsync(destination_fd)
+            finally:
+                os.close(destination_fd)
+        except (IOError, OSError) as e:
+            self.logger.log(msg="failed to replay the slice item backup file: {0}, stack trace: {1}".format(e, traceback.format_exc()),
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+
+        self.current_slice_index += slice_count
+        self.commit_slice_index()
+        self.remove_backup_slice()
+        return CommonVariables.process_success
+
     def resume_copy(self):
-        if self.from_end.lower() == 'true':
-            skip_block = (self.total_slice_size - self.current_slice_index - 1)
-        else:
-            skip_block = self.current_slice_index
+        """
+        replays the batch of current_slice_count slices that was being copied
+        when the copy was interrupted, using the slice item backup file.
+        """
+        slice_count = min(self.current_slice_count, self.total_slice_size - self.current_slice_index)
+        if slice_count <= 0:
+            return CommonVariables.process_success
 
-        return_code = CommonVariables.process_success
+        offset, length = self.get_batch_range(self.current_slice_index, slice_count)
+        if length == 0:
+            self.logger.log(msg="the last slice",
+                            level=CommonVariables.WarningLevel)
+            return CommonVariables.process_success
 
-        if self.current_slice_index == 0:
-            if self.last_slice_size > 0:
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                    return_code = self.resume_copy_internal(copy_slice_item_backup_file_size=copy_slice_item_backup_file_size,
-                                                           skip_block=skip_block,
-                                                           original_total_copy_size=self.last_slice_size)
-                else:
-                    self.logger.log(msg="1. the slice item backup file not exists.",
-                                    level=CommonVariables.WarningLevel)
-            else:
-                self.logger.log(msg="the last slice",
-                                level=CommonVariables.WarningLevel)
-        else:
-            if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                return_code = self.resume_copy_internal(copy_slice_item_backup_file_size, skip_block=skip_block, original_total_copy_size=self.block_size)
-            else:
-                self.logger.log(msg="2. unfortunately the slice item backup file not exists.",
-                                level=CommonVariables.WarningLevel)
-        return return_code
-
-    def copy_last_slice(self, skip_block):
-        block_size_of_last_slice = 512
-        skip_of_last_slice = (skip_block * self.block_size) / block_size_of_last_slice
-        count_of_last_slice = self.last_slice_size / block_size_of_last_slice
-
-        copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                         to_device = self.destination,
-                                         skip=skip_of_last_slice,
-                                         seek=skip_of_last_slice,
-                                         block_size=block_size_of_last_slice,
-                                         count = count_of_last_slice)
-        return copy_result
+        if not os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
+            self.logger.log(msg="the slice item backup file not exists.",
+                            level=CommonVariables.WarningLevel)
+            return CommonVariables.process_success
+
+        copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
+        return self.resume_copy_internal(copy_slice_item_backup_file_size=copy_slice_item_backup_file_size,
+                                         offset=offset,
+                                         original_total_copy_size=length,
+                                         slice_count=slice_count)
 
     def begin_copy(self):
         """
         check the device_item size first, cut it
         """
-        self.resume_copy()
-        if self.from_end.lower() == 'true':
-            while self.current_slice_index < self.total_slice_size:
-                skip_block = (self.total_slice_size - self.current_slice_index - 1)
-
-                if self.current_slice_index == 0:
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the 0 index.")
-                else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
-
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
-
-                self.current_slice_index += 1
-
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
+        return_code = self.resume_copy()
+        if return_code != CommonVariables.process_success:
+            return return_code
 
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
+        source_fd = None
+        destination_fd = None
+        reader = None
+        try:
+            source_fd = self.open_source()
+            destination_fd = self.open_destination()
 
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
+            first_slice_count = self.batch_sizer.next_slice_count()
+            if self.current_slice_count != first_slice_count:
+                self.current_slice_count = first_slice_count
+                self.commit_slice_index()
 
-            return CommonVariables.process_success
-        else:
             while self.current_slice_index < self.total_slice_size:
-                skip_block = self.current_slice_index
-
-                if self.current_slice_index == (self.total_slice_size - 1):
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the last slice index.")
+                batch_start_time = time.time()
+                slice_count = min(self.current_slice_count, self.total_slice_size - self.current_slice_index)
+                offset, length = self.get_batch_range(self.current_slice_index, slice_count)
+
+                if length > 0:
+                    if reader is None:
+                        reader = SliceReader(source_fd, offset, length)
+                    data = reader.result()
+                    reader = None
+                    if len(data) != length:
+                        self.logger.log(msg="short read of {0} bytes at offset {1} of {2}, expected {3}".format(len(data), offset, self.source_dev_full_path, length),
+                                        level=CommonVariables.ErrorLevel)
+                        return CommonVariables.copy_data_error
                 else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
-
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
-
-                self.current_slice_index += 1
-
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
-
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
-
-                self.hutil.do_status_report(operation='DataCopy',
-                                            status=CommonVariables.extension_success_status,
-                                            status_code=str(CommonVariables.success),
-                                            message=msg)
-
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
+                    data = None
+                    self.logger.log(msg = "the last slice size is zero, so skip the slice index {0}.".format(self.current_slice_index))
+
+                # read the next batch while this one is written
+                next_slice_index = self.current_slice_index + slice_count
+                next_slice_count = self.batch_sizer.next_slice_count()
+                if next_slice_index < self.total_slice_size:
+                    next_offset, next_length = self.get_batch_range(next_slice_index,
+                                                                    min(next_slice_count, self.total_slice_size - next_slice_index))
+                    if next_length > 0:
+                        reader = SliceReader(source_fd, next_offset, next_length)
+
+                if data is not None:
+                    self.copy_internal(data, destination_fd, offset)
+                    self.batch_sizer.record(length, time.time() - batch_start_time)
+                    self.progress_reporter.add_copied_bytes(length)
+
+                self.current_slice_index = next_slice_index
+                self.current_slice_count = next_slice_count
+                self.commit_slice_index()
+
+                self.progress_reporter.report(current_slice_index=self.current_slice_index,
+                                              total_slice_size=self.total_slice_size,
+                                              remaining_bytes=self.get_remaining_bytes(),
+                                              force=(self.current_slice_index >= self.total_slice_size))
             return CommonVariables.process_success
-
-    """
-    TODO: if the copy failed?
-    """
-    def copy_internal(self, from_device, to_device,  block_size, skip=0, seek=0, count=1):
+        except (IOError, OSError) as e:
+            self.logger.log(msg="failed to copy slice {0} of {1}: {2}, stack trace: {3}".format(self.current_slice_index, self.source_dev_full_path, e, traceback.format_exc()),
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+        finally:
+            if reader is not None:
+                reader.thread.join()
+            if source_fd is not None:
+                os.close(source_fd)
+            if destination_fd is not None:
+                os.close(destination_fd)
+
+    def copy_internal(self, data, destination_fd, offset):
         """
-        first, copy the data to the middle cache
+        first, journal the batch to the backup slice file, then write it to the
+        destination. the backup is cleared only when the destination is synced.
         """
-        dd_cmd = str(self.copy_command) \
-               + ' if=' + from_device \
-               + ' of=' + self.slice_file_path \
-               + ' bs=' + str(block_size) \
-               + ' skip=' + str(skip) \
-               + ' count=' + str(count)
-
-        return_code = self.command_executer.Execute(dd_cmd)
-        if return_code != CommonVariables.process_success:
-            self.logger.log(msg="{0} is {1}".format(dd_cmd, return_code), level=CommonVariables.ErrorLevel)
-            return return_code
-        else:
-            slice_file_size = os.path.getsize(self.slice_file_path)
-            self.logger.log(msg=("slice_file_size is: {0}".format(slice_file_size)))
-            """
-            second, copy the data in the middle cache to the backup slice.
-            """
-            backup_slice_item_cmd = str(self.copy_command) \
-                                  + ' if=' + self.slice_file_path \
-                                  + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                                  + ' bs=' + str(block_size) \
-                                  + ' count=' + str(count)
-            backup_slice_args = shlex.split(backup_slice_item_cmd)
-            backup_process = Popen(backup_slice_args)
-            self.logger.log("backup_slice_item_cmd is:{0}".format(backup_slice_item_cmd))
-
-            """
-            third, copy the data in the middle cache to the target device.
-            """
-            dd_cmd = str(self.copy_command) + ' if=' + self.slice_file_path + ' of=' + to_device + ' bs=' + str(block_size) + ' seek=' + str(seek) + ' count=' + str(count)
-            return_code = self.command_executer.Execute(dd_cmd)
-            if return_code != CommonVariables.process_success:
-                self.logger.log(msg=("{0} is: {1}".format(dd_cmd, return_code)), level = CommonVariables.ErrorLevel)
-            else:
-                #the copy done correctly, so clear the backup slice file item.
-                backup_process.kill()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    self.logger.log(msg = "clean up the backup file")
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                if os.path.exists(self.slice_file_path):
-                    self.logger.log(msg = "clean up the slice file")
-                    os.remove(self.slice_file_path)
-            return return_code
-
-    def prepare_mem_fs(self):
-        self.disk_util.make_sure_path_exists(self.tmpfs_mount_point)
-        commandToExecute = self.patching.mount_path + " -t tmpfs -o size=" + str(self.block_size + 1024) + " tmpfs " + self.tmpfs_mount_point
-        self.logger.log("prepare mem fs script is: {0}".format(commandToExecute))
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
-
-    def clear_mem_fs(self):
-        commandToExecute = self.patching.umount_path + " " + self.tmpfs_mount_point
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
+        self.write_backup_slice(data)
+        write_range(destination_fd, offset, data)
+        os.fsync(destination_fd)
+        self.remove_backup_slice()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import os
+import re
+import struct
+import time
+import traceback
+from Common import CommonVariables
+from CommandExecutor import CommandExecutor, ProcessCommunicator
+from TransactionalCopyTask import SliceReader, read_range, write_range
+
+# python 2 has no os.SEEK_DATA/os.SEEK_HOLE, these are the linux values
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+
+def complement_ranges(ranges, total_size):
+    """
+    returns the (offset, length) ranges of [0, total_size) not covered by ranges.
+    """
+    result = []
+    position = 0
+    for offset, length in sorted(ranges):
+        if offset > position:
+            result.append((position, offset - position))
+        position = max(position, offset + length)
+    if position < total_size:
+        result.append((position, total_size - position))
+    return result
+
+def split_ranges(ranges, chunk_size):
+    """
+    splits the ranges at the multiples of chunk_size, so every read and write
+    but the first and last of a range is chunk_size long and chunk_size aligned.
+    """
+    for offset, length in ranges:
+        end = offset + length
+        while offset < end:
+            chunk_end = min(end, (offset // chunk_size + 1) * chunk_size)
+            yield (offset, chunk_end - offset)
+            offset = chunk_end
+
+def parse_ext_free_ranges(dumpe2fs_output):
+    """
+    returns the size in bytes and the free (offset, length) ranges of an ext2/3/4
+    file system from the block group listing of dumpe2fs.
+    """
+    block_size = None
+    block_count = None
+    free_blocks = []
+    for line in dumpe2fs_output.splitlines():
+        if line.startswith('Block size:'):
+            block_size = int(line.split(':')[1])
+        elif line.startswith('Block count:'):
+            block_count = int(line.split(':')[1])
+        elif line.startswith('  Free blocks:'):
+            # the free blocks of a group, e.g. "  Free blocks: 5258-8192, 9000",
+            # unlike the "Free blocks:" count of the superblock
+            for item in line.split(':', 1)[1].split(','):
+                item = item.strip()
+                if not item:
+                    continue
+                first, _, last = item.partition('-')
+                free_blocks.append((int(first), int(last or first)))
+    if block_size is None or block_count is None:
+        raise ValueError('block size or block count missing from the dumpe2fs output')
+    free_ranges = [(first * block_size, (last - first + 1) * block_size) for first, last in free_blocks]
+    return block_count * block_size, free_ranges
+
+def parse_xfs_free_ranges(superblock_output, freesp_output):
+    """
+    returns the size in bytes and the free (offset, length) ranges of an xfs file
+    system from the superblock fields and the free extents dumped by xfs_db freesp -d.
+    """
+    superblock = dict(re.findall(r'^(\w+) = (\d+)\s*$', superblock_output, re.MULTILINE))
+    block_size = int(superblock['blocksize'])
+    ag_blocks = int(superblock['agblocks'])
+    total_size = int(superblock['dblocks']) * block_size
+    free_ranges = []
+    for line in freesp_output.splitlines():
+        # one "agno agbno len" line per free extent, followed by a histogram with more columns
+        fields = line.split()
+        if len(fields) == 3 and all(field.isdigit() for field in fields):
+            ag_number, ag_block, length = [int(field) for field in fields]
+            free_ranges.append(((ag_number * ag_blocks + ag_block) * block_size, length * block_size))
+    return total_size, free_ranges
+
+
+class UsedSpaceCopyTask(object):
+    """
+    copies the blocks of source in use by its file system to destination at the
+    same offsets, e.g. from a partition to the dm-crypt device encrypting it in
+    place. the used ranges are the complement of the free extents of ext2/3/4
+    and xfs, read from the unmounted file system. for other contents the data
+    ranges are found with SEEK_DATA/SEEK_HOLE, which on a block device is the
+    whole device, and all zero chunks are not written like dd conv=sparse did.
+    """
+    def __init__(self, logger, hutil, source, destination,
+                 chunk_size=CommonVariables.used_space_copy_chunk_size,
+                 status_report_interval=CommonVariables.copy_status_report_interval_in_seconds):
+        self.logger = logger
+        self.hutil = hutil
+        self.source = source
+        self.destination = destination
+        self.chunk_size = chunk_size
+        self.status_report_interval = status_report_interval
+        self.command_executor = CommandExecutor(logger)
+        self.copied_bytes = 0
+        self.total_bytes = 0
+        self.last_report_time = None
+
+    def get_fs_type(self, fd):
+        header = read_range(fd, 0, 2048)
+        if header[0:4] == b'XFSB':
+            return 'xfs'
+        if len(header) >= 1082 and struct.unpack('<H', header[1080:1082])[0] == 0xEF53:
+            return 'ext'
+        return None
+
+    def execute(self, command):
+        proc_comm = ProcessCommunicator()
+        self.command_executor.Execute(command, raise_exception_on_failure=True, communicator=proc_comm, suppress_logging=True)
+        return proc_comm.stdout
+
+    def get_ext_used_ranges(self):
+        total_size, free_ranges = parse_ext_free_ranges(self.execute('dumpe2fs {0}'.format(self.source)))
+        return complement_ranges(free_ranges, total_size)
+
+    def get_xfs_used_ranges(self):
+        superblock_output = self.execute('xfs_db -r -c "sb 0" -c "p blocksize" -c "p agblocks" -c "p dblocks" {0}'.format(self.source))
+        freesp_output = self.execute('xfs_db -r -c "freesp -d" {0}'.format(self.source))
+        total_size, free_ranges = parse_xfs_free_ranges(superblock_output, freesp_output)
+        return complement_ranges(free_ranges, total_size)
+
+    def get_data_ranges(self, fd):
+        size = os.lseek(fd, 0, os.SEEK_END)
+        ranges = []
+        offset = 0
+        try:
+            while offset < size:
+                try:
+                    data_offset = os.lseek(fd, offset, SEEK_DATA)
+                except OSError as e:
+                    if e.errno == errno.ENXIO:
+                        break
+                    raise
+                hole_offset = os.lseek(fd, data_offset, SEEK_HOLE)
+                ranges.append((data_offset, hole_offset - data_offset))
+                offset = hole_offset
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            self.logger.log("SEEK_DATA is not supported on {0}, copying all of it".format(self.source))
+            return [(0, size)]
+        return ranges
+
+    def get_used_ranges(self, source_fd):
+        """
+        returns the ranges to copy and whether all zero chunks of them can be skipped.
+        """
+        fs_type = self.get_fs_type(source_fd)
+        try:
+            if fs_type == 'ext':
+                return self.get_ext_used_ranges(), False
+            if fs_type == 'xfs':
+                return self.get_xfs_used_ranges(), False
+        except Exception as e:
+            self.logger.log(msg="failed to get the free extents of the {0} file system on {1}: {2}".format(fs_type, self.source, e),
+                            level=CommonVariables.WarningLevel)
+        return self.get_data_ranges(source_fd), True
+
+    def report_progress(self, force=False):
+        now = time.time()
+        if not force and self.last_report_time is not None and now - self.last_report_time < self.status_report_interval:
+            return
+        self.last_report_time = now
+        msg = 'OS disk encryption: {0} of {1} MB copied ({2}%)'.format(self.copied_bytes // 1048576,
+                                                                      self.total_bytes // 1048576,
+                                                                      int(self.copied_bytes * 100.0 / max(1, self.total_bytes)))
+        self.logger.log(msg)
+        self.hutil.do_status_report(operation='DataCopy',
+                                    status=CommonVariables.extension_success_status,
+                                    status_code=str(CommonVariables.success),
+                                    message=msg)
+
+    def begin_copy(self):
+        source_fd = None
+        destination_fd = None
+        reader = None
+        try:
+            source_fd = os.open(self.source, os.O_RDONLY)
+            destination_fd = os.open(self.destination, os.O_WRONLY)
+
+            ranges, sparse = self.get_used_ranges(source_fd)
+            self.total_bytes = sum(length for offset, length in ranges)
+            source_size = os.lseek(source_fd, 0, os.SEEK_END)
+            self.logger.log("copying {0} bytes in {1} ranges of the {2} bytes of {3} to {4}".format(self.total_bytes, len(ranges), source_size,
+                                                                                                 self.source, self.destination))
+            chunks = split_ranges(ranges, self.chunk_size)
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                reader = SliceReader(source_fd, next_chunk[0], next_chunk[1])
+            while next_chunk is not None:
+                offset, length = next_chunk
+                data = reader.result()
+                if len(data) != length:
+                    self.logger.log(msg="short read of {0} bytes at offset {1} of {2}, expected {3}".format(len(data), offset, self.source, length),
+                                    level=CommonVariables.ErrorLevel)
+                    return CommonVariables.copy_data_error
+                # read the next chunk while this one is written, it is past this one so the copy can be in place
+                next_chunk = next(chunks, None)
+                reader = SliceReader(source_fd, next_chunk[0], next_chunk[1]) if next_chunk is not None else None
+
+                if not (sparse and data == b'\0' * length):
+                    write_range(destination_fd, offset, data)
+                self.copied_bytes += length
+                self.report_progress()
+            os.fsync(destination_fd)
+            self.report_progress(force=True)
+            return CommonVariables.process_success
+        except (IOError, OSError) as e:
+            self.logger.log(msg="failed to copy {0} to {1} after {2} bytes: {3}, stack trace: {4}".format(self.source, self.destination, self.copied_bytes,
+                                                                                                      e, traceback.format_exc()),
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+        finally:
+            if reader is not None:
+                try:
+                    reader.result()
+                except (IOError, OSError):
+                    pass
+            if source_fd is not None:
+                os.close(source_fd)
+            if destination_fd is not None:
+                os.close(destination_fd)
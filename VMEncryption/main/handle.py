@@ -25,6 +25,7 @@ import subprocess
 import sys
 import time
 import tempfile
+import threading
 import traceback
 import uuid
 import shutil
@@ -43,6 +44,7 @@ from check_util import CheckUtil
 from DecryptionMarkConfig import DecryptionMarkConfig
 from EncryptionMarkConfig import EncryptionMarkConfig
 from EncryptionEnvironment import EncryptionEnvironment
+from EncryptionScheduler import EncryptionScheduler, SynchronizedStatusReporter
 from OnGoingItemConfig import OnGoingItemConfig
 from ProcessLock import ProcessLock
 from CommandExecutor import CommandExecutor, ProcessCommunicator
@@ -397,18 +399,56 @@ def none_or_empty(obj):
         return False
 
 
+se_linux_lock = threading.Lock()
+se_linux_disable_count = 0
+se_linux_disabled = False
+
+
 def toggle_se_linux_for_centos7(disable):
+    """
+    calls to disable and enable are paired, concurrent encryptions disable se linux
+    once and it is enabled again when the last of them is done.
+    """
+    global se_linux_disable_count, se_linux_disabled
     if DistroPatcher.distro_info[0].lower() == 'centos' and DistroPatcher.distro_info[1].startswith('7.0'):
-        if disable:
-            se_linux_status = encryption_environment.get_se_linux()
-            if se_linux_status.lower() == 'enforcing':
-                encryption_environment.disable_se_linux()
-                return True
-        else:
-            encryption_environment.enable_se_linux()
+        with se_linux_lock:
+            if disable:
+                se_linux_disable_count += 1
+                if se_linux_disable_count == 1:
+                    se_linux_status = encryption_environment.get_se_linux()
+                    if se_linux_status.lower() == 'enforcing':
+                        encryption_environment.disable_se_linux()
+                        se_linux_disabled = True
+                return se_linux_disabled
+            else:
+                se_linux_disable_count = max(0, se_linux_disable_count - 1)
+                if se_linux_disable_count == 0 and se_linux_disabled:
+                    encryption_environment.enable_se_linux()
+                    se_linux_disabled = False
     return False
 
 
+def get_device_item_path(device_item):
+    if os.path.exists(os.path.join('/dev/', device_item.name)):
+        return os.path.join('/dev/', device_item.name)
+    else:
+        return os.path.join('/dev/mapper/', device_item.name)
+
+
+def get_slot_disk_util(slot, status_reporter, concurrent_copies):
+    """
+    returns the DiskUtil of the encryption worker in slot, which keeps its ongoing
+    item config and copy files apart from the other workers and shares the copy
+    memory with concurrent_copies workers.
+    """
+    slot_disk_util = DiskUtil(hutil=status_reporter,
+                              patching=DistroPatcher,
+                              logger=logger,
+                              encryption_environment=encryption_environment.get_slot_environment(slot))
+    slot_disk_util.concurrent_copies = concurrent_copies
+    return slot_disk_util
+
+
 def mount_encrypted_disks(disk_util, bek_util, passphrase_file, encryption_config):
 
     # mount encrypted resource disk
@@ -483,11 +523,12 @@ def main():
             daemon()
 
 
-def mark_encryption(command, volume_type, disk_format_query):
+def mark_encryption(command, volume_type, disk_format_query, max_concurrent_encryptions=None):
     encryption_marker = EncryptionMarkConfig(logger, encryption_environment)
     encryption_marker.command = command
     encryption_marker.volume_type = volume_type
     encryption_marker.diskFormatQuery = disk_format_query
+    encryption_marker.max_concurrent_encryptions = max_concurrent_encryptions
     encryption_marker.commit()
     return encryption_marker
 
@@ -688,7 +729,8 @@ def enable_encryption():
                 logger.log(msg="config file exists and passphrase file exists.", level=CommonVariables.WarningLevel)
                 encryption_marker = mark_encryption(command=extension_parameter.command,
                                                     volume_type=extension_parameter.VolumeType,
-                                                    disk_format_query=extension_parameter.DiskFormatQuery)
+                                                    disk_format_query=extension_parameter.DiskFormatQuery,
+                                                    max_concurrent_encryptions=extension_parameter.MaxConcurrentEncryptions)
                 start_daemon('EnableEncryption')
             else:
                 """
@@ -763,7 +805,8 @@ def enable_encryption():
 
                 encryption_marker = mark_encryption(command=extension_parameter.command,
                                                     volume_type=extension_parameter.VolumeType,
-                                                    disk_format_query=extension_parameter.DiskFormatQuery)
+                                                    disk_format_query=extension_parameter.DiskFormatQuery,
+                                                    max_concurrent_encryptions=extension_parameter.MaxConcurrentEncryptions)
 
                 if kek_secret_id_created:
                     hutil.do_exit(exit_code=0,
@@ -790,7 +833,7 @@ def enable_encryption():
                       message=message)
 
 
-def enable_encryption_format(passphrase, disk_format_query, disk_util, force=False):
+def enable_encryption_format(passphrase, disk_format_query, disk_util, force=False, max_concurrent_encryptions=1):
     logger.log('enable_encryption_format')
     logger.log('disk format query is {0}'.format(disk_format_query))
 
@@ -803,6 +846,7 @@ def enable_encryption_format(passphrase, disk_format_query, disk_util, force=Fal
     else:
         raise Exception("JSON parse error. Input: {0}".format(disk_format_query))
 
+    items_to_format = []
     for encryption_item in encryption_format_items:
         dev_path_in_query = None
 
@@ -821,66 +865,73 @@ def enable_encryption_format(passphrase, disk_format_query, disk_util, force=Fal
         else:
             device_item = devices[0]
             if device_item.file_system is None or device_item.file_system == "" or force:
-                if device_item.mount_point:
-                    disk_util.swapoff()
-                    disk_util.umount(device_item.mount_point)
-                mapper_name = str(uuid.uuid4())
-                logger.log("encrypting " + str(device_item))
-                encrypted_device_path = os.path.join(CommonVariables.dev_mapper_root, mapper_name)
-                try:
-                    se_linux_status = None
-                    if DistroPatcher.distro_info[0].lower() == 'centos' and DistroPatcher.distro_info[1].startswith('7.0'):
-                        se_linux_status = encryption_environment.get_se_linux()
-                        if se_linux_status.lower() == 'enforcing':
-                            encryption_environment.disable_se_linux()
-                    encrypt_result = disk_util.encrypt_disk(dev_path=dev_path_in_query, passphrase_file=passphrase, mapper_name=mapper_name, header_file=None)
-                finally:
-                    if DistroPatcher.distro_info[0].lower() == 'centos' and DistroPatcher.distro_info[1].startswith('7.0'):
-                        if se_linux_status is not None and se_linux_status.lower() == 'enforcing':
-                            encryption_environment.enable_se_linux()
-
-                if encrypt_result == CommonVariables.process_success:
-                    # TODO: let customer specify the default file system in the
-                    # parameter
-                    file_system = None
-                    if "file_system" in encryption_item and encryption_item["file_system"] != "":
-                        file_system = encryption_item["file_system"]
-                    else:
-                        file_system = CommonVariables.default_file_system
-                    format_disk_result = disk_util.format_disk(dev_path=encrypted_device_path, file_system=file_system)
-                    if format_disk_result != CommonVariables.process_success:
-                        logger.log(msg=("format of disk {0} failed with result: {1}".format(encrypted_device_path, format_disk_result)), level=CommonVariables.ErrorLevel)
-                    crypt_item_to_update = CryptItem()
-                    crypt_item_to_update.mapper_name = mapper_name
-                    crypt_item_to_update.dev_path = dev_path_in_query
-                    crypt_item_to_update.luks_header_path = None
-                    crypt_item_to_update.file_system = file_system
-                    crypt_item_to_update.uses_cleartext_key = False
-                    crypt_item_to_update.current_luks_slot = 0
+                items_to_format.append((dev_path_in_query, device_item, encryption_item))
+            else:
+                logger.log(msg=("the item fstype is not empty {0}".format(device_item.file_system)))
 
-                    if "name" in encryption_item and encryption_item["name"] != "":
-                        crypt_item_to_update.mount_point = os.path.join("/mnt/", str(encryption_item["name"]))
-                    else:
-                        crypt_item_to_update.mount_point = os.path.join("/mnt/", mapper_name)
+    def encrypt_format_item(item_to_format, slot):
+        dev_path_in_query, device_item, encryption_item = item_to_format
+        if device_item.mount_point:
+            disk_util.swapoff()
+            disk_util.umount(device_item.mount_point)
+        mapper_name = str(uuid.uuid4())
+        logger.log("encrypting " + str(device_item))
+        encrypted_device_path = os.path.join(CommonVariables.dev_mapper_root, mapper_name)
+        try:
+            toggle_se_linux_for_centos7(True)
+            encrypt_result = disk_util.encrypt_disk(dev_path=dev_path_in_query, passphrase_file=passphrase, mapper_name=mapper_name, header_file=None)
+        finally:
+            toggle_se_linux_for_centos7(False)
+
+        if encrypt_result == CommonVariables.process_success:
+            # TODO: let customer specify the default file system in the
+            # parameter
+            file_system = None
+            if "file_system" in encryption_item and encryption_item["file_system"] != "":
+                file_system = encryption_item["file_system"]
+            else:
+                file_system = CommonVariables.default_file_system
+            format_disk_result = disk_util.format_disk(dev_path=encrypted_device_path, file_system=file_system)
+            if format_disk_result != CommonVariables.process_success:
+                logger.log(msg=("format of disk {0} failed with result: {1}".format(encrypted_device_path, format_disk_result)), level=CommonVariables.ErrorLevel)
+            crypt_item_to_update = CryptItem()
+            crypt_item_to_update.mapper_name = mapper_name
+            crypt_item_to_update.dev_path = dev_path_in_query
+            crypt_item_to_update.luks_header_path = None
+            crypt_item_to_update.file_system = file_system
+            crypt_item_to_update.uses_cleartext_key = False
+            crypt_item_to_update.current_luks_slot = 0
+
+            if "name" in encryption_item and encryption_item["name"] != "":
+                crypt_item_to_update.mount_point = os.path.join("/mnt/", str(encryption_item["name"]))
+            else:
+                crypt_item_to_update.mount_point = os.path.join("/mnt/", mapper_name)
 
-                    # allow override through the new full_mount_point field
-                    if "full_mount_point" in encryption_item and encryption_item["full_mount_point"] != "":
-                        crypt_item_to_update.mount_point = os.path.join(str(encryption_item["full_mount_point"]))
+            # allow override through the new full_mount_point field
+            if "full_mount_point" in encryption_item and encryption_item["full_mount_point"] != "":
+                crypt_item_to_update.mount_point = os.path.join(str(encryption_item["full_mount_point"]))
 
-                    logger.log(msg="modifying/removing the entry for unencrypted drive in fstab", level=CommonVariables.InfoLevel)
-                    disk_util.modify_fstab_entry_encrypt(crypt_item_to_update.mount_point, os.path.join(CommonVariables.dev_mapper_root, mapper_name))
+            logger.log(msg="modifying/removing the entry for unencrypted drive in fstab", level=CommonVariables.InfoLevel)
+            disk_util.modify_fstab_entry_encrypt(crypt_item_to_update.mount_point, os.path.join(CommonVariables.dev_mapper_root, mapper_name))
 
-                    disk_util.make_sure_path_exists(crypt_item_to_update.mount_point)
-                    update_crypt_item_result = disk_util.add_crypt_item(crypt_item_to_update, passphrase)
-                    if not update_crypt_item_result:
-                        logger.log(msg="update crypt item failed", level=CommonVariables.ErrorLevel)
+            disk_util.make_sure_path_exists(crypt_item_to_update.mount_point)
+            update_crypt_item_result = disk_util.add_crypt_item(crypt_item_to_update, passphrase)
+            if not update_crypt_item_result:
+                logger.log(msg="update crypt item failed", level=CommonVariables.ErrorLevel)
 
-                    mount_result = disk_util.mount_filesystem(dev_path=encrypted_device_path, mount_point=crypt_item_to_update.mount_point)
-                    logger.log(msg=("mount result is {0}".format(mount_result)))
-                else:
-                    logger.log(msg="encryption failed with code {0}".format(encrypt_result), level=CommonVariables.ErrorLevel)
-            else:
-                logger.log(msg=("the item fstype is not empty {0}".format(device_item.file_system)))
+            mount_result = disk_util.mount_filesystem(dev_path=encrypted_device_path, mount_point=crypt_item_to_update.mount_point)
+            logger.log(msg=("mount result is {0}".format(mount_result)))
+        else:
+            logger.log(msg="encryption failed with code {0}".format(encrypt_result), level=CommonVariables.ErrorLevel)
+        return True
+
+    # formatting is bound by the disk as much as copying, so the same scheduling applies
+    scheduler = EncryptionScheduler(logger=logger,
+                                    max_concurrency=max_concurrent_encryptions,
+                                    get_disks=lambda item_to_format: disk_util.get_physical_disks(item_to_format[0]))
+    failed_items = scheduler.run(items_to_format, encrypt_format_item)
+    if failed_items:
+        raise Exception("encrypting and formatting {0} failed".format(', '.join(item[0] for item in failed_items)))
 
 
 def encrypt_inplace_without_seperate_header_file(passphrase_file,
@@ -896,7 +947,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
     logger.log("encrypt_inplace_without_seperate_header_file")
     current_phase = CommonVariables.EncryptionPhaseBackupHeader
     if ongoing_item_config is None:
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment, logger=logger)
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=disk_util.encryption_environment, logger=logger)
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
         ongoing_item_config.current_slice_index = 0
         ongoing_item_config.device_size = device_item.size
@@ -957,15 +1008,15 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
             else:
                 ongoing_item_config.current_slice_index = 0
                 ongoing_item_config.current_source_path = original_dev_path
-                ongoing_item_config.current_destination = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.current_destination = disk_util.encryption_environment.copy_header_slice_file_path
                 ongoing_item_config.current_total_copy_size = CommonVariables.default_block_size
                 ongoing_item_config.from_end = False
-                ongoing_item_config.header_slice_file_path = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.header_slice_file_path = disk_util.encryption_environment.copy_header_slice_file_path
                 ongoing_item_config.original_dev_path = original_dev_path
                 ongoing_item_config.commit()
-                if os.path.exists(encryption_environment.copy_header_slice_file_path):
+                if os.path.exists(disk_util.encryption_environment.copy_header_slice_file_path):
                     logger.log(msg="the header slice file is there, remove it.", level=CommonVariables.WarningLevel)
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                    os.remove(disk_util.encryption_environment.copy_header_slice_file_path)
 
                 copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
 
@@ -1062,8 +1113,8 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
                     logger.log(msg=original_dev_name_path + " is not defined in fstab, no need to update",
                                level=CommonVariables.InfoLevel)
 
-                if os.path.exists(encryption_environment.copy_header_slice_file_path):
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                if os.path.exists(disk_util.encryption_environment.copy_header_slice_file_path):
+                    os.remove(disk_util.encryption_environment.copy_header_slice_file_path)
 
                 current_phase = CommonVariables.EncryptionPhaseDone
                 ongoing_item_config.phase = current_phase
@@ -1098,7 +1149,7 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
     logger.log("encrypt_inplace_with_seperate_header_file")
     current_phase = CommonVariables.EncryptionPhaseEncryptDevice
     if ongoing_item_config is None:
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment,
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=disk_util.encryption_environment,
                                                 logger=logger)
         mapper_name = str(uuid.uuid4())
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
@@ -1372,10 +1423,11 @@ def enable_encryption_all_format(passphrase_file, encryption_marker, disk_util,
                            status_code=str(CommonVariables.success),
                            message=msg)
 
-    return encrypt_format_device_items(passphrase_file, device_items_to_encrypt, disk_util, True)
+    return encrypt_format_device_items(passphrase_file, device_items_to_encrypt, disk_util, True,
+                                       max_concurrent_encryptions=encryption_marker.get_max_concurrent_encryptions())
 
 
-def encrypt_format_device_items(passphrase, device_items, disk_util, force=False):
+def encrypt_format_device_items(passphrase, device_items, disk_util, force=False, max_concurrent_encryptions=1):
     """
     Formats the block devices represented by the supplied device_item.
 
@@ -1407,20 +1459,21 @@ def encrypt_format_device_items(passphrase, device_items, disk_util, force=False
 
     disk_format_query = json.dumps(map(single_device_item_to_format_query_dict, device_items))
 
-    return enable_encryption_format(passphrase, disk_format_query, disk_util, force)
+    return enable_encryption_format(passphrase, disk_format_query, disk_util, force, max_concurrent_encryptions)
 
 
 def find_all_devices_to_encrypt(encryption_marker, disk_util, bek_util):
-    device_items = disk_util.get_device_items(None)
-    device_items_to_encrypt = []
-    special_azure_devices_to_skip = disk_util.get_azure_devices()
-    for device_item in device_items:
-        logger.log("device_item == " + str(device_item))
-
-        should_skip = disk_util.should_skip_for_inplace_encryption(device_item, special_azure_devices_to_skip, encryption_marker.get_volume_type())
-        if not should_skip and \
-           not any(di.name == device_item.name for di in device_items_to_encrypt):
-            device_items_to_encrypt.append(device_item)
+    with disk_util.shared_device_inventory():
+        device_items = disk_util.get_device_items(None)
+        device_items_to_encrypt = []
+        special_azure_devices_to_skip = disk_util.get_azure_devices()
+        for device_item in device_items:
+            logger.log("device_item == " + str(device_item))
+
+            should_skip = disk_util.should_skip_for_inplace_encryption(device_item, special_azure_devices_to_skip, encryption_marker.get_volume_type())
+            if not should_skip and \
+               not any(di.name == device_item.name for di in device_items_to_encrypt):
+                device_items_to_encrypt.append(device_item)
     return device_items_to_encrypt
 
 
@@ -1439,40 +1492,50 @@ def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util
                            status_code=str(CommonVariables.success),
                            message=msg)
 
-    for device_num, device_item in enumerate(device_items_to_encrypt):
+    status_reporter = SynchronizedStatusReporter(hutil)
+    max_concurrent_encryptions = encryption_marker.get_max_concurrent_encryptions()
+    concurrent_copies = min(max_concurrent_encryptions, len(device_items_to_encrypt))
+
+    def encrypt_device_item(device_item, slot):
         umount_status_code = CommonVariables.success
         if device_item.mount_point is not None and device_item.mount_point != "":
             umount_status_code = disk_util.umount(device_item.mount_point)
         if umount_status_code != CommonVariables.success:
             logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
+            return True
+
+        logger.log(msg=("encrypting: {0}".format(device_item)))
+        no_header_file_support = not_support_header_option_distro(DistroPatcher)
+        status_prefix = "Encrypting data volume {0}/{1}".format(device_items_to_encrypt.index(device_item) + 1,
+                                                                len(device_items_to_encrypt))
+        slot_disk_util = get_slot_disk_util(slot, status_reporter, concurrent_copies)
+
+        # TODO check the file system before encrypting it.
+        if no_header_file_support:
+            logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series, need to resize data drive",
+                       level=CommonVariables.WarningLevel)
+
+            encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
+                                                                                   device_item=device_item,
+                                                                                   disk_util=slot_disk_util,
+                                                                                   bek_util=bek_util,
+                                                                                   status_prefix=status_prefix)
         else:
-            logger.log(msg=("encrypting: {0}".format(device_item)))
-            no_header_file_support = not_support_header_option_distro(DistroPatcher)
-            status_prefix = "Encrypting data volume {0}/{1}".format(device_num + 1,
-                                                                    len(device_items_to_encrypt))
-
-            # TODO check the file system before encrypting it.
-            if no_header_file_support:
-                logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series, need to resize data drive",
-                           level=CommonVariables.WarningLevel)
-
-                encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
-                                                                                       device_item=device_item,
-                                                                                       disk_util=disk_util,
-                                                                                       bek_util=bek_util,
-                                                                                       status_prefix=status_prefix)
-            else:
-                encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
-                                                                                    device_item=device_item,
-                                                                                    disk_util=disk_util,
-                                                                                    bek_util=bek_util,
-                                                                                    status_prefix=status_prefix)
+            encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
+                                                                                device_item=device_item,
+                                                                                disk_util=slot_disk_util,
+                                                                                bek_util=bek_util,
+                                                                                status_prefix=status_prefix)
 
-            if encryption_result_phase == CommonVariables.EncryptionPhaseDone:
-                continue
-            else:
-                # do exit to exit from this round
-                return device_item
+        return encryption_result_phase == CommonVariables.EncryptionPhaseDone
+
+    # volumes on different disks are encrypted at the same time, the first failure ends this round
+    scheduler = EncryptionScheduler(logger=logger,
+                                    max_concurrency=max_concurrent_encryptions,
+                                    get_disks=lambda device_item: disk_util.get_physical_disks(get_device_item_path(device_item)))
+    failed_items = scheduler.run(device_items_to_encrypt, encrypt_device_item)
+    if failed_items:
+        return failed_items[0]
     return None
 
 
@@ -1732,6 +1795,56 @@ def daemon_encrypt():
                                message=message)
 
 
+def resume_encryption_in_place(passphrase_file, resume_slots, encryption_marker, disk_util, bek_util):
+    """
+    resumes the encryptions interrupted in resume_slots, each in its slot since its
+    ongoing item config and copy files are there. returns the slots which failed.
+    """
+    status_reporter = SynchronizedStatusReporter(hutil)
+    max_concurrent_encryptions = encryption_marker.get_max_concurrent_encryptions()
+    concurrent_copies = min(max_concurrent_encryptions, len(resume_slots))
+
+    def get_ongoing_item_config(slot):
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment.get_slot_environment(slot), logger=logger)
+        ongoing_item_config.load_value_from_file()
+        return ongoing_item_config
+
+    def resume_slot(slot):
+        ongoing_item_config = get_ongoing_item_config(slot)
+        slot_disk_util = get_slot_disk_util(slot, status_reporter, concurrent_copies)
+        header_file_path = ongoing_item_config.get_header_file_path()
+        mount_point = ongoing_item_config.get_mount_point()
+        status_prefix = "Resuming encryption after reboot"
+        if not none_or_empty(mount_point):
+            logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
+            umount_status_code = slot_disk_util.umount(mount_point)
+            logger.log("unmount return code is {0}".format(umount_status_code))
+        if none_or_empty(header_file_path):
+            encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
+                                                                                   device_item=None,
+                                                                                   disk_util=slot_disk_util,
+                                                                                   bek_util=bek_util,
+                                                                                   status_prefix=status_prefix,
+                                                                                   ongoing_item_config=ongoing_item_config)
+            # TODO mount it back when shrink failed
+        else:
+            encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
+                                                                                device_item=None,
+                                                                                disk_util=slot_disk_util,
+                                                                                bek_util=bek_util,
+                                                                                status_prefix=status_prefix,
+                                                                                ongoing_item_config=ongoing_item_config)
+        if encryption_result_phase != CommonVariables.EncryptionPhaseDone:
+            return False
+        ongoing_item_config.clear_config()
+        return True
+
+    scheduler = EncryptionScheduler(logger=logger,
+                                    max_concurrency=max_concurrent_encryptions,
+                                    get_disks=lambda slot: disk_util.get_physical_disks(get_ongoing_item_config(slot).get_original_dev_name_path()))
+    return scheduler.run(resume_slots, lambda slot, worker_slot: resume_slot(slot), get_slot=lambda slot: slot)
+
+
 def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util, bek_util, bek_passphrase_file):
     try:
         """
@@ -1747,42 +1860,23 @@ def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util,
         we need the special handling is because the half done device can be a error state: say, the file system header missing.so it could be
         identified.
         """
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment, logger=logger)
-
-        if ongoing_item_config.config_file_exists():
-            logger.log("OngoingItemConfig exists.")
-            ongoing_item_config.load_value_from_file()
-            header_file_path = ongoing_item_config.get_header_file_path()
-            mount_point = ongoing_item_config.get_mount_point()
-            status_prefix = "Resuming encryption after reboot"
-            if not none_or_empty(mount_point):
-                logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
-                umount_status_code = disk_util.umount(mount_point)
-                logger.log("unmount return code is {0}".format(umount_status_code))
-            if none_or_empty(header_file_path):
-                encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=bek_passphrase_file,
-                                                                                       device_item=None,
-                                                                                       disk_util=disk_util,
-                                                                                       bek_util=bek_util,
-                                                                                       status_prefix=status_prefix,
-                                                                                       ongoing_item_config=ongoing_item_config)
-                # TODO mount it back when shrink failed
-            else:
-                encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=bek_passphrase_file,
-                                                                                    device_item=None,
-                                                                                    disk_util=disk_util,
-                                                                                    bek_util=bek_util,
-                                                                                    status_prefix=status_prefix,
-                                                                                    ongoing_item_config=ongoing_item_config)
+        resume_slots = encryption_environment.get_ongoing_item_config_slots()
+
+        if resume_slots:
+            logger.log("OngoingItemConfig exists for the slots {0}.".format(resume_slots))
+            failed_slots = resume_encryption_in_place(passphrase_file=bek_passphrase_file,
+                                                      resume_slots=resume_slots,
+                                                      encryption_marker=encryption_marker,
+                                                      disk_util=disk_util,
+                                                      bek_util=bek_util)
             """
             if the resuming failed, we should fail.
             """
-            if encryption_result_phase != CommonVariables.EncryptionPhaseDone:
-                original_dev_path = ongoing_item_config.get_original_dev_path
-                message = 'EnableEncryption: resuming encryption for {0} failed'.format(original_dev_path)
+            if failed_slots:
+                original_dev_paths = [OnGoingItemConfig(encryption_environment=encryption_environment.get_slot_environment(slot), logger=logger).get_original_dev_path()
+                                      for slot in failed_slots]
+                message = 'EnableEncryption: resuming encryption for {0} failed'.format(', '.join(str(path) for path in original_dev_paths))
                 raise Exception(message)
-            else:
-                ongoing_item_config.clear_config()
         else:
             logger.log("OngoingItemConfig does not exist")
             failed_item = None
@@ -1800,7 +1894,8 @@ def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util,
                 disk_format_query = encryption_marker.get_encryption_disk_format_query()
                 failed_item = enable_encryption_format(passphrase=bek_passphrase_file,
                                                        disk_format_query=disk_format_query,
-                                                       disk_util=disk_util)
+                                                       disk_util=disk_util,
+                                                       max_concurrent_encryptions=encryption_marker.get_max_concurrent_encryptions())
             elif encryption_marker.get_current_command() == CommonVariables.EnableEncryptionFormatAll:
                 failed_item = enable_encryption_all_format(passphrase_file=bek_passphrase_file,
                                                            encryption_marker=encryption_marker,
@@ -30,6 +30,7 @@ from CommandExecutor import *
 from BekUtil import *
 from DiskUtil import *
 from EncryptionConfig import *
+from UsedSpaceCopyTask import UsedSpaceCopyTask
 
 class OSEncryptionState(object):
     def __init__(self, state_name, context):
@@ -171,6 +172,14 @@ class OSEncryptionState(object):
                                       communicator=proc_comm)
         return int(proc_comm.stdout.strip())
 
+    def _copy_used_space(self, source, destination):
+        copy_task = UsedSpaceCopyTask(logger=self.context.logger,
+                                      hutil=self.context.hutil,
+                                      source=source,
+                                      destination=destination)
+        if copy_task.begin_copy() != CommonVariables.process_success:
+            raise Exception("Failed to copy the used space of {0} to {1}".format(source, destination))
+
     def _is_uuid(self, s):
         try:
             UUID(s)
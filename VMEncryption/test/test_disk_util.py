@@ -1,7 +1,7 @@
 import unittest
 import mock
 
-from main.Common import CryptItem
+from main.Common import CryptItem, LvmItem
 from main.EncryptionEnvironment import EncryptionEnvironment
 from main.DiskUtil import DiskUtil
 from console_logger import ConsoleLogger
@@ -280,3 +280,46 @@ class TestDiskUtil(unittest.TestCase):
         self.assertTrue("\n/dev/mapper/mapper_name2 /mnt/point2 ext4 defaults,nofail 0 0" in open_mock.content_dict["/etc/fstab"])
         self.assertTrue("\nmapper_name /dev/dev_path /test_passphrase_path" in open_mock.content_dict["/etc/crypttab"])
         self.assertTrue("\nmapper_name2 /dev/dev_path2 /test_passphrase_path" in open_mock.content_dict["/etc/crypttab"])
+
+    @mock.patch('main.DiskUtil.DiskUtil.get_device_id_from_sysfs', return_value='00000000-0001-8899-0000-000000000000')
+    @mock.patch('main.DiskUtil.DiskUtil.get_azure_symlinks', return_value={'resource': '/dev/sdb'})
+    @mock.patch('main.DiskUtil.DiskUtil.get_lvm_items')
+    def test_shared_device_inventory(self, get_lvm_items_mock, get_azure_symlinks_mock, get_device_id_mock):
+        lvm_item = LvmItem()
+        lvm_item.lv_name = 'lv0'
+        lvm_item.vg_name = 'vg0'
+        lvm_item.lv_kernel_major = '253'
+        lvm_item.lv_kernel_minor = '0'
+        get_lvm_items_mock.return_value = [lvm_item]
+        lsblk_output = '\n'.join([
+            'NAME="sdb" TYPE="disk" FSTYPE="" MOUNTPOINT="" LABEL="" UUID="" MODEL="Virtual Disk" SIZE="1073741824" MAJ:MIN="8:16"',
+            'NAME="sdb1" TYPE="part" FSTYPE="ext4" MOUNTPOINT="/mnt" LABEL="" UUID="1234" MODEL="" SIZE="1072693248" MAJ:MIN="8:17"',
+            'NAME="vg0-lv0" TYPE="lvm" FSTYPE="ext4" MOUNTPOINT="/data" LABEL="" UUID="5678" MODEL="" SIZE="1072693248" MAJ:MIN="253:0"'])
+
+        def execute_side_effect(command, communicator=None, *args, **kwargs):
+            communicator.stdout = lsblk_output
+            return 0
+
+        self.disk_util.command_executor = mock.Mock()
+        self.disk_util.command_executor.Execute.side_effect = execute_side_effect
+
+        with self.disk_util.shared_device_inventory() as inventory:
+            device_items = self.disk_util.get_device_items(None)
+            self.assertEqual(self.disk_util.get_device_items(None)[2].name, device_items[2].name)
+            self.assertTrue(self.disk_util.get_device_inventory() is inventory)
+
+        self.assertEqual(self.disk_util.command_executor.Execute.call_count, 1)
+        self.assertEqual(get_lvm_items_mock.call_count, 1)
+        self.assertEqual(get_azure_symlinks_mock.call_count, 1)
+        self.assertEqual([device_item.name for device_item in device_items], ['sdb', 'sdb1', 'vg0/lv0'])
+        self.assertEqual(inventory.by_mount_point['/data'].name, 'vg0/lv0')
+        self.assertEqual(inventory.by_majmin['8:17'].name, 'sdb1')
+        self.assertEqual(inventory.by_name['sdb'].azure_name, 'resource')
+        self.assertEqual(device_items[0].device_id, '00000000-0001-8899-0000-000000000000')
+        # the items handed out are copies, the snapshot itself is not changed
+        device_items[0].name = 'changed'
+        self.assertEqual(inventory.device_items[0].name, 'sdb')
+
+        # without a shared inventory every query takes a new snapshot
+        self.disk_util.get_device_items(None)
+        self.assertEqual(self.disk_util.command_executor.Execute.call_count, 2)
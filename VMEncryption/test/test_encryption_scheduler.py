@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from main.EncryptionEnvironment import EncryptionEnvironment
+from main.EncryptionScheduler import EncryptionScheduler
+from console_logger import ConsoleLogger
+
+
+class TestEncryptionScheduler(unittest.TestCase):
+    """ unit tests for functions in the EncryptionScheduler module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.lock = threading.Lock()
+        self.running = []
+        self.max_running = 0
+        self.slots = {}
+
+    def _encrypt(self, failing=()):
+        def encrypt(item, slot):
+            with self.lock:
+                for running_item, running_slot in self.running:
+                    self.assertNotEqual(running_slot, slot)
+                self.running.append((item, slot))
+                self.max_running = max(self.max_running, len(self.running))
+                self.slots[item] = slot
+            time.sleep(0.05)
+            with self.lock:
+                self.running.remove((item, slot))
+            return item not in failing
+        return encrypt
+
+    def test_items_on_different_disks_run_concurrently(self):
+        disks = {'sdc1': set(['sdc']), 'sdd1': set(['sdd']), 'sde1': set(['sde'])}
+        scheduler = EncryptionScheduler(self.logger, 4, lambda item: disks[item])
+        self.assertEqual(scheduler.run(sorted(disks), self._encrypt()), [])
+        self.assertEqual(self.max_running, 3)
+        self.assertEqual(sorted(self.slots.values()), [0, 1, 2])
+
+    def test_max_concurrency(self):
+        items = ['sd{0}1'.format(letter) for letter in 'cdefgh']
+        scheduler = EncryptionScheduler(self.logger, 2, lambda item: set([item[:-1]]))
+        self.assertEqual(scheduler.run(items, self._encrypt()), [])
+        self.assertEqual(self.max_running, 2)
+        self.assertEqual(set(self.slots.values()), set([0, 1]))
+
+    def test_items_sharing_a_disk_run_one_at_a_time(self):
+        # two partitions of sdc, and a raid over sdc and sdd
+        disks = {'sdc1': set(['sdc']), 'sdc2': set(['sdc']), 'md0': set(['sdc', 'sdd'])}
+        scheduler = EncryptionScheduler(self.logger, 4, lambda item: disks[item])
+        self.assertEqual(scheduler.run(['sdc1', 'sdc2', 'md0'], self._encrypt()), [])
+        self.assertEqual(self.max_running, 1)
+        self.assertEqual(sorted(self.slots), ['md0', 'sdc1', 'sdc2'])
+
+    def test_no_item_is_started_after_a_failure(self):
+        scheduler = EncryptionScheduler(self.logger, 1, lambda item: set([item]))
+        self.assertEqual(scheduler.run(['sdc', 'sdd', 'sde'], self._encrypt(failing=['sdd'])), ['sdd'])
+        self.assertEqual(sorted(self.slots), ['sdc', 'sdd'])
+
+    def test_exception_is_a_failure(self):
+        def encrypt(item, slot):
+            if item == 'sdd':
+                raise Exception('cryptsetup failed')
+            return True
+        scheduler = EncryptionScheduler(self.logger, 4, lambda item: set([item]))
+        self.assertEqual(scheduler.run(['sdc', 'sdd'], encrypt), ['sdd'])
+
+    def test_fixed_slots(self):
+        # resuming slots 0 and 3 of a run with more slots than the limit now is
+        scheduler = EncryptionScheduler(self.logger, 2, lambda item: set(['sd' + str(item)]))
+        self.assertEqual(scheduler.run([3, 0], self._encrypt(), get_slot=lambda item: item), [])
+        self.assertEqual(self.slots, {0: 0, 3: 3})
+
+    def test_slot_environment(self):
+        config_path = tempfile.mkdtemp()
+        try:
+            encryption_environment = EncryptionEnvironment(None, self.logger)
+            encryption_environment.encryption_config_path = config_path
+            encryption_environment.azure_crypt_ongoing_item_config_path = os.path.join(config_path, 'azure_crypt_ongoing_item.ini')
+            self.assertTrue(encryption_environment.get_slot_environment(0) is encryption_environment)
+
+            slot_environment = encryption_environment.get_slot_environment(2)
+            self.assertEqual(slot_environment.azure_crypt_ongoing_item_config_path, os.path.join(config_path, 'azure_crypt_ongoing_item_2.ini'))
+            self.assertEqual(slot_environment.copy_header_slice_file_path, os.path.join(config_path, 'copy_header_slice_file_2'))
+            self.assertEqual(slot_environment.copy_slice_item_backup_file, os.path.join(config_path, 'copy_slice_item_2.bak'))
+            self.assertEqual(slot_environment.encryption_config_file_path, encryption_environment.encryption_config_file_path)
+
+            # archived configs are not resumed
+            for name in ['azure_crypt_ongoing_item.ini', 'azure_crypt_ongoing_item_2.ini',
+                         'azure_crypt_ongoing_item_1.ini_2018-01-01 00:00:00.000000']:
+                open(os.path.join(config_path, name), 'w').close()
+            self.assertEqual(encryption_environment.get_ongoing_item_config_slots(), [0, 2])
+        finally:
+            shutil.rmtree(config_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+import BaseHTTPServer
+import SocketServer
+import errno
+import httplib
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import mock
+
+from main.HttpUtil import HttpUtil
+from main.KeyVaultUtil import KeyVaultUtil
+from console_logger import ConsoleLogger
+
+
+class StubVaultServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the pooled connections are closed by the clients at any time
+        pass
+
+
+class StubVaultHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    serves the key vault and aad token endpoints used by KeyVaultUtil, all the
+    host names resolve to the one server.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, content, headers=None):
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.close_after_response:
+            # like a server timing out an idle connection, without Connection: close
+            self.close_connection = 1
+
+    def handle_request(self, method):
+        content_length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(content_length)
+        self.server.requests.append((method, self.headers.getheader('Host'), self.path, self.headers.getheader('Authorization'), body))
+        path = self.path.split('?')[0]
+        if method == 'GET' and path == '/keys':
+            authorization = 'Bearer authorization="https://login.test:{0}/tenant", resource="https://vault.azure.net"'.format(self.server.server_port)
+            self.send_json(401, {'error': {'code': 'Unauthorized'}}, {'WWW-Authenticate': authorization})
+        elif method == 'POST' and path == '/tenant/oauth2/token':
+            self.server.tokens_issued += 1
+            self.send_json(200, {'access_token': 'token{0}'.format(self.server.tokens_issued),
+                                 'expires_on': str(int(time.time()) + self.server.token_lifetime)})
+        elif method == 'POST' and path == '/keys/kek/1/wrapkey':
+            time.sleep(self.server.wrapkey_delay)
+            self.send_json(200, {'kid': 'kek', 'value': 'wrapped-' + json.loads(body)['value']})
+        elif method == 'PUT' and path.startswith('/secrets/'):
+            self.send_json(200, {'id': 'https://myvault.vault.test' + path, 'value': json.loads(body)['value']})
+        else:
+            self.send_json(404, {})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+
+class TestKeyVaultUtil(unittest.TestCase):
+    """ unit tests for functions in the KeyVaultUtil module, against a local https stub vault """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.work_dir = tempfile.mkdtemp()
+        cert_path = os.path.join(self.work_dir, 'vault.pem')
+        try:
+            subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=myvault.vault.test',
+                                   '-keyout', cert_path, '-out', cert_path],
+                                  stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            shutil.rmtree(self.work_dir)
+            self.skipTest('openssl is not available')
+
+        self.server = StubVaultServer(('127.0.0.1', 0), StubVaultHandler)
+        self.server.socket = ssl.wrap_socket(self.server.socket, certfile=cert_path, server_side=True)
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.tokens_issued = 0
+        self.server.token_lifetime = 3600
+        self.server.close_after_response = False
+        self.server.wrapkey_delay = 0
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.vault_url = 'https://myvault.vault.test:{0}/'.format(self.server.server_port)
+
+        # resolve the vault and login hosts to the stub, which has a self signed certificate
+        create_connection = socket.create_connection
+        patchers = [mock.patch('socket.create_connection', lambda address, *args, **kwargs: create_connection(('127.0.0.1', address[1]), *args, **kwargs)),
+                    mock.patch('ssl._create_default_https_context', ssl._create_unverified_context),
+                    mock.patch.dict(KeyVaultUtil.authorize_uris, clear=True),
+                    mock.patch.dict(KeyVaultUtil.access_tokens, clear=True)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # no proxy
+        waagent_patcher = mock.patch('main.HttpUtil.waagent')
+        waagent_patcher.start().ConfigurationProvider.return_value.get.return_value = None
+        self.addCleanup(waagent_patcher.stop)
+
+    def tearDown(self):
+        HttpUtil.close_pooled_connections()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir)
+
+    def _create_kek_secret(self):
+        key_vault_util = KeyVaultUtil(self.logger)
+        secret_id = key_vault_util.create_kek_secret(Passphrase='passphrase',
+                                                     KeyVaultURL=self.vault_url,
+                                                     KeyEncryptionKeyURL=self.vault_url + 'keys/kek/1',
+                                                     AADClientID='client',
+                                                     AADClientCertThumbprint=None,
+                                                     KeyEncryptionAlgorithm='RSA-OAEP',
+                                                     AADClientSecret='secret',
+                                                     DiskEncryptionKeyFileName='LinuxPassPhraseFileName')
+        return key_vault_util, secret_id
+
+    def _operations(self, key_vault_util):
+        return [operation for operation, duration in key_vault_util.request_times]
+
+    def test_create_kek_secret(self):
+        key_vault_util, secret_id = self._create_kek_secret()
+        self.assertTrue(secret_id.startswith('https://myvault.vault.test/secrets/'))
+        self.assertEqual(self._operations(key_vault_util), ['challenge', 'token', 'wrapkey', 'secret'])
+        self.assertEqual([(method, host.split(':')[0]) for method, host, path, authorization, body in self.server.requests],
+                         [('GET', 'myvault.vault.test'), ('POST', 'login.test'), ('POST', 'myvault.vault.test'), ('PUT', 'myvault.vault.test')])
+        self.assertEqual(self.server.requests[2][3], 'Bearer token1')
+        self.assertTrue('wrapped-' in self.server.requests[3][4])
+        # one connection to the vault and one to the login host
+        self.assertEqual(self.server.connections, 2)
+
+    def test_token_and_connections_are_reused(self):
+        self._create_kek_secret()
+        key_vault_util, secret_id = self._create_kek_secret()
+        self.assertTrue(secret_id is not None)
+        self.assertEqual(self._operations(key_vault_util), ['wrapkey', 'secret'])
+        self.assertEqual(self.server.tokens_issued, 1)
+        self.assertEqual(self.server.requests[-1][3], 'Bearer token1')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_token_is_renewed_before_it_expires(self):
+        self.server.token_lifetime = KeyVaultUtil.token_expiry_margin_in_seconds - 60
+        self._create_kek_secret()
+        key_vault_util, secret_id = self._create_kek_secret()
+        self.assertTrue(secret_id is not None)
+        self.assertEqual(self._operations(key_vault_util), ['token', 'wrapkey', 'secret'])
+        self.assertEqual(self.server.requests[-1][3], 'Bearer token2')
+
+    def test_reconnect_after_the_server_closed_the_connection(self):
+        self.server.close_after_response = True
+        self._create_kek_secret()
+        key_vault_util, secret_id = self._create_kek_secret()
+        self.assertTrue(secret_id is not None)
+        self.assertEqual(self._operations(key_vault_util), ['wrapkey', 'secret'])
+        self.assertEqual(self.server.connections, 6)
+
+    def test_no_retry_after_a_timeout(self):
+        HTTPSConnection = httplib.HTTPSConnection
+        with mock.patch('main.HttpUtil.httplib.HTTPSConnection', lambda host, port, timeout: HTTPSConnection(host, port, timeout=0.5)):
+            self._create_kek_secret()
+            self.server.wrapkey_delay = 1
+            key_vault_util, secret_id = self._create_kek_secret()
+        self.assertTrue(secret_id is None)
+        # the server may still wrap the key, so it is not asked again
+        self.assertEqual(len([request for request in self.server.requests if '/wrapkey' in request[2]]), 2)
+
+    def test_stale_connection_errors(self):
+        self.assertTrue(HttpUtil.is_stale_connection_error(socket.error(errno.EPIPE, 'Broken pipe'), False))
+        self.assertTrue(HttpUtil.is_stale_connection_error(socket.error(errno.ECONNRESET, 'Connection reset by peer'), False))
+        self.assertTrue(HttpUtil.is_stale_connection_error(httplib.BadStatusLine(''), True))
+        self.assertTrue(HttpUtil.is_stale_connection_error(ssl.SSLError(ssl.SSL_ERROR_EOF, 'EOF occurred in violation of protocol'), True))
+        self.assertFalse(HttpUtil.is_stale_connection_error(socket.timeout('timed out'), False))
+        self.assertFalse(HttpUtil.is_stale_connection_error(socket.timeout('timed out'), True))
+        self.assertFalse(HttpUtil.is_stale_connection_error(socket.error(errno.ECONNRESET, 'Connection reset by peer'), True))
+        self.assertFalse(HttpUtil.is_stale_connection_error(httplib.BadStatusLine('HTTP/1.1 abc'), True))
+
+
+if __name__ == '__main__':
+    unittest.main()
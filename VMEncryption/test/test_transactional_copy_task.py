@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from main.Common import CommonVariables
+from main.TransactionalCopyTask import TransactionalCopyTask, CopyBatchSizer
+from console_logger import ConsoleLogger
+
+
+class TestTransactionalCopyTask(unittest.TestCase):
+    """ unit tests for functions in the TransactionalCopyTask module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.work_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.work_dir, 'source')
+        self.destination = os.path.join(self.work_dir, 'destination')
+        self.source_data = os.urandom(10 * 1024 + 512)
+        with open(self.source, 'wb') as source_file:
+            source_file.write(self.source_data)
+        with open(self.destination, 'wb') as destination_file:
+            destination_file.write(b'\0' * len(self.source_data))
+        self.encryption_environment = mock.MagicMock()
+        self.encryption_environment.copy_slice_item_backup_file = os.path.join(self.work_dir, 'copy_slice_item.bak')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _create_copy_task(self, from_end, current_slice_index=0, block_size=4096, current_slice_count=None, max_batch_size=4096,
+                          concurrent_copies=1):
+        ongoing_item_config = mock.MagicMock()
+        ongoing_item_config.get_current_total_copy_size.return_value = len(self.source_data)
+        ongoing_item_config.get_current_block_size.return_value = block_size
+        ongoing_item_config.get_current_source_path.return_value = self.source
+        ongoing_item_config.get_current_destination.return_value = self.destination
+        ongoing_item_config.get_current_slice_index.return_value = current_slice_index
+        ongoing_item_config.get_current_slice_count.return_value = current_slice_count
+        ongoing_item_config.get_from_end.return_value = from_end
+        return TransactionalCopyTask(logger=self.logger,
+                                     hutil=mock.MagicMock(),
+                                     disk_util=None,
+                                     ongoing_item_config=ongoing_item_config,
+                                     patching=None,
+                                     encryption_environment=self.encryption_environment,
+                                     status_prefix='Encrypting',
+                                     max_batch_size=max_batch_size,
+                                     status_report_interval=3600,
+                                     concurrent_copies=concurrent_copies)
+
+    def _read_destination(self):
+        with open(self.destination, 'rb') as destination_file:
+            return destination_file.read()
+
+    def test_copy_forward(self):
+        copy_task = self._create_copy_task('False')
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.source_data)
+        self.assertEqual(copy_task.current_slice_index, 3)
+        self.assertEqual(copy_task.ongoing_item_config.commit.call_count, 3)
+        self.assertFalse(os.path.exists(self.encryption_environment.copy_slice_item_backup_file))
+
+    def test_copy_from_end(self):
+        copy_task = self._create_copy_task('True')
+        self.assertEqual(copy_task.get_slice_range(0), (8192, 2048 + 512))
+        self.assertEqual(copy_task.get_slice_range(2), (0, 4096))
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.source_data)
+
+    def test_copy_block_aligned(self):
+        self.source_data = self.source_data[:8192]
+        with open(self.source, 'wb') as source_file:
+            source_file.write(self.source_data)
+        copy_task = self._create_copy_task('False')
+        self.assertEqual(copy_task.get_slice_range(2), (8192, 0))
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination()[:8192], self.source_data)
+
+    def test_resume_partial_backup(self):
+        # the interrupted slice 1 was journaled partially, the rest comes from the source
+        with open(self.encryption_environment.copy_slice_item_backup_file, 'wb') as backup_file:
+            backup_file.write(self.source_data[4096:4096 + 1024])
+        copy_task = self._create_copy_task('False', current_slice_index=1)
+        self.assertEqual(copy_task.resume_copy(), CommonVariables.process_success)
+        self.assertEqual(copy_task.current_slice_index, 2)
+        self.assertEqual(self._read_destination()[4096:8192], self.source_data[4096:8192])
+        self.assertFalse(os.path.exists(self.encryption_environment.copy_slice_item_backup_file))
+
+    def test_copy_in_batches(self):
+        copy_task = self._create_copy_task('True', block_size=1024, max_batch_size=8192)
+        copy_task.batch_sizer.get_memory_available = mock.Mock(return_value=None)
+        self.assertEqual(copy_task.get_batch_range(0, 2), (9216, 1536))
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        self.assertEqual(self._read_destination(), self.source_data)
+        # batches of 1, 1, 2, 4 and the remaining 3 slices, one commit each
+        self.assertEqual(copy_task.ongoing_item_config.commit.call_count, 5)
+        self.assertEqual(copy_task.ongoing_item_config.current_slice_index, 11)
+
+    def test_batch_memory_shared_by_concurrent_copies(self):
+        # 64 slices available, two batches in memory use at most a quarter of it
+        memory_available = 64 * 1024 * 8
+        batch_sizer = CopyBatchSizer(block_size=1024, max_batch_size=1024 * 1024, target_seconds=1)
+        batch_sizer.get_memory_available = mock.Mock(return_value=memory_available)
+        self.assertEqual(batch_sizer.get_slice_count_limit(), 64)
+
+        copy_task = self._create_copy_task('False', block_size=1024, max_batch_size=1024 * 1024, concurrent_copies=4)
+        copy_task.batch_sizer.get_memory_available = mock.Mock(return_value=memory_available)
+        self.assertEqual(copy_task.batch_sizer.get_slice_count_limit(), 16)
+        copy_task.batch_sizer.record(copied_bytes=1024 * 1024, elapsed_seconds=0.01)
+        for _ in range(10):
+            self.assertTrue(copy_task.batch_sizer.next_slice_count() <= 16)
+        self.assertEqual(copy_task.batch_sizer.next_slice_count(), 16)
+
+        # at least one slice, however many copies share the memory
+        batch_sizer = CopyBatchSizer(block_size=1024, max_batch_size=1024 * 1024, target_seconds=1, concurrent_copies=128)
+        batch_sizer.get_memory_available = mock.Mock(return_value=memory_available)
+        self.assertEqual(batch_sizer.get_slice_count_limit(), 1)
+
+    def test_status_report_rate_limited(self):
+        copy_task = self._create_copy_task('False')
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+        # the first and the final report only
+        self.assertEqual(copy_task.hutil.do_status_report.call_count, 2)
+        message = copy_task.hutil.do_status_report.call_args[1]['message']
+        self.assertTrue(message.startswith('Encrypting: 100% ('))
+        self.assertTrue('MB/s, ETA 0s)' in message)
+
+    def test_resume_batch(self):
+        # a batch of two slices from the end was journaled completely
+        with open(self.encryption_environment.copy_slice_item_backup_file, 'wb') as backup_file:
+            backup_file.write(self.source_data[4096:])
+        copy_task = self._create_copy_task('True', current_slice_index=0, current_slice_count=2)
+        self.assertEqual(copy_task.resume_copy(), CommonVariables.process_success)
+        self.assertEqual(copy_task.current_slice_index, 2)
+        self.assertEqual(self._read_destination()[4096:], self.source_data[4096:])
+        self.assertEqual(self._read_destination()[:4096], b'\0' * 4096)
+
+    def test_resume_backup_too_big(self):
+        with open(self.encryption_environment.copy_slice_item_backup_file, 'wb') as backup_file:
+            backup_file.write(b'\0' * 8192)
+        copy_task = self._create_copy_task('False', current_slice_index=1)
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.backup_slice_file_error)
+        self.assertEqual(copy_task.current_slice_index, 1)
+
+    def test_copy_missing_source(self):
+        os.remove(self.source)
+        copy_task = self._create_copy_task('False')
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.copy_data_error)
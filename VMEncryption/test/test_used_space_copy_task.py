@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import mock
+
+from main.Common import CommonVariables
+from main.UsedSpaceCopyTask import UsedSpaceCopyTask, complement_ranges, split_ranges, parse_xfs_free_ranges
+from console_logger import ConsoleLogger
+
+
+XFS_SUPERBLOCK_OUTPUT = """blocksize = 4096
+agblocks = 65536
+dblocks = 262144
+"""
+
+XFS_FREESP_OUTPUT = """       0     1024     64512
+       1        8     65528
+       3    60000      5536
+   from      to extents  blocks    pct
+   32768   65535       3  135576 100.00
+total free extents 3
+total free blocks 135576
+average free extent size 45192
+"""
+
+
+class TestUsedSpaceCopyTask(unittest.TestCase):
+    """ unit tests for functions in the UsedSpaceCopyTask module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.work_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.work_dir, 'source.img')
+        self.destination = os.path.join(self.work_dir, 'destination.img')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _create_copy_task(self):
+        return UsedSpaceCopyTask(logger=self.logger,
+                                 hutil=mock.MagicMock(),
+                                 source=self.source,
+                                 destination=self.destination,
+                                 chunk_size=65536,
+                                 status_report_interval=3600)
+
+    def _create_destination(self, size):
+        # what is not copied reads as garbage through the dm-crypt device
+        with open(self.destination, 'wb') as destination_file:
+            destination_file.write(b'\xa5' * size)
+
+    def _create_ext4_image(self, image_size, data_size):
+        """
+        creates an ext4 image holding data_size bytes of files, without mounting it.
+        """
+        root = os.path.join(self.work_dir, 'root')
+        os.mkdir(root)
+        for index in range(0, data_size // 1048576):
+            with open(os.path.join(root, 'file{0}'.format(index)), 'wb') as data_file:
+                data_file.write(os.urandom(1048576))
+        with open(self.source, 'wb') as source_file:
+            source_file.truncate(image_size)
+        try:
+            subprocess.check_call(['mkfs.ext4', '-q', '-F', '-b', '4096', '-d', root, self.source],
+                                  stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest('mkfs.ext4 with -d is not available')
+        return root
+
+    def _check_ext4_copy(self, image_size, data_size):
+        root = self._create_ext4_image(image_size, data_size)
+        self._create_destination(image_size)
+        copy_task = self._create_copy_task()
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+
+        # only the blocks in use by the data and the file system metadata are copied
+        superblock = dict(line.split(':', 1) for line in subprocess.check_output(['dumpe2fs', '-h', self.source],
+                                                                                stderr=open(os.devnull, 'w')).decode().splitlines() if ':' in line)
+        used_bytes = (int(superblock['Block count']) - int(superblock['Free blocks'])) * int(superblock['Block size'])
+        self.assertEqual(copy_task.copied_bytes, used_bytes)
+        self.assertEqual(copy_task.total_bytes, used_bytes)
+        self.assertTrue(data_size < used_bytes < image_size)
+        self.assertEqual(subprocess.call(['e2fsck', '-fn', self.destination],
+                                         stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT), 0)
+        for name in os.listdir(root):
+            copied = subprocess.check_output(['debugfs', '-R', 'cat /' + name, self.destination], stderr=open(os.devnull, 'w'))
+            with open(os.path.join(root, name), 'rb') as data_file:
+                self.assertEqual(copied, data_file.read())
+        message = copy_task.hutil.do_status_report.call_args[1]['message']
+        self.assertTrue(message.endswith('MB copied (100%)'), message)
+
+    def test_copy_ext4_quarter_full(self):
+        self._check_ext4_copy(image_size=128 * 1048576, data_size=32 * 1048576)
+
+    def test_copy_ext4_three_quarters_full(self):
+        self._check_ext4_copy(image_size=128 * 1048576, data_size=96 * 1048576)
+
+    def test_copy_sparse_image(self):
+        # data at 1M and 3M of an 8M image with no file system, and a zero block at 3M + 64K
+        data = os.urandom(65536)
+        with open(self.source, 'wb') as source_file:
+            source_file.truncate(8 * 1048576)
+            source_file.seek(1048576)
+            source_file.write(data)
+            source_file.seek(3 * 1048576)
+            source_file.write(data + b'\0' * 65536)
+        self._create_destination(8 * 1048576)
+        copy_task = self._create_copy_task()
+        self.assertEqual(copy_task.begin_copy(), CommonVariables.process_success)
+
+        with open(self.destination, 'rb') as destination_file:
+            copied = destination_file.read()
+        self.assertEqual(copied[1048576:1048576 + 65536], data)
+        self.assertEqual(copied[3 * 1048576:3 * 1048576 + 65536], data)
+        # the holes and the all zero chunks are not written
+        self.assertEqual(copied[:1048576], b'\xa5' * 1048576)
+        self.assertEqual(copied[3 * 1048576 + 65536:3 * 1048576 + 131072], b'\xa5' * 65536)
+        if copy_task.total_bytes != 8 * 1048576:
+            # SEEK_DATA is supported by the file system of the image
+            self.assertTrue(copy_task.copied_bytes <= 4 * 65536)
+
+    def test_parse_xfs_free_ranges(self):
+        total_size, free_ranges = parse_xfs_free_ranges(XFS_SUPERBLOCK_OUTPUT, XFS_FREESP_OUTPUT)
+        self.assertEqual(total_size, 262144 * 4096)
+        self.assertEqual(free_ranges, [(1024 * 4096, 64512 * 4096),
+                                       ((65536 + 8) * 4096, 65528 * 4096),
+                                       ((3 * 65536 + 60000) * 4096, 5536 * 4096)])
+        used_ranges = complement_ranges(free_ranges, total_size)
+        self.assertEqual(used_ranges, [(0, 1024 * 4096),
+                                       (65536 * 4096, 8 * 4096),
+                                       (2 * 65536 * 4096, (65536 + 60000) * 4096)])
+
+    def test_split_ranges(self):
+        self.assertEqual(list(split_ranges([(100, 200), (1000, 2500)], 1024)),
+                         [(100, 200), (1000, 24), (1024, 1024), (2048, 1024), (3072, 428)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Copies a file backed device with TransactionalCopyTask the way the in place
+# encryption does (from the end, 50M slices), once with one slice per batch and
+# a status report per slice, and once with the adaptive batches and the rate
+# limited status reports. Reports the wall time, the read/write syscalls from
+# /proc/self/io, the status reports and the ongoing item config commits.
+# When run as root with losetup available the backing files are attached to
+# loop devices. Run from the VMEncryption folder:
+#   python test/transactional_copy_benchmark.py [size_in_gb] [work_dir]
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'main'))
+from Common import CommonVariables
+from TransactionalCopyTask import TransactionalCopyTask
+
+
+class ConsoleLogger(object):
+    def log(self, msg, level='Info'):
+        if level != 'Info':
+            print(msg)
+
+
+class StatusCounter(object):
+    def __init__(self):
+        self.status_reports = 0
+
+    def do_status_report(self, operation, status, status_code, message):
+        self.status_reports += 1
+
+
+class OnGoingItemConfigStub(object):
+    def __init__(self, source, destination, total_size):
+        self.source = source
+        self.destination = destination
+        self.total_size = total_size
+        self.current_slice_index = 0
+        self.current_slice_count = None
+        self.commits = 0
+
+    def get_current_total_copy_size(self):
+        return self.total_size
+
+    def get_current_block_size(self):
+        return CommonVariables.default_block_size
+
+    def get_current_source_path(self):
+        return self.source
+
+    def get_current_destination(self):
+        return self.destination
+
+    def get_current_slice_index(self):
+        return self.current_slice_index
+
+    def get_current_slice_count(self):
+        return self.current_slice_count
+
+    def get_from_end(self):
+        return 'True'
+
+    def commit(self):
+        self.commits += 1
+
+
+class EncryptionEnvironmentStub(object):
+    def __init__(self, work_dir):
+        self.copy_slice_item_backup_file = os.path.join(work_dir, 'copy_slice_item.bak')
+
+
+def get_syscall_counts():
+    counts = {}
+    with open('/proc/self/io', 'r') as io_file:
+        for line in io_file:
+            key, value = line.split(':')
+            counts[key] = int(value)
+    return counts['syscr'], counts['syscw']
+
+def attach_loop_device(backing_file):
+    if os.geteuid() != 0:
+        return None
+    try:
+        return subprocess.check_output(['losetup', '--find', '--show', backing_file]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def detach_loop_device(device):
+    subprocess.call(['losetup', '-d', device])
+
+def create_backing_file(path, size):
+    chunk = os.urandom(1048576)
+    with open(path, 'wb') as backing_file:
+        for i in range(0, size // len(chunk)):
+            backing_file.write(chunk)
+
+def run(name, source, destination, total_size, work_dir, max_batch_size, status_report_interval):
+    ongoing_item_config = OnGoingItemConfigStub(source, destination, total_size)
+    hutil = StatusCounter()
+    copy_task = TransactionalCopyTask(logger=ConsoleLogger(),
+                                      hutil=hutil,
+                                      disk_util=None,
+                                      ongoing_item_config=ongoing_item_config,
+                                      patching=None,
+                                      encryption_environment=EncryptionEnvironmentStub(work_dir),
+                                      status_prefix='Encryption in progress',
+                                      max_batch_size=max_batch_size,
+                                      status_report_interval=status_report_interval)
+    syscr, syscw = get_syscall_counts()
+    start = time.time()
+    result = copy_task.begin_copy()
+    elapsed = time.time() - start
+    end_syscr, end_syscw = get_syscall_counts()
+    if result != CommonVariables.process_success:
+        raise Exception('{0} copy failed with {1}'.format(name, result))
+    print('{0}: {1:.2f}s ({2:.1f} MB/s), read syscalls: {3}, write syscalls: {4}, status reports: {5}, commits: {6}'.format(
+        name, elapsed, total_size / elapsed / 1048576.0, end_syscr - syscr, end_syscw - syscw,
+        hutil.status_reports, ongoing_item_config.commits))
+
+def main():
+    size_in_gb = 4
+    if len(sys.argv) > 1:
+        size_in_gb = int(sys.argv[1])
+    work_dir = tempfile.mkdtemp(dir=(sys.argv[2] if len(sys.argv) > 2 else None))
+    total_size = size_in_gb * 1073741824
+    source_file = os.path.join(work_dir, 'source.img')
+    destination_file = os.path.join(work_dir, 'destination.img')
+    create_backing_file(source_file, total_size)
+    create_backing_file(destination_file, total_size)
+
+    devices = []
+    try:
+        source = attach_loop_device(source_file)
+        destination = attach_loop_device(destination_file)
+        for device in (source, destination):
+            if device is not None:
+                devices.append(device)
+        if source is None or destination is None:
+            print('loop devices not available, copying the backing files')
+            source = source_file
+            destination = destination_file
+
+        run('one slice per batch', source, destination, total_size, work_dir, CommonVariables.default_block_size, 0)
+        run('adaptive batches', source, destination, total_size, work_dir,
+            CommonVariables.max_copy_batch_size, CommonVariables.copy_status_report_interval_in_seconds)
+    finally:
+        for device in devices:
+            detach_loop_device(device)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()